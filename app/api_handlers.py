@@ -4,9 +4,6 @@ They generally convert a URL directly to an API function call.
 
 from google.appengine.api import users as app_engine_users
 from google.appengine.ext import ndb
-from io import BytesIO
-from MySQLdb import IntegrityError
-import datetime
 import hashlib
 import itertools
 import json
@@ -14,23 +11,33 @@ import logging
 import os
 import random
 import string
-import unicodecsv
 
 from gae_handlers import (ApiHandler, RestHandler, Route)
 from graphql_handlers import (DashboardByOwner, GraphQLBase, SuperDashboard,
                               TasklistHandler)
 from model import (AccountManager, AuthToken, BadPassword, Checkpoint,
-                   Email, Liaisonship, DatastoreModel, Notification, Organization,
-                   Participant, Program, ParticipantData, Project,
-                   ProjectCohort, SecretValue, Survey, SurveyLink, Task,
+                   DashboardRow, Email, Liaisonship, DatastoreModel,
+                   Notification, Organization,
+                   Participant, Program, ParticipantData, PooledCode,
+                   Project, ProjectCohort, SecretValue, Survey, SurveyLink, Task,
                    Tasklist, TaskReminder, User)
-from permission import owns, owns_program
+from permission import (jwt_allows_endpoints, owns, owns_many,
+                        owns_program)
 from util import PermissionDenied
 import api_helper
+import beacon_queue
 import cloudstorage as gcs
+import config
+import csv_export
+import datastore_helper
+import identity_map
+import instrumentation
 import jwt_helper
 import mandrill
+import mysql_pool
 import notifier
+import provisioning
+import task_events
 import util
 
 from rserve_handlers import authenticate_rserve, routes as rserve_routes
@@ -911,11 +918,8 @@ class ProjectCohorts(RestHandler):
         program = Program.get_config(params['program_label'])
 
         # Validate the cohort. Can't join after they're closed.
-        date_str = program['cohorts'][params['cohort_label']]['close_date']
-        close_date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-        if datetime.date.today() > close_date:
-            msg = ("Can't join {}, close date has passed ({})."
-                   .format(params['cohort_label'], close_date))
+        msg = provisioning.cohort_error(program, params['cohort_label'])
+        if msg:
             logging.error(msg)
             return self.http_bad_request(msg)
 
@@ -940,23 +944,128 @@ class ProjectCohorts(RestHandler):
             return
 
         # Not forbidden, so save our work and notify.
-
-        surveys = Survey.create_for_project_cohort(program['surveys'], pc)
-        pc.survey_ids = [s.uid for s in surveys]
-        ndb.put_multi(surveys + [pc])
+        provisioning.commit([provisioning.plan(pc, program)], new_owner=user)
         notifier.joined_cohort(user, pc)
 
-        # Tasks are children of surveys, so they have to be put after
-        # surveys are put.
-        for s in surveys:
-            s.tasklist.open(user)
-
     ## @todo(chris): may want to enforce that org admins may only change the
     ## liaison_id and the expected_participants, not other props.
     # def patch(self, id):
     #     pass
 
 
+class ProjectCohortsBatch(ApiHandler):
+    """Enroll many organizations in a cohort at once, e.g. a roster from
+    another system."""
+    requires_auth = True
+
+    def post(self):
+        """Body: {
+          "program_label": "...",
+          "cohort_label": "...",
+          "items": [
+            {
+              "organization_id": "Organization_X",
+              "liaison_id": "User_Y",  // optional, defaults to project's
+              "expected_participants": 100,  // optional
+              "portal_type": "...",  // optional
+              "portal_message": "..."  // optional
+            },
+            ...
+          ]
+        }
+
+        Each organization needs a project in the program. Organizations
+        already in the cohort are skipped.
+
+        Returns: {"results": [...], "counts": {...}}, one result per item, in
+        order, with the organization_id, a status (200, 400, or 404), and
+        either the new project_cohort_id and code or an error message.
+        """
+        user = self.get_current_user()
+        if not user.super_admin:
+            return self.http_forbidden()
+
+        params = self.get_params({
+            'program_label': str,
+            'cohort_label': str,
+            'items': 'json',
+        })
+        try:
+            program = Program.get_config(params.get('program_label', None))
+        except ImportError:
+            return self.http_bad_request("Program not found.")
+        msg = provisioning.cohort_error(program, params.get('cohort_label'))
+        if msg:
+            return self.http_bad_request(msg)
+        items = params.get('items', None)
+        if not items or not isinstance(items, list):
+            return self.http_bad_request("Parameter 'items' required.")
+        if len(items) > config.project_cohort_batch_max_items:
+            return self.http_bad_request(
+                "At most {} items allowed.".format(
+                    config.project_cohort_batch_max_items))
+
+        items = [i if isinstance(i, dict) else {} for i in items]
+        org_ids = list(set(i['organization_id'] for i in items
+                           if i.get('organization_id', None)))
+
+        # Query projects and existing project cohorts for all orgs at once.
+        projects_by_org = {}
+        enrolled_orgs = set()
+        for chunk in datastore_helper.chunks(org_ids):
+            for project in Project.get(program_label=program['label'],
+                                       organization_id=chunk,
+                                       n=float('inf')):
+                projects_by_org[project.organization_id] = project
+            for pc in ProjectCohort.get(program_label=program['label'],
+                                        cohort_label=params['cohort_label'],
+                                        organization_id=chunk,
+                                        n=float('inf')):
+                enrolled_orgs.add(pc.organization_id)
+
+        results = []
+        plans = []  # (result, plan)
+        for item in items:
+            org_id = item.get('organization_id', None)
+            result = {'organization_id': org_id}
+            results.append(result)
+            if not org_id:
+                result.update(status=400, error="Missing organization_id.")
+                continue
+            if org_id not in projects_by_org:
+                result.update(status=404,
+                              error="Organization has no project in program.")
+                continue
+            if org_id in enrolled_orgs:
+                result.update(status=400,
+                              error="Project cohort already exists.")
+                continue
+            enrolled_orgs.add(org_id)
+
+            project = projects_by_org[org_id]
+            pc = ProjectCohort.create(
+                organization_id=org_id,
+                project_id=project.uid,
+                program_label=program['label'],
+                cohort_label=params['cohort_label'],
+                liaison_id=item.get('liaison_id', None) or project.liaison_id,
+                expected_participants=item.get('expected_participants',
+                                               None),
+                portal_type=item.get('portal_type', None),
+                portal_message=item.get('portal_message', None),
+            )
+            plans.append((result, provisioning.plan(pc, program)))
+
+        counts = provisioning.commit([p for r, p in plans])
+        for result, plan in plans:
+            result.update(status=200,
+                          project_cohort_id=plan.project_cohort.uid,
+                          code=plan.project_cohort.code)
+        notifier.joined_cohorts([p.project_cohort for r, p in plans])
+
+        self.write({'results': results, 'counts': counts})
+
+
 class Surveys(RestHandler):
     model = Survey
 
@@ -1066,40 +1175,15 @@ class Tasks(RestHandler):
 
         super(Tasks, self).put(id)
 
-        # Bubble task status changes up to checkpoints.
-        checkpoint = Checkpoint.get_by_id(task.checkpoint_id)
-        checkpoint.status = Checkpoint.get_status_from_tasks(checkpoint)
-        checkpoint.put()
-
-        # Notify various parties.
-
-        parent = task.key.parent().get()
-        parent_kind = DatastoreModel.get_kind(parent)
-        project = None  # used to update project.last_active
-        if parent_kind == 'Organization':
-            notify_fn = notifier.changed_organization_task
-        elif parent_kind == 'Project':
-            notify_fn = notifier.changed_project_task
-            project = parent
-        elif parent_kind == 'Survey':
-            notify_fn = notifier.changed_survey_task
-            project = Project.get_by_id(parent.project_id)
-        else:
-            logging.error('Notification rules for {} tasks not written'
-                          .format(parent_kind))
-            return
+        # Checkpoint status, notifications, and the project's last active
+        # time are updated off the request. See task_events.py.
 
         # The client adds a project cohort id to all Task updates, even though
         # they're not part of the datastore model, because we need them in
         # notifications to construct useful links for recipients.
         params = self.get_params({'project_cohort_id': str})
-        project_cohort_id = params.get('project_cohort_id', None)
-        notify_fn(user, parent, task, project_cohort_id)
-
-        # Update last active.
-        if project and user.non_admin:
-            project.last_active = datetime.datetime.now()
-            project.put()
+        task_events.task_changed(
+            task, user, params.get('project_cohort_id', None))
 
 
 class TasksAttachment(ApiHandler):
@@ -1733,29 +1817,7 @@ class Seed(ApiHandler):
 
 
         # Create Surveys
-        surveys = []
-
-        for i, survey_definition in enumerate(program['surveys']):
-            survey = Survey.create(
-                survey_definition['survey_tasklist_template'],
-                project_id=project.uid,
-                organization_id=organization.uid,
-                program_label=program['label'],
-                cohort_label=random_cohort_label,
-                project_cohort_id=project_cohort.uid,
-                ordinal=i + 1,
-            )
-
-            surveys.append(survey)
-
-        project_cohort.survey_ids = [s.uid for s in surveys]
-        project_cohort.put()
-        ndb.put_multi(surveys)
-
-        # Tasks are children of surveys, so they have to be put after
-        # surveys are put.
-        for s in surveys:
-            s.tasklist.open()
+        provisioning.commit([provisioning.plan(project_cohort, program)])
 
     def create_seed_user(self, name, organization_id):
         user_name = '{} {}'.format(name.capitalize(), name.capitalize()[:3])
@@ -1806,9 +1868,16 @@ class Participation(ApiHandler):
                 # efficient bulk query.
                 result = self.get_for_project_cohorts(ids, user)
             else:
+                if parent_type != 'programs':
+                    # Permissions and parent lookups below will each want
+                    # these; get them all in one batch.
+                    identity_map.prefetch(
+                        [self.get_long_uid(parent_type, id) for id in ids])
+                allowed = self.parents_allowed(parent_type, ids, user)
                 result = {
-                    uid: self.get_for_single_parent(
-                        parent_type, parent_field, id, cohort_label, user)
+                    id: self.get_for_single_parent(
+                        parent_type, parent_field, id, cohort_label, user,
+                        allowed=allowed[id])
                     for id in ids
                 }
 
@@ -1835,12 +1904,47 @@ class Participation(ApiHandler):
 
         return allowed
 
+    def parents_allowed(self, parent_type, parent_ids, user):
+        """Like parent_allowed() for many parents, with one batch get for
+        ownership and one jwt decode for the rest.
+
+        Returns: dict of parent id to bool.
+        """
+        allowed = owns_many(user, parent_ids)
+        not_owned = [id for id, owned in allowed.items() if not owned]
+        if not not_owned:
+            return allowed
+
+        jwt_user, jwt_error = self.get_jwt_user()
+        if not jwt_user or jwt_error:
+            return allowed
+
+        payload, error = jwt_helper.decode(self.get_jwt())
+        endpoints = {
+            # See parent_allowed() for why the path is changed.
+            id: self.get_endpoint_str(
+                path='/api/{}/{}/participation'.format(parent_type, id))
+            for id in not_owned
+        }
+        endpoint_ok = jwt_allows_endpoints(
+            None if error else payload, endpoints.values())
+        for id, endpoint in endpoints.items():
+            allowed[id] = endpoint_ok[endpoint]
+
+        return allowed
+
     def get_for_single_parent(self, parent_type, parent_field, id_or_code,
-                              cohort_label, user):
+                              cohort_label, user, allowed=None):
+        """Args:
+            allowed: bool, optional, if permission has already been checked,
+                e.g. by parents_allowed() for a batch.
+        """
         parent_id = self.get_parent_id(parent_type, id_or_code)
         if not parent_id:
             return self.http_not_found()
-        if not self.parent_allowed(parent_type, id_or_code, user):
+        if allowed is None:
+            allowed = self.parent_allowed(parent_type, id_or_code, user)
+        if not allowed:
             return self.http_forbidden()
         kwargs = dict(
             # Program label, or pc id, or survey id
@@ -1883,17 +1987,18 @@ class Participation(ApiHandler):
             # Couldn't find any. Either they're all 404s or they're codes.
             # Attempt to convert the codes to ids_or_codes.
             codes = [ioc.replace('-', ' ') for ioc in ids_or_codes]
-            if ProjectCohort.count(code=codes[:30]) == 0:
+            if not ProjectCohort.uids_for_codes(codes[:30]):
                 # Still couldn't find any. Abort.
                 return self.http_not_found()
             using_codes = True
+        else:
+            # Checking permissions gets each project cohort; do it in one
+            # batch.
+            identity_map.prefetch(pc_ids)
 
         # User should have all necessary permissions.
-        allowed = [
-            self.parent_allowed('project_cohorts', ioc, user)
-            for ioc in ids_or_codes
-        ]
-        if not all(allowed):
+        allowed = self.parents_allowed('project_cohorts', ids_or_codes, user)
+        if not all(allowed.values()):
             return self.http_forbidden()
 
         by_value_result = ParticipantData.participation_by_project_cohort(
@@ -1922,16 +2027,13 @@ class Participation(ApiHandler):
         else:
             klass = DatastoreModel.url_kind_to_class(parent_type)
             uid = klass.get_long_uid(id)
-            parent = DatastoreModel.get_by_id(uid)
+            parent = identity_map.get(uid)
             if parent is None:
                 # We might not have been able to find this id because it was a
                 # participation code. Treat it is a such and see if we do any
                 # better.
-                pcs = ProjectCohort.get(code=id.replace('-', ' '))
-                if len(pcs) > 0:
-                    uid = pcs[0].uid
-                else:
-                    uid = None
+                pc = ProjectCohort.get_by_code(id.replace('-', ' '))
+                uid = pc.uid if pc else None
 
         return uid
 
@@ -1972,31 +2074,24 @@ class CompletionIdsCsv(Participation):
             **self.get_params({'start': 'datetime', 'end': 'datetime'})
         )
 
-        results = ParticipantData.completion_ids(**kwargs)
-
-        self.response.write(self.to_csv_str(results))
-        self.response.headers['Content-Type'] = 'application/csv'
+        # Stream rows from the database to the response so large districts
+        # don't have to fit the whole export in memory; very large exports go
+        # to GCS. See csv_export.py.
+        query, query_params = ParticipantData.completion_ids_query(**kwargs)
+        csv_export.export(
+            self,
+            query,
+            query_params,
+            ('token', 'percent_progress', 'module'),
+            'completion_ids.csv',
+            parent_id=project_cohort_id,
+        )
 
         # Notify super admins a download has occurred. These are also recorded
         # by the client to ProjectCohort.data_export_survey.
         if not user.super_admin:
             notifier.downloaded_identifiers(user, project_cohort_id)
 
-    def to_csv_str(self, results):
-        # https://github.com/jdunck/python-unicodecsv
-        with BytesIO() as fh:
-            w = unicodecsv.DictWriter(
-                fh,
-                fieldnames=('token', 'percent_progress', 'module'),
-                encoding='utf-8'
-            )
-            w.writeheader()
-            for row in results:
-                w.writerow(row)
-            fh.seek(0)
-            csv_str = fh.read()
-        return csv_str
-
 
 class CompletionIdsAnonymous(Participation):
     requires_auth = True
@@ -2026,6 +2121,20 @@ class CompletionIdsAnonymous(Participation):
         if 'start' not in params or 'end' not in params:
             return self.http_bad_request("Missing 'start' and 'end' times.")
 
+        if self.get_param('format', str, None) == 'csv':
+            query, query_params = (
+                ParticipantData.completion_ids_anonymous_query(
+                    project_cohort_id, params['start'], params['end']))
+            csv_export.export(
+                self,
+                query,
+                query_params,
+                ('participant_id', 'survey_ordinal', 'value'),
+                'completion_ids_anonymous.csv',
+                parent_id=project_cohort_id,
+            )
+            return
+
         results = ParticipantData.completion_ids_anonymous(
             project_cohort_id,
             params['start'],
@@ -2059,12 +2168,114 @@ class CohortCompletion(ApiHandler):
         self.write(ParticipantData.completion_by_cohort(program_label))
 
 
+class ParticipationCacheStats(ApiHandler):
+    requires_auth = True
+
+    def get(self):
+        """Hit, miss, and stale counts of the participation cache."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        self.write(ParticipantData.participation_cache_stats())
+
+    def delete(self):
+        """Reset counts."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        ParticipantData.reset_participation_cache_stats()
+        self.http_no_content()
+
+
+class DashboardRefreshStats(ApiHandler):
+    requires_auth = True
+
+    def get(self):
+        """Requested, queued, and executed counts of dashboard row refreshes.
+        See model/dashboardrow.py."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        self.write(DashboardRow.refresh_stats())
+
+    def delete(self):
+        """Reset counts."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        DashboardRow.reset_refresh_stats()
+        self.http_no_content()
+
+
+class InstrumentationStats(ApiHandler):
+    requires_auth = True
+
+    def get(self):
+        """Per-route request counts, latency histograms, and API and SQL
+        calls, for the instance serving this request. See
+        instrumentation.py."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        self.write(instrumentation.route_stats())
+
+    def delete(self):
+        """Reset this instance's aggregates."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        instrumentation.reset_route_stats()
+        self.http_no_content()
+
+
+class CodePoolStats(ApiHandler):
+    requires_auth = True
+
+    def get(self):
+        """Depth of the participation code pool, plus allocations, lease
+        retries, and refills since reset, for the instance serving this
+        request. See model/codepool.py."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        self.write(PooledCode.pool_stats())
+
+    def delete(self):
+        """Reset counts."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        PooledCode.clear_stats()
+        self.http_no_content()
+
+
+class MySqlPoolStats(ApiHandler):
+    requires_auth = True
+
+    def get(self):
+        """Connections open and in use, plus checkouts, reuses, waits, and
+        reconnects since reset, for the instance serving this request. See
+        mysql_pool.py."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        self.write(mysql_pool.get_pool().stats())
+
+    def delete(self):
+        """Reset counts."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        mysql_pool.get_pool().reset_stats()
+        self.http_no_content()
+
+
 class Participants(ApiHandler):
     def get(self, participant_id=None):
         if not participant_id:
             return self.query()
 
-        participant = Participant.get_by_id(participant_id)
+        participant = Participant.get_by_id_cached(participant_id)
         if participant:
             self.write(participant)
         else:
@@ -2076,7 +2287,8 @@ class Participants(ApiHandler):
         if not params['name'] or not params['organization_id']:
             self.error(400)  # Bad Request
             return
-        self.write(Participant.get(**params))
+        participant = Participant.get_by_name(**params)
+        self.write([participant] if participant else [])
 
     def post(self):
         params = self.get_params({
@@ -2086,28 +2298,21 @@ class Participants(ApiHandler):
         })
         if 'name' not in params or 'organization_id' not in params:
             return self.http_bad_request()
-
-        participant = Participant.create(**params)
-        try:
-            participant.put()
-        except IntegrityError as error:
-            if error.args[1].startswith('Duplicate entry'):
-                # Slow networks using the participant portal often post
-                # multiple times to this endpoint, but every one after the
-                # first causes an error because of the unique name-org index on
-                # the participant table. Silence the error and give the browser
-                # a redirect to the existing entity instead. The portal will
-                # call the redirect and use that object as the participant.
-                logging.info("MySQL error downgraded to warning, see "
-                             "api_handlers.Participants for comments.")
-
-                participant = Participant.get(
-                    name=params['name'],
-                    organization_id=params['organization_id'],
-                )[0]
-                return self.http_see_other(participant.uid)
-            else:
-                raise error
+        # With upsert, an existing participant is returned as if created,
+        # saving the client from following a redirect.
+        upsert = self.get_param('upsert', bool, False)
+
+        participant, created = Participant.upsert(**params)
+        if participant is None:
+            return self.http_bad_request("Participant id already in use.")
+
+        if not created and not upsert:
+            # Slow networks using the participant portal often post multiple
+            # times to this endpoint, but the participant's name is unique
+            # within the org. Give the browser a redirect to the existing
+            # entity instead. The portal will call the redirect and use that
+            # object as the participant.
+            return self.http_see_other(participant.uid)
 
         self.write(participant)
 
@@ -2145,48 +2350,36 @@ class ParticipantDataHandler(ApiHandler):
         self.write(ParticipantData.get_by_participant(participant_id, pc_id))
 
     def post(self, participant_id, key):
-        expected = {
+        params = self.get_params({
             'value': unicode,
             'survey_id': str,
-        }
-        params = self.get_params(expected)
+        })
+        error = ParticipantData.write_error(
+            key, params.get('value', None), params.get('survey_id', None))
+        if error:
+            return self.http_bad_request(error)
+
         survey_id, survey_descriptor = (
             ParticipantData.separate_survey_descriptor(params['survey_id']))
 
         # Get remaining params from the survey.
         survey = Survey.get_by_id(survey_id)
+        if not survey:
+            return self.http_not_found()
         project_cohort = ProjectCohort.get_by_id(survey.project_cohort_id)
 
         # Add optional survey descriptor.
         if not survey_descriptor:
             survey_descriptor = self.get_param('survey_descriptor', str, None)
-        if survey_descriptor:
-            params['survey_id'] = ParticipantData.combine_survey_descriptor(
-                survey.uid,
-                survey_descriptor,
-            )
-
-        params['survey_ordinal'] = survey.ordinal
-        params['program_label'] = survey.program_label
-        params['project_id'] = survey.project_id
-        params['cohort_label'] = survey.cohort_label
-        params['project_cohort_id'] = survey.project_cohort_id
-        params['code'] = project_cohort.code
-
-        # All params should be present and truthy.
-        if not all([k in params and params[k] for k in expected.keys()]):
-            return self.http_bad_request('Missing parameters.')
-
-        if (
-            key == 'progress' and
-            not ParticipantData.is_valid_progress_value(params['value'])
-        ):
-            return self.http_bad_request('Invalid progress value.')
 
-        params['participant_id'] = participant_id
-        params['key'] = key
-
-        pd = ParticipantData.create(**params)
+        pd = ParticipantData.create_for_survey(
+            survey,
+            project_cohort,
+            survey_descriptor=survey_descriptor,
+            participant_id=participant_id,
+            key=key,
+            value=params['value'],
+        )
 
         if ParticipantData.is_progress_downgrade(pd):
             message = 'Progress value may not decrease.'
@@ -2204,6 +2397,133 @@ class ParticipantDataHandler(ApiHandler):
         return self.http_method_not_allowed('HEAD, GET, POST')
 
 
+class ParticipantDataBatch(ApiHandler):
+    """Write many participant data at once, e.g. everything a survey module
+    records on one page, rather than one request per key."""
+    # POSTs will contain responses from participants; don't log them.
+    should_log_request = False
+
+    def post(self):
+        """Validate like ParticipantDataHandler.post, then write all valid
+        items in one multi-row upsert.
+
+        Body: {
+          "participant_id": "Participant_X",  // default for items, optional
+          "items": [
+            {
+              "key": "progress",
+              "value": "33",
+              "survey_id": "Survey_X",  // may include a descriptor
+              "participant_id": "Participant_Y",  // optional
+              "survey_descriptor": "...",  // optional
+              "testing": false  // optional
+            },
+            ...
+          ]
+        }
+
+        Returns: {"results": [...]}, one per item, in order, each with the
+        item's participant_id, survey_id, and key, a status (200, 400, or
+        404), and, if not 200, an error message.
+        """
+        params = self.get_params({'participant_id': str, 'items': 'json'})
+        items = params.get('items', None)
+        if not items or not isinstance(items, list):
+            return self.http_bad_request("Parameter 'items' required.")
+        if len(items) > config.participant_data_batch_max_items:
+            return self.http_bad_request(
+                "At most {} items allowed.".format(
+                    config.participant_data_batch_max_items))
+        default_participant_id = params.get('participant_id', None)
+
+        results = []
+        valid = []  # (result, item, value)
+        for item in items:
+            item = item if isinstance(item, dict) else {}
+            value = item.get('value', None)
+            value = None if value is None else unicode(value)
+            result = {
+                'participant_id': item.get('participant_id',
+                                           default_participant_id),
+                'survey_id': item.get('survey_id', None),
+                'key': item.get('key', None),
+            }
+            results.append(result)
+            if not result['participant_id']:
+                error = 'Missing parameters.'
+            else:
+                error = ParticipantData.write_error(
+                    result['key'], value, result['survey_id'])
+            if error:
+                result.update(status=400, error=error)
+            else:
+                valid.append((result, item, value))
+
+        # Look up each survey and project cohort once.
+        survey_ids = set(
+            ParticipantData.separate_survey_descriptor(r['survey_id'])[0]
+            for r, item, value in valid
+        )
+        surveys_by_id = {s.uid: s for s in Survey.get_by_id(list(survey_ids))
+                         if s}
+        pc_ids = set(s.project_cohort_id for s in surveys_by_id.values())
+        pcs_by_id = {pc.uid: pc for pc in ProjectCohort.get_by_id(list(pc_ids))
+                     if pc}
+
+        pds = []  # (result, pd)
+        for result, item, value in valid:
+            survey_id, survey_descriptor = (
+                ParticipantData.separate_survey_descriptor(
+                    result['survey_id']))
+            survey = surveys_by_id.get(survey_id, None)
+            if not survey or survey.project_cohort_id not in pcs_by_id:
+                result.update(status=404, error="Survey not found.")
+                continue
+            pd = ParticipantData.create_for_survey(
+                survey,
+                pcs_by_id[survey.project_cohort_id],
+                survey_descriptor=(survey_descriptor or
+                                   item.get('survey_descriptor', None)),
+                participant_id=result['participant_id'],
+                key=result['key'],
+                value=value,
+                # Items may be JSON booleans or strings like "false".
+                testing=(unicode(item.get('testing', False)).lower()
+                         in ('true', '1')),
+            )
+            pds.append((result, pd))
+
+        # Same rule as is_progress_downgrade(), with one query for all.
+        existing = ParticipantData.get_existing_progress(
+            [p for r, p in pds if p.key == 'progress'])
+        to_write = {}  # coalesced by participant-survey-key
+        for result, pd in pds:
+            row = existing.get((pd.participant_id, pd.survey_id), None)
+            if (pd.key == 'progress' and pd.value != '100' and row and
+                    int(row['value']) > int(pd.value)):
+                result.update(status=400,
+                              error='Progress value may not decrease.')
+                continue
+            result.update(status=200)
+            index = (pd.participant_id, pd.survey_id, pd.key)
+            other = to_write.get(index, None)
+            if (other is None or pd.key != 'progress' or
+                    int(pd.value) > int(other.value)):
+                to_write[index] = pd
+
+        ParticipantData.upsert_batch(to_write.values())
+
+        progress_pds = [p for p in to_write.values() if p.key == 'progress']
+        if progress_pds:
+            ParticipantData.invalidate_participation(
+                [p.survey_id for p in progress_pds] +
+                [p.project_cohort_id for p in progress_pds] +
+                [p.code for p in progress_pds]
+            )
+
+        self.write({'results': results})
+
+
 class ParticipantDataCorsHandler(ApiHandler):
     """Similar to ParticipantDataHandler, but with the following additions:
     * This provides a CORS accessible means for Qualtrics integration.
@@ -2218,6 +2538,16 @@ class ParticipantDataCorsHandler(ApiHandler):
     should_log_request = False
 
     def get(self, participant_id):
+        if config.beacon_write_behind:
+            beacon = self.queue_participant_data(participant_id)
+            if beacon:
+                logging.info(u"Queued pd for: {} {}".format(
+                    participant_id, beacon['survey_id']))
+            else:
+                logging.info("Invalid params, did not queue.")
+            self.cors_gif_response()
+            return
+
         pd = self.update_participant_data(participant_id)
         if pd:
             logging.info(
@@ -2228,32 +2558,55 @@ class ParticipantDataCorsHandler(ApiHandler):
             logging.info("Invalid params, did not insert.")
         self.cors_gif_response()
 
-    def update_participant_data(self, participant_id):
+    def get_beacon_params(self):
+        """Params common to queued and synchronous writes, or None if any are
+        invalid."""
         expected = {
             'key': str,
             'value': unicode,
             'survey_id': str,
         }
         params = self.get_params(expected)
-        survey_id, survey_descriptor = (
-            ParticipantData.separate_survey_descriptor(params['survey_id']))
 
         # All params should be present and truthy.
         if not all([k in params and params[k] for k in expected.keys()]):
             logging.info("One or more params is missing or falsy.")
             return None
 
-        # Participant should exist
-        if not Participant.get_by_id(participant_id):
-            logging.info("Participant does not exist.")
-            return None
-
         if (
             params['key'] == 'progress' and
             not ParticipantData.is_valid_progress_value(params['value'])
         ):
             return None
 
+        return params
+
+    def queue_participant_data(self, participant_id):
+        """Validate only what's in the request, leaving lookups of the
+        participant, survey, and project cohort to beacon_queue.flush()."""
+        params = self.get_beacon_params()
+        if params is None:
+            return None
+
+        survey_descriptor = self.get_param('survey_descriptor', str, None)
+        if survey_descriptor:
+            params['survey_descriptor'] = survey_descriptor
+        params.update(self.get_params({'testing': bool}, required=True))
+
+        return beacon_queue.enqueue(participant_id, params)
+
+    def update_participant_data(self, participant_id):
+        params = self.get_beacon_params()
+        if params is None:
+            return None
+        survey_id, survey_descriptor = (
+            ParticipantData.separate_survey_descriptor(params['survey_id']))
+
+        # Participant should exist
+        if not Participant.get_by_id_cached(participant_id):
+            logging.info("Participant does not exist.")
+            return None
+
         # If we've passed all the above validation, add participant data
         params['participant_id'] = participant_id
 
@@ -2267,21 +2620,15 @@ class ParticipantDataCorsHandler(ApiHandler):
 
         if not survey_descriptor:
             survey_descriptor = self.get_param('survey_descriptor', str, None)
-        if survey_descriptor:
-            params['survey_id'] = ParticipantData.combine_survey_descriptor(
-                survey.uid,
-                survey_descriptor,
-            )
-
-        params['survey_ordinal'] = survey.ordinal
-        params['program_label'] = survey.program_label
-        params['project_id'] = survey.project_id
-        params['cohort_label'] = survey.cohort_label
-        params['project_cohort_id'] = survey.project_cohort_id
-        params['code'] = project_cohort.code
+        del params['survey_id']
         params.update(self.get_params({'testing': bool}, required=True))
 
-        pd = ParticipantData.create(**params)
+        pd = ParticipantData.create_for_survey(
+            survey,
+            project_cohort,
+            survey_descriptor=survey_descriptor,
+            **params
+        )
 
         if ParticipantData.is_progress_downgrade(pd):
             message = 'Progress value may not decrease.'
@@ -2312,6 +2659,19 @@ class SurveyLinks(ApiHandler):
             self.error(404)
 
 
+class SurveyLinkImports(ApiHandler):
+    requires_auth = True
+
+    def get(self, program_label, survey_ordinal):
+        """Progress of csv imports of links for this survey, by file. See
+        SurveyLink.import_range()."""
+        if not self.get_current_user().super_admin:
+            return self.http_forbidden()
+
+        self.write(SurveyLink.import_report(program_label,
+                                            int(survey_ordinal)))
+
+
 class ParticipationCodes(RestHandler):
     def get(self, code=None):
         # Public endpoint for getting details from a participation code.
@@ -2321,15 +2681,10 @@ class ParticipationCodes(RestHandler):
 
         # Codes have spaces replaced with dashes when they're in the URL.
         code = code.replace('-', ' ')
-        pc_result = ProjectCohort.get(code=code)
+        project_cohort = ProjectCohort.get_by_code(code)
 
-        if len(pc_result) > 1:
-            logging.error("Participation code duplication!")
-            logging.info(pc_result)
-            # gracefully fall through
-
-        if len(pc_result) > 0:
-            self.write(pc_result[0])
+        if project_cohort:
+            self.write(project_cohort)
         else:
             # This error is too noisy.
             # logging.error("Someone asked for a code and got 404'ed: {}"
@@ -2368,24 +2723,11 @@ class ParticipationCodes(RestHandler):
             portal_message=params.get('portal_message', None),
             survey_params=params.get('survey_params', None),
         )
-        pc.put()
 
-        # Create surveys according to the program definition.
-        program = Program.get_config(params['program_label'])
-        surveys = []
-        for i, survey_definition in enumerate(program['surveys']):
-            # Most things we need for surveys are available as pc params.
-            survey = Survey.create(
-                survey_definition['survey_tasklist_template'],
-                project_id=params.get('project_id', None),
-                organization_id=params['organization_id'],
-                program_label=params['program_label'],
-                cohort_label=params.get('cohort_label', None),
-                project_cohort_id=pc.uid,
-                ordinal=i + 1,
-            )
-            surveys.append(survey)
-        ndb.put_multi(surveys)
+        # Create surveys according to the program definition. These codes
+        # aren't for Neptune organizations, so there's no one to remind of
+        # tasks.
+        provisioning.commit([provisioning.plan(pc)], remind=False)
 
         self.write({k: v for k, v in pc.to_client_dict().items()
                     if k in prop_types or k == 'code'})
@@ -2410,11 +2752,10 @@ class ParticipationCodes(RestHandler):
             'survey_params': 'json',
         })
 
-        pc_result = ProjectCohort.get(code=code.replace('-', ' '))
-        if len(pc_result) == 0:
+        project_cohort = ProjectCohort.get_by_code(code.replace('-', ' '))
+        if not project_cohort:
             return self.http_not_found()
 
-        project_cohort = pc_result[0]
         for k, v in params.items():
             setattr(project_cohort, k, v)
         project_cohort.put()
@@ -2433,11 +2774,10 @@ class ParticipationCodes(RestHandler):
             return self.http_forbidden(
                 "Did not find correct 'allowed_endpoints' value in jwt.")
 
-        pc_result = ProjectCohort.get(code=code.replace('-', ' '))
-        if len(pc_result) == 0:
+        project_cohort = ProjectCohort.get_by_code(code.replace('-', ' '))
+        if not project_cohort:
             return self.http_not_found()
 
-        project_cohort = pc_result[0]
         key_name = ProjectCohort.uniqueness_key(project_cohort.code)
         unique_key = ndb.Key('Unique', key_name)
         # n = 10 should be fine here, we never have that many surveys per pc.
@@ -2445,6 +2785,7 @@ class ParticipationCodes(RestHandler):
                                  keys_only=True)
 
         ndb.delete_multi([project_cohort.key, unique_key] + survey_keys)
+        ProjectCohort.unindex_code(project_cohort.code)
 
         return self.http_no_content()
 
@@ -2547,6 +2888,10 @@ api_routes = rserve_routes + [
 
     # Participation
 
+    Route('/api/instrumentation', InstrumentationStats),
+    Route('/api/code_pool', CodePoolStats),
+    Route('/api/mysql_pool', MySqlPoolStats),
+    Route('/api/participation/cache_stats', ParticipationCacheStats),
     Route('/api/<parent_type>/participation', Participation),
     Route('/api/<parent_type>/<id>/participation', Participation),
     Route('/api/<parent_type:programs>/<id>/cohorts/<cohort_label>/'
@@ -2603,6 +2948,7 @@ api_routes = rserve_routes + [
     Route('/api/<parent_type>/<parent_id>/checkpoints', Checkpoints),
 
     Route('/api/project_cohorts', ProjectCohorts),
+    Route('/api/project_cohorts/batch', ProjectCohortsBatch),
     Route('/api/project_cohorts/<id>', ProjectCohorts),
     Route('/api/<parent_type:organizations>/<rel_id>/project_cohorts',
           RelatedQuery(ProjectCohort, 'organization_id')),
@@ -2613,6 +2959,7 @@ api_routes = rserve_routes + [
     Route('/api/users/<user_id>/dashboard', DashboardByOwner),
     Route('/api/organizations/<organization_id>/dashboard', DashboardByOwner),
     Route('/api/dashboard', SuperDashboard),
+    Route('/api/dashboard/refresh_stats', DashboardRefreshStats),
 
     Route('/api/secret_values', SecretValues),
     Route('/api/secret_values/<id>', SecretValues),
@@ -2644,12 +2991,15 @@ api_routes = rserve_routes + [
     Route('/api/participants', Participants),
     Route('/api/participants/<participant_id>', Participants),
     Route('/api/participants/<participant_id>/data', ParticipantDataHandler),
+    Route('/api/participant_data', ParticipantDataBatch),
     Route('/api/participants/<participant_id>/data/cross_site.gif',
           ParticipantDataCorsHandler),
     Route('/api/participants/<participant_id>/data/<key>',
           ParticipantDataHandler),
     Route('/api/survey_links/<program_label>/<survey_ordinal>/get_unique',
           SurveyLinks),
+    Route('/api/survey_links/<program_label>/<survey_ordinal>/imports',
+          SurveyLinkImports),
 
     Route('/api/codes', ParticipationCodes),
     Route('/api/codes/<code>', ParticipationCodes),
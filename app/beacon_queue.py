@@ -0,0 +1,222 @@
+"""Write-behind ingestion of participant data beacons.
+
+The Qualtrics cross_site.gif beacon (see api_handlers.ParticipantDataCorsHandler)
+fires for every participant on every page of a survey. Written synchronously,
+each hit costs several Datastore gets, a SQL read to prevent progress
+downgrades, an upsert, and a round of memcache invalidation. When a whole
+school starts a survey at once that saturates our MySQL connections.
+
+When config.beacon_write_behind is True, the handler only validates the query
+string and appends the beacon to a pull queue, which is durable. A cron
+(/cron/flush_beacons, see cron_handlers.FlushBeacons) leases beacons in bulk
+and:
+
+* resolves participants, surveys, and project cohorts once per batch,
+* coalesces repeated beacons for the same participant-survey-key,
+* writes everything with ParticipantData.upsert_batch(), which prevents
+  progress downgrades inside the SQL, and
+* clears participation caches once per batch rather than once per beacon.
+
+Every branch's namespace shares the queue, so beacons are tagged with the
+namespace they arrived in and each flush leases only its own.
+"""
+
+from google.appengine.api import taskqueue
+import datetime
+import json
+import logging
+
+from model import Participant, ParticipantData, ProjectCohort, Survey
+from taskqueue_helper import namespace_tag
+import config
+
+
+# Pull queue, see queue.yaml.
+QUEUE_NAME = 'participant-data-beacons'
+
+# Max allowed by the taskqueue api.
+LEASE_BATCH_SIZE = 1000
+
+# How long the worker has to write a leased batch before the tasks become
+# available to other workers. Rows are upserted, so a repeated batch is
+# harmless.
+LEASE_SECONDS = 60
+
+# Beacons that have failed to write this many times are dropped rather than
+# retried.
+MAX_BEACON_RETRIES = 5
+
+
+def enqueue(participant_id, params):
+    """Durably store a validated beacon for the worker.
+
+    Args:
+        participant_id: str
+        params: dict with 'key', 'value', 'survey_id', and 'testing', and
+            optionally 'survey_descriptor'.
+    """
+    beacon = dict(
+        params,
+        participant_id=participant_id,
+        received=datetime.datetime.utcnow().strftime(
+            config.iso_datetime_format),
+    )
+    task = taskqueue.Task(payload=json.dumps(beacon), method='PULL',
+                          tag=namespace_tag())
+    taskqueue.Queue(QUEUE_NAME).add(task)
+    return beacon
+
+
+def flush(max_batches=10):
+    """Lease, write, and delete this namespace's beacons until there are no
+    more.
+
+    Returns: dict of counts for reporting.
+    """
+    queue = taskqueue.Queue(QUEUE_NAME)
+    report = {'leased': 0, 'written': 0, 'invalid': 0, 'failed': 0}
+
+    for x in range(max_batches):
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, LEASE_BATCH_SIZE,
+                                         tag=namespace_tag())
+        if not tasks:
+            break
+
+        try:
+            written, invalid = write_beacons(
+                [json.loads(t.payload) for t in tasks])
+            done = tasks
+        except Exception:
+            # One bad beacon shouldn't hold up the rest. Write them one at a
+            # time and leave only the failures leased, to be retried when
+            # their lease expires.
+            logging.exception("Failed to write a batch of beacons.")
+            written, invalid, done = write_each(tasks)
+
+        # Invalid beacons are dropped, same as the synchronous handler, which
+        # always responds 200 and simply doesn't write.
+        if done:
+            queue.delete_tasks(done)
+
+        report['leased'] += len(tasks)
+        report['written'] += written
+        report['invalid'] += invalid
+        report['failed'] += len(tasks) - len(done)
+
+    return report
+
+
+def write_each(tasks):
+    """Write leased beacons one at a time.
+
+    Returns: tuple of (int number written, int number invalid, list of tasks
+        that are done with, either written or failed too many times).
+    """
+    num_written = 0
+    num_invalid = 0
+    done = []
+    for t in tasks:
+        try:
+            written, invalid = write_beacons([json.loads(t.payload)])
+            num_written += written
+            num_invalid += invalid
+        except Exception:
+            if t.retry_count < MAX_BEACON_RETRIES:
+                logging.exception(u"Failed to write beacon, will retry: {}"
+                                  .format(t.payload))
+                continue
+            logging.exception(u"Failed to write beacon {} times, dropping "
+                              u"it: {}".format(t.retry_count, t.payload))
+        done.append(t)
+    return num_written, num_invalid, done
+
+
+def coalesce(beacons):
+    """Reduce beacons to one per participant-survey-key.
+
+    Progress keeps its maximum value, matching the database rule that
+    progress never decreases. Other keys keep the most recently received
+    value.
+    """
+    by_index = {}
+    for b in beacons:
+        index = (b['participant_id'], b['survey_id'], b['key'])
+        existing = by_index.get(index, None)
+        if existing is None:
+            by_index[index] = b
+        elif b['key'] == 'progress':
+            if int(b['value']) > int(existing['value']):
+                by_index[index] = b
+        elif b['received'] >= existing['received']:
+            by_index[index] = b
+
+    return by_index.values()
+
+
+def write_beacons(beacons):
+    """Resolve context for beacons and upsert them as participant data.
+
+    Args:
+        beacons: list of dicts, see enqueue().
+
+    Returns: tuple of ints (number written, number invalid).
+    """
+    # Split compound survey ids (with descriptors) so we can look up the
+    # real surveys.
+    for b in beacons:
+        survey_id, descriptor = ParticipantData.separate_survey_descriptor(
+            b['survey_id'])
+        b['survey_id'] = survey_id
+        b['survey_descriptor'] = descriptor or b.get('survey_descriptor', None)
+
+    # One query per kind, regardless of how many beacons there are.
+    participant_ids = Participant.get_existing_ids(
+        set(b['participant_id'] for b in beacons))
+    surveys = Survey.get_by_id(list(set(b['survey_id'] for b in beacons)))
+    surveys_by_id = {s.uid: s for s in surveys if s}
+    pcs = ProjectCohort.get_by_id(
+        list(set(s.project_cohort_id for s in surveys_by_id.values())))
+    pcs_by_id = {pc.uid: pc for pc in pcs if pc}
+
+    valid = []
+    for b in beacons:
+        survey = surveys_by_id.get(b['survey_id'], None)
+        if b['participant_id'] not in participant_ids:
+            logging.info(u"Participant does not exist: {}"
+                         .format(b['participant_id']))
+            continue
+        if not survey or survey.project_cohort_id not in pcs_by_id:
+            logging.info(u"Survey doesn't exist: {}".format(b['survey_id']))
+            continue
+        if b['survey_descriptor']:
+            b['survey_id'] = ParticipantData.combine_survey_descriptor(
+                survey.uid, b['survey_descriptor'])
+        valid.append(b)
+
+    pds = []
+    for b in coalesce(valid):
+        survey_id, descriptor = ParticipantData.separate_survey_descriptor(
+            b['survey_id'])
+        survey = surveys_by_id[survey_id]
+        pds.append(ParticipantData.create_for_survey(
+            survey,
+            pcs_by_id[survey.project_cohort_id],
+            survey_descriptor=descriptor,
+            key=b['key'],
+            value=b['value'],
+            participant_id=b['participant_id'],
+            testing=b.get('testing', False),
+        ))
+
+    num_written = ParticipantData.upsert_batch(pds)
+
+    # Invalidate participation caches once for the whole batch.
+    progress_pds = [pd for pd in pds if pd.key == 'progress']
+    if progress_pds:
+        ParticipantData.invalidate_participation(
+            [pd.survey_id for pd in progress_pds] +
+            [pd.project_cohort_id for pd in progress_pds] +
+            [pd.code for pd in progress_pds]
+        )
+
+    return (num_written, len(beacons) - len(valid))
@@ -80,4 +80,76 @@ should_deliver_smtp_dev = True
 # https://cloud.google.com/appengine/docs/standard/python/refdocs/google.appengine.api.taskqueue#google.appengine.api.taskqueue.add
 task_consistency_countdown = 30
 
-
+# When True, the participant data beacon (cross_site.gif) only validates and
+# queues its data; see beacon_queue.py. Participation counts then lag by up to
+# the cron interval of /cron/flush_beacons.
+beacon_write_behind = False
+
+# When True, the side effects of task updates (checkpoint status,
+# notifications, last active) happen during the request rather than in a
+# worker; see task_events.py. For tests.
+task_events_synchronous = False
+
+# When True, progress writes recount their participation rollup buckets during
+# the request rather than in a worker; see model/participationrollup.py. For
+# tests.
+participation_rollup_synchronous = False
+
+# Reuse MySQL connections within requests and across them, see
+# mysql_pool.py. Connections per instance, how long to wait for one when all
+# are in use, how long one may sit idle before it's pinged, and how long one
+# lives before it's replaced.
+mysql_pool_enabled = True
+mysql_pool_size = 10
+mysql_pool_wait_seconds = 10
+mysql_pool_health_check_seconds = 30
+mysql_pool_max_age_seconds = 60 * 60
+
+# Index of participation codes to project cohort uids, see
+# ProjectCohort.get_by_code(). Codes cached in each instance's memory, for how
+# long, and how long they're cached in memcache.
+code_index_local_size = 10000
+code_index_local_seconds = 60
+code_index_memcache_seconds = 24 * 60 * 60
+
+# Most items allowed in one request to the participant data batch endpoint,
+# see api_handlers.ParticipantDataBatch.
+participant_data_batch_max_items = 500
+
+# Participation codes are reserved ahead of time and kept in a pool, see
+# model/codepool.py. How many to keep, how many words new codes start with,
+# the most words they may grow to, and the fraction of new candidates that
+# must already be taken before growing.
+code_pool_enabled = True
+code_pool_target = 2000
+code_pool_min_words = 2
+code_pool_max_words = 4
+code_pool_grow_at = 0.5
+
+# Most organizations enrolled in one request, see
+# api_handlers.ProjectCohortsBatch.
+project_cohort_batch_max_items = 500
+
+# How long participants are cached by id and by name and org, see
+# Participant.upsert(). Short, since resetting the participant table would
+# leave the cache pointing at rows that are gone.
+participant_cache_seconds = 5 * 60
+
+# Count and time Datastore, memcache, taskqueue, and MySQL calls in every
+# request, see instrumentation.py.
+instrumentation_enabled = True
+
+# When True, notifications to many recipients are written during the request
+# rather than in a task; see notifier.fan_out(). For tests.
+notifications_synchronous = False
+
+# CSV exports with more rows than this are written to a Dataset in GCS rather
+# than to the response; see csv_export.py. Falsy to always use the response.
+csv_export_gcs_threshold = 50000
+
+# How long the download link of such an export is valid.
+csv_export_token_minutes = 10
+
+# Reporting units sent to RServe per request by the report crons, see
+# rserve_reports.py.
+rserve_reporting_units_per_request = 500
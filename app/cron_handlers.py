@@ -1,23 +1,21 @@
 from google.appengine.api import taskqueue
-from google.appengine.api import urlfetch
-import json
 import logging
-import os
 import traceback
 
 import cloudstorage as gcs
 
 from big_query_api import BigQueryApi
 from gae_handlers import (BackupSqlToGcsHandler, BackupToGcsHandler,
-                          BaseHandler, CronHandler, CleanGcsBucket, Route,
-                          rserve_jwt)
-from model import (Checkpoint, DatastoreModel, Email, ErrorChecker, Program,
-                   Project, ProjectCohort, SecretValue, Task)
+                          BaseHandler, CronHandler, CleanGcsBucket, Route)
+from model import (DashboardRow, DatastoreModel, Email, ErrorChecker,
+                   ParticipationRollup, Program, Project, ProjectCohort)
 import auto_prompt
+import beacon_queue
 import mandrill
 import mysql_connection
+import rserve_reports
 import slow_query
-import util
+import task_events
 
 
 class SendPendingEmail(CronHandler):
@@ -42,140 +40,76 @@ class CheckForErrors(CronHandler):
 
 
 class CacheDashboards(CronHandler):
-    """Periodically refresh dashboard cache to fight stale data.
+    """Reconcile precomputed super dashboard rows with the Datastore.
 
-    See #1029.
+    Rows are normally refreshed as entities change; this catches anything
+    missed, including rows that were never built. See #1029 and
+    model/dashboardrow.py.
     """
     def get(self):
-        # Refresh the newest two cohorts of each program.
-        tasks = []
+        # Check the newest two cohorts of each program.
+        organization_ids = set()
         for program_config in Program.get_all_configs():
             cohorts = sorted(program_config['cohorts'].keys())
             for cohort_label in cohorts[-2:]:
-                task = taskqueue.add(
-                    url='/task/cache_dashboard',
-                    headers={'Content-Type': 'application/json'},
-                    payload=json.dumps({
-                        'program_label': program_config['label'],
-                        'cohort_label': cohort_label,
-                    }),
+                pcs = ProjectCohort.get(
+                    n=float('inf'),
+                    program_label=program_config['label'],
+                    cohort_label=cohort_label,
                 )
-                tasks.append(task)
+                organization_ids |= DashboardRow.organizations_to_reconcile(
+                    program_config['label'], cohort_label, list(pcs))
+
+        tasks = DashboardRow.queue_refresh(organization_ids)
         self.write({
-            'tasks': [
-                {'name': t.name, 'payload': json.loads(t.payload)}
-                for t in tasks
-            ]
+            'organizations': len(organization_ids),
+            'tasks': [t.name for t in tasks],
         })
 
 
-class RServeCGReports(CronHandler):
+class FlushBeacons(CronHandler):
+    """Write any queued participant data beacons. See beacon_queue.py."""
     def get(self):
-        program_label = 'cg17'
-        cohort = Program.get_current_cohort(program_label)
+        self.write(beacon_queue.flush())
 
-        url = '{protocol}://{domain}/api/scripts/cg'.format(
-            protocol='http' if util.is_localhost() else 'https',
-            domain=('localhost:9080' if util.is_localhost()
-                    else os.environ['RSERVE_DOMAIN']),
-        )
 
-        # Look up all the valid project cohorts
-        pc_ids = [pc_key.id() for pc_key in ProjectCohort.get(
-            program_label=program_label,
-            cohort_label=cohort['label'],
-            status='open',
-            keys_only=True,
-            n=float('inf'),
-        )]
-
-        # To match up the right report tasks, we'll need tasks and checkpoints.
-        checkpoints = [c for c in Checkpoint.get(
-            label='cg17_survey__monitor_1',
-            cohort_label=cohort['label'],
-            n=float('inf'),
-        ) if c.project_cohort_id in pc_ids]
-        checkpoint_ids = [c.uid for c in checkpoints]
-        tasks = [t for t in Task.get(
-            label='cg17_survey__report_1',
-            n=float('inf'),
-        ) if t.checkpoint_id in checkpoint_ids]
-
-        # Alternate way to get tasks, via surveys, which may or may not be
-        # more efficient. My current assumption is, for large result sets,
-        # SQL-back checkpoints are faster.
-        #
-        # survey_keys = [s.key for s in Survey.get(
-        #     program_label=program_label,
-        #     cohort_label=cohort['label'],
-        #     n=float('inf'),
-        # ) if s.project_cohort_id in pc_ids]
-        # tasks = [t for t in Task.get(
-        #     label='cg17_survey__report_1',
-        #     n=float('inf'),
-        # ) if t.key.parent() in survey_keys]
-
-        payload = {
-            'reporting_units': [
-                self.build_reporting_unit(uid, checkpoints, tasks)
-                for uid in pc_ids
-            ],
-        }
-
-        secrets = ('neptune_sql_credentials', 'big_pipe_credentials',
-                   'qualtrics_credentials')
-        for s in secrets:
-            payload[s] = SecretValue.get(s, None)
-
-        result = urlfetch.fetch(
-            url=url,
-            payload=json.dumps(payload),
-            method=urlfetch.POST,
-            headers={
-                'Authorization': 'Bearer ' + rserve_jwt(),
-                'Content-Type': 'application/json',
-            }
-        )
+class RefillCodePool(CronHandler):
+    """Top up reserved participation codes. See model/codepool.py."""
+    def get(self):
+        task = taskqueue.add(url='/task/refill_code_pool')
+        self.write({'name': task.name})
 
-        if not result or result.status_code >= 300:
-            logging.error("Non-successful response from RServe: {} {}"
-                          .format(result.status_code, result.content))
-        else:
-            logging.info("response status: {}".format(result.status_code))
-            try:
-                json.loads(result.content)
-                # ok, it's valid
-                # logging.info(util.truncate_json(result.content))
-                logging.info(result.content)
-            except:
-                # just log as text
-                logging.info(result.content)
-
-    def build_reporting_unit(self, pc_id, checkpoints, tasks):
-        url_base = '{protocol}://{domain}'.format(
-            protocol='http' if util.is_localhost() else 'https',
-            domain=('localhost:8888' if util.is_localhost()
-                    else os.environ['HOSTING_DOMAIN']),
-        )
 
-        # Find the right task for this project cohort
-        c = next(c for c in checkpoints if c.project_cohort_id == pc_id)
-        t = next(t for t in tasks if t.checkpoint_id == c.uid)
+class FlushTaskEvents(CronHandler):
+    """Apply the side effects of any task updates missed by their workers.
+    See task_events.py."""
+    def get(self):
+        self.write(task_events.flush())
 
-        # Assemble the URLs that RServe will need to post back to.
-        dataset_url = '{base}/api/datasets?parent_id={parent_id}'.format(
-            base=url_base,
-            parent_id=pc_id,
-        )
-        task_attachment_url = '{base}/api/tasks/{task_id}/attachment'.format(
-            base=url_base,
-            task_id=t.uid,
+
+class FlushParticipationRollup(CronHandler):
+    """Recount any participation rollup groups missed by their workers. See
+    model/participationrollup.py."""
+    def get(self):
+        self.write(ParticipationRollup.flush_recounts())
+
+
+class CheckParticipationRollup(CronHandler):
+    """Find and repair drift between ParticipationRollup and raw data."""
+    def get(self):
+        task = taskqueue.add(
+            url='/task/check_participation_rollup',
+            params={'repair': 'true'},
         )
-        return {
-            'project_cohort_id': pc_id,
-            'post_url': dataset_url,
-            'post_task_attachment_url': task_attachment_url,
-        }
+        self.write({'name': task.name})
+
+
+class RServeReports(CronHandler):
+    """Ask RServe to write the reports programs have configured, for every
+    open project cohort of their current cohorts. See rserve_reports.py."""
+    def get(self):
+        program_label = self.request.get('program_label', None)
+        self.write(rserve_reports.run(program_label))
 
 
 class RServeDaily(CronHandler):
@@ -245,9 +179,16 @@ cron_routes = [
     Route('/cron/backup', BackupToGcsHandler),
     Route('/cron/cache_dashboards', CacheDashboards),
     Route('/cron/check_for_errors', CheckForErrors),
+    Route('/cron/check_participation_rollup', CheckParticipationRollup),
     Route('/cron/clean_gcs_bucket/<bucket>', CleanGcsBucket),
     Route('/cron/export_slow_query_log', ExportSlowQueryLog),
-    Route('/cron/rserve/cg_reports', RServeCGReports),
+    Route('/cron/flush_beacons', FlushBeacons),
+    Route('/cron/flush_participation_rollup', FlushParticipationRollup),
+    Route('/cron/flush_task_events', FlushTaskEvents),
+    Route('/cron/refill_code_pool', RefillCodePool),
+    # Formerly just cg17's reports.
+    Route('/cron/rserve/cg_reports', RServeReports),
+    Route('/cron/rserve/reports', RServeReports),
     Route('/cron/rserve/daily', RServeDaily),
     Route('/cron/send_pending_email', SendPendingEmail),
     Route('/cron/sql_backup/<instance>/<db>/<bucket>', BackupSqlToGcsHandler),
@@ -0,0 +1,157 @@
+"""Stream large SQL query results out as CSV.
+
+Exports like completion ids used to load every row into a list of dicts,
+build the whole file in a BytesIO, and then copy that into the response. For a
+large district that's tens of thousands of rows held three times over.
+
+Here rows come off a server-side (unbuffered) MySQL cursor a batch at a time,
+are formatted into CSV chunks by a generator, and each chunk is written out
+as soon as it's ready, either to the response or, once an export proves very
+large, to a Dataset in Google Cloud Storage. The client is then redirected to
+download the Dataset with a short-lived token, so whoever was allowed the
+export is allowed the download, e.g. Triton's jwts with allowed_endpoints,
+and App Engine serves it from GCS directly (see rserve_handlers.Datasets).
+
+Typical use in a handler:
+
+    query, params = ParticipantData.completion_ids_query(**kwargs)
+    csv_export.export(self, query, params, fieldnames, 'ids.csv',
+                      parent_id=project_cohort_id)
+"""
+
+from io import BytesIO
+import itertools
+import MySQLdb.cursors
+import unicodecsv
+
+from model import Dataset
+import config
+import instrumentation
+import jwt_helper
+import mysql_connection
+
+
+# Rows requested from the server per round trip.
+FETCH_SIZE = 1000
+
+# Rows per CSV chunk yielded to the writer.
+ROWS_PER_CHUNK = 500
+
+
+def stream_rows(query, params=tuple(), fetch_size=FETCH_SIZE):
+    """Yield result rows as dicts without buffering the result set.
+
+    The connection stays open until the generator is exhausted or closed, so
+    consume it promptly. It's a dedicated connection rather than a pooled
+    one (see mysql_pool.py), so other queries can run in the meantime.
+    """
+    with mysql_connection.connect() as sql:
+        cursor = sql.connection.cursor(MySQLdb.cursors.SSDictCursor)
+        try:
+            with instrumentation.timed_sql(query):
+                cursor.execute(query, tuple(params))
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            # Discards any unread rows so the connection can be reused.
+            cursor.close()
+
+
+def csv_chunks(rows, fieldnames, rows_per_chunk=ROWS_PER_CHUNK):
+    """Yield utf-8 encoded CSV text, starting with the header row.
+
+    Args:
+        rows: iterable of dicts, typically from stream_rows(). Keys not in
+            fieldnames are ignored.
+        fieldnames: tuple of column names, in order.
+        rows_per_chunk: int, rows formatted before each yield.
+    """
+    # https://github.com/jdunck/python-unicodecsv
+    fh = BytesIO()
+    writer = unicodecsv.DictWriter(fh, fieldnames=fieldnames,
+                                   encoding='utf-8', extrasaction='ignore')
+    writer.writeheader()
+
+    num_buffered = 0
+    for row in rows:
+        writer.writerow(row)
+        num_buffered += 1
+        if num_buffered == rows_per_chunk:
+            yield fh.getvalue()
+            fh.seek(0)
+            fh.truncate()
+            num_buffered = 0
+
+    if fh.tell():
+        yield fh.getvalue()
+
+
+def export(handler, query, params, fieldnames, filename, parent_id=None,
+           gcs_threshold=None):
+    """Respond to a request with the results of a query as CSV.
+
+    Rows are counted as they're written. Once an export passes gcs_threshold
+    rows, what's been written so far and the rest of the rows go to a Dataset
+    owned by parent_id instead, and the client is redirected to download it,
+    keeping large files out of instance memory. The redirect carries a token
+    for the download, so the handler must check permission before calling
+    this.
+
+    Args:
+        handler: webapp2.RequestHandler handling the export request.
+        query: str SQL, may include %s placeholders.
+        params: tuple of query parameters.
+        fieldnames: tuple of column names to export, in order.
+        filename: str, suggested name for the downloaded file.
+        parent_id: str uid of the entity which should own a Dataset, if one
+            is created.
+        gcs_threshold: int, defaults to config.csv_export_gcs_threshold.
+
+    Returns: Dataset if the export was written to GCS, else None.
+    """
+    if gcs_threshold is None:
+        gcs_threshold = config.csv_export_gcs_threshold
+
+    num_rows = [0]
+
+    def counted(rows):
+        for row in rows:
+            num_rows[0] += 1
+            yield row
+
+    chunks = csv_chunks(counted(stream_rows(query, params)), fieldnames)
+    response = handler.response
+
+    for chunk in chunks:
+        response.write(chunk)
+        if gcs_threshold and num_rows[0] > gcs_threshold:
+            # The response is buffered until the handler returns, so nothing
+            # has been sent yet. Move it to GCS along with the rest.
+            written = response.body
+            response.clear()
+            dataset = Dataset.create_from_chunks(
+                filename, itertools.chain([written], chunks), 'text/csv',
+                parent_id=parent_id)
+            dataset.put()
+            handler.redirect(download_url(handler, dataset))
+            return dataset
+
+    response.headers['Content-Type'] = 'application/csv'
+    response.headers['Content-Disposition'] = (
+        'attachment; filename={}'.format(filename))
+    return None
+
+
+def download_url(handler, dataset):
+    """Url of a Dataset with a token allowing just this download, briefly."""
+    path = '/api/datasets/{}'.format(dataset.uid)
+    token = jwt_helper.encode(
+        {'allowed_endpoints': [
+            handler.get_endpoint_str(method='GET', path=path)]},
+        expiration_minutes=config.csv_export_token_minutes,
+    )
+    return '{}?token={}'.format(path, token)
@@ -0,0 +1,11 @@
+"""Helpers for querying the Datastore within its limits."""
+
+
+# The Datastore raises on more terms than this in one property filter.
+MAX_FILTER_TERMS = 30
+
+
+def chunks(values):
+    """Split values for IN queries, see MAX_FILTER_TERMS."""
+    return [values[i:i + MAX_FILTER_TERMS]
+            for i in range(0, len(values), MAX_FILTER_TERMS)]
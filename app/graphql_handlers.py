@@ -1,15 +1,14 @@
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 import graphene
 import json
 import logging
 
 from gae_handlers import ApiHandler
-from model import Organization, Program, ProjectCohort, User
-from permission import owns
+from model import DashboardRow, Organization, Program, ProjectCohort, User
+from permission import owns, owns_many
+import csv_export
 import graphql_model
 import graphql_queries
-import util
+import identity_map
 
 
 class NeptuneQuery(graphene.ObjectType):
@@ -35,6 +34,12 @@ class NeptuneQuery(graphene.ObjectType):
 NeptuneSchema = graphene.Schema(query=NeptuneQuery, auto_camelcase=False)
 
 
+def execute(query, **kwargs):
+    """Run a query with its own DataLoaders, see graphql_model/loaders.py."""
+    return NeptuneSchema.execute(
+        query, context_value=graphql_model.Loaders(), **kwargs)
+
+
 class GraphQLBase(ApiHandler):
     requires_auth = True
 
@@ -81,7 +86,7 @@ class GraphQLBase(ApiHandler):
             'operation_name': str,
         })
 
-        result = NeptuneSchema.execute(
+        result = execute(
             params['query'],
             variable_values=params.get('variables', None),
             operation_name=params.get('operation_name', None),
@@ -100,14 +105,15 @@ class TasklistHandler(ApiHandler):
         """Run a hard-coded query, for org admins, ideal for one tasklist."""
         project_cohort_id = ProjectCohort.get_long_uid(project_cohort_id)
 
-        pc = ProjectCohort.get_by_id(project_cohort_id)
+        # Shared with owns(), below.
+        pc = identity_map.get(project_cohort_id)
         if not pc:
             return self.http_not_found()
 
         if not owns(self.get_current_user(), project_cohort_id):
             return self.http_forbidden("You don't own this program.")
 
-        result = NeptuneSchema.execute(
+        result = execute(
             graphql_queries.single_tasklist,
             variable_values={'uid': project_cohort_id},
         )
@@ -136,11 +142,10 @@ class DashboardByOwner(ApiHandler):
 
         # Make sure requesting user owns any specified ids.
         user = self.get_current_user()
-        for key, id in kwargs.items():
-            if not owns(user, id):
-                return self.http_forbidden()
+        if not all(owns_many(user, kwargs.values()).values()):
+            return self.http_forbidden()
 
-        result = NeptuneSchema.execute(
+        result = execute(
             graphql_queries.dashboard,
             variable_values=kwargs,
         )
@@ -154,17 +159,15 @@ class DashboardByOwner(ApiHandler):
 class SuperDashboard(ApiHandler):
     requires_auth = True
 
-    def get(self, queue_cache_task=True):
+    def get(self):
         """Get everything for all "program cards" with checkpoint progress.
 
-        Args:
-            queue_cache_task - bool, default True, only False when this code is
-                re-used within a task, to avoid recursion.
-
         Different from DashboardByOwner because it uses query string parameters:
         * program_label
         * cohort_label
         * organization_id
+
+        Assembled from precomputed rows, see model/dashboardrow.py.
         """
         if not self.get_current_user().super_admin:
             return self.http_forbidden()
@@ -174,48 +177,59 @@ class SuperDashboard(ApiHandler):
             'program_label': str,
             'cohort_label': str,
         })
-        cache_key = util.cached_query_key('SuperDashboard', **params)
-
-        cached = memcache.get(cache_key)
-        if cached:
-            self.response.write(cached)  # already a JSON string
-            return
-        # else run the query...
 
         program_label = params.get('program_label', None)
         if program_label:
             config = Program.get_config(program_label)
             if not config.get('listed', True):
                 # This program is unlisted, don't allow it to be queried.
-                # But don't respond with an error code, because when this runs
-                # as a task that would cause it to retry.
                 logging.info("Skipping query for unlisted program.")
                 self.write([])
                 return
 
-        # Queue a task to run this same code in case we're hit by the 30
-        # second limit.
-        if queue_cache_task:
-            taskqueue.add(
-                url='/task/cache_dashboard',
-                headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                payload=self.request.query_string,
-            )
-
+        # Same shapes as graphql_queries.program_cohort_dashboard and
+        # graphql_queries.dashboard, respectively.
         program_cohort_set = (params.get('program_label', None) and
                               params.get('cohort_label', None))
-        query = (graphql_queries.program_cohort_dashboard
-                 if program_cohort_set else graphql_queries.dashboard)
 
-        result = NeptuneSchema.execute(
-            # graphql_queries.dashboard,
-            query,
-            variable_values=params,
-        )
+        self.response.headers['Content-Type'] = (
+            'application/json; charset=utf-8')
 
+        if program_cohort_set:
+            result = execute(
+                graphql_queries.program_cohort,
+                variable_values=params,
+            )
+            if result.errors:
+                raise Exception(result.errors)
+            self.response.write('{{"program_cohort": {}, '.format(
+                json.dumps(result.data['program_cohort'])))
+        else:
+            self.response.write('{')
+
+        # Rows are already JSON; copy them straight to the response.
+        query, query_params = DashboardRow.documents_query(
+            'summary' if program_cohort_set else 'document', **params)
+        self.response.write('"project_cohorts": [')
+        for i, row in enumerate(csv_export.stream_rows(query, query_params)):
+            self.response.write((',' if i else '') + row['json'])
+        self.response.write(']}')
+
+
+def materialize_dashboard_rows(organization_ids):
+    """Recompute precomputed dashboard rows for these organizations.
+
+    Returns: int number of rows written.
+    """
+    documents = []
+    for organization_id in organization_ids:
+        result = execute(
+            graphql_queries.dashboard,
+            variable_values={'organization_id': organization_id},
+        )
         if result.errors:
             raise Exception(result.errors)
+        documents += result.data['project_cohorts']
 
-        memcache.set(cache_key, json.dumps(result.data))
-
-        self.write(result.data)
+    DashboardRow.replace_organizations(organization_ids, documents)
+    return len(documents)
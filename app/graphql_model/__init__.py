@@ -6,6 +6,7 @@ Describes Neptune models for GraphQL.
 """
 
 from .checkpoint import Checkpoint, CheckpointResource, CheckpointCollection
+from .loaders import Loaders
 from .organization import (
   Organization,
   OrganizationResource,
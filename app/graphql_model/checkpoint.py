@@ -3,8 +3,9 @@
 import graphene
 
 from .config import default_n
+from .loaders import load_tasks
 from .task import Task
-from gae_models import DatastoreModel, SqlModel, graphql_util
+from gae_models import SqlModel, graphql_util
 import model
 
 
@@ -36,12 +37,7 @@ class Checkpoint(graphene.ObjectType):
     tasks = graphene.List(Task)
 
     def resolve_tasks(self, info):
-        return model.Task.get(
-            ancestor=DatastoreModel.id_to_key(self.parent_id),
-            checkpoint_id=self.uid,
-            order='ordinal',
-            n=default_n,
-        )
+        return load_tasks(info, self)
 
 
 CheckpointResource = graphene.Field(
@@ -0,0 +1,159 @@
+"""Batched data fetching for GraphQL resolvers.
+
+GraphQL resolves related objects one parent at a time: asking for the surveys
+of 300 project cohorts calls ProjectCohort.resolve_surveys() 300 times. If
+each of those queried the Datastore, a dashboard would make thousands of
+RPCs.
+
+Instead, resolvers call load() on one of the DataLoaders here, which returns
+a promise. The loader collects every key requested while resolving the
+current level of the query, then fetches them all at once: one get_multi, or
+one query, for the whole batch.
+
+A fresh set of loaders is made for each execution and passed as the GraphQL
+context, so nothing is cached between requests:
+
+    NeptuneSchema.execute(query, context_value=Loaders())
+
+See graphql_handlers.execute().
+"""
+
+from promise import Promise
+from promise.dataloader import DataLoader
+import json
+
+from datastore_helper import chunks
+from gae_models import DatastoreModel
+import identity_map
+import model
+
+
+class EntityLoader(DataLoader):
+    """Datastore entities of any kind by uid, None if not found.
+
+    Projects are returned with their cached properties, which are also
+    fetched in batch, see graphql_util.resolve_client_prop().
+    """
+    def batch_load_fn(self, uids):
+        entities = identity_map.get_multi(uids)
+
+        projects = [e for e in entities
+                    if e and DatastoreModel.get_kind(e) == 'Project']
+        if projects:
+            props_by_id = model.Project.batch_cached_properties_from_db(
+                projects=projects)
+            for p in projects:
+                p._cached_properties = props_by_id[p.uid]
+
+        return Promise.resolve(entities)
+
+
+class UsersByOrganizationLoader(DataLoader):
+    """Owners of each organization uid, sorted by email."""
+    def batch_load_fn(self, organization_ids):
+        # Every owner, rather than a page of them. Users owning organizations
+        # in more than one chunk are found more than once.
+        users_by_id = {}
+        for chunk in chunks(list(organization_ids)):
+            users_by_id.update((u.uid, u) for u in model.User.get(
+                owned_organizations=chunk,
+                order='email',
+                n=float('inf'),
+            ))
+
+        by_org = {org_id: [] for org_id in organization_ids}
+        for user in sorted(users_by_id.values(), key=lambda u: u.email):
+            for org_id in user.owned_organizations:
+                if org_id in by_org:
+                    by_org[org_id].append(user)
+
+        return Promise.resolve([by_org[org_id] for org_id in organization_ids])
+
+
+class ProjectCohortLoader(DataLoader):
+    """Base for loaders of things related to project cohorts.
+
+    Keys are project cohort uids, but batches need the whole project cohort,
+    so call load_for() rather than load().
+    """
+    def __init__(self, *args, **kwargs):
+        super(ProjectCohortLoader, self).__init__(*args, **kwargs)
+        self.project_cohorts = {}
+
+    def load_for(self, project_cohort):
+        self.project_cohorts[project_cohort.uid] = project_cohort
+        return self.load(project_cohort.uid)
+
+
+class CheckpointsByProjectCohortLoader(ProjectCohortLoader):
+    """Task list checkpoints of each project cohort, in one SQL query."""
+    def batch_load_fn(self, pc_ids):
+        checkpoints_by_pc = model.Checkpoint.for_tasklists(
+            [self.project_cohorts[uid] for uid in pc_ids])
+        return Promise.resolve([checkpoints_by_pc[uid] for uid in pc_ids])
+
+
+class SurveysByProjectCohortLoader(ProjectCohortLoader):
+    """Surveys of each project cohort, by ordinal.
+
+    Most project cohorts list their surveys in survey_ids, so they can be
+    fetched by key. Those that don't are found with a query per chunk of
+    them.
+    """
+    def batch_load_fn(self, pc_ids):
+        pcs = [self.project_cohorts[uid] for uid in pc_ids]
+
+        listed = [s_id for pc in pcs for s_id in pc.survey_ids]
+        surveys = model.Survey.get_by_id(listed) if listed else []
+        unlisted = [pc.uid for pc in pcs if not pc.survey_ids]
+        for chunk in chunks(unlisted):
+            surveys += list(model.Survey.get(
+                project_cohort_id=chunk,
+                order='ordinal',
+                n=float('inf'),
+            ))
+
+        by_pc = {uid: [] for uid in pc_ids}
+        for s in surveys:
+            if s and not s.deleted and s.project_cohort_id in by_pc:
+                by_pc[s.project_cohort_id].append(s)
+
+        return Promise.resolve([
+            sorted(by_pc[uid], key=lambda s: s.ordinal) for uid in pc_ids
+        ])
+
+
+class Loaders(object):
+    """All the loaders for one GraphQL execution."""
+    def __init__(self):
+        self.entities = EntityLoader()
+        self.users_by_organization = UsersByOrganizationLoader()
+        self.checkpoints_by_project_cohort = CheckpointsByProjectCohortLoader()
+        self.surveys_by_project_cohort = SurveysByProjectCohortLoader()
+
+
+def get_loaders(info):
+    """The loaders for the execution a resolver is part of."""
+    if isinstance(info.context, Loaders):
+        return info.context
+    # Executed without loaders. Results are still correct, but nothing is
+    # batched beyond a single resolver.
+    return Loaders()
+
+
+def load_entity(info, uid):
+    """Promise of an entity, or None if there's no uid to load."""
+    if not uid:
+        return None
+    return get_loaders(info).entities.load(uid)
+
+
+def load_tasks(info, checkpoint):
+    """Promise of a checkpoint's tasks, by ordinal."""
+    task_ids = json.loads(checkpoint.task_ids or '[]')
+    return get_loaders(info).entities.load_many(task_ids).then(
+        lambda tasks: sorted(
+            [t for t in tasks if t and not t.deleted],
+            key=lambda t: t.ordinal,
+        )
+    )
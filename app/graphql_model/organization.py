@@ -4,6 +4,7 @@ import graphene
 from graphene_gae import NdbObjectType
 
 from .config import default_n
+from .loaders import get_loaders, load_entity
 from .user import User
 from gae_models import DatastoreModel, graphql_util
 import model
@@ -23,14 +24,10 @@ class Organization(NdbObjectType):
     poid = graphql_util.PassthroughScalar()
 
     def resolve_liaison(self, info):
-        return model.User.get_by_id(self.liaison_id)
+        return load_entity(info, self.liaison_id)
 
     def resolve_users(self, info):
-        return model.User.get(
-            owned_organizations=self.uid,
-            order='email',
-            n=default_n,
-        )
+        return get_loaders(info).users_by_organization.load(self.uid)
 
 
 OrganizationResource = graphene.Field(
@@ -23,13 +23,13 @@ class ProgramCohort(graphene.ObjectType):
 
 def program_cohort_resource_resolver(program_label, cohort_label):
     program_conf = model.Program.get_config(program_label)
-    cohort_conf = program_conf['cohorts'][cohort_label]
-    cohort_conf.update(
+    # Configs are shared, so copy rather than modify.
+    return dict(
+        program_conf['cohorts'][cohort_label],
         program_description=program_conf['description'],
         program_label=program_conf['label'],
         program_name=program_conf['name'],
     )
-    return cohort_conf
 
 
 def program_cohort_collection_resolver(root, info, **kwargs):
@@ -38,10 +38,10 @@ def program_cohort_collection_resolver(root, info, **kwargs):
         program_conf['cohorts'].values(),
         key=lambda c: c['label'],
     )
-    for c in cohorts:
-        c.update(program_label=program_conf['label'],
+    # Configs are shared, so copy rather than modify.
+    return [dict(c, program_label=program_conf['label'],
                  program_name=program_conf['name'])
-    return cohorts
+            for c in cohorts]
 
 ProgramCohortResource = graphene.Field(
     ProgramCohort,
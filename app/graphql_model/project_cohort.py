@@ -3,26 +3,20 @@
 from google.appengine.api import memcache
 from graphene_gae import NdbObjectType
 import graphene
-import logging
 
 from .checkpoint import Checkpoint
 from .config import default_n
+from .loaders import get_loaders, load_entity
 from .organization import Organization
 from .program_cohort import ProgramCohort, program_cohort_resource_resolver
 from .project import Project
 from .survey import Survey
 from .user import User
-from gae_models import DatastoreModel, graphql_util
+from gae_models import graphql_util
 import model
 import util
 
 
-def init_cached_property(root, prop):
-    if not getattr(root, '_cached_properties', None):
-        root._cached_properties = root.get_cached_properties()
-    return root._cached_properties[prop]
-
-
 class ProjectCohort(NdbObjectType):
     class Meta:
         model = model.ProjectCohort
@@ -46,32 +40,29 @@ class ProjectCohort(NdbObjectType):
     project = graphene.Field(Project)
 
     def resolve_surveys(self, info):
-        if info.operation.name.value == 'ProgramCohortDashboard':
-            return init_cached_property(self, 'surveys')
-        return model.Survey.get(project_cohort_id=self.uid, order='ordinal',
-                                n=default_n)
+        return get_loaders(info).surveys_by_project_cohort.load_for(self)
 
     def resolve_checkpoints(self, info):
-        if info.operation.name.value == 'ProgramCohortDashboard':
-            return init_cached_property(self, 'checkpoints')
-        return model.Checkpoint.for_tasklist(self)
+        return get_loaders(info).checkpoints_by_project_cohort.load_for(self)
 
     def resolve_liaison(self, info):
-        return model.User.get_by_id(self.liaison_id)
+        return load_entity(info, self.liaison_id)
 
     def resolve_organization(self, info):
-        if info.operation.name.value == 'ProgramCohortDashboard':
-            return init_cached_property(self, 'organization')
-        return model.Organization.get_by_id(self.organization_id)
+        return load_entity(info, self.organization_id)
 
     def resolve_program_cohort(self, info):
         return program_cohort_resource_resolver(self.program_label,
                                                 self.cohort_label)
 
     def resolve_project(self, info):
-        if info.operation.name.value == 'ProgramCohortDashboard':
-            return init_cached_property(self, 'project')
-        return model.Project.get_by_id(self.project_id)
+        return load_entity(info, self.project_id)
+
+
+# Queries of project cohorts asking only for the fields of their cached
+# properties (see c_fields and s_fields in model/projectcohort.py), which can
+# be served from memcache.
+CACHED_PROPERTY_OPERATIONS = ('ProgramCohortDashboard',)
 
 
 ProjectCohortResource = graphene.Field(
@@ -86,7 +77,9 @@ ProjectCohortResource = graphene.Field(
 
 
 def pc_collection_resolver(root, info, **kwargs):
-    """Query project cohorts with lots of associated data and agressive caching.
+    """Query project cohorts. Their related data is fetched in batches by the
+    resolvers above, see loaders.py, or for the super dashboard, from their
+    cached properties.
 
     Can be called three ways, based on what's in kwargs:
 
@@ -107,47 +100,57 @@ def pc_collection_resolver(root, info, **kwargs):
     util.profiler.add_event("querying pcs")
     pcs = list(model.ProjectCohort.get(n=default_n, **kwargs))
 
-    # Get cached properties for these project cohorts all at once. See
-    # graphql_util.resolve_client_prop().
+    operation = info.operation.name.value if info.operation.name else None
+    if operation in CACHED_PROPERTY_OPERATIONS:
+        prime_from_cached_properties(get_loaders(info), pcs)
+
+    util.profiler.add_event("handing off to graphql")
+    return pcs
+
+
+def prime_from_cached_properties(loaders, pcs):
+    """Get cached properties for these project cohorts all at once, and give
+    them to the loaders, so the resolvers don't fetch them again."""
     pcs_by_memkey = {util.cached_properties_key(pc.uid): pc for pc in pcs}
 
     # memcache.get_multi only returns results for keys it finds; those it
     # doesn't find are missing (rather than being set to None)
-    mem_results = memcache.get_multi(pcs_by_memkey.keys())
-    for memkey, props in mem_results.items():
-        pc = pcs_by_memkey[memkey]
-        pc._cached_properties = props
+    props_by_memkey = memcache.get_multi(pcs_by_memkey.keys())
 
     # Go to the db for pc's which didn't have memcache results. Refresh
     # memcache all at once with the results.
     uncached = {memkey: pc for memkey, pc in pcs_by_memkey.items()
-                if memkey not in mem_results.keys()}
+                if memkey not in props_by_memkey}
     util.profiler.add_event("batch cached pc props")
     cached_pc_props_by_id = model.ProjectCohort.batch_cached_properties_from_db(
         project_cohorts=uncached.values()
     )
-
-    # Inform memcache about all the properties we fetched from the db.
-    to_set = {}
-    for memkey, pc in uncached.items():
-        props = cached_pc_props_by_id[pc.uid]
-        pc._cached_properties = props
-        to_set[memkey] = props
+    to_set = {memkey: cached_pc_props_by_id[pc.uid]
+              for memkey, pc in uncached.items()}
     memcache.set_multi(to_set)
+    props_by_memkey.update(to_set)
 
     # Projects have their own cached properties which we can also batch, with
     # data that's already been fetched.
     util.profiler.add_event("batch cached project props")
+    all_props = props_by_memkey.values()
+    projects = [p['project'] for p in all_props if p['project']]
     cached_project_props_by_id = model.Project.batch_cached_properties_from_db(
-        projects=[pc._cached_properties['project'] for pc in pcs],
-        organizations=[pc._cached_properties['organization'] for pc in pcs],
+        projects=projects,
+        organizations=[p['organization'] for p in all_props
+                       if p['organization']],
     )
-    for pc in pcs:
-        props = cached_project_props_by_id[pc.project_id]
-        pc._cached_properties['project']._cached_properties = props
-
-    util.profiler.add_event("handing off to graphql")
-    return pcs
+    for project in projects:
+        project._cached_properties = cached_project_props_by_id[project.uid]
+
+    for memkey, pc in pcs_by_memkey.items():
+        props = props_by_memkey[memkey]
+        loaders.checkpoints_by_project_cohort.prime(
+            pc.uid, props['checkpoints'])
+        loaders.surveys_by_project_cohort.prime(pc.uid, props['surveys'])
+        for entity in (props['organization'], props['project']):
+            if entity:
+                loaders.entities.prime(entity.uid, entity)
 
 
 ProjectCohortCollection = graphene.Field(
@@ -318,3 +318,19 @@ program_cohort_dashboard = '''
         }
     }
 '''
+
+
+program_cohort = PctTemplate('''
+    query ProgramCohort(
+        $program_label: String!,
+        $cohort_label: String!,
+    ) {
+        program_cohort(
+            program_label: $program_label,
+            cohort_label: $cohort_label,
+        ) {
+            ...program_cohort_fields
+        }
+    }
+    %{program_cohort_fields}
+''').substitute(fragments)
@@ -0,0 +1,117 @@
+"""Request-scoped identity map for Datastore entities.
+
+Within one request the same entities are often fetched many times over: a
+participation request calls owns() for every id, which gets each Project,
+ProjectCohort, or Survey, then get_parent_id() gets it again, and Task and
+Notification ownership recurses into their parents, getting those too.
+
+Read paths can call get() and get_multi() here instead of
+DatastoreModel.get_by_id(). Each uid is fetched at most once per request, and
+when a list of ids is known up front, prefetch() gets them all in one batch.
+
+The map is tied to the current webapp2 request, so every handler gets a fresh
+one without any setup, and calls made outside a request (tests, deferred
+code) simply pass through to the Datastore. Entities in the map are shared
+within the request; code that modifies and puts an entity should fetch its
+own copy, or call forget() afterwards.
+
+middleware() clears the map at the end of each request and, in development,
+reports the number of Datastore RPCs the request made, as counted by
+instrumentation.py, in the X-Datastore-RPCs response header. It's installed
+in appengine_config.py.
+"""
+
+import threading
+import webapp2
+
+from model import DatastoreModel
+import instrumentation
+import util
+
+
+RPC_COUNT_HEADER = 'X-Datastore-RPCs'
+
+_local = threading.local()
+
+
+def _scope():
+    """The identity map state for the current request, or None if there is
+    no current request."""
+    try:
+        request = webapp2.get_request()
+    except AssertionError:
+        return None
+
+    if getattr(_local, 'request', None) is not request:
+        _local.request = request
+        _local.entities = {}
+
+    return _local
+
+
+def get(uid):
+    """Get one entity by uid, or None if it doesn't exist."""
+    return get_multi([uid])[0]
+
+
+def get_multi(uids):
+    """Get entities by uid, in order, with None for any that don't exist.
+
+    Uids already in the map cost nothing. All the others are fetched in a
+    single batch.
+    """
+    scope = _scope()
+    if scope is None:
+        return DatastoreModel.get_by_id(list(uids)) if uids else []
+
+    missing = list(set(uid for uid in uids if uid not in scope.entities))
+    if missing:
+        fetched = DatastoreModel.get_by_id(missing)
+        # Remember non-existent entities too, so they aren't re-fetched.
+        scope.entities.update(zip(missing, fetched))
+
+    return [scope.entities[uid] for uid in uids]
+
+
+def prefetch(uids):
+    """Load many entities in one batch ahead of piecemeal get() calls."""
+    get_multi(uids)
+
+
+def forget(uid):
+    """Drop an entity from the map, e.g. after it's been modified."""
+    scope = _scope()
+    if scope is not None:
+        scope.entities.pop(uid, None)
+
+
+def rpc_count():
+    """Datastore RPCs made so far in the current request, or None if calls
+    aren't being counted."""
+    stats = instrumentation.current()
+    return stats.counts['datastore'] if stats is not None else None
+
+
+def clear():
+    _local.request = None
+    _local.entities = {}
+
+
+def middleware(application):
+    """Wrap a WSGI application so each request starts and ends with an empty
+    identity map, and RPC counts are reported in development."""
+    def wrapped(environ, start_response):
+        clear()
+
+        def counting_start_response(status, headers, exc_info=None):
+            count = rpc_count()
+            if count is not None and util.is_development():
+                headers.append((RPC_COUNT_HEADER, str(count)))
+            return start_response(status, headers, exc_info)
+
+        try:
+            return application(environ, counting_start_response)
+        finally:
+            clear()
+
+    return wrapped
@@ -0,0 +1,305 @@
+"""Per-request counts and timings of Datastore, memcache, taskqueue, and
+MySQL calls.
+
+middleware() (installed in appengine_config.py) watches every request and:
+
+* adds a Server-Timing header, which browser dev tools show alongside the
+  request, e.g. `datastore;dur=41.2;desc="12 calls", sql;dur=8.1;...`,
+* logs one structured line, `instrumentation {...json...}`, with the route,
+  status, timings, counts, and the slowest SQL statements (normalized, so
+  values and long IN lists don't make every statement unique), and
+* adds the request to per-route aggregates kept in memory: request count,
+  a latency histogram, and total calls and time of each kind. These are per
+  instance; read them from /api/instrumentation.
+
+This is the one place calls are counted. identity_map.py's X-Datastore-RPCs
+header reads current(), and tests and benchmarks count calls with collect().
+
+App Engine API calls are seen with apiproxy hooks. MySQL statements are
+timed where they're issued, with timed_sql(): mysql_pool.connect() yields
+connections whose query() and select_query() use it, and batches and
+csv_export's streamed queries call it directly. SQL run on a bare
+mysql_connection.connect() isn't counted. Work done after the response
+starts, like streaming a CSV export's rows, isn't included in a request's
+stats.
+
+Set config.instrumentation_enabled to False to turn all this off.
+"""
+
+from google.appengine.api import apiproxy_stub_map
+import collections
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import webapp2
+
+import config
+
+
+# Names of the kinds of calls we count, by App Engine API service name.
+SERVICE_KINDS = {
+    'datastore_v3': 'datastore',
+    'memcache': 'memcache',
+    'taskqueue': 'taskqueue',
+}
+KINDS = ('datastore', 'memcache', 'taskqueue', 'sql')
+
+# Upper bounds, in ms, of latency histogram buckets. The last is unbounded.
+HISTOGRAM_BOUNDS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Slowest statements to log per request.
+SLOW_SQL_LOGGED = 3
+
+# Normalized SQL is cut off at this many characters.
+MAX_SQL_LENGTH = 300
+
+_local = threading.local()
+
+_routes_lock = threading.Lock()
+_routes = {}  # RouteStats by "<method> <route template>"
+
+
+class RequestStats(object):
+    """Calls made during one request."""
+    def __init__(self):
+        self.start = time.time()
+        self.counts = collections.Counter()
+        self.ms = collections.Counter()
+        self.statements = []  # (ms, normalized sql)
+
+    def record(self, kind, ms):
+        self.counts[kind] += 1
+        self.ms[kind] += ms
+
+    def elapsed_ms(self):
+        return (time.time() - self.start) * 1000
+
+    def server_timing(self, total_ms):
+        parts = [
+            '{};dur={:.1f};desc="{} calls"'.format(
+                kind, self.ms[kind], self.counts[kind])
+            for kind in KINDS if self.counts[kind]
+        ]
+        parts.append('total;dur={:.1f}'.format(total_ms))
+        return ', '.join(parts)
+
+    def slowest_statements(self, n=SLOW_SQL_LOGGED):
+        return [
+            {'ms': round(ms, 1), 'sql': sql}
+            for ms, sql in sorted(self.statements, reverse=True)[:n]
+        ]
+
+
+class RouteStats(object):
+    """Aggregate of all requests to one route."""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.counts = collections.Counter()
+        self.ms = collections.Counter()
+
+    def add(self, stats, total_ms, status):
+        self.requests += 1
+        self.errors += status >= 500
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, total_ms)
+        bucket = len(HISTOGRAM_BOUNDS_MS)
+        for i, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if total_ms <= bound:
+                bucket = i
+                break
+        self.histogram[bucket] += 1
+        self.counts.update(stats.counts)
+        self.ms.update(stats.ms)
+
+    def to_dict(self):
+        n = self.requests
+        return {
+            'requests': n,
+            'errors': self.errors,
+            'mean_ms': round(self.total_ms / n, 1) if n else None,
+            'max_ms': round(self.max_ms, 1),
+            'histogram': [
+                {'le_ms': bound, 'n': count}
+                for bound, count in zip(HISTOGRAM_BOUNDS_MS + (None,),
+                                        self.histogram)
+            ],
+            'per_request': {
+                kind: {
+                    'calls': round(float(self.counts[kind]) / n, 2),
+                    'ms': round(self.ms[kind] / n, 1),
+                }
+                for kind in KINDS
+            } if n else {},
+        }
+
+
+def current():
+    """The innermost RequestStats being collected, or None outside of a
+    request or collect() block."""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def _collecting():
+    """Every RequestStats being collected; calls count toward all of them."""
+    return getattr(_local, 'stack', None) or []
+
+
+@contextlib.contextmanager
+def collect():
+    """Count and time the calls made inside the block, e.g. in a test or
+    benchmark:
+
+        with instrumentation.collect() as stats:
+            do_work()
+        stats.counts['datastore']
+
+    Blocks may nest, and may contain whole requests handled by middleware().
+    """
+    _install_hooks()
+    stats = RequestStats()
+    if getattr(_local, 'stack', None) is None:
+        _local.stack = []
+        _local.started = {}
+    _local.stack.append(stats)
+    try:
+        yield stats
+    finally:
+        _local.stack.remove(stats)
+
+
+@contextlib.contextmanager
+def timed_sql(query):
+    """Count and time a statement, run in the block, as a 'sql' call."""
+    stack = _collecting()
+    if not stack:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        ms = (time.time() - start) * 1000
+        normalized = normalize_sql(query)
+        for stats in stack:
+            stats.record('sql', ms)
+            stats.statements.append((ms, normalized))
+
+
+def normalize_sql(query):
+    """Reduce a statement to its shape: placeholders and literals become ?,
+    lists of them become ?..., and repeated value rows collapse."""
+    sql = re.sub(r'\s+', ' ', query).strip()
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'", '?', sql)
+    sql = re.sub(r'%s|\b\d+\b', '?', sql)
+    sql = re.sub(r'\?(?:\s*,\s*\?)+', '?...', sql)
+    sql = re.sub(r'\((\?\.*)\)(?:\s*,\s*\(\?\.*\))+', r'(\1), ...', sql)
+    return sql[:MAX_SQL_LENGTH]
+
+
+def _call_token(request, rpc):
+    """Pairs a call's pre and post hooks. Async calls have their own rpc;
+    sync calls get the request message, which lives until the call ends, so
+    overlapping calls to the same service and method never share a key."""
+    return id(rpc) if rpc is not None else id(request)
+
+
+def _pre_call(service, call, request, response, rpc=None):
+    if _collecting():
+        _local.started[_call_token(request, rpc)] = time.time()
+
+
+def _post_call(service, call, request, response, rpc=None, error=None):
+    stack = _collecting()
+    if not stack:
+        return
+    start = _local.started.pop(_call_token(request, rpc), None)
+    ms = (time.time() - start) * 1000 if start else 0
+    for stats in stack:
+        stats.record(SERVICE_KINDS.get(service, service), ms)
+
+
+def _install_hooks():
+    # The testbed replaces the apiproxy between tests, so check every time
+    # stats are collected. Append() is a no-op if the hook is already there.
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'instrumentation', _pre_call)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'instrumentation', _post_call)
+
+
+def route_stats():
+    """Aggregates of requests this instance has handled, by route."""
+    with _routes_lock:
+        routes = {template: r.to_dict() for template, r in _routes.items()}
+    return {
+        'instance_id': os.environ.get('INSTANCE_ID', None),
+        'routes': routes,
+    }
+
+
+def reset_route_stats():
+    with _routes_lock:
+        _routes.clear()
+
+
+def _route_template():
+    try:
+        route = webapp2.get_request().route
+    except (AssertionError, AttributeError):
+        route = None
+    return getattr(route, 'template', None) or 'unmatched'
+
+
+def _finish(stats, route, method, status):
+    total_ms = stats.elapsed_ms()
+    key = '{} {}'.format(method, route)
+    with _routes_lock:
+        _routes.setdefault(key, RouteStats()).add(stats, total_ms, status)
+
+    logging.info('instrumentation ' + json.dumps({
+        'route': route,
+        'method': method,
+        'status': status,
+        'total_ms': round(total_ms, 1),
+        'calls': dict(stats.counts),
+        'ms': {k: round(v, 1) for k, v in stats.ms.items()},
+        'slowest_sql': stats.slowest_statements(),
+    }, sort_keys=True))
+
+    return total_ms
+
+
+def middleware(application):
+    """Wrap a WSGI application to instrument each request."""
+    def wrapped(environ, start_response):
+        if not config.instrumentation_enabled:
+            return application(environ, start_response)
+
+        with collect() as stats:
+
+            def timing_start_response(status, headers, exc_info=None):
+                # Called by the application before the body is returned,
+                # but after the handler has done its work, while the route
+                # is known.
+                total_ms = _finish(
+                    stats,
+                    _route_template(),
+                    environ.get('REQUEST_METHOD', 'GET'),
+                    int(status.split(' ')[0]),
+                )
+                headers.append(
+                    ('Server-Timing', stats.server_timing(total_ms)))
+                return start_response(status, headers, exc_info)
+
+            return application(environ, timing_start_response)
+
+    return wrapped
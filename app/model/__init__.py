@@ -14,8 +14,10 @@ from gae_models import Email, SecretValue, SqlModel, StorageObject
 from .accountmanager import AccountManager
 from .authtoken import AuthToken
 from .checkpoint import Checkpoint
+from .codepool import PooledCode
 from .datarequest import DataRequest
 from .dataset import Dataset
+from .dashboardrow import DashboardRow
 from .datatable import DataTable
 from .errorchecker import ErrorChecker
 from .liaisonship import Liaisonship
@@ -23,11 +25,12 @@ from .notification import Notification
 from .organization import Organization
 from .participant import Participant
 from .participantdata import ParticipantData
+from .participationrollup import ParticipationRollup
 from .program import Program
 from .project import Project
 from .projectcohort import ProjectCohort
 from .survey import Survey
-from .surveylink import SurveyLink
+from .surveylink import SurveyLink, SurveyLinkImport
 from .task import Task
 from .tasklist import Tasklist
 from .taskreminder import TaskReminder
@@ -3,19 +3,21 @@ status. SQL-backed."""
 
 from collections import OrderedDict
 from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 import json
 import logging
 
 from gae_models import DatastoreModel
 from gae_models import SqlModel, SqlField as Field
-import config
 import model
-import mysql_connection
+import mysql_pool
 import organization_tasks
 import util
 
 
+# Rows per INSERT statement in insert_multi().
+INSERT_BATCH_SIZE = 500
+
+
 class Checkpoint(SqlModel):
     """A grouping of tasks designed for high-level reporting of task status.
 
@@ -54,6 +56,33 @@ class Checkpoint(SqlModel):
                 'name': 'ordinal',
                 'fields': ['ordinal'],
             },
+            # One for each branch of for_tasklists().
+            {
+                'name': 'parent_kind-organization',
+                'fields': ['parent_kind', 'organization_id', 'ordinal'],
+            },
+            {
+                'name': 'parent_kind-project',
+                'fields': ['parent_kind', 'project_id', 'ordinal'],
+            },
+            {
+                'name': 'parent_kind-project_cohort',
+                'fields': ['parent_kind', 'project_cohort_id', 'ordinal'],
+            },
+            # For for_organizations_in_program().
+            {
+                'name': 'parent_kind-program',
+                'fields': ['parent_kind', 'program_label'],
+            },
+            # For listing the checkpoints of a tasklist, see Tasklist.status().
+            {
+                'name': 'parent-ordinal',
+                'fields': ['parent_id', 'ordinal'],
+            },
+            {
+                'name': 'project_cohort',
+                'fields': ['project_cohort_id'],
+            },
         ],
         'engine': 'InnoDB',
         'charset': 'utf8',
@@ -71,6 +100,39 @@ class Checkpoint(SqlModel):
 
         return super(klass, klass).create(**kwargs)
 
+    @classmethod
+    def insert_multi(klass, checkpoints):
+        """Write new checkpoints with multi-row INSERTs.
+
+        Unlike put_multi(), after_put() isn't called, so the caller must
+        clear related cached properties and dashboard rows itself, once for
+        all checkpoints. See provisioning.commit().
+
+        Returns: int number of rows inserted.
+        """
+        if not checkpoints:
+            return 0
+
+        row_dicts = [klass.coerce_row_dict(c.to_dict()) for c in checkpoints]
+        fields = sorted(row_dicts[0].keys())
+        row_interps = '({})'.format(','.join(['%s'] * len(fields)))
+
+        with mysql_pool.connect() as sql:
+            for i in range(0, len(row_dicts), INSERT_BATCH_SIZE):
+                batch = row_dicts[i:i + INSERT_BATCH_SIZE]
+                query = """
+                    INSERT INTO `{table}` ({fields})
+                    VALUES {rows}
+                """.format(
+                    table=klass.table,
+                    fields=', '.join('`{}`'.format(f) for f in fields),
+                    rows=',\n'.join([row_interps] * len(batch)),
+                )
+                params = tuple(d[f] for d in batch for f in fields)
+                sql.query(query, params)
+
+        return len(row_dicts)
+
     @classmethod
     def property_types(klass):
         # Normally no properties are directly queryable or updateable. But
@@ -79,24 +141,61 @@ class Checkpoint(SqlModel):
 
     @classmethod
     def get_status_from_tasks(klass, checkpoint):
-        tasks = model.Task.get_by_id(json.loads(checkpoint.task_ids))
+        return klass.get_statuses_from_tasks([checkpoint])[checkpoint.uid]
+
+    @classmethod
+    def get_statuses_from_tasks(klass, checkpoints):
+        """Derive the status of many checkpoints, getting all their tasks in
+        one batch.
 
-        all_complete = True
-        all_assigned_complete = True
-        for t in tasks:
-            if t.status != 'complete':
-                all_complete = False
-                if t.to_client_dict()['non_admin_may_edit'] is True:
-                    all_assigned_complete = False
+        Returns: dict of status by checkpoint uid.
+        """
+        task_ids_by_ckpt = {c.uid: json.loads(c.task_ids) for c in checkpoints}
+        all_task_ids = [t_id for ids in task_ids_by_ckpt.values()
+                        for t_id in ids]
+        tasks = model.Task.get_by_id(all_task_ids) if all_task_ids else []
+        tasks_by_id = {t.uid: t for t in tasks if t}
+
+        statuses = {}
+        for ckpt_id, task_ids in task_ids_by_ckpt.items():
+            all_complete = True
+            all_assigned_complete = True
+            for t_id in task_ids:
+                t = tasks_by_id.get(t_id, None)
+                if t is None:
+                    continue
+                if t.status != 'complete':
+                    all_complete = False
+                    if t.to_client_dict()['non_admin_may_edit'] is True:
+                        all_assigned_complete = False
 
-        if all_complete:
-            status = 'complete'
-        elif all_assigned_complete:
-            status = 'waiting'
-        else:
-            status = 'incomplete'
+            if all_complete:
+                status = 'complete'
+            elif all_assigned_complete:
+                status = 'waiting'
+            else:
+                status = 'incomplete'
+            statuses[ckpt_id] = status
 
-        return status
+        return statuses
+
+    @classmethod
+    def get_by_ids(klass, uids):
+        """Many checkpoints by uid in one query, in no particular order."""
+        uids = list(uids)
+        if not uids:
+            return []
+
+        query = """
+            SELECT *
+            FROM `{table}`
+            WHERE `uid` IN ({interps})
+        """.format(table=klass.table, interps=','.join(['%s'] * len(uids)))
+
+        with mysql_pool.connect() as sql:
+            row_dicts = sql.select_query(query, tuple(uids))
+
+        return [klass.row_dict_to_obj(d) for d in row_dicts]
 
     @classmethod
     def get_checkpoint_config(klass, checkpoint):
@@ -108,11 +207,8 @@ class Checkpoint(SqlModel):
             tasklist = program['project_tasklist_template']
             return tasklist[checkpoint.ordinal - 1]
         elif checkpoint.parent_kind == 'Survey':
-            program = model.Program.get_config(checkpoint.program_label)
-            for survey in program['surveys']:
-                for cp_template in survey['survey_tasklist_template']:
-                    if cp_template['label'] == checkpoint.label:
-                        return cp_template
+            return model.Program.get_checkpoint_template(
+                checkpoint.program_label, 'Survey', checkpoint.label)
 
     @classmethod
     def for_organizations_in_program(klass, program_label, limit=1000):
@@ -131,35 +227,108 @@ class Checkpoint(SqlModel):
 
             LIMIT {limit};
         """.format(limit=limit)
-        with mysql_connection.connect() as sql:
+        with mysql_pool.connect() as sql:
             row_dicts = sql.select_query(query, (program_label,))
         return [klass.row_dict_to_obj(d) for d in row_dicts]
 
     @classmethod
     def for_tasklist(klass, project_cohort, fields=None):
-        fields = '`{}`'.format('`, `'.join(fields)) if fields else '*'
+        """All the checkpoints on a project cohort's task list, in order."""
+        return klass.for_tasklists([project_cohort], fields)[project_cohort.uid]
+
+    @classmethod
+    def for_project_cohorts(klass, label, project_cohort_ids, fields=None):
+        """Survey checkpoints with this label in any of these project
+        cohorts, filtered in SQL rather than fetching the whole label.
+
+        Returns: list of checkpoints.
+        """
+        if not project_cohort_ids:
+            return []
+
         query = """
             SELECT {fields}
             FROM `checkpoint`
-            WHERE (
-                (`parent_kind` = 'Organization' AND `organization_id` = %s)
-                OR
-                (`parent_kind` = 'Project' AND `project_id` = %s)
-                OR
-                (`parent_kind` = 'Survey' AND `project_cohort_id` = %s)
-            )
-            ORDER BY FIELD(`parent_kind`,'Organization','Project','Survey'),
-                     `ordinal`
-        """.format(fields=fields)
-        params = (
-            project_cohort.organization_id,
-            project_cohort.project_id,
-            project_cohort.uid,
+            WHERE `parent_kind` = 'Survey'
+              AND `project_cohort_id` IN ({interps})
+              AND `label` = %s
+        """.format(
+            fields='`{}`'.format('`, `'.join(fields)) if fields else '*',
+            interps=', '.join(['%s'] * len(project_cohort_ids)),
         )
-        with mysql_connection.connect() as sql:
+        params = tuple(project_cohort_ids) + (label,)
+
+        with mysql_pool.connect() as sql:
             row_dicts = sql.select_query(query, params)
+
         return [klass.row_dict_to_obj(d) for d in row_dicts]
 
+    @classmethod
+    def for_tasklists(klass, project_cohorts, fields=None):
+        """Checkpoints for many project cohorts' task lists in one query.
+
+        A task list includes the checkpoints of the project cohort's
+        organization and project as well as those of its surveys. Each kind
+        of parent gets its own branch of a UNION ALL so that each can use its
+        composite index, rather than an OR which scans the table.
+
+        Returns: dict of lists of checkpoints, keyed by project cohort uid,
+            sorted organization first, then project, then survey, then by
+            ordinal.
+        """
+        if not project_cohorts:
+            return {}
+
+        fields = '`{}`'.format('`, `'.join(fields)) if fields else '*'
+        branches = [
+            # parent kind, column to match, ids to match
+            ('Organization', 'organization_id',
+             set(pc.organization_id for pc in project_cohorts)),
+            ('Project', 'project_id',
+             set(pc.project_id for pc in project_cohorts)),
+            ('Survey', 'project_cohort_id',
+             set(pc.uid for pc in project_cohorts)),
+        ]
+
+        # Each branch reports which id it matched, its place in the sort, and
+        # the ordinal, which may not be among the requested fields. These are
+        # removed before converting to checkpoints.
+        selects = []
+        params = []
+        for sort, (parent_kind, column, ids) in enumerate(branches):
+            ids = [id for id in ids if id]
+            if not ids:
+                continue
+            selects.append("""
+                (SELECT {fields},
+                        `{column}` AS `_group_id`,
+                        {sort} AS `_sort`,
+                        `ordinal` AS `_ordinal`
+                 FROM `checkpoint`
+                 WHERE `parent_kind` = %s
+                   AND `{column}` IN ({interps}))
+            """.format(fields=fields, column=column, sort=sort,
+                       interps=', '.join(['%s'] * len(ids))))
+            params += [parent_kind] + ids
+
+        query = '{} ORDER BY `_sort`, `_ordinal`'.format(
+            ' UNION ALL '.join(selects))
+        with mysql_pool.connect() as sql:
+            row_dicts = sql.select_query(query, tuple(params))
+
+        by_group = {}
+        for d in row_dicts:
+            group = (d.pop('_sort'), d.pop('_group_id'))
+            d.pop('_ordinal')
+            by_group.setdefault(group, []).append(klass.row_dict_to_obj(d))
+
+        return {
+            pc.uid: (by_group.get((0, pc.organization_id), []) +
+                     by_group.get((1, pc.project_id), []) +
+                     by_group.get((2, pc.uid), []))
+            for pc in project_cohorts
+        }
+
     def clear_cached_properties(self, prop):
         """Related project cohorts need their cached properties cleared."""
         # This relationship is "down" so there may be many keys to clear so
@@ -196,24 +365,10 @@ class Checkpoint(SqlModel):
                 pc.update_cached_properties()
                 pcs.append(pc)
 
-        # Then clear cached queries related to these project cohorts and queue
-        # a task to re-cached them.
-        to_delete = []
-        if self.organization_id:
-            to_delete.append(util.cached_query_key(
-                'SuperDashboard', organization_id=self.organization_id
-            ))
-        for pc in pcs:
-            kwargs = {'program_label': pc.program_label,
-                      'cohort_label': pc.cohort_label}
-            to_delete.append(util.cached_query_key('SuperDashboard', **kwargs))
-            taskqueue.add(
-                url='/task/cache_dashboard',
-                headers={'Content-Type': 'application/json; charset=utf-8'},
-                payload=json.dumps(kwargs),
-                countdown=config.task_consistency_countdown,
-            )
-        memcache.delete_multi(to_delete)
+        # Then refresh these project cohorts' rows in the super dashboard.
+        if pcs:
+            model.DashboardRow.queue_refresh(
+                [p.organization_id for p in pcs])
 
     def to_client_dict(self, include_conf=True):
         """Add properties from checkpoint definitions that aren't stored."""
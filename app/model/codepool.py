@@ -0,0 +1,215 @@
+"""PooledCode: A participation code reserved ahead of time.
+
+Allocation
+----------
+
+Project cohorts used to pick codes by generating random phrases and trying
+to reserve each with a Unique entity, one transaction per try, right in the
+enrollment request. As the two-word space fills, more and more tries
+collide.
+
+Instead, a background task (refill(), see /task/refill_code_pool) keeps a
+pool of codes that are already reserved but not yet assigned:
+
+* Each code's Unique entity is created along with a PooledCode child in the
+  same entity group, so reserving many codes takes one cross-group
+  transaction per block rather than one per code.
+* Pooled codes are a LeasedPool (see model/leasedpool.py), spread over
+  random shards and leased in blocks into a per-instance reservoir, so
+  concurrent enrollments rarely see the same codes and most allocations
+  make no Datastore calls at all.
+* When most new candidates collide with existing codes, refill() moves on to
+  phrases with more words. Their Unique keys differ, so they can't collide
+  with shorter codes, and the participant portal accepts codes of any
+  number of words (see vm.splitCode in portal.component.js).
+
+Codes in a reservoir are already out of the pool, so if an instance shuts
+down they're never assigned. That's fine; the code space is large.
+"""
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from webapp2_extras.appengine.auth.models import Unique
+import collections
+import logging
+import random
+import time
+
+from .leasedpool import LeasedPool
+from .projectcohort import ProjectCohort
+import code_phrase
+import config
+import taskqueue_helper
+
+
+# Codes reserved per transaction in refill(). Cross-group transactions may
+# touch at most 25 entity groups, and each code is its own group.
+RESERVE_BLOCK_SIZE = 20
+
+# Queue at most one refill task per this many seconds.
+REFILL_DEBOUNCE_SECONDS = 60
+
+# Memcache key of the number of words refill() last grew to, so the next
+# refill doesn't start over with mostly-taken shorter phrases.
+NUM_WORDS_KEY = 'code_pool_num_words'
+
+
+class PooledCode(LeasedPool, ndb.Model):
+    """A reserved, unassigned code. Key id is the code, and the parent is
+    its Unique entity, see ProjectCohort.uniqueness_key()."""
+    shard = ndb.IntegerProperty()
+    num_words = ndb.IntegerProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+    # Fewer than for survey links; if leasing fails, ProjectCohort.create()
+    # can still generate a code the old way.
+    max_lease_tries = 5
+
+    # Counts of allocations and refills, and of lease attempts and
+    # collisions, for monitoring and benchmarks. Per instance.
+    stats = collections.Counter()
+    lease_stats = collections.Counter()
+
+    @property
+    def code(self):
+        return self.key.id()
+
+    @classmethod
+    def unique_key(klass, code):
+        return ndb.Key('Unique', ProjectCohort.uniqueness_key(code))
+
+    @classmethod
+    def allocate(klass):
+        """Take a code out of the pool.
+
+        Returns: str code, reserved for the caller alone, or None if the pool
+            is empty, in which case a refill is queued.
+        """
+        pooled = klass.pop_pooled()
+        if not pooled:
+            klass.stats['empty'] += 1
+            return None
+        klass.stats['allocated'] += 1
+        return pooled.code
+
+    @classmethod
+    def after_lease(klass, pooled):
+        if len(pooled) < klass.lease_block_size:
+            # Running low.
+            klass.queue_refill()
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def reserve_block(klass, codes, num_words):
+        """Reserve whichever of these codes are unused and add them to the
+        pool, atomically.
+
+        Returns: list of str codes reserved.
+        """
+        unique_keys = [klass.unique_key(c) for c in codes]
+        existing = ndb.get_multi(unique_keys)
+        to_put = []
+        reserved = []
+        for code, key, entity in zip(codes, unique_keys, existing):
+            if entity:
+                continue
+            to_put.append(Unique(key=key))
+            to_put.append(klass(
+                id=code,
+                parent=key,
+                shard=random.randrange(klass.num_shards),
+                num_words=num_words,
+            ))
+            reserved.append(code)
+        ndb.put_multi(to_put)
+        return reserved
+
+    @classmethod
+    def depth(klass, limit=None):
+        """Number of codes in the pool, eventually consistent."""
+        return klass.query().count(limit)
+
+    @classmethod
+    def refill(klass, target=None):
+        """Reserve new codes until the pool holds at least `target`.
+
+        Returns: dict of counts for reporting.
+        """
+        target = target or config.code_pool_target
+        report = {'reserved': 0, 'collisions': 0, 'transactions': 0}
+        needed = target - klass.depth(target)
+        num_words = max(config.code_pool_min_words,
+                        memcache.get(NUM_WORDS_KEY) or 0)
+        # Enough for every block to collide a few times before giving up.
+        max_transactions = 4 * (needed // RESERVE_BLOCK_SIZE + 1)
+
+        while needed > 0 and report['transactions'] < max_transactions:
+            n = min(needed, RESERVE_BLOCK_SIZE)
+            candidates = list(set(
+                code_phrase.generate(n=num_words) for x in range(n)))
+            try:
+                reserved = klass.reserve_block(candidates, num_words)
+            except datastore_errors.TransactionFailedError:
+                # E.g. a concurrent enrollment reserved one of these.
+                reserved = []
+            report['transactions'] += 1
+            report['reserved'] += len(reserved)
+            report['collisions'] += len(candidates) - len(reserved)
+            needed -= len(reserved)
+
+            collision_rate = 1 - float(len(reserved)) / len(candidates)
+            if (collision_rate > config.code_pool_grow_at and
+                    num_words < config.code_pool_max_words):
+                # Phrases of this length are mostly taken.
+                num_words += 1
+                memcache.set(NUM_WORDS_KEY, num_words)
+                logging.info("Code pool growing to {}-word codes."
+                             .format(num_words))
+
+        if needed > 0:
+            logging.error("Running critically low on codes. Pool is {} "
+                          "short of its target.".format(needed))
+
+        report['num_words'] = num_words
+        klass.stats['refill_reserved'] += report['reserved']
+        klass.stats['refill_collisions'] += report['collisions']
+        return report
+
+    @classmethod
+    def queue_refill(klass):
+        """Queue a refill task, unless one was queued recently."""
+        window = int(time.time() // REFILL_DEBOUNCE_SECONDS)
+        name = taskqueue_helper.named_task_name('refill-code-pool', window)
+        try:
+            taskqueue.add(url='/task/refill_code_pool', name=name)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            return False
+        klass.stats['refills_queued'] += 1
+        return True
+
+    @classmethod
+    def pool_stats(klass):
+        return dict(
+            klass.stats,
+            lease_attempts=klass.lease_stats['attempts'],
+            lease_collisions=klass.lease_stats['collisions'],
+            lease_failures=klass.lease_stats['failures'],
+            from_reservoir=klass.lease_stats['from_reservoir'],
+            depth=klass.depth(),
+            target=config.code_pool_target,
+            reservoir=klass.reservoir_size(),
+        )
+
+    @classmethod
+    def clear_stats(klass):
+        klass.stats.clear()
+        klass.lease_stats.clear()
+
+    @classmethod
+    def reset_reservoirs(klass):
+        """Forget any leased codes, e.g. between unit tests."""
+        super(PooledCode, klass).reset_reservoirs()
+        klass.stats.clear()
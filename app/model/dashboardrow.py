@@ -0,0 +1,367 @@
+"""DashboardRow: One precomputed super dashboard entry per project cohort.
+SQL-backed.
+
+The super dashboard used to be one memcached JSON blob per (program, cohort)
+or organization. Any change to any project cohort deleted the blob and queued
+a rebuild of the whole thing, so busy cohorts were rebuilt over and over and
+sometimes hit the 30 second limit.
+
+Now each project cohort has a row here holding its part of the dashboard,
+already serialized, in two shapes:
+
+* `document`: what graphql_queries.dashboard returns for the project cohort.
+* `summary`: the smaller subset graphql_queries.program_cohort_dashboard
+  returns, see SUMMARY_FIELDS.
+
+Rows are refreshed for a whole organization at a time (rarely more than a
+few project cohorts), because every change that affects a project cohort's
+entry (to it, its checkpoints, surveys, project, or organization) knows its
+organization id. See queue_refresh() and the /task/refresh_dashboard_rows
+handler. Refreshes are debounced and deduplicated by task name, so a burst of
+changes to an organization rebuilds its rows once. The /cron/cache_dashboards
+handler reconciles rows against the Datastore to catch anything missed, and
+/task/backfill_dashboard_rows builds rows for every organization, e.g. after
+the table is first deployed.
+
+Requests assemble the dashboard by streaming rows, see
+graphql_handlers.SuperDashboard.
+"""
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+import contextlib
+import graphql
+import json
+import threading
+import time
+
+from gae_models import SqlModel, SqlField as Field
+import config
+import graphql_queries
+import mysql_pool
+import taskqueue_helper
+
+
+# Rows older than this many seconds are refreshed by reconciliation even if
+# nothing seems to have changed.
+MAX_AGE = 24 * 60 * 60
+
+# All refreshes requested for an organization within a window of this many
+# seconds share one task, which runs after the window closes.
+REFRESH_DEBOUNCE_SECONDS = 30
+
+# Max tasks per taskqueue add() call.
+TASKQUEUE_ADD_LIMIT = 100
+
+REFRESH_STATS_PREFIX = 'dashboard_refresh_stats:'
+REFRESH_STATS_NAMES = ('requested', 'queued', 'executed')
+
+# Organization ids collected by DashboardRow.coalesce_refreshes().
+_pending = threading.local()
+
+
+def summary_fields(query):
+    """Fields a query selects from each project cohort.
+
+    Returns: dict of field name to None, or for nested objects and lists, a
+        tuple of subfield names.
+    """
+    operation = graphql.parse(query).definitions[0]
+    project_cohorts = next(s for s in operation.selection_set.selections
+                           if s.name.value == 'project_cohorts')
+    return {
+        s.name.value: (tuple(sub.name.value
+                             for sub in s.selection_set.selections)
+                       if s.selection_set else None)
+        for s in project_cohorts.selection_set.selections
+    }
+
+
+# Fields of a dashboard document kept in the summary, with subfields for
+# nested objects and lists.
+SUMMARY_FIELDS = summary_fields(graphql_queries.program_cohort_dashboard)
+
+
+class DashboardRow(SqlModel):
+    """Serialized dashboard entries for one project cohort."""
+    table = 'dashboard_row'
+
+    py_table_definition = {
+        'table_name': table,
+        'fields': [
+            #     name,            type,      length, unsigned, null,  default, on_update
+            Field('project_cohort_id','varchar',50,   None,     False, None,    None),
+            Field('organization_id','varchar',50,     None,     False, None,    None),
+            Field('program_label', 'varchar', 50,     None,     False, None,    None),
+            Field('cohort_label',  'varchar', 50,     None,     False, None,    None),
+            # JSON strings.
+            Field('document',      'mediumtext',None, None,     False, None,    None),
+            Field('summary',       'text',    None,   None,     False, None,    None),
+            Field('materialized',  'datetime',None,   None,     False, SqlModel.sql_current_timestamp, SqlModel.sql_current_timestamp),
+        ],
+        'primary_key': ['project_cohort_id'],
+        'indices': [
+            {
+                'name': 'program-cohort',
+                'fields': ['program_label', 'cohort_label'],
+            },
+            {
+                'name': 'organization',
+                'fields': ['organization_id'],
+            },
+        ],
+        'engine': 'InnoDB',
+        'charset': 'utf8',
+    }
+
+    @classmethod
+    def summarize(klass, document):
+        """Reduce a dashboard document (dict) to SUMMARY_FIELDS."""
+        def pick(d, fields):
+            return None if d is None else {f: d.get(f, None) for f in fields}
+
+        summary = {}
+        for field, subfields in SUMMARY_FIELDS.items():
+            value = document.get(field, None)
+            if subfields is None:
+                summary[field] = value
+            elif isinstance(value, list):
+                summary[field] = [pick(v, subfields) for v in value]
+            else:
+                summary[field] = pick(value, subfields)
+        return summary
+
+    @classmethod
+    def replace_organizations(klass, organization_ids, documents):
+        """Make these the only rows for these organizations.
+
+        Args:
+            organization_ids: list of str, every organization refreshed.
+            documents: list of dashboard document dicts, each for a project
+                cohort in one of the organizations.
+        """
+        if not organization_ids:
+            return
+
+        rows = [
+            (
+                d['uid'],
+                d['organization_id'],
+                d['program_label'],
+                d['cohort_label'],
+                json.dumps(d),
+                json.dumps(klass.summarize(d)),
+            )
+            for d in documents
+        ]
+        pc_ids = [r[0] for r in rows]
+
+        # One block, so the delete and upsert commit together.
+        with mysql_pool.connect() as sql:
+            # Rows for project cohorts that no longer exist (or moved).
+            delete_query = """
+                DELETE FROM `{table}`
+                WHERE `organization_id` IN ({orgs})
+                {keep}
+            """.format(
+                table=klass.table,
+                orgs=','.join(['%s'] * len(organization_ids)),
+                keep=('AND `project_cohort_id` NOT IN ({})'.format(
+                    ','.join(['%s'] * len(pc_ids))) if pc_ids else ''),
+            )
+            sql.query(delete_query, tuple(organization_ids) + tuple(pc_ids))
+
+            if rows:
+                upsert_query = """
+                    INSERT INTO `{table}`
+                      (`project_cohort_id`, `organization_id`,
+                       `program_label`, `cohort_label`, `document`,
+                       `summary`)
+                    VALUES {rows}
+                    ON DUPLICATE KEY UPDATE
+                      `organization_id` = VALUES(`organization_id`),
+                      `program_label` = VALUES(`program_label`),
+                      `cohort_label` = VALUES(`cohort_label`),
+                      `document` = VALUES(`document`),
+                      `summary` = VALUES(`summary`),
+                      `materialized` = CURRENT_TIMESTAMP()
+                """.format(
+                    table=klass.table,
+                    rows=',\n'.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows)),
+                )
+                sql.query(upsert_query,
+                          tuple(v for row in rows for v in row))
+
+    @classmethod
+    def documents_query(klass, column, organization_id=None,
+                        program_label=None, cohort_label=None):
+        """SQL and params to select serialized entries, for streaming, see
+        csv_export.stream_rows().
+
+        Args:
+            column: str, 'document' or 'summary'.
+            organization_id, program_label, cohort_label: optional str
+                filters, as for graphql_queries.dashboard.
+        """
+        if column not in ('document', 'summary'):
+            raise Exception("Invalid dashboard column: {}".format(column))
+
+        filters = [(k, v) for k, v in (
+            ('organization_id', organization_id),
+            ('program_label', program_label),
+            ('cohort_label', cohort_label),
+        ) if v]
+        query = """
+            SELECT `{column}` AS `json`
+            FROM `{table}`
+            {where}
+            ORDER BY `project_cohort_id`
+        """.format(
+            column=column,
+            table=klass.table,
+            where=('WHERE ' + ' AND '.join(
+                '`{}` = %s'.format(k) for k, v in filters)
+                if filters else ''),
+        )
+        return (query, tuple(v for k, v in filters))
+
+    @classmethod
+    def organizations_to_reconcile(klass, program_label, cohort_label,
+                                   project_cohorts, max_age=MAX_AGE):
+        """Organizations whose rows in this program cohort are missing,
+        orphaned, or older than max_age seconds.
+
+        Args:
+            program_label: str
+            cohort_label: str
+            project_cohorts: all the ProjectCohorts currently in the program
+                cohort.
+            max_age: int seconds.
+
+        Returns: set of organization ids.
+        """
+        query = """
+            SELECT `project_cohort_id`
+            ,      `organization_id`
+            ,      `materialized` < NOW() - INTERVAL %s SECOND AS `expired`
+            FROM `{table}`
+            WHERE `program_label` = %s
+              AND `cohort_label` = %s
+        """.format(table=klass.table)
+        with mysql_pool.connect() as sql:
+            rows = sql.select_query(
+                query, (max_age, program_label, cohort_label))
+        rows_by_pc = {r['project_cohort_id']: r for r in rows}
+        pcs_by_id = {pc.uid: pc for pc in project_cohorts}
+
+        missing = set(pc.organization_id for pc in project_cohorts
+                      if pc.uid not in rows_by_pc)
+        orphaned = set(r['organization_id'] for r in rows
+                       if r['project_cohort_id'] not in pcs_by_id)
+        expired = set(r['organization_id'] for r in rows if r['expired'])
+
+        return missing | orphaned | expired
+
+    @classmethod
+    @contextlib.contextmanager
+    def coalesce_refreshes(klass):
+        """Within this block, queue_refresh() only collects organization ids,
+        and they're all queued together at the end.
+
+        For code that puts many related entities, each of which would
+        otherwise queue its own refresh of the same organizations.
+        """
+        if getattr(_pending, 'organization_ids', None) is not None:
+            # Already coalescing, the outermost block will queue.
+            yield
+            return
+
+        _pending.organization_ids = set()
+        try:
+            yield
+            organization_ids = _pending.organization_ids
+        finally:
+            _pending.organization_ids = None
+        klass.queue_refresh(organization_ids)
+
+    @classmethod
+    def queue_refresh(klass, organization_ids):
+        """Rebuild rows for these organizations soon, in tasks.
+
+        Every request to refresh an organization within the same
+        REFRESH_DEBOUNCE_SECONDS window gets the same task name, so the task
+        queue drops duplicates, and the one task, which runs after the window
+        closes, sees all the changes made during it.
+
+        Returns: list of tasks actually queued, empty if all were duplicates
+            or if coalescing, see coalesce_refreshes().
+        """
+        organization_ids = sorted(set(o for o in organization_ids if o))
+        if getattr(_pending, 'organization_ids', None) is not None:
+            _pending.organization_ids.update(organization_ids)
+            return []
+        if not organization_ids:
+            return []
+
+        now = time.time()
+        window = int(now // REFRESH_DEBOUNCE_SECONDS)
+        countdown = ((window + 1) * REFRESH_DEBOUNCE_SECONDS - now +
+                     config.task_consistency_countdown)
+        tasks = [
+            taskqueue.Task(
+                url='/task/refresh_dashboard_rows',
+                name=klass.refresh_task_name(org_id, window),
+                params={'organization_id': [org_id]},
+                countdown=countdown,
+            )
+            for org_id in organization_ids
+        ]
+
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), TASKQUEUE_ADD_LIMIT):
+            try:
+                queue.add(tasks[i:i + TASKQUEUE_ADD_LIMIT])
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                # The rest of the batch is still added.
+                pass
+
+        queued = [t for t in tasks if t.was_enqueued]
+        klass.record_refresh_stats(requested=len(tasks), queued=len(queued))
+        return queued
+
+    @classmethod
+    def refresh_task_name(klass, organization_id, window):
+        return taskqueue_helper.named_task_name(
+            'dashboard-rows', organization_id, window)
+
+    @classmethod
+    def record_refresh_stats(klass, **counts):
+        """Add to the counters reported by refresh_stats().
+
+        Args:
+            requested, queued, executed: int
+        """
+        counts = {k: v for k, v in counts.items() if v}
+        if counts:
+            memcache.offset_multi(counts, key_prefix=REFRESH_STATS_PREFIX,
+                                  initial_value=0)
+
+    @classmethod
+    def refresh_stats(klass):
+        """Counts of organization refreshes since reset.
+
+        * requested: calls for an organization to be refreshed
+        * queued: tasks queued, i.e. requests that weren't duplicates
+        * executed: tasks run
+        """
+        found = memcache.get_multi(REFRESH_STATS_NAMES,
+                                   key_prefix=REFRESH_STATS_PREFIX)
+        stats = {k: int(found.get(k, 0)) for k in REFRESH_STATS_NAMES}
+        stats['dropped'] = stats['requested'] - stats['queued']
+        return stats
+
+    @classmethod
+    def reset_refresh_stats(klass):
+        memcache.delete_multi(REFRESH_STATS_NAMES,
+                              key_prefix=REFRESH_STATS_PREFIX)
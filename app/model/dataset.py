@@ -51,14 +51,48 @@ class Dataset(StorageObject):
 
         ds.data = data  # will write this to gcs on put; not for datastore
 
-        ds.gcs_path = '/{bucket}{namespace}/{file_hash}'.format(
-            bucket=app_identity.get_application_id() + '-datasets',
-            namespace=os.environ['GCS_UPLOAD_PREFIX'],
-            file_hash=hashlib.md5(Dataset._dumps(ds)).hexdigest(),
+        ds.gcs_path = klass._gcs_path(
+            hashlib.md5(Dataset._dumps(ds)).hexdigest())
+
+        return ds
+
+    @classmethod
+    def create_from_chunks(klass, filename, chunks, content_type,
+                           parent_id=None, **kwargs):
+        """Create a dataset from an iterable of already-encoded strings.
+
+        Unlike create(), the file is written to GCS here, one chunk at a time,
+        so the whole file never has to be in memory. See csv_export.py.
+        """
+        if content_type not in klass.allowed_content_types:
+            raise Exception("Forbidden content type: {}".format(content_type))
+
+        ds = super(klass, klass).create(
+            filename=filename,
+            content_type=content_type,
+            parent_id=parent_id,
+            **kwargs
         )
 
+        # The content isn't known in advance, so it can't be hashed.
+        ds.gcs_path = klass._gcs_path(ds.uid)
+
+        open_kwargs = ds._gcs_open_kwargs()
+        with gcs.open(ds.gcs_path, 'w', **open_kwargs) as gcs_file:
+            for chunk in chunks:
+                gcs_file.write(chunk)
+            ds.size = gcs_file.tell()
+
         return ds
 
+    @classmethod
+    def _gcs_path(klass, file_name):
+        return '/{bucket}{namespace}/{file_name}'.format(
+            bucket=app_identity.get_application_id() + '-datasets',
+            namespace=os.environ['GCS_UPLOAD_PREFIX'],
+            file_name=file_name,
+        )
+
     @classmethod
     def _dumps(klass, dataset):
         return klass.allowed_content_types[dataset.content_type](dataset.data)
@@ -69,7 +103,14 @@ class Dataset(StorageObject):
             # entity which was loaded from the db won't have it, so do nothing.
             return
 
-        open_kwargs = {
+        open_kwargs = self._gcs_open_kwargs()
+        with gcs.open(self.gcs_path, 'w', **open_kwargs) as gcs_file:
+            gcs_file.write(Dataset._dumps(self))
+            # Grab the size so it can be saved on the entity.
+            self.size = gcs_file.tell()
+
+    def _gcs_open_kwargs(self):
+        return {
             'content_type': self.content_type,
             'retry_params': gcs.RetryParams(backoff_factor=1.1),
             'options': {
@@ -80,8 +121,3 @@ class Dataset(StorageObject):
                 'x-goog-meta-dataset-id': self.uid,
             }
         }
-
-        with gcs.open(self.gcs_path, 'w', **open_kwargs) as gcs_file:
-            gcs_file.write(Dataset._dumps(self))
-            # Grab the size so it can be saved on the entity.
-            self.size = gcs_file.tell()
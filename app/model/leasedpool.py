@@ -0,0 +1,174 @@
+"""LeasedPool: Entities handed out once each, to many callers at once.
+
+Survey links and pooled participation codes are both requested in bursts,
+by whole classrooms or by many schools enrolling before a cohort opens. If
+every caller ran the same query they'd all get the same first entity and
+fight over it. Instead:
+
+* Entities are spread over `num_shards` random shards when they're created,
+  and each lease queries a random shard, so concurrent callers rarely see
+  the same ones. If that shard is empty, or the entities were created before
+  sharding, the lease queries the whole pool from a random offset.
+* Each lease pops a block of entities in one cross-group transaction and
+  keeps the extras in a per-instance reservoir, so most callers are served
+  from memory with no Datastore calls at all.
+
+Entities in a reservoir have already been deleted from the Datastore, so if
+an instance shuts down they're never handed out. Pools are large enough
+that this doesn't matter.
+"""
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import namespace_manager
+from google.appengine.ext import ndb
+import collections
+import logging
+import random
+import threading
+
+
+# Entities leased but not yet handed out, see LeasedPool.reservoir_key().
+_reservoirs = collections.defaultdict(list)
+_reservoir_lock = threading.Lock()
+
+
+class LeasedPool(object):
+    """Mixin for ndb models kept as a pool.
+
+    Subclasses give each entity a random `shard` in range(num_shards), and
+    define their own `lease_stats` Counter. Methods take a `scope`, e.g. the
+    program and survey ordinal of a link, passed on to pool_query().
+    """
+
+    # Number of random buckets entities are assigned to.
+    num_shards = 20
+
+    # How many entities a lease pops at once. Cross-group transactions may
+    # touch at most 25 entity groups, and each entity is its own group.
+    lease_block_size = 10
+
+    # How many leases to attempt before giving up, e.g. if every candidate
+    # was taken by another instance.
+    max_lease_tries = 10
+
+    # The unsharded query skips a random number of entities, up to this, so
+    # that callers don't all see the same first ones.
+    fallback_max_offset = 200
+
+    @classmethod
+    def pool_query(klass, *scope):
+        """Query of the pool within a scope. Override to filter by it."""
+        return klass.query()
+
+    @classmethod
+    def reservoir_key(klass, *scope):
+        # Each branch has its own namespace, and so its own pool.
+        return (klass.__name__, namespace_manager.get_namespace()) + scope
+
+    @classmethod
+    def pop_pooled(klass, *scope):
+        """Take an entity out of the pool, for the caller alone.
+
+        Returns: entity, already deleted from the Datastore, or None if the
+            pool is empty.
+        """
+        reservoir_key = klass.reservoir_key(*scope)
+        with _reservoir_lock:
+            reservoir = _reservoirs[reservoir_key]
+            if reservoir:
+                klass.lease_stats['from_reservoir'] += 1
+                return reservoir.pop()
+
+        entities = klass.lease_block(*scope)
+        klass.after_lease(entities, *scope)
+        if not entities:
+            return None
+
+        entity = entities.pop()
+        with _reservoir_lock:
+            _reservoirs[reservoir_key].extend(entities)
+        return entity
+
+    @classmethod
+    def after_lease(klass, entities, *scope):
+        """Called with each block leased, e.g. to refill a pool running
+        low."""
+        pass
+
+    @classmethod
+    def lease_block(klass, *scope):
+        """Remove up to lease_block_size entities from the Datastore for our
+        use.
+
+        Returns: list of entities, empty if none could be leased.
+        """
+        for x in range(klass.max_lease_tries):
+            keys = klass.candidate_keys(klass.lease_block_size, *scope)
+            if not keys:
+                # The pool is empty.
+                return []
+
+            klass.lease_stats['attempts'] += 1
+            try:
+                entities = klass.datastore_pop_multi(keys)
+            except datastore_errors.TransactionFailedError:
+                entities = []
+
+            if entities:
+                return entities
+
+            # Every candidate had already been taken by someone else.
+            klass.lease_stats['collisions'] += 1
+
+        klass.lease_stats['failures'] += 1
+        logging.warning("Failed to lease {} {}."
+                        .format(klass.__name__, scope))
+        return []
+
+    @classmethod
+    def candidate_keys(klass, n, *scope):
+        """Keys of entities that are probably available, eventually
+        consistent.
+
+        Looks in a random shard first. If that's empty (or the entities were
+        created before sharding) looks at the whole pool, from a random
+        offset.
+        """
+        query = klass.pool_query(*scope)
+        shard = random.randrange(klass.num_shards)
+        keys = query.filter(klass.shard == shard).fetch(n, keys_only=True)
+        if not keys:
+            offset = random.randrange(klass.fallback_max_offset)
+            keys = query.fetch(n, offset=offset, keys_only=True)
+            if not keys and offset:
+                # Fewer entities than that are left.
+                keys = query.fetch(n, keys_only=True)
+        return keys
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def datastore_pop_multi(klass, keys):
+        """Delete whichever of these entities still exist, atomically, and
+        return them.
+
+        Wrapping in a transaction means no race condition between verifying
+        that the entities do, in fact, exist, and deleting them.
+        """
+        entities = [e for e in ndb.get_multi(keys) if e]
+        ndb.delete_multi([e.key for e in entities])
+        return entities
+
+    @classmethod
+    def reservoir_size(klass, *scope):
+        with _reservoir_lock:
+            return len(_reservoirs.get(klass.reservoir_key(*scope), []))
+
+    @classmethod
+    def reset_reservoirs(klass):
+        """Forget any leased entities of this class, e.g. between unit
+        tests."""
+        with _reservoir_lock:
+            for key in list(_reservoirs):
+                if key[0] == klass.__name__:
+                    del _reservoirs[key]
+        klass.lease_stats.clear()
@@ -21,6 +21,8 @@ class Notification(DatastoreModel):
     # Some notifications have nothing to view so they should have no view
     # button, e.g. being rejected from an organization.
     viewable = ndb.BooleanProperty(default=True)
+    # How many events this notification stands for, see fold_into_digests().
+    digest_count = ndb.IntegerProperty(default=1)
 
     # There may be an email created to go along with the notification if this
     # entity was just instantiated via Notification.create(). If so, calling
@@ -46,29 +48,55 @@ class Notification(DatastoreModel):
         * Joey updated task X to read "blah"
 
         ...when both tasks haven't been dismissed.
-        """
-        # Index notifications by their recipient so we can minimize entity
-        # group reads.
-
-        notes_by_parent = defaultdict(list)
-        for n in notifications:
-            notes_by_parent[DatastoreModel.get_parent_uid(n.uid)].append(n)
 
-        # Filter out redundant notifications from each user.
-        for parent_id, new_notes in notes_by_parent.items():
+        Undismissed notifications about the same tasks are found with one
+        query for all recipients, rather than one per recipient.
+        """
+        task_ids = sorted(set(n.task_id for n in notifications if n.task_id))
+        if not task_ids:
+            return list(notifications)
 
-            existing_notes = Notification.get(
-                ancestor=DatastoreModel.id_to_key(parent_id))
+        existing_notes = klass.get(task_id=task_ids, dismissed=False,
+                                   n=float('inf'))
+        redundant = set((DatastoreModel.get_parent_uid(ex.uid), ex.task_id)
+                        for ex in existing_notes)
 
-            def not_redundant(new_note):
-                """Does the new note match any existing, undismissed one?"""
-                return all([ex.task_id != new_note.task_id or ex.dismissed
-                            for ex in existing_notes])
+        return [n for n in notifications
+                if (DatastoreModel.get_parent_uid(n.uid), n.task_id)
+                not in redundant]
 
-            notes_by_parent[parent_id] = filter(not_redundant, new_notes)
+    @classmethod
+    def fold_into_digests(klass, notifications):
+        """Fold new notifications into undismissed ones with the same context
+        and subject, so an event that keeps happening makes one notification
+        that counts up, rather than many.
 
-        # Collapse the lists for return.
-        return reduce(lambda x, y: x + y, notes_by_parent.values(), [])
+        Returns: tuple of (new notifications with nothing to fold into,
+            existing notifications updated but not yet put).
+        """
+        by_topic = defaultdict(list)
+        for n in notifications:
+            by_topic[(n.context_id, n.subject)].append(n)
+
+        new_notes, digests = [], []
+        for (context_id, subject), notes in by_topic.items():
+            existing_notes = klass.get(context_id=context_id, subject=subject,
+                                       dismissed=False, n=float('inf'))
+            existing_by_parent = {DatastoreModel.get_parent_uid(ex.uid): ex
+                                  for ex in existing_notes}
+            for n in notes:
+                digest = existing_by_parent.get(
+                    DatastoreModel.get_parent_uid(n.uid), None)
+                if digest is None:
+                    new_notes.append(n)
+                    continue
+                digest.digest_count = (digest.digest_count or 1) + 1
+                digest.body = u"{} ({} times)".format(
+                    n.body, digest.digest_count)
+                digest.link = n.link
+                digests.append(digest)
+
+        return new_notes, digests
 
     @classmethod
     def get_long_uid(klass, short_uid):
@@ -1,7 +1,7 @@
 """Organization: a University, College, School, or other institution."""
 
 from collections import OrderedDict
-from google.appengine.api import memcache, taskqueue
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 import json
 import logging
@@ -11,7 +11,6 @@ import string
 import organization_tasks
 
 from gae_models import DatastoreModel
-import config
 import model
 import util
 
@@ -146,23 +145,12 @@ class Organization(DatastoreModel):
         )  # force generator to store whole list in memory for re-use
         # These keys are for individual project cohort entities
         to_delete += [util.cached_properties_key(pc.uid) for pc in pcs]
-        # These are for caches of whole query results.
-        to_delete += [
-            util.cached_query_key('SuperDashboard', organization_id=self.uid)
-        ]
-        for pc in pcs:
-            kwargs = {'program_label': pc.program_label,
-                      'cohort_label': pc.cohort_label}
-            to_delete.append(util.cached_query_key('SuperDashboard', **kwargs))
-            taskqueue.add(
-                url='/task/cache_dashboard',
-                headers={'Content-Type': 'application/json; charset=utf-8'},
-                payload=json.dumps(kwargs),
-                countdown=config.task_consistency_countdown,
-            )
 
         memcache.delete_multi(to_delete)
 
+        if pcs:
+            model.DashboardRow.queue_refresh([self.uid])
+
         # Save tasklist.
         if self.tasklist:
             # Tasklist might not always be present; it is if created via
@@ -1,8 +1,18 @@
 """Participant: A person who participates in a survey. SQL-backed."""
 
+from google.appengine.api import memcache
+import hashlib
+import json
 import logging
 
 from gae_models import SqlModel, SqlField as Field
+import config
+import mysql_pool
+
+
+# Memcache keys of cached participant rows, by uid and by name and org.
+CACHE_PREFIX_ID = 'participant:'
+CACHE_PREFIX_NAME = 'participant_name:'
 
 
 class Participant(SqlModel):
@@ -48,3 +58,120 @@ class Participant(SqlModel):
         'engine': 'InnoDB',
         'charset': 'utf8',
     }
+
+    @classmethod
+    def get_existing_ids(klass, uids):
+        """Which of these participant ids exist? Returns a set."""
+        uids = list(uids)
+        if not uids:
+            return set()
+
+        query = """
+            SELECT `uid`
+            FROM `participant`
+            WHERE `uid` IN ({interps})
+        """.format(interps=','.join(['%s'] * len(uids)))
+
+        with mysql_pool.connect() as sql:
+            row_dicts = sql.select_query(query, tuple(uids))
+
+        return set(d['uid'] for d in row_dicts)
+
+    @classmethod
+    def name_cache_key(klass, name, organization_id):
+        # Names may be long and non-ascii, too much for a memcache key.
+        return CACHE_PREFIX_NAME + hashlib.sha1(
+            json.dumps([organization_id, name])).hexdigest()
+
+    @classmethod
+    def cache_row(klass, row_dict):
+        """Participants never change once created, so rows are safe to cache
+        for config.participant_cache_seconds."""
+        memcache.set_multi(
+            {
+                CACHE_PREFIX_ID + row_dict['uid']: row_dict,
+                klass.name_cache_key(
+                    row_dict['name'], row_dict['organization_id']): row_dict,
+            },
+            time=config.participant_cache_seconds,
+        )
+
+    @classmethod
+    def get_by_id_cached(klass, uid):
+        """Like get_by_id(), but checking memcache first."""
+        row_dict = memcache.get(CACHE_PREFIX_ID + uid)
+        if row_dict:
+            return klass.row_dict_to_obj(row_dict)
+
+        participant = klass.get_by_id(uid)
+        if participant:
+            klass.cache_row(klass.coerce_row_dict(participant.to_dict()))
+        return participant
+
+    @classmethod
+    def get_by_name(klass, name, organization_id):
+        """The participant with this name in the org, or None. Checks
+        memcache first."""
+        row_dict = memcache.get(klass.name_cache_key(name, organization_id))
+        if row_dict:
+            return klass.row_dict_to_obj(row_dict)
+
+        results = klass.get(name=name, organization_id=organization_id)
+        if not results:
+            return None
+        klass.cache_row(klass.coerce_row_dict(results[0].to_dict()))
+        return results[0]
+
+    @classmethod
+    def upsert(klass, name, organization_id, id=None):
+        """Get or create the participant with this name in the org.
+
+        Slow networks make the participant portal post the same participant
+        many times. Rather than insert and catch the duplicate key error,
+        insert-or-ignore and read back whichever row won, in one round trip,
+        and remember it in memcache for the next post.
+
+        Returns: tuple of (participant, bool whether it was created), or
+            (None, False) if the id is taken by a participant with a
+            different name or org.
+        """
+        row_dict = memcache.get(klass.name_cache_key(name, organization_id))
+        if row_dict:
+            return klass.row_dict_to_obj(row_dict), False
+
+        kwargs = {'id': id} if id else {}
+        new_participant = klass.create(
+            name=name, organization_id=organization_id, **kwargs)
+        new_row = klass.coerce_row_dict(new_participant.to_dict())
+        fields = ('uid', 'short_uid', 'name', 'organization_id')
+
+        with mysql_pool.batch() as batch:
+            batch.execute(
+                """
+                    INSERT INTO `{table}` ({fields})
+                    VALUES ({interps})
+                    ON DUPLICATE KEY UPDATE `uid` = `uid`
+                """.format(
+                    table=klass.table,
+                    fields=', '.join('`{}`'.format(f) for f in fields),
+                    interps=', '.join(['%s'] * len(fields)),
+                ),
+                tuple(new_row[f] for f in fields),
+            )
+            result = batch.select(
+                """
+                    SELECT *
+                    FROM `{table}`
+                    WHERE `name` = %s AND `organization_id` = %s
+                """.format(table=klass.table),
+                (name, organization_id),
+            )
+
+        if not result.rows:
+            logging.warning("Participant id {} is taken.".format(id))
+            return None, False
+
+        row_dict = result.rows[0]
+        klass.cache_row(row_dict)
+        return (klass.row_dict_to_obj(row_dict),
+                row_dict['uid'] == new_participant.uid)
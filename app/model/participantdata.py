@@ -18,19 +18,27 @@ Example table, focusing on one participant and one project cohort.
 """
 from google.appengine.api import memcache
 import collections
+import contextlib
 import logging
+import threading
+import time
 
 from gae_models import SqlModel, SqlField as Field
+from .participationrollup import ParticipationRollup
 import config
-import mysql_connection
+import mysql_pool
 import util
 
-# A small cached set of participation results pickles to less than 400 bytes.
-# Memcache limits values to 1 MB. Conservatively limit how many date ranges we
-# store to avoid passing the memory limit. Another good reason to keep this
-# low is to avoid lots of cycles looping through keys when invalidating date
-# ranges on pd write.
-PARTICIPATION_CACHE_MAX_LENGTH = 1000
+# Memcache counters of participation cache hits, misses, and stale results.
+PARTICIPATION_STATS_PREFIX = 'participation_cache_stats:'
+
+# Multi-row upserts are built as one statement with a tuple of placeholders
+# per row. Keep statements comfortably under max_allowed_packet.
+UPSERT_BATCH_SIZE = 500
+
+# Notes whether this thread is already inside tracking_progress(), so nested
+# puts aren't counted twice.
+_tracking = threading.local()
 
 class ParticipantData(SqlModel):
     """Some datum about a participant.
@@ -123,7 +131,7 @@ class ParticipantData(SqlModel):
         if project_cohort_id:
             params.append(project_cohort_id)
 
-        with mysql_connection.connect() as sql:
+        with mysql_pool.connect() as sql:
             row_dicts = sql.select_query(query, tuple(params))
 
         return [klass.row_dict_to_obj(d) for d in row_dicts]
@@ -147,6 +155,195 @@ class ParticipantData(SqlModel):
 
         return False
 
+    @classmethod
+    def get_existing_progress(klass, pds):
+        """Current progress rows matching these pd, before they're written.
+
+        Returns: dict of row dicts keyed by (participant_id, survey_id).
+        """
+        query, params = klass.existing_progress_query(pds)
+        if not params:
+            return {}
+
+        with mysql_pool.connect() as sql:
+            row_dicts = sql.select_query(query, params)
+
+        return klass.index_existing_progress(pds, row_dicts)
+
+    @classmethod
+    def existing_progress_query(klass, pds):
+        """Returns: tuple of query and params for get_existing_progress(),
+        params empty if there are no pds."""
+        participant_ids = list(set(pd.participant_id for pd in pds))
+
+        # Filter by participant, which is indexed, and match surveys in
+        # index_existing_progress().
+        query = """
+            SELECT *
+            FROM `participant_data`
+            WHERE `key` = 'progress'
+              AND `participant_id` IN({interps})
+        """.format(interps=','.join(['%s'] * len(participant_ids)))
+        return query, tuple(participant_ids)
+
+    @classmethod
+    def index_existing_progress(klass, pds, row_dicts):
+        """Returns: dict of the rows of these pds' surveys, keyed by
+        (participant_id, survey_id)."""
+        indexes = set((pd.participant_id, pd.survey_id) for pd in pds)
+        return {
+            (d['participant_id'], d['survey_id']): d for d in row_dicts
+            if (d['participant_id'], d['survey_id']) in indexes
+        }
+
+    @classmethod
+    @contextlib.contextmanager
+    def tracking_progress(klass, pds):
+        """Keep ParticipationRollup up to date with progress written within.
+
+        Args:
+            pds: list of ParticipantData about to be written.
+        """
+        progress_pds = [pd for pd in pds if pd.key == 'progress']
+        if getattr(_tracking, 'active', False) or not progress_pds:
+            yield
+            return
+
+        existing = klass.get_existing_progress(progress_pds)
+        _tracking.active = True
+        try:
+            yield
+        finally:
+            _tracking.active = False
+        # Only reached if the write succeeded.
+        ParticipationRollup.record(existing, progress_pds)
+
+    def put(self, *args, **kwargs):
+        with self.tracking_progress([self]):
+            return super(ParticipantData, self).put(*args, **kwargs)
+
+    @classmethod
+    def put_multi(klass, pds, *args, **kwargs):
+        with klass.tracking_progress(pds):
+            return super(ParticipantData, klass).put_multi(
+                pds, *args, **kwargs)
+
+    @classmethod
+    def put_for_index(klass, pd, index_name):
+        with klass.tracking_progress([pd]):
+            return super(ParticipantData, klass).put_for_index(pd, index_name)
+
+    @classmethod
+    def delete_multi(klass, pds, *args, **kwargs):
+        progress_pds = [pd for pd in pds if pd.key == 'progress']
+        existing = klass.get_existing_progress(progress_pds)
+        result = super(ParticipantData, klass).delete_multi(
+            pds, *args, **kwargs)
+        # Only rows actually deleted leave their buckets.
+        uids = set(pd.uid for pd in progress_pds)
+        ParticipationRollup.record_deletes(
+            [row for row in existing.values() if row['uid'] in uids])
+        return result
+
+    @classmethod
+    def upsert_batch(klass, pds):
+        """Write many pd in one multi-row INSERT ... ON DUPLICATE KEY UPDATE.
+
+        Rows collide on the `participant-survey-key` index, like
+        put_for_index(). Progress may never decrease, but rather than reading
+        existing rows first (see is_progress_downgrade), the comparison
+        happens inside the statement with GREATEST().
+
+        Callers should coalesce pd beforehand so each participant-survey-key
+        appears only once; MySQL applies duplicates within a statement in
+        order, which is correct but wasteful.
+
+        Existing progress rows, which ParticipationRollup.record() needs to
+        know which buckets they leave, are read in the same transaction and
+        round trip as the write, see mysql_pool.batch().
+
+        Args:
+            pds: list of ParticipantData instances, e.g. from create().
+
+        Returns: int number of rows submitted.
+        """
+        if not pds:
+            return 0
+
+        # Created and modified are left to their column defaults, and uid,
+        # short_uid, and created must not change for existing rows.
+        row_dicts = [klass.coerce_row_dict(pd.to_dict()) for pd in pds]
+        fields = sorted(k for k in row_dicts[0].keys()
+                        if k not in ('created', 'modified'))
+        immutable = ('uid', 'short_uid', 'key', 'participant_id', 'survey_id')
+        updates = [
+            '`{f}` = VALUES(`{f}`)'.format(f=f)
+            for f in fields if f not in immutable and f != 'value'
+        ]
+        updates.insert(0, """`value` = IF(
+                `key` = 'progress',
+                GREATEST(CAST(`value` AS UNSIGNED),
+                         CAST(VALUES(`value`) AS UNSIGNED)),
+                VALUES(`value`)
+            )""")
+        # `modified` is ON UPDATE CURRENT_TIMESTAMP, so it would move if any
+        # other column changed, even when progress didn't increase. That
+        # moves the row to today's rollup bucket without a recount, see
+        # ParticipationRollup.record(). Set it explicitly instead, only when
+        # the value changes. Assignments apply in order, so this has to come
+        # before `value` is updated.
+        updates.insert(0, """`modified` = IF(
+                IF(
+                    `key` = 'progress',
+                    CAST(VALUES(`value`) AS UNSIGNED) >
+                        CAST(`value` AS UNSIGNED),
+                    NOT (VALUES(`value`) <=> `value`)
+                ),
+                CURRENT_TIMESTAMP,
+                `modified`
+            )""")
+
+        row_interps = '({})'.format(','.join(['%s'] * len(fields)))
+
+        progress_pds = [pd for pd in pds if pd.key == 'progress']
+        existing_query, existing_params = klass.existing_progress_query(
+            progress_pds)
+        existing_rows = None
+
+        # One transaction. Existing rows are read in the same round trip as
+        # the first upsert. Upserts go in separate round trips to keep each
+        # packet under max_allowed_packet.
+        with mysql_pool.connect():
+            for i in range(0, len(row_dicts), UPSERT_BATCH_SIZE):
+                rows = row_dicts[i:i + UPSERT_BATCH_SIZE]
+                query = """
+                    INSERT INTO `{table}` ({fields})
+                    VALUES {rows}
+                    ON DUPLICATE KEY UPDATE
+                    {updates}
+                """.format(
+                    table=klass.table,
+                    fields=', '.join('`{}`'.format(f) for f in fields),
+                    rows=',\n'.join([row_interps] * len(rows)),
+                    updates=',\n'.join(updates),
+                )
+                params = tuple(d[f] for d in rows for f in fields)
+                with mysql_pool.batch() as batch:
+                    if i == 0 and existing_params:
+                        existing_rows = batch.select(existing_query,
+                                                     existing_params)
+                    batch.execute(query, params)
+
+        # Only reached if the write succeeded.
+        if existing_rows is not None:
+            ParticipationRollup.record(
+                klass.index_existing_progress(progress_pds, existing_rows.rows),
+                progress_pds,
+                only_increases=True,
+            )
+
+        return len(row_dicts)
+
     @classmethod
     def is_valid_progress_value(klass, value):
         # Then `value` should be an integer between 0 and 100 inclusive.
@@ -165,9 +362,10 @@ class ParticipantData(SqlModel):
         """Summarize participation for a single scope, pc or survey.
 
         This attempts to retrive results from memcache first. It falls back
-        on participation_from_sql on cache miss.
+        on participation_from_rollup on cache miss.
 
-        Cache is structured like cache_key: {date_range: result, ...}
+        Cached results are keyed by entity, generation, and date range. See
+        participation_generations().
         """
         cacheable_kwargs = (
             set(('project_cohort_id', 'start', 'end')),
@@ -177,80 +375,86 @@ class ParticipantData(SqlModel):
         is_cacheable = set_keys in cacheable_kwargs
 
         if is_cacheable:
-            survey_id = kwargs.get('survey_id', None)
-            project_cohort_id = kwargs.get('project_cohort_id', None)
+            entity_id = kwargs.get('survey_id', None) or kwargs.get(
+                'project_cohort_id', None)
             date_key = klass.date_key(kwargs['start'], kwargs['end'])
+            generation = klass.participation_generations(
+                [entity_id]).get(entity_id, None)
+            is_cacheable = generation is not None
 
-            # Find any cached data by the relevant entity id.
+        if is_cacheable:
             cache_key = klass.participation_cache_key(
-                survey_id or project_cohort_id)
-            cache_value = memcache.get(cache_key) or {}
+                entity_id, generation, date_key)
+            stale_key = klass.participation_cache_key(
+                entity_id, generation - 1, date_key)
+            cached = memcache.get_multi([cache_key, stale_key])
 
-            # Cache value is results keyed by date range. Choose the right one,
-            # if available.
-            result = cache_value.get(date_key, None)
+            if cache_key in cached:
+                klass.count_participation_cache(hit=1)
+                return cached[cache_key]
 
-            # If we found anything, use it, and skip sql entirely.
-            if result:
-                return result
+            klass.count_participation_cache(
+                **({'stale': 1} if stale_key in cached else {'miss': 1}))
 
-        sql_results = klass.participation_from_sql(**kwargs)
+        results = klass.participation_from_rollup(**kwargs)
 
         if is_cacheable:
-            if len(cache_value) > PARTICIPATION_CACHE_MAX_LENGTH:
-                cache_value = klass.truncate_cached(cache_value)
-            cache_value[date_key] = sql_results
-            memcache.set(cache_key, cache_value)
+            memcache.set(cache_key, results)
 
-        return sql_results
+        return results
 
     @classmethod
     def participation_by_project_cohort(klass, ids_or_codes, *args, **kwargs):
         """Summarize participation for multiple project cohorts at once.
 
         This attempts to retrive results from memcache first. It falls back
-        on participation_by_project_cohort_from_sql on cache miss.
+        on participation_by_project_cohort_from_rollup on cache miss.
 
-        Cache is structured like cache_key: {date_range: result, ...}
+        Cached results are keyed by id or code, generation, and date range.
+        See participation_generations().
         """
         results = []
         # Assume we'll have to go to sql for all this data, unless we find it
         # cached.
         ids_for_sql = list(ids_or_codes)  # copy
-        cache_data_to_update = {}
+        cache_keys = {}
         is_cacheable = 'start' in kwargs and 'end' in kwargs
 
         if is_cacheable:
             date_key = klass.date_key(kwargs['start'], kwargs['end'])
-            id_by_cache_key = {
-                klass.participation_by_pc_cache_key(id_or_code): id_or_code
-                for id_or_code in ids_or_codes
-            }
-
-            # Get all the data we're interested in via a batch operation.
-            cache_data = memcache.get_multi(id_by_cache_key.keys())
+            generations = klass.participation_generations(ids_or_codes)
 
-            # Then check each value to see if a matching date range is present.
-            for cache_key, id_or_code in id_by_cache_key.items():
-                # Find any cached data by the relevant entity id.
-                cache_value = cache_data.get(cache_key, {})
+            # Current and previous keys for each id, so we can tell stale
+            # results (invalidated by a write) from ones never cached.
+            stale_keys = {}
+            for id_or_code, generation in generations.items():
+                cache_keys[id_or_code] = klass.participation_by_pc_cache_key(
+                    id_or_code, generation, date_key)
+                stale_keys[id_or_code] = klass.participation_by_pc_cache_key(
+                    id_or_code, generation - 1, date_key)
 
-                cache_result = cache_value.get(date_key, None)
+            # Get all the data we're interested in via a batch operation.
+            cached = memcache.get_multi(
+                cache_keys.values() + stale_keys.values())
 
-                if cache_result is None:
-                    # We didn't find a result for this id. Queue it for sql and
-                    # caching.
-                    cache_data_to_update[cache_key] = cache_value
-                else:
+            counts = collections.Counter()
+            for id_or_code, cache_key in cache_keys.items():
+                if cache_key in cached:
                     # We found a result for this id. Don't look it up from sql.
-                    results += cache_result  # store it for return
+                    results += cached[cache_key]
                     ids_for_sql.remove(id_or_code)
+                    counts['hit'] += 1
+                elif stale_keys[id_or_code] in cached:
+                    counts['stale'] += 1
+                else:
+                    counts['miss'] += 1
+            klass.count_participation_cache(**counts)
 
         # We may have found all relevant data in memcache, in which case this
         # will be empty, and sql is skipped. Anything not found in memcache
         # means ids remain in this list, and we query from sql.
         if ids_for_sql:
-            sql_results = klass.participation_by_project_cohort_from_sql(
+            sql_results = klass.participation_by_project_cohort_from_rollup(
                 ids_for_sql,
                 **kwargs
             )
@@ -258,68 +462,132 @@ class ParticipantData(SqlModel):
             # @todo: messes up ordering?
             results += sql_results
 
-            if is_cacheable:
-                if len(cache_value) > PARTICIPATION_CACHE_MAX_LENGTH:
-                    cache_value = klass.truncate_cached(cache_value)
-
-                # Any data from sql should be cached. Find the right result row,
-                # mix it into existing cached data for that id/code, then cache
-                # it as memcache.set(cache_key, {date_key: result, ...}), but
-                # with a batch operation.
-                for id_or_code in ids_for_sql:
-                    matching_results = [
-                        r for r in sql_results
-                        if (id_or_code == r['project_cohort_id'] or
-                            id_or_code == r['code'])
-                    ]
-                    cache_key = klass.participation_by_pc_cache_key(id_or_code)
-                    cache_value = cache_data_to_update[cache_key]
-                    cache_value[date_key] = matching_results
-
-                memcache.set_multi(cache_data_to_update)
+            # Any data from sql should be cached under its current
+            # generation, with a batch operation.
+            to_set = {}
+            for id_or_code in ids_for_sql:
+                if id_or_code not in cache_keys:
+                    continue
+                to_set[cache_keys[id_or_code]] = [
+                    r for r in sql_results
+                    if (id_or_code == r['project_cohort_id'] or
+                        id_or_code == r['code'])
+                ]
+            if to_set:
+                memcache.set_multi(to_set)
 
         return results
 
     @classmethod
-    def participation_cache_key(klass, entity_id):
-        return u'participation:{}'.format(entity_id)
+    def participation_cache_key(klass, entity_id, generation, date_key):
+        return u'participation:{}:{}:{}'.format(
+            entity_id, generation, date_key)
 
     @classmethod
-    def participation_by_pc_cache_key(klass, entity_id):
-        return u'participation_by_pc:{}'.format(entity_id)
+    def participation_by_pc_cache_key(klass, entity_id, generation, date_key):
+        return u'participation_by_pc:{}:{}:{}'.format(
+            entity_id, generation, date_key)
 
     @classmethod
-    def date_key(klass, start, end):
-        return '{},{}'.format(
-            start.strftime(config.iso_datetime_format),
-            end.strftime(config.iso_datetime_format),
+    def participation_generation_key(klass, entity_id):
+        return u'participation_generation:{}'.format(entity_id)
+
+    @classmethod
+    def participation_generations(klass, entity_ids):
+        """Current cache generation of surveys, project cohorts, or codes.
+
+        Writing progress increments the generation of related entities (see
+        invalidate_participation()), so results cached under an older
+        generation are never read again, and memcache evicts them in time.
+
+        Returns: dict of int generations keyed by entity id. Ids are missing
+            if memcache is unavailable.
+        """
+        ids_by_key = {klass.participation_generation_key(id): id
+                      for id in entity_ids}
+        found = memcache.get_multi(ids_by_key.keys())
+
+        missing = [k for k in ids_by_key.keys() if k not in found]
+        if missing:
+            # Generations are evicted like anything else. Start over from the
+            # clock rather than zero so old results can't become current
+            # again. If another request beats us to it, use theirs.
+            initial = klass.initial_generation()
+            memcache.add_multi({k: initial for k in missing})
+            found.update(memcache.get_multi(missing))
+
+        return {ids_by_key[k]: int(v) for k, v in found.items()}
+
+    @classmethod
+    def initial_generation(klass):
+        return int(time.time() * 1000)
+
+    @classmethod
+    def invalidate_participation(klass, entity_ids):
+        """Make cached participation of these entities stale, atomically.
+
+        Args:
+            entity_ids: iterable of survey ids, project cohort ids, and codes.
+        """
+        memcache.offset_multi(
+            {klass.participation_generation_key(id): 1
+             for id in set(entity_ids) if id},
+            initial_value=klass.initial_generation(),
         )
 
     @classmethod
-    def truncate_cached(klass, cache_value):
-        """See comments on PARTICIPATION_CACHE_MAX_LENGTH."""
-        # Format is '{ISO datetime},{ISO datetime}', so naive string
-        # sort will give us all the oldest date ranges first.
-        sorted_keys = sorted(cache_value.keys())
+    def count_participation_cache(klass, **counts):
+        """Add to the counters reported by participation_cache_stats().
+
+        Args:
+            hit, miss, stale: int
+        """
+        counts = {k: v for k, v in counts.items() if v}
+        if counts:
+            memcache.offset_multi(counts, key_prefix=PARTICIPATION_STATS_PREFIX,
+                                  initial_value=0)
 
-        # Keep only a fraction the max allowed keys to avoid calling this
-        # truncation function every time.
-        num_to_keep = PARTICIPATION_CACHE_MAX_LENGTH // 10
+    @classmethod
+    def participation_cache_stats(klass):
+        """Counts of cache hits, misses, and stale results since reset.
 
-        # Throw away keys up to the most recent set.
-        for k in sorted_keys[:-num_to_keep]:
-            del cache_value[k]
+        Stale means a result for the same entity and date range was cached
+        but has been invalidated by a write since.
+        """
+        names = ('hit', 'miss', 'stale')
+        found = memcache.get_multi(names, key_prefix=PARTICIPATION_STATS_PREFIX)
+        stats = {k: int(found.get(k, 0)) for k in names}
+        total = sum(stats.values())
+        stats['hit_rate'] = float(stats['hit']) / total if total else None
+        return stats
 
-        return cache_value
+    @classmethod
+    def reset_participation_cache_stats(klass):
+        memcache.delete_multi(('hit', 'miss', 'stale'),
+                              key_prefix=PARTICIPATION_STATS_PREFIX)
 
     @classmethod
-    def split_date_key(klass, date_key):
-        return date_key.split(',')
+    def date_key(klass, start, end):
+        return '{},{}'.format(
+            start.strftime(config.iso_datetime_format),
+            end.strftime(config.iso_datetime_format),
+        )
 
     @classmethod
     def participation_from_sql(klass, **kwargs):
         """Get counts of participants reaching each marker.
 
+        See participation_from_sql_query() for arguments.
+        """
+        query, params = klass.participation_from_sql_query(**kwargs)
+        with mysql_pool.connect() as sql:
+            result = sql.select_query(query, params)
+        return result
+
+    @classmethod
+    def participation_from_sql_query(klass, **kwargs):
+        """SQL and params for participation_from_sql().
+
         Args:
             program_label: str applicable program
             cohort_label: str applicable cohort (requires program also)
@@ -375,10 +643,108 @@ class ParticipantData(SqlModel):
             start='AND `modified` >= %s' if kwargs['start'] else '',
             end='AND `modified` < %s' if kwargs['end'] else '',
         )
+        return (query, tuple(query_params))
 
-        with mysql_connection.connect() as sql:
-            result = sql.select_query(query, tuple(query_params))
-        return result
+    @classmethod
+    def participation_from_rollup(klass, **kwargs):
+        """Like participation_from_sql(), but summing ParticipationRollup.
+
+        Whole days in the date range come from the rollup. Any partial days
+        at either end are counted from raw participant data, which is indexed
+        by modified time.
+        """
+        # All kwargs default to None.
+        kwargs = collections.defaultdict(lambda: None, kwargs)
+
+        scope_keys = ('program_label', 'project_cohort_id', 'survey_id')
+        scope_filters = {k: kwargs[k] for k in scope_keys if kwargs[k]}
+        if len(scope_filters) != 1:
+            raise Exception("Invalid scope filters: {}".format(scope_filters))
+        scope_key, scope_value = scope_filters.items()[0]
+
+        days, edges = ParticipationRollup.full_days(
+            kwargs['start'], kwargs['end'])
+
+        # These are independent, send them together.
+        with mysql_pool.batch() as batch:
+            rollup = None
+            if days:
+                query, params = ParticipationRollup.participation_query(
+                    scope_key, scope_value, kwargs['cohort_label'], *days)
+                rollup = batch.select(query, params)
+            raw = [
+                batch.select(*klass.participation_from_sql_query(
+                    **dict(kwargs, start=start, end=end)))
+                for start, end in edges
+            ]
+
+        result_lists = [r.rows for r in raw]
+        if rollup:
+            result_lists.insert(0, ParticipationRollup.int_counts(rollup.rows))
+
+        return klass.merge_participation(
+            result_lists, ('survey_ordinal', 'value'))
+
+    @classmethod
+    def participation_by_project_cohort_from_rollup(
+        klass,
+        ids_or_codes,
+        using_codes=False,
+        start=None,
+        end=None
+    ):
+        """Like participation_by_project_cohort_from_sql(), but summing
+        ParticipationRollup. See participation_from_rollup()."""
+        if len(ids_or_codes) == 0:
+            return []
+
+        days, edges = ParticipationRollup.full_days(start, end)
+
+        # These are independent, send them together.
+        with mysql_pool.batch() as batch:
+            rollup = None
+            if days:
+                query, params = (
+                    ParticipationRollup.participation_by_project_cohort_query(
+                        ids_or_codes, using_codes, *days))
+                rollup = batch.select(query, params)
+            raw = [
+                batch.select(*klass.participation_by_project_cohort_query(
+                    ids_or_codes, using_codes, edge_start, edge_end))
+                for edge_start, edge_end in edges
+            ]
+
+        result_lists = [r.rows for r in raw]
+        if rollup:
+            result_lists.insert(0, ParticipationRollup.int_counts(rollup.rows))
+
+        return klass.merge_participation(
+            result_lists, ('project_cohort_id', 'survey_ordinal', 'value'))
+
+    @classmethod
+    def merge_participation(klass, result_lists, key_fields):
+        """Sum counts of participation results from different sources.
+
+        Returns: list of dicts sorted like the source queries, by key fields
+            with progress value as a number.
+        """
+        if len(result_lists) == 1:
+            return result_lists[0]
+
+        by_key = collections.OrderedDict()
+        for results in result_lists:
+            for row in results:
+                key = tuple(row[f] for f in key_fields)
+                if key in by_key:
+                    by_key[key]['n'] += row['n']
+                else:
+                    by_key[key] = dict(row)
+
+        return sorted(
+            by_key.values(),
+            key=lambda row: [row[f] for f in key_fields[:-1]] +
+                            [int(row['value'])],
+        )
 
     @classmethod
     def participation_by_project_cohort_from_sql(
@@ -402,6 +768,16 @@ class ParticipantData(SqlModel):
         if len(ids_or_codes) == 0:
             return []
 
+        query, params = klass.participation_by_project_cohort_query(
+            ids_or_codes, using_codes, start, end)
+        with mysql_pool.connect() as sql:
+            result = sql.select_query(query, params)
+        return result
+
+    @classmethod
+    def participation_by_project_cohort_query(
+            klass, ids_or_codes, using_codes=False, start=None, end=None):
+        """SQL and params for participation_by_project_cohort_from_sql()."""
         query = """
             SELECT  `project_cohort_id`
             ,       MAX(`code`) as code
@@ -430,10 +806,7 @@ class ParticipantData(SqlModel):
             query_params.append(start.strftime(config.sql_datetime_format))
         if end:
             query_params.append(end.strftime(config.sql_datetime_format))
-
-        with mysql_connection.connect() as sql:
-            result = sql.select_query(query, tuple(query_params))
-        return result
+        return (query, tuple(query_params))
 
     @classmethod
     def completion_by_cohort(klass, program_label):
@@ -454,7 +827,7 @@ class ParticipantData(SqlModel):
             ORDER BY `cohort_label`, `survey_ordinal`
         """
 
-        with mysql_connection.connect() as sql:
+        with mysql_pool.connect() as sql:
             result = sql.select_query(query, (program_label,))
         for row in result:
             # These come back as Decimal objects, want integers.
@@ -474,6 +847,16 @@ class ParticipantData(SqlModel):
         Returns: list of rows with 'participant_id', 'survey_ordinal', and
             'value' (which is progress).
         """
+        query, query_params = klass.completion_ids_anonymous_query(
+            project_cohort_id, start, end)
+        with mysql_pool.connect() as sql:
+            result = sql.select_query(query, query_params)
+        return result
+
+    @classmethod
+    def completion_ids_anonymous_query(klass, project_cohort_id, start, end):
+        """SQL and params for completion_ids_anonymous(), for callers that
+        want to stream results, see csv_export.py."""
         # Optionally add a time range. Note that SQL stores and compares
         # datetime strings in a different format.
         query = """
@@ -493,10 +876,7 @@ class ParticipantData(SqlModel):
             start.strftime(config.sql_datetime_format),
             end.strftime(config.sql_datetime_format),
         )
-
-        with mysql_connection.connect() as sql:
-            result = sql.select_query(query, tuple(query_params))
-        return result
+        return (query, query_params)
 
     @classmethod
     def completion_ids(klass, **kwargs):
@@ -509,9 +889,18 @@ class ParticipantData(SqlModel):
             start: datetime filters for pd modified after this date
             end: datetime filters for pd modified before this date
 
-        Returns: List of dictionaries, each with keys 'participant_id' and
-        'survey_ordinal'.
+        Returns: List of dictionaries, each with keys 'token',
+        'percent_progress', and 'module'.
         """
+        query, query_params = klass.completion_ids_query(**kwargs)
+        with mysql_pool.connect() as sql:
+            result = sql.select_query(query, query_params)
+        return result
+
+    @classmethod
+    def completion_ids_query(klass, **kwargs):
+        """SQL and params for completion_ids(), for callers that want to
+        stream results, see csv_export.py."""
         # All kwargs default to None.
         kwargs = collections.defaultdict(lambda: None, kwargs)
 
@@ -545,10 +934,7 @@ class ParticipantData(SqlModel):
             start='AND pd.`modified` > %s' if kwargs['start'] else '',
             end='AND pd.`modified` < %s' if kwargs['end'] else '',
         )
-
-        with mysql_connection.connect() as sql:
-            result = sql.select_query(query, tuple(query_params))
-        return result
+        return (query, tuple(query_params))
 
     @classmethod
     def combine_survey_descriptor(self, survey_id, survey_descriptor):
@@ -563,6 +949,46 @@ class ParticipantData(SqlModel):
         parts = compound_survey_id.split(':')
         return (parts[0], None) if len(parts) == 1 else parts
 
+    @classmethod
+    def write_error(klass, key, value, survey_id):
+        """Why a write of participant data from a survey is invalid, or None
+        if it's fine. Shared by the api's single and batch write endpoints.
+        """
+        # All params should be present and truthy.
+        if not (key and value and survey_id):
+            return 'Missing parameters.'
+        if key == 'progress' and not klass.is_valid_progress_value(value):
+            return 'Invalid progress value.'
+        return None
+
+    @classmethod
+    def create_for_survey(klass, survey, project_cohort,
+                          survey_descriptor=None, **kwargs):
+        """Create pd with the context of the survey it came from.
+
+        Args:
+            survey: Survey entity.
+            project_cohort: ProjectCohort entity of the survey.
+            survey_descriptor: str, optional, see combine_survey_descriptor.
+            kwargs: other properties, e.g. participant_id, key, and value.
+        """
+        if survey_descriptor:
+            survey_id = klass.combine_survey_descriptor(
+                survey.uid, survey_descriptor)
+        else:
+            survey_id = survey.uid
+
+        return klass.create(
+            survey_id=survey_id,
+            survey_ordinal=survey.ordinal,
+            program_label=survey.program_label,
+            project_id=survey.project_id,
+            cohort_label=survey.cohort_label,
+            project_cohort_id=survey.project_cohort_id,
+            code=project_cohort.code,
+            **kwargs
+        )
+
     def after_put(self, init_kwargs, *args, **kwargs):
         """Reset memcache for related objects.
 
@@ -572,20 +998,5 @@ class ParticipantData(SqlModel):
             # Caching only relevant to progress.
             return
 
-        keys = (
-            self.participation_cache_key(self.survey_id),
-            self.participation_cache_key(self.project_cohort_id),
-            self.participation_by_pc_cache_key(self.project_cohort_id),
-            self.participation_by_pc_cache_key(self.code),
-        )
-        for k in keys:
-            cache_value = memcache.get(k) or {}
-            needs_update = False
-            for date_key in cache_value.keys():
-                start, end = self.split_date_key(date_key)
-                created = self.created.strftime(config.iso_datetime_format)
-                if created >= start and created < end:
-                    needs_update = True
-                    del cache_value[date_key]
-            if needs_update:
-                memcache.set(k, cache_value)
+        self.invalidate_participation(
+            (self.survey_id, self.project_cohort_id, self.code))
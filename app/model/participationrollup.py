@@ -0,0 +1,694 @@
+"""ParticipationRollup: Counts of participant progress by day. SQL-backed.
+
+Participation (how many participants reached each progress value of each
+survey) used to be aggregated from raw participant_data rows on every cache
+miss. This table holds the same counts, pre-aggregated into day buckets, so
+that participation for any date range is a sum over a few rows per survey.
+
+| project_cohort_id | survey_id | value |    day     | n  |
+|-------------------|-----------|-------|------------|----|
+| ProjectCohort_A   | Survey_C  | 1     | 2020-01-06 | 3  |
+| ProjectCohort_A   | Survey_C  | 100   | 2020-01-06 | 21 |
+| ProjectCohort_A   | Survey_C  | 100   | 2020-01-07 | 2  |
+
+A participant's progress row lives in the bucket of its value and the day it
+was last modified, which matches how participation_from_sql() filters raw
+rows. When progress is inserted, upgraded, or deleted, the buckets of the
+row's survey on the day it left and on the day it joined need a recount from
+the raw table. See ParticipantData.tracking_progress() and upsert_batch()
+for where writes are observed; the latter reads the rows it's about to
+change in the same transaction and round trip as the write. Rows written
+with testing = true aren't counted.
+
+Recounts don't happen during the write. Each write adds the groups it touched
+to a pull queue, and a worker (/task/recount_participation_rollup) leases
+them in bulk, recounts each group once, however many writes touched it, and
+clears the participation caches of what it recounted.
+Workers are debounced like those of task_events.py, and
+/cron/flush_participation_rollup is a backstop. Participation counts lag
+writes by a few seconds.
+
+Counts can still drift (e.g. if a request dies between writing and queuing).
+check() compares against the raw table and rebuild() recomputes from it; see
+the /task/backfill_participation_rollup and /cron/check_participation_rollup
+handlers.
+
+When config.participation_rollup_synchronous is True, groups are recounted
+as soon as they're queued, which is what tests want.
+"""
+
+from google.appengine.api import taskqueue
+import collections
+import datetime
+import json
+import logging
+import time
+
+from gae_models import SqlModel, SqlField as Field
+from taskqueue_helper import namespace_tag
+import config
+import mysql_pool
+import taskqueue_helper
+
+
+# Buckets are written, or groups of them recounted, this many per statement.
+WRITE_BATCH_SIZE = 500
+
+# Pull queue of groups waiting for a recount, see queue.yaml.
+RECOUNT_QUEUE_NAME = 'participation-rollup'
+
+RECOUNT_WORKER_URL = '/task/recount_participation_rollup'
+
+# Writes within a window of this many seconds share a worker.
+RECOUNT_DEBOUNCE_SECONDS = 5
+
+# Max allowed by the taskqueue api.
+RECOUNT_LEASE_BATCH_SIZE = 1000
+
+# How long the worker has to recount a leased batch before the groups become
+# available to other workers. Recounts are idempotent, so a repeated batch is
+# harmless.
+RECOUNT_LEASE_SECONDS = 60
+
+# Queued recounts that have failed this many times are dropped; check()
+# finds any buckets they leave wrong.
+MAX_RECOUNT_RETRIES = 5
+
+
+class ParticipationRollup(SqlModel):
+    """Day bucket of participant progress counts.
+
+    There are no instances of this class; rows are only read as aggregates.
+    """
+    table = 'participation_rollup'
+
+    py_table_definition = {
+        'table_name': table,
+        'fields': [
+            #     name,            type,      length, unsigned, null,  default, on_update
+            Field('project_cohort_id','varchar',50,   None,     False, None,    None),
+            # Empty string if participant data has no survey.
+            Field('survey_id',     'varchar', 50,     None,     False, None,    None),
+            Field('value',         'varchar', 50,     None,     False, None,    None),
+            Field('day',           'date',    None,   None,     False, None,    None),
+            # The survey ordinal follows from the survey, so it's not part of
+            # the primary key.
+            Field('survey_ordinal','tinyint', 3,      True,     True,  SqlModel.sql_null, None),
+            # Copied from participant data so other scopes can be summed.
+            Field('program_label', 'varchar', 50,     None,     True,  SqlModel.sql_null, None),
+            Field('cohort_label',  'varchar', 50,     None,     True,  SqlModel.sql_null, None),
+            Field('code',          'varchar', 50,     None,     True,  SqlModel.sql_null, None),
+            Field('n',             'int',     None,   None,     False, 0,       None),
+        ],
+        'primary_key': ['project_cohort_id', 'survey_id', 'value', 'day'],
+        'indices': [
+            {
+                'name': 'survey-day',
+                'fields': ['survey_id', 'day'],
+            },
+            {
+                'name': 'program-cohort-day',
+                'fields': ['program_label', 'cohort_label', 'day'],
+            },
+            {
+                'name': 'code-day',
+                'fields': ['code', 'day'],
+            },
+        ],
+        'engine': 'InnoDB',
+        'charset': 'utf8',
+    }
+
+    # Bucket identity and the other columns copied with it.
+    key_fields = ('project_cohort_id', 'survey_id', 'value', 'day')
+    copied_fields = ('survey_ordinal', 'program_label', 'cohort_label', 'code')
+
+    @classmethod
+    def bucket(klass, row, day):
+        """Hashable bucket for a participant data row or object."""
+        get = row.get if isinstance(row, dict) else lambda k: getattr(row, k)
+        return (
+            get('project_cohort_id'),
+            get('survey_id') or '',
+            str(get('value')),
+            day,
+        ) + tuple(get(f) for f in klass.copied_fields)
+
+    @classmethod
+    def group(klass, row, day):
+        """The buckets of a row's project cohort, survey, and day."""
+        get = row.get if isinstance(row, dict) else lambda k: getattr(row, k)
+        return (get('project_cohort_id'), get('survey_id') or '', day)
+
+    @classmethod
+    def record(klass, existing_by_index, pds, only_increases=False):
+        """Queue a recount of the buckets progress rows left or joined after
+        they've been written.
+
+        Args:
+            existing_by_index: dict of raw row dicts as they were before the
+                write, keyed by (participant_id, survey_id), see
+                ParticipantData.get_existing_progress().
+            pds: list of progress ParticipantData just written.
+            only_increases: bool, True if the write can't lower existing
+                values, see ParticipantData.upsert_batch().
+        """
+        groups = set()
+        for pd in pds:
+            old = existing_by_index.get((pd.participant_id, pd.survey_id), None)
+            if old:
+                if only_increases and int(old['value']) >= int(pd.value):
+                    # The row wasn't modified so it stays in its bucket.
+                    continue
+                groups.add(klass.group(old, old['modified'].date()))
+            # The database's idea of today, see recount().
+            groups.add(klass.group(pd, None))
+
+        klass.queue_recount(groups)
+
+    @classmethod
+    def record_deletes(klass, existing_rows):
+        """Queue a recount of the buckets of progress rows after they're
+        deleted.
+
+        Args:
+            existing_rows: list of raw row dicts as they were before the
+                delete.
+        """
+        klass.queue_recount(set(klass.group(row, row['modified'].date())
+                                for row in existing_rows))
+
+    @classmethod
+    def queue_recount(klass, groups):
+        """Recount these groups later, in a worker, or now if synchronous.
+
+        Args:
+            groups: iterable of (project_cohort_id, survey_id, day) tuples,
+                see recount().
+        """
+        groups = list(groups)
+        if not groups:
+            return
+
+        if config.participation_rollup_synchronous:
+            klass.recount(groups)
+            return
+
+        payload = [
+            (pc_id, survey_id,
+             day.strftime(config.iso_date_format) if day else None)
+            for pc_id, survey_id, day in groups
+        ]
+        task = taskqueue.Task(payload=json.dumps(payload), method='PULL',
+                              tag=namespace_tag())
+        taskqueue.Queue(RECOUNT_QUEUE_NAME).add(task)
+        klass.schedule_recount_worker()
+
+    @classmethod
+    def schedule_recount_worker(klass):
+        """Make sure a worker will run after the current debounce window.
+
+        Returns: the task, or None if this window already had one.
+        """
+        window = int(time.time() // RECOUNT_DEBOUNCE_SECONDS)
+        name = taskqueue_helper.named_task_name('participation-rollup',
+                                                window)
+        try:
+            return taskqueue.add(
+                url=RECOUNT_WORKER_URL,
+                name=name,
+                countdown=RECOUNT_DEBOUNCE_SECONDS,
+            )
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            return None
+
+    @classmethod
+    def flush_recounts(klass, max_batches=10):
+        """Lease, recount, and delete this namespace's queued groups until
+        there are no more.
+
+        Returns: dict of counts for reporting.
+        """
+        # Imported here because participantdata imports this module.
+        from .participantdata import ParticipantData
+
+        queue = taskqueue.Queue(RECOUNT_QUEUE_NAME)
+        report = {'leased': 0, 'groups': 0, 'failed': 0}
+
+        for x in range(max_batches):
+            tasks = queue.lease_tasks_by_tag(
+                RECOUNT_LEASE_SECONDS, RECOUNT_LEASE_BATCH_SIZE,
+                tag=namespace_tag())
+            if not tasks:
+                break
+
+            groups = set(tuple(g) for t in tasks
+                         for g in json.loads(t.payload))
+            try:
+                recounted = klass.recount(klass.resolve_days(groups))
+                # Participation cached since the write, before this recount,
+                # is stale.
+                ParticipantData.invalidate_participation(recounted)
+                done = tasks
+            except Exception:
+                # Leave the batch leased, to be retried when its lease
+                # expires, unless it's been tried too many times.
+                logging.exception("Failed to recount participation rollup.")
+                done = [t for t in tasks
+                        if t.retry_count >= MAX_RECOUNT_RETRIES]
+                for t in done:
+                    logging.error(u"Dropping participation rollup recount "
+                                  u"after {} tries: {}"
+                                  .format(t.retry_count, t.payload))
+            if done:
+                queue.delete_tasks(done)
+
+            report['leased'] += len(tasks)
+            report['groups'] += len(groups)
+            report['failed'] += len(tasks) - len(done)
+
+        return report
+
+    @classmethod
+    def resolve_days(klass, groups):
+        """Replace the "today" of queued groups with actual days.
+
+        A write's today may be yesterday by the time its group is recounted,
+        so recount both.
+
+        Returns: set of groups.
+        """
+        resolved = set(g for g in groups if g[2] is not None)
+        undated = [g for g in groups if g[2] is None]
+        if not undated:
+            return resolved
+
+        with mysql_pool.connect() as sql:
+            rows = sql.select_query("SELECT CURRENT_DATE() AS `today`",
+                                    tuple())
+        today = rows[0]['today']
+        for pc_id, survey_id, day in undated:
+            for d in (today, today - datetime.timedelta(days=1)):
+                resolved.add((pc_id, survey_id,
+                              d.strftime(config.iso_date_format)))
+        return resolved
+
+    @classmethod
+    def recount(klass, groups):
+        """Set the buckets of these groups to their counts in the raw data.
+
+        Adding the change each write made would double count when writes to
+        the same row race, since each computes its change from what it read
+        beforehand. A recount doesn't depend on what anyone read: the last
+        one to run sees every write committed before it.
+
+        Counts come from a plain SELECT, which doesn't lock participant data
+        rows, so recounts never hold up progress writes.
+
+        Args:
+            groups: iterable of (project_cohort_id, survey_id, day) tuples,
+                see group(). A day of None means the current date according
+                to the database, which is the same clock that sets `modified`
+                on participant data.
+
+        Returns: set of the project cohort ids, survey ids, and codes whose
+            participation was recounted.
+        """
+        groups = list(groups)
+        if not groups:
+            return set()
+
+        day = 'IFNULL(%s, CURRENT_DATE())'
+        group_interps = '(%s, %s, {})'.format(day)
+        condition = """(
+                `project_cohort_id` = %s
+                AND IFNULL(`survey_id`, '') = %s
+                AND `modified` >= {day}
+                AND `modified` < {day} + INTERVAL 1 DAY
+            )""".format(day=day)
+
+        recounted = set()
+
+        # One transaction, see mysql_pool.transaction().
+        with mysql_pool.transaction() as sql:
+            for i in range(0, len(groups), WRITE_BATCH_SIZE):
+                batch = groups[i:i + WRITE_BATCH_SIZE]
+
+                # Zero the groups' buckets first, so buckets with no rows left
+                # are cleared. The row locks this takes also make concurrent
+                # recounts of the same groups wait until this one commits,
+                # before they read any counts.
+                group_params = tuple(v for g in batch for v in g)
+                zero_query = """
+                    UPDATE `participation_rollup`
+                    SET `n` = 0
+                    WHERE (`project_cohort_id`, `survey_id`, `day`)
+                      IN ({groups})
+                """.format(groups=', '.join([group_interps] * len(batch)))
+                sql.query(zero_query, group_params)
+
+                count_query = """
+                    SELECT  `project_cohort_id`
+                    ,       IFNULL(`survey_id`, '') as survey_id
+                    ,       `value`
+                    ,       DATE(`modified`) as day
+                    ,       MAX(`survey_ordinal`) as survey_ordinal
+                    ,       MAX(`program_label`) as program_label
+                    ,       MAX(`cohort_label`) as cohort_label
+                    ,       MAX(`code`) as code
+                    ,       COUNT(`uid`) as n
+                    FROM `participant_data`
+                    WHERE `key` = 'progress'
+                      AND `testing` = 0
+                      AND ({conditions})
+                    GROUP BY `project_cohort_id`, IFNULL(`survey_id`, ''),
+                             `value`, DATE(`modified`)
+                """.format(
+                    conditions='\n OR '.join([condition] * len(batch)),
+                )
+                params = tuple(v for pc_id, survey_id, d in batch
+                               for v in (pc_id, survey_id, d, d))
+                counts = klass.bucket_counts(
+                    sql.select_query(count_query, params))
+
+                # Buckets were just zeroed, so adding sets them.
+                for query, params in klass.apply_deltas_queries(counts):
+                    sql.query(query, params)
+
+                # Codes of buckets both emptied and counted.
+                codes_query = """
+                    SELECT DISTINCT `code`
+                    FROM `participation_rollup`
+                    WHERE (`project_cohort_id`, `survey_id`, `day`)
+                      IN ({groups})
+                """.format(groups=', '.join([group_interps] * len(batch)))
+                recounted.update(r['code'] for r in
+                                 sql.select_query(codes_query, group_params))
+
+        recounted.update(pc_id for pc_id, survey_id, d in groups)
+        recounted.update(survey_id for pc_id, survey_id, d in groups)
+        return recounted
+
+    @classmethod
+    def apply_deltas_queries(klass, deltas):
+        """SQL to add counts to buckets, one per WRITE_BATCH_SIZE buckets.
+
+        Args:
+            deltas: dict of int changes keyed by bucket(). A day of None
+                means the current date according to the database, see
+                recount().
+
+        Returns: list of (query, params) tuples.
+        """
+        rows = [b + (n,) for b, n in deltas.items() if n != 0]
+
+        fields = klass.key_fields + klass.copied_fields + ('n',)
+        interps = ['%s'] * len(fields)
+        interps[fields.index('day')] = 'IFNULL(%s, CURRENT_DATE())'
+        row_interps = '({})'.format(','.join(interps))
+
+        queries = []
+        for i in range(0, len(rows), WRITE_BATCH_SIZE):
+            batch = rows[i:i + WRITE_BATCH_SIZE]
+            query = """
+                INSERT INTO `participation_rollup` ({fields})
+                VALUES {rows}
+                ON DUPLICATE KEY UPDATE
+                `n` = `n` + VALUES(`n`)
+            """.format(
+                fields=', '.join('`{}`'.format(f) for f in fields),
+                rows=',\n'.join([row_interps] * len(batch)),
+            )
+            queries.append((query, tuple(v for row in batch for v in row)))
+        return queries
+
+    @classmethod
+    def full_days(klass, start, end):
+        """Split a datetime range into whole days and partial edges.
+
+        Returns: tuple of (days, edges). Days is a tuple (first_day, end_day)
+            where days in [first_day, end_day) lie entirely within
+            [start, end), either of which may be None if the range is
+            unbounded on that side, or days is None if the range doesn't
+            contain a whole day. Edges is a list of (start, end) datetime
+            tuples covering the remainder.
+        """
+        midnight = datetime.time()
+        # Dates are allowed, meaning midnight.
+        start, end = [
+            datetime.datetime.combine(d, midnight)
+            if d and not isinstance(d, datetime.datetime) else d
+            for d in (start, end)
+        ]
+
+        first_day = None
+        end_day = None
+        edges = []
+
+        if start:
+            first_day = start.date()
+            if start.time() != midnight:
+                first_day += datetime.timedelta(days=1)
+        if end:
+            end_day = end.date()
+
+        if first_day and end_day and first_day >= end_day:
+            return (None, [(start, end)])
+
+        if start and start.time() != midnight:
+            edges.append(
+                (start, datetime.datetime.combine(first_day, midnight)))
+        if end and end.time() != midnight:
+            edges.append((datetime.datetime.combine(end_day, midnight), end))
+
+        return ((first_day, end_day), edges)
+
+    @classmethod
+    def participation(klass, scope_key, scope_value, cohort_label=None,
+                      first_day=None, end_day=None):
+        """Sum buckets for one scope, see ParticipantData.participation().
+
+        Returns: list of dicts with 'value', 'survey_ordinal', and 'n'.
+        """
+        query, params = klass.participation_query(
+            scope_key, scope_value, cohort_label, first_day, end_day)
+        with mysql_pool.connect() as sql:
+            result = sql.select_query(query, params)
+        return klass.int_counts(result)
+
+    @classmethod
+    def participation_query(klass, scope_key, scope_value, cohort_label=None,
+                            first_day=None, end_day=None):
+        """SQL and params for participation(), e.g. for mysql_pool.batch().
+        Pass the results through int_counts()."""
+        if cohort_label and scope_key != 'program_label':
+            raise Exception("Cannot specify a cohort without a program.")
+
+        params = [scope_value]
+        if cohort_label:
+            params.append(cohort_label)
+        params += [d.strftime(config.iso_date_format)
+                   for d in (first_day, end_day) if d]
+
+        query = """
+            SELECT  `value`
+            ,       `survey_ordinal`
+            ,       SUM(`n`) as n
+            FROM `participation_rollup`
+            WHERE `{scope_key}` = %s
+              {cohort}
+              {start}
+              {end}
+            GROUP BY `survey_ordinal`, `value`
+            HAVING SUM(`n`) > 0
+            ORDER BY `survey_ordinal`, `value` * 1
+        """.format(
+            scope_key=scope_key,
+            cohort='AND `cohort_label` = %s' if cohort_label else '',
+            start='AND `day` >= %s' if first_day else '',
+            end='AND `day` < %s' if end_day else '',
+        )
+        return (query, tuple(params))
+
+    @classmethod
+    def participation_by_project_cohort(klass, ids_or_codes, using_codes=False,
+                                        first_day=None, end_day=None):
+        """Sum buckets for many project cohorts at once.
+
+        Returns: list of dicts with 'project_cohort_id', 'code', 'value',
+            'survey_ordinal', and 'n'.
+        """
+        if len(ids_or_codes) == 0:
+            return []
+
+        query, params = klass.participation_by_project_cohort_query(
+            ids_or_codes, using_codes, first_day, end_day)
+        with mysql_pool.connect() as sql:
+            result = sql.select_query(query, params)
+        return klass.int_counts(result)
+
+    @classmethod
+    def participation_by_project_cohort_query(
+            klass, ids_or_codes, using_codes=False, first_day=None,
+            end_day=None):
+        """SQL and params for participation_by_project_cohort(). Pass the
+        results through int_counts()."""
+        params = list(ids_or_codes)
+        params += [d.strftime(config.iso_date_format)
+                   for d in (first_day, end_day) if d]
+
+        query = """
+            SELECT  `project_cohort_id`
+            ,       MAX(`code`) as code
+            ,       `value`
+            ,       `survey_ordinal`
+            ,       SUM(`n`) as n
+            FROM `participation_rollup`
+            WHERE `{match_field}` IN({interps})
+              {start}
+              {end}
+            GROUP BY `project_cohort_id`, `survey_ordinal`, `value`
+            HAVING SUM(`n`) > 0
+            ORDER BY `project_cohort_id`, `survey_ordinal`, `value` * 1
+        """.format(
+            match_field='code' if using_codes else 'project_cohort_id',
+            interps=','.join(['%s'] * len(ids_or_codes)),
+            start='AND `day` >= %s' if first_day else '',
+            end='AND `day` < %s' if end_day else '',
+        )
+        return (query, tuple(params))
+
+    @classmethod
+    def int_counts(klass, rows):
+        # SUM() comes back as a Decimal, want integers like COUNT().
+        for row in rows:
+            row['n'] = int(row['n'])
+        return rows
+
+    @classmethod
+    def project_cohort_ids_after(klass, cursor=None, n=100):
+        """Page through project cohorts having progress, in id order.
+
+        Args:
+            cursor: str, optional, the last project cohort id of the previous
+                page.
+            n: int, page size.
+
+        Returns: list of project cohort ids.
+        """
+        query = """
+            SELECT DISTINCT `project_cohort_id`
+            FROM `participant_data`
+            WHERE `project_cohort_id` > %s
+            ORDER BY `project_cohort_id`
+            LIMIT {n}
+        """.format(n=int(n))
+
+        with mysql_pool.connect() as sql:
+            rows = sql.select_query(query, (cursor or '',))
+        return [r['project_cohort_id'] for r in rows]
+
+    @classmethod
+    def counts_from_raw(klass, project_cohort_ids):
+        """What the buckets of these project cohorts should contain.
+
+        Returns: dict of int counts keyed by bucket().
+        """
+        query, params = klass.counts_from_raw_query(project_cohort_ids)
+        with mysql_pool.connect() as sql:
+            rows = sql.select_query(query, params)
+        return klass.bucket_counts(rows)
+
+    @classmethod
+    def counts_from_raw_query(klass, project_cohort_ids):
+        """SQL and params for counts_from_raw(). Pass the results through
+        bucket_counts()."""
+        query = """
+            SELECT  `project_cohort_id`
+            ,       `survey_id`
+            ,       `value`
+            ,       DATE(`modified`) as day
+            ,       MAX(`survey_ordinal`) as survey_ordinal
+            ,       MAX(`program_label`) as program_label
+            ,       MAX(`cohort_label`) as cohort_label
+            ,       MAX(`code`) as code
+            ,       COUNT(`uid`) as n
+            FROM `participant_data`
+            WHERE `key` = 'progress'
+              AND `testing` = 0
+              AND `project_cohort_id` IN({interps})
+            GROUP BY `project_cohort_id`, `survey_id`, `value`, day
+        """.format(interps=','.join(['%s'] * len(project_cohort_ids)))
+        return (query, tuple(project_cohort_ids))
+
+    @classmethod
+    def bucket_counts(klass, rows):
+        """Returns: dict of int counts keyed by bucket()."""
+        return {klass.bucket(r, r['day']): int(r['n']) for r in rows}
+
+    @classmethod
+    def counts_from_rollup(klass, project_cohort_ids):
+        """What the buckets of these project cohorts do contain.
+
+        Returns: dict of int counts keyed by bucket().
+        """
+        query = """
+            SELECT *
+            FROM `participation_rollup`
+            WHERE `n` != 0
+              AND `project_cohort_id` IN({interps})
+        """.format(interps=','.join(['%s'] * len(project_cohort_ids)))
+
+        with mysql_pool.connect() as sql:
+            rows = sql.select_query(query, tuple(project_cohort_ids))
+        return klass.bucket_counts(rows)
+
+    @classmethod
+    def check(klass, project_cohort_ids):
+        """Compare buckets to the raw participant data.
+
+        Returns: list of ids of project cohorts whose buckets are wrong.
+        """
+        if not project_cohort_ids:
+            return []
+
+        # Only the bucket identity matters, not copied columns.
+        raw = collections.Counter()
+        for bucket, n in klass.counts_from_raw(project_cohort_ids).items():
+            raw[bucket[:len(klass.key_fields)]] += n
+        rollup = collections.Counter()
+        for bucket, n in klass.counts_from_rollup(project_cohort_ids).items():
+            rollup[bucket[:len(klass.key_fields)]] += n
+
+        inconsistent = set()
+        for bucket in set(raw.keys()) | set(rollup.keys()):
+            if raw.get(bucket, 0) != rollup.get(bucket, 0):
+                inconsistent.add(bucket[0])
+
+        for pc_id in sorted(inconsistent):
+            logging.warning(u"Participation rollup inconsistent for {}"
+                            .format(pc_id))
+        return sorted(inconsistent)
+
+    @classmethod
+    def rebuild(klass, project_cohort_ids):
+        """Recompute the buckets of these project cohorts from raw data."""
+        if not project_cohort_ids:
+            return
+
+        # One transaction, so readers never see the buckets emptied. Every
+        # statement uses the same connection, see mysql_pool.transaction().
+        with mysql_pool.transaction() as sql:
+            query, params = klass.counts_from_raw_query(project_cohort_ids)
+            counts = klass.bucket_counts(sql.select_query(query, params))
+            sql.query(
+                """
+                    DELETE FROM `participation_rollup`
+                    WHERE `project_cohort_id` IN({interps})
+                """.format(
+                    interps=','.join(['%s'] * len(project_cohort_ids))),
+                tuple(project_cohort_ids),
+            )
+            for query, params in klass.apply_deltas_queries(counts):
+                sql.query(query, params)
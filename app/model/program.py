@@ -11,17 +11,111 @@ import os
 import pkgutil
 import programs
 import re
+import threading
 
 import programs
+import organization_tasks
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("Compiled program configs are read-only.")
+
+
+class ReadOnlyDict(dict):
+    """A dictionary that can't be changed after it's created.
+
+    Copies, e.g. with dict(), copy.deepcopy(), or pickle, are plain dicts.
+    """
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class ReadOnlyList(list):
+    """A list that can't be changed after it's created.
+
+    Copies, e.g. with list(), copy.deepcopy(), or pickle, are plain lists.
+    """
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze(value):
+    """Read-only copy of a config, all the way down."""
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ReadOnlyList(freeze(v) for v in value)
+    return value
+
+
+def program_tasklists(config):
+    """Tasklist templates of a program, with the kind of their parent."""
+    tasklists = [('Project', config.get('project_tasklist_template', []))]
+    tasklists += [('Survey', s.get('survey_tasklist_template', []))
+                  for s in config.get('surveys', [])]
+    return tasklists
+
+
+def compile_templates(program_label, tasklists):
+    """Index task and checkpoint templates by label.
+
+    Args:
+        program_label: str, or None for organization templates.
+        tasklists: list of tuples (parent_kind, tasklist template), see
+            program_tasklists().
+
+    Returns: tuple of dicts (tasks, checkpoints) keyed by
+        (program_label, parent_kind, label). Project and survey templates may
+        share labels without shadowing each other. If a label repeats within
+        a parent kind, the first wins, as it would when searching the
+        templates in order.
+    """
+    tasks = {}
+    checkpoints = {}
+    for parent_kind, tasklist in tasklists:
+        for checkpoint in tasklist:
+            if 'label' in checkpoint:
+                checkpoints.setdefault(
+                    (program_label, parent_kind, checkpoint['label']),
+                    checkpoint,
+                )
+            for task in checkpoint.get('tasks', []):
+                tasks.setdefault((program_label, parent_kind, task['label']),
+                                 task)
+    return tasks, checkpoints
 
 
 class Program():
 
     mocks = {}
 
+    # Compiled program configs and indexes of their templates, built once
+    # per process, see compiled().
+    _registry = None
+    _registry_lock = threading.Lock()
+
+    # Organization templates don't belong to any program. They're indexed
+    # with a program label of None.
+    _org_source = None
+    _org_indexes = None
+
+    # Indexes for programs with mocks, which are built as needed and are
+    # discarded whenever mocks change.
+    _mock_indexes = {}
+
     @classmethod
     def reset_mocks(klass):
         klass.mocks = {}
+        klass._mock_indexes = {}
 
     @classmethod
     def mock_program_config(klass, label, partial_config):
@@ -29,29 +123,121 @@ class Program():
         if 'label' not in partial_config:
             partial_config['label'] = label
         klass.mocks[label] = partial_config
+        klass._mock_indexes = {}
+
+    @classmethod
+    def compiled(klass):
+        """The process-wide registry of program configs.
+
+        Returns: dict with 'configs' keyed by program label, and 'tasks' and
+            'checkpoints' keyed by (program_label, parent_kind, label). All
+            of it is read-only.
+        """
+        if klass._registry is None:
+            with klass._registry_lock:
+                if klass._registry is None:
+                    klass._registry = klass.compile_registry()
+        return klass._registry
+
+    @classmethod
+    def compile_registry(klass):
+        configs = {}
+        tasks = {}
+        checkpoints = {}
+
+        for _, label, _ in pkgutil.iter_modules(programs.__path__):
+            config = freeze(
+                getattr(import_module('programs.' + label), 'config'))
+            configs[label] = config
+            program_tasks, program_checkpoints = compile_templates(
+                label, program_tasklists(config))
+            tasks.update(program_tasks)
+            checkpoints.update(program_checkpoints)
+
+        return ReadOnlyDict(
+            configs=ReadOnlyDict(configs),
+            tasks=ReadOnlyDict(tasks),
+            checkpoints=ReadOnlyDict(checkpoints),
+        )
+
+    @classmethod
+    def compiled_organization_templates(klass):
+        """Indexes of organization_tasks, which don't belong to any program.
+
+        Rebuilt if the template is replaced, as unit tests do.
+        """
+        template = organization_tasks.tasklist_template
+        if klass._org_source is not template:
+            tasks, checkpoints = compile_templates(
+                None, [('Organization', template)])
+            klass._org_indexes = {'tasks': tasks, 'checkpoints': checkpoints}
+            klass._org_source = template
+        return klass._org_indexes
 
     @classmethod
     def get_config(klass, label):
-        """Returns parsed JSON definition. Raises exception if not found."""
-        try:
-            config = getattr(import_module('programs.' + label), 'config')
-        except ImportError as e:
+        """Returns parsed JSON definition. Raises exception if not found.
+
+        Configs are shared by the whole process, so they're read-only. Copy
+        them to make changes, e.g. dict(config, name="Foo").
+        """
+        config = klass.compiled()['configs'].get(label, None)
+        if config is None:
             # Allow unknown programs to be mocked.
             if label in klass.mocks:
                 return klass.mocks[label]
             else:
-                raise e
+                raise ImportError("No program config: {}".format(label))
 
         # Allow known programs to be modified via mocks.
         # Copy the dict before mixing in the mocks so we don't change the
         # true config. This applies in unit testing where we don't want mocks
         # to persist from test to test.
-        config = config.copy()
         if label in klass.mocks:
+            config = config.copy()
             config.update(klass.mocks[label])
 
         return config
 
+    @classmethod
+    def get_template(klass, kind, program_label, parent_kind, label):
+        """Look up a task or checkpoint template by label.
+
+        Args:
+            kind: str, either 'tasks' or 'checkpoints'.
+            program_label: str, or None for organization templates.
+            parent_kind: str, 'Organization', 'Project', or 'Survey', which
+                tasklist template to look in.
+            label: str, the task or checkpoint label.
+
+        Returns: dict or None if not found.
+        """
+        if program_label is None:
+            index = klass.compiled_organization_templates()[kind]
+        elif program_label in klass.mocks:
+            if program_label not in klass._mock_indexes:
+                tasks, checkpoints = compile_templates(
+                    program_label,
+                    program_tasklists(klass.get_config(program_label)),
+                )
+                klass._mock_indexes[program_label] = {
+                    'tasks': tasks,
+                    'checkpoints': checkpoints,
+                }
+            index = klass._mock_indexes[program_label][kind]
+        else:
+            index = klass.compiled()[kind]
+        return index.get((program_label, parent_kind, label), None)
+
+    @classmethod
+    def get_task_template(klass, program_label, parent_kind, label):
+        return klass.get_template('tasks', program_label, parent_kind, label)
+
+    @classmethod
+    def get_checkpoint_template(klass, program_label, parent_kind, label):
+        return klass.get_template('checkpoints', program_label, parent_kind,
+                                  label)
+
     @classmethod
     def get_all_configs(klass):
         # http://stackoverflow.com/questions/487971/is-there-a-standard-way-to-list-names-of-python-modules-in-a-package
@@ -1,13 +1,11 @@
 """Project: A team from some organization participating in a program."""
 
 from collections import OrderedDict
-from google.appengine.api import memcache, taskqueue
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
-import json
 import logging
 
 from gae_models import DatastoreModel, CachedPropertiesModel
-import config
 import model
 import util
 
@@ -72,29 +70,17 @@ class Project(DatastoreModel, CachedPropertiesModel):
         # This relationship is "down" so there may be many keys to clear so
         # don't try to actually refresh the cached values, just set up a cache
         # miss for their next read and they'll recover.
-        to_delete = []
-
-        for pc in model.ProjectCohort.get(n=float('inf'), project_id=self.uid):
-            # These keys are for individual project cohort entities.
-            to_delete.append(util.cached_properties_key(pc.uid))
-            # These are for caches of whole query results.
-            kwargs = {'program_label': pc.program_label,
-                      'cohort_label': pc.cohort_label}
-            to_delete.append(util.cached_query_key('SuperDashboard', **kwargs))
-            taskqueue.add(
-                url='/task/cache_dashboard',
-                headers={'Content-Type': 'application/json; charset=utf-8'},
-                payload=json.dumps(kwargs),
-                countdown=config.task_consistency_countdown,
-            )
-        # Also clear the dashboard's organization query.
-        to_delete.append(
-            util.cached_query_key('SuperDashboard',
-                                  organization_id=self.organization_id)
-        )
+        pcs = list(
+            model.ProjectCohort.get(n=float('inf'), project_id=self.uid))
+        # These keys are for individual project cohort entities.
+        to_delete = [util.cached_properties_key(pc.uid) for pc in pcs]
 
         memcache.delete_multi(to_delete)
 
+        # Project cohorts of a project are all in its organization.
+        if pcs:
+            model.DashboardRow.queue_refresh([self.organization_id])
+
     def tasklist_name(self):
         program_config = model.Program.get_config(self.program_label)
         org = DatastoreModel.get_by_id(self.organization_id)
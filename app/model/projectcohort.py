@@ -4,17 +4,21 @@ I.e. One organization participating in one program for a specific period of
 time.
 """
 
-from google.appengine.api import memcache, taskqueue
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from webapp2_extras.appengine.auth.models import Unique
+import collections
 import json
 import logging
+import threading
+import time
 
 import model
 
 from gae_models import DatastoreModel, CachedPropertiesModel
 import code_phrase
 import config
+import datastore_helper
 import util
 
 
@@ -26,6 +30,46 @@ c_fields = ('parent_kind', 'status', 'survey_id', 'uid')
 # for looking up its name from the program.
 s_fields = ('ordinal', 'program_label', 'status', 'uid')
 
+# Memcache keys of the participation code index, see ProjectCohort.get_by_code.
+CODE_INDEX_PREFIX = 'project_cohort_code:'
+
+
+class CodeIndex(object):
+    """In-process LRU of participation code -> project cohort uid, with
+    entries expiring after a while so other instances' changes show up."""
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = collections.OrderedDict()  # code: (uid, expires)
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        with self._lock:
+            entry = self._entries.pop(code, None)
+            if entry is None or entry[1] < time.time():
+                return None
+            self._entries[code] = entry  # now most recently used
+            return entry[0]
+
+    def set(self, code, uid):
+        with self._lock:
+            self._entries.pop(code, None)
+            self._entries[code] = (uid, time.time() + self.ttl_seconds)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, code):
+        with self._lock:
+            self._entries.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_code_index = CodeIndex(config.code_index_local_size,
+                        config.code_index_local_seconds)
+
 
 class ProjectCohort(DatastoreModel, CachedPropertiesModel):
     project_id = ndb.StringProperty()
@@ -69,6 +113,10 @@ class ProjectCohort(DatastoreModel, CachedPropertiesModel):
 
     json_props = ['survey_params_json', 'data_export_survey_json']
 
+    # True while provisioning.commit() writes this project cohort; it
+    # refreshes dashboard rows once for everything it writes.
+    provisioned = False
+
     @property
     def survey_params(self):
         return (json.loads(self.survey_params_json)
@@ -105,8 +153,14 @@ class ProjectCohort(DatastoreModel, CachedPropertiesModel):
         # duplicates, with retries if necessary.
 
         code = kwargs.pop('code', None)
-        if code is None:
-            # No code specified. Generate a unique one.
+        pooled_code = None
+        if code is None and config.code_pool_enabled:
+            # Already reserved; see model/codepool.py.
+            pooled_code = model.PooledCode.allocate()
+        if pooled_code is not None:
+            code = pooled_code
+        elif code is None:
+            # No code specified, and the pool is empty. Generate a unique one.
             # Rather than a while, raise an exception after too many tries.
             for num_tries in range(10):
                 code = code_phrase.generate()  # default n=2
@@ -131,110 +185,221 @@ class ProjectCohort(DatastoreModel, CachedPropertiesModel):
                 kwargs['portal_message'] = conf.get('default_portal_message',
                                                     None)
 
+        # The code is reserved, so nothing else can claim it, but it's only
+        # indexed once the project cohort is written, see after_put().
         return super(klass, klass).create(code=code, **kwargs)
 
     @classmethod
     def uniqueness_key(klass, code):
         return u'ProjectCohort.code:{}'.format(code)
 
+    @classmethod
+    def index_code(klass, code, uid):
+        _code_index.set(code, uid)
+        memcache.set(CODE_INDEX_PREFIX + code, uid,
+                     time=config.code_index_memcache_seconds)
+
+    @classmethod
+    def index_codes(klass, project_cohorts):
+        """Like index_code(), for many project cohorts at once."""
+        uids = {pc.code: pc.uid for pc in project_cohorts}
+        for code, uid in uids.items():
+            _code_index.set(code, uid)
+        memcache.set_multi(uids, key_prefix=CODE_INDEX_PREFIX,
+                           time=config.code_index_memcache_seconds)
+
+    @classmethod
+    def unindex_code(klass, code):
+        _code_index.delete(code)
+        memcache.delete(CODE_INDEX_PREFIX + code)
+
+    @classmethod
+    def uids_for_codes(klass, codes):
+        """Look up project cohort uids by participation code, first in this
+        instance's index, then in memcache, then with a query.
+
+        Uids may belong to project cohorts deleted in the last
+        config.code_index_local_seconds; use get_by_code() to be sure.
+
+        Returns: dict of code: uid, without codes not found.
+        """
+        codes = list(set(codes))
+        uids = {}
+        for code in codes:
+            uid = _code_index.get(code)
+            if uid is not None:
+                uids[code] = uid
+
+        missing = [c for c in codes if c not in uids]
+        if missing:
+            cached = memcache.get_multi(missing, key_prefix=CODE_INDEX_PREFIX)
+            for code, uid in cached.items():
+                _code_index.set(code, uid)
+            uids.update(cached)
+
+        missing = [c for c in codes if c not in uids]
+        found = {}
+        for chunk in datastore_helper.chunks(missing):
+            for pc in klass.get(code=chunk):
+                if pc.code in found:
+                    logging.error("Participation code duplication! {}"
+                                  .format(pc.code))
+                    continue
+                found[pc.code] = pc.uid
+        if found:
+            for code, uid in found.items():
+                _code_index.set(code, uid)
+            memcache.set_multi(found, key_prefix=CODE_INDEX_PREFIX,
+                               time=config.code_index_memcache_seconds)
+            uids.update(found)
+
+        return uids
+
+    @classmethod
+    def get_by_code(klass, code):
+        """The project cohort with this participation code, or None.
+
+        Resolves the code through the code index, so a whole school entering
+        the same code costs one entity get each rather than one query.
+        """
+        def lookup():
+            uid = klass.uids_for_codes([code]).get(code, None)
+            pc = klass.get_by_id(uid) if uid else None
+            return uid, pc
+
+        uid, pc = lookup()
+        if uid and (pc is None or pc.deleted or pc.code != code):
+            # Deleted, or the code changed, since it was indexed. Ask the
+            # Datastore directly.
+            klass.unindex_code(code)
+            uid, pc = lookup()
+        return pc if pc and not pc.deleted else None
+
     @classmethod
     def batch_cached_properties_from_db(
         klass,
-        ids=[],
-        project_cohorts=[],
-        checkpoints=[],
-        organizations=[],
-        projects=[],
-        surveys=[],
+        ids=None,
+        project_cohorts=None,
+        checkpoints=None,
+        organizations=None,
+        projects=None,
+        surveys=None,
     ):
+        """Cached properties of many project cohorts at once.
+
+        Any of checkpoints, organizations, projects, or surveys may be passed
+        in to save looking them up. Only None means "look them up"; an empty
+        list means there are none.
+        """
         if not ids and not project_cohorts:
             return {}
 
-        if not project_cohorts:
+        if project_cohorts is None:
             project_cohorts = klass.get_by_id(ids)
 
-        to_get = []
-
-        if not checkpoints:
-            # This seems hard right now.
-            pass
-
-        if not organizations:
-            util.profiler.add_event("getting orgs by id")
-            to_get += [pc.organization_id for pc in project_cohorts]
-
-        if not projects:
-            util.profiler.add_event("getting projects by id")
-            to_get += [pc.project_id for pc in project_cohorts]
-
-        if not surveys:
-            util.profiler.add_event("querying surveys")
-            to_get += [uid for pc in project_cohorts for uid in pc.survey_ids]
-
+        if checkpoints is None:
+            util.profiler.add_event("querying checkpoints")
+            checkpoints_by_pc = model.Checkpoint.for_tasklists(
+                project_cohorts, fields=c_fields)
+        else:
+            # Checkpoints passed in may belong to any of the project cohorts.
+            # Sort them out the same way for_tasklists() does, by parent.
+            # Survey checkpoints are grouped by their project cohort.
+            by_parent = collections.defaultdict(list)
+            for c in checkpoints:
+                if c.parent_kind == 'Survey':
+                    by_parent[c.project_cohort_id].append(c)
+                else:
+                    by_parent[c.parent_id].append(c)
+            checkpoints_by_pc = {
+                pc.uid: (by_parent[pc.organization_id] +
+                         by_parent[pc.project_id] +
+                         by_parent[pc.uid])
+                for pc in project_cohorts
+            }
+
+        # Everything else is one get_multi, with shared orgs and projects
+        # fetched once.
+        to_get = set()
+        if organizations is None:
+            to_get.update(pc.organization_id for pc in project_cohorts)
+        if projects is None:
+            to_get.update(pc.project_id for pc in project_cohorts)
+        if surveys is None:
+            to_get.update(uid for pc in project_cohorts for uid in pc.survey_ids)
+        to_get.discard(None)
+
+        by_kind = collections.defaultdict(list)
         if to_get:
-            entities = DatastoreModel.get_by_id(to_get)
-            checkpoints = []
-            organizations = []
-            projects = []
-            surveys = []
-            for e in entities:
-                if DatastoreModel.get_kind(e) == 'Checkpoint':
-                    checkpoints.append(e)
-                elif DatastoreModel.get_kind(e) == 'Organization':
-                    organizations.append(e)
-                elif DatastoreModel.get_kind(e) == 'Project':
-                    projects.append(e)
-                elif DatastoreModel.get_kind(e) == 'Survey':
-                    surveys.append(e)
+            util.profiler.add_event("getting orgs, projects, and surveys")
+            for e in DatastoreModel.get_by_id(list(to_get)):
+                if e:
+                    by_kind[DatastoreModel.get_kind(e)].append(e)
+
+        if surveys is None:
+            # Older project cohorts don't list their survey ids. Query for
+            # their surveys like get_cached_properties_from_db() does, a
+            # chunk of project cohorts at a time.
+            unlisted = [pc.uid for pc in project_cohorts if not pc.survey_ids]
+            for chunk in datastore_helper.chunks(unlisted):
+                util.profiler.add_event("querying unlisted surveys")
+                by_kind['Survey'] += model.Survey.get(
+                    project_cohort_id=chunk,
+                    n=float('inf'),
+                )
+
+        if organizations is None:
+            organizations = by_kind['Organization']
+        if projects is None:
+            projects = by_kind['Project']
+        if surveys is None:
+            surveys = by_kind['Survey']
 
         orgs_by_id = {o.uid: o for o in organizations}
         projects_by_id = {p.uid: p for p in projects}
+        surveys_by_pc = collections.defaultdict(list)
+        for s in surveys:
+            surveys_by_pc[s.project_cohort_id].append(s)
 
         props_by_id = {}
         for pc in project_cohorts:
-            pc_surveys = [s for s in surveys if s.project_cohort_id == pc.uid]
             props_by_id[pc.uid] = pc.get_cached_properties_from_db(
-                checkpoints=checkpoints,
-                organization=orgs_by_id[pc.organization_id],
-                project=projects_by_id[pc.project_id],
-                surveys=sorted(pc_surveys, key=lambda s: s.ordinal)
+                checkpoints=checkpoints_by_pc[pc.uid],
+                organization=orgs_by_id.get(pc.organization_id, None),
+                project=projects_by_id.get(pc.project_id, None),
+                surveys=sorted(surveys_by_pc[pc.uid], key=lambda s: s.ordinal),
             )
 
         return props_by_id
 
-    def get_cached_properties_from_db(self, checkpoints=[], organization=None,
-                                      project=None, surveys=[]):
+    def get_cached_properties_from_db(self, checkpoints=None,
+                                      organization=None, project=None,
+                                      surveys=None):
         """Doesn't use memcache; see get_ and update_cached_properties."""
         # Either use the data passed in (if part of a batch) or query for it.
+        # An empty list passed in means there are none, not that they should
+        # be queried.
         return {
-            'checkpoints': (checkpoints if checkpoints else
+            'checkpoints': (checkpoints if checkpoints is not None else
                             model.Checkpoint.for_tasklist(self, fields=c_fields)),
             'organization': (organization if organization else
                              model.Organization.get_by_id(self.organization_id)),
             'project': (project if project else
                         model.Project.get_by_id(self.project_id)),
-            'surveys': (surveys if surveys else
+            'surveys': (surveys if surveys is not None else
                         model.Survey.get(project_cohort_id=self.uid,
                                          order='ordinal', projection=s_fields)),
         }
 
     def after_put(self, *args, **kwargs):
-        """Clear any cached queries related to this."""
-        kwargs = {'program_label': self.program_label,
-                  'cohort_label': self.cohort_label}
-        to_delete = [
-            util.cached_query_key('SuperDashboard',
-                                  organization_id=self.organization_id),
-            util.cached_query_key('SuperDashboard', **kwargs),
-        ]
-        taskqueue.add(
-            url='/task/cache_dashboard',
-            headers={'Content-Type': 'application/json; charset=utf-8'},
-            payload=json.dumps(kwargs),
-            countdown=config.task_consistency_countdown,
-        )
-
-        memcache.delete_multi(to_delete)
+        """Index the code and refresh this project cohort's row in the super
+        dashboard."""
+        if self.provisioned:
+            return
+        # Refresh rather than drop the entry, so the next lookup doesn't have
+        # to wait for the query to be consistent.
+        self.index_code(self.code, self.uid)
+        model.DashboardRow.queue_refresh([self.organization_id])
 
     def tasklist_name(self):
         program_config = model.Program.get_config(self.program_label)
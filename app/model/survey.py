@@ -26,6 +26,11 @@ class Survey(DatastoreModel):
     # databases.
     tasklist = None
 
+    # True while provisioning.commit() writes this survey along with its
+    # tasklist and project cohort, and takes care of the side effects of
+    # after_put() once for everything it writes.
+    provisioned = False
+
     @classmethod
     def create(klass, tasklist_template, **kwargs):
         """Create task list as well."""
@@ -67,6 +72,9 @@ class Survey(DatastoreModel):
         return self.config()['name']
 
     def after_put(self, *args, **kwargs):
+        if self.provisioned:
+            return
+
         if self.tasklist:
             # Tasklist might not always be present; it is if created via
             # create(), but not if fetched from the datastore.
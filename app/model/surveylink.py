@@ -1,20 +1,72 @@
-"""SurveyLink: A URL to a survey that is unique to a participant."""
+"""SurveyLink: A URL to a survey that is unique to a participant.
+
+Allocation
+----------
+
+Whole classrooms request links at the same moment, so links are a
+LeasedPool, see model/leasedpool.py. Links imported before sharding are
+given a shard by /task/backfill_survey_link_shards. Until then they're found
+by an unsharded query from a random offset.
+
+Links in a reservoir have already been deleted from the Datastore, so if an
+instance shuts down they're never issued. That's fine; we import far more
+links than we use.
+
+Import
+------
+
+Qualtrics exports can run to 100k rows. Each file in cloud storage is split
+into byte ranges of about IMPORT_SHARD_BYTES, each imported by its own task
+(see ImportLinks in task_handlers.py):
+
+* A range owns the rows that start within it. It skips the partial row at its
+  start and reads past its end to finish its last row. Link exports have no
+  line breaks within fields, so rows are lines.
+* Rows are read while the previous batch is written with put_multi_async().
+  Batches grow while writes are quick and shrink if they're slow or time out.
+* After each batch is written, the offset reached is saved in a
+  SurveyLinkImport entity, so a retried task picks up where it left off
+  rather than starting over. Re-importing a link is harmless, see
+  test_duplicate_links_overwrite.
+"""
 
 from google.appengine.api import app_identity
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
+import collections
 import csv
-import logging
+import random
+import time
 
-from .program import Program
+from .leasedpool import LeasedPool
 import cloudstorage as gcs
 
 
-class SurveyLink(ndb.Model):
+# Approximate size of the byte range imported by each task.
+IMPORT_SHARD_BYTES = 2 * 1024 * 1024
+
+# Rows per write when an import starts, and the limits it adapts within.
+IMPORT_BATCH_SIZE = 500
+MIN_IMPORT_BATCH_SIZE = 100
+MAX_IMPORT_BATCH_SIZE = 2000
+
+# Batches grow if written faster than this, and shrink if slower.
+IMPORT_BATCH_SECONDS = 1.0
+
+
+class SurveyLink(LeasedPool, ndb.Model):
     # The key name / entity id _is_ the url. We assume that Qualtrics "unique
     # links" are globally unique.
     program_label = ndb.StringProperty()
     survey_ordinal = ndb.IntegerProperty()
     url = ndb.ComputedProperty(lambda self: self.key.id())
+    # Random bucket, see LeasedPool. Links imported before sharding don't
+    # have one until backfill_shards().
+    shard = ndb.IntegerProperty()
+
+    # Counts of lease attempts, collisions with other callers, and failures,
+    # for monitoring and benchmarks.
+    lease_stats = collections.Counter()
 
     @classmethod
     def import_path(klass, program_label, survey_ordinal, file_name=None):
@@ -34,40 +86,169 @@ class SurveyLink(ndb.Model):
 
     @classmethod
     def import_links(klass, program_label, survey_ordinal, file_name):
-        """Generate SurveyLink entities based on a csv file in cloud storage.
+        """Generate SurveyLink entities based on a csv file in cloud storage,
+        all in this request. For large files, see import_range().
 
-        Needs to be able to work with large file sizes (100k rows).
+        Returns: int number of links imported.
         """
-        num_imported = 0
-        batch_size = 100  # to reduce RPCs
-        link_batch = []
-
         paths = klass.list_gcs_files(program_label, survey_ordinal, file_name)
-        for path in paths:
-            with gcs.open(path, 'r') as fh:
-                csv_reader = csv.DictReader(fh)
-                # `row` garbage collected with each loop.
-                for row in csv_reader:
-                    link = SurveyLink(
-                        id=row['Link'],
+        return sum(
+            klass.import_range(program_label, survey_ordinal, path)[
+                'num_imported']
+            for path in paths
+        )
+
+    @classmethod
+    def import_shards(klass, path, shard_bytes=None):
+        """Split a file into byte ranges to import in parallel.
+
+        Returns: list of (start, end) tuples, end exclusive.
+        """
+        shard_bytes = shard_bytes or IMPORT_SHARD_BYTES
+        size = gcs.stat(path).st_size
+        return [(start, min(start + shard_bytes, size))
+                for start in range(0, max(size, 1), shard_bytes)]
+
+    @classmethod
+    def import_range(klass, program_label, survey_ordinal, path, start=0,
+                     end=None):
+        """Import the rows starting within a byte range of a csv file,
+        resuming from where any earlier attempt left off.
+
+        Args:
+            program_label: str
+            survey_ordinal: int
+            path: str, of the file in cloud storage
+            start: int, byte offset
+            end: int, byte offset, exclusive, or None for the end of the file
+
+        Returns: dict of the import's progress, see SurveyLinkImport.
+        """
+        progress = SurveyLinkImport.get_or_create(
+            program_label, survey_ordinal, path, start, end)
+        if progress.complete:
+            return progress.to_client_dict()
+
+        batch_size = progress.batch_size or IMPORT_BATCH_SIZE
+        # The write in flight: (futures, links, rows read, offset after them,
+        # time started).
+        pending = None
+        # When progress was last saved.
+        clock = {'saved': time.time()}
+
+        def finish(pending, batch_size):
+            """Wait for a write, save progress, and adapt the batch size."""
+            futures, links, num_rows, offset, write_started = pending
+            try:
+                ndb.Future.wait_all(futures)
+                for f in futures:
+                    f.check_success()
+            except datastore_errors.Timeout:
+                # Try again, in smaller pieces.
+                batch_size = max(MIN_IMPORT_BATCH_SIZE, batch_size // 2)
+                for i in range(0, len(links), batch_size):
+                    ndb.put_multi(links[i:i + batch_size])
+            else:
+                seconds = time.time() - write_started
+                if seconds < IMPORT_BATCH_SECONDS / 2:
+                    batch_size = min(MAX_IMPORT_BATCH_SIZE, batch_size * 2)
+                elif seconds > IMPORT_BATCH_SECONDS:
+                    batch_size = max(MIN_IMPORT_BATCH_SIZE, batch_size // 2)
+
+            now = time.time()
+            progress.offset = offset
+            progress.num_imported += len(links)
+            progress.num_skipped += num_rows - len(links)
+            progress.num_batches += 1
+            progress.batch_size = batch_size
+            progress.seconds += now - clock['saved']
+            clock['saved'] = now
+            progress.put()
+            return batch_size
+
+        with gcs.open(path, 'r') as fh:
+            columns = next(csv.reader([fh.readline()]))
+            link_column = columns.index('Link')
+            header_end = fh.tell()
+
+            if progress.offset is not None:
+                # Resuming; this is the start of a row.
+                fh.seek(progress.offset)
+            elif start > header_end:
+                # Skip the partial row, which belongs to the previous range.
+                fh.seek(start - 1)
+                fh.readline()
+
+            lines = []
+            while True:
+                # Each row belongs to the range it starts in.
+                at_end = end is not None and fh.tell() >= end
+                line = None if at_end else fh.readline()
+                if line:
+                    lines.append(line)
+                    if len(lines) < batch_size:
+                        continue
+                elif not lines:
+                    break
+
+                links = [
+                    SurveyLink(
+                        id=row[link_column],
                         program_label=program_label,
                         survey_ordinal=survey_ordinal,
+                        shard=random.randrange(SurveyLink.num_shards),
                     )
-                    link_batch.append(link)
+                    for row in csv.reader(lines)
+                    if len(row) > link_column and row[link_column]
+                ]
 
-                    # Save the batch.
-                    if len(link_batch) == batch_size:
-                        ndb.put_multi(link_batch)
-                        num_imported += len(link_batch)
-                        # `link_batch` garbage collected every 100 loops.
-                        link_batch = []
+                # Read the next batch while this one is written.
+                if pending:
+                    batch_size = finish(pending, batch_size)
+                pending = (ndb.put_multi_async(links), links, len(lines),
+                           fh.tell(), time.time())
+                lines = []
 
-        # If there's a partially-full batch, save that too.
-        if len(link_batch) > 0:
-            ndb.put_multi(link_batch)
-            num_imported += len(link_batch)
+                if not line:
+                    break
 
-        return num_imported
+        if pending:
+            finish(pending, batch_size)
+        progress.complete = True
+        progress.put()
+        return progress.to_client_dict()
+
+    @classmethod
+    def import_report(klass, program_label, survey_ordinal):
+        """Progress of every import for a survey, by file.
+
+        Returns: list of dicts, see SurveyLinkImport.to_client_dict().
+        """
+        imports = SurveyLinkImport.query(
+            SurveyLinkImport.program_label == program_label,
+            SurveyLinkImport.survey_ordinal == survey_ordinal,
+        ).fetch()
+
+        by_file = collections.OrderedDict()
+        for i in sorted(imports, key=lambda i: (i.path, i.start)):
+            by_file.setdefault((i.path, i.etag), []).append(i)
+
+        report = []
+        for (path, etag), ranges in by_file.items():
+            num_imported = sum(r.num_imported for r in ranges)
+            seconds = sum(r.seconds for r in ranges)
+            report.append({
+                'path': path,
+                'etag': etag,
+                'shards': len(ranges),
+                'shards_complete': sum(1 for r in ranges if r.complete),
+                'num_imported': num_imported,
+                'num_skipped': sum(r.num_skipped for r in ranges),
+                # Across all tasks, as if they ran one after another.
+                'rows_per_second': (round(num_imported / seconds, 1)
+                                    if seconds else None),
+            })
+        return report
 
     @classmethod
     def get_unique(klass, program_label, survey_ordinal):
@@ -78,39 +259,93 @@ class SurveyLink(ndb.Model):
             survey_ordinal int
 
         Returns:
-            A SurveyLink entity that is guaranteed to have been just deleted,
-            or None if no SurveyLink entities could be found.
+            A SurveyLink entity that is guaranteed to have been deleted from
+            the datastore, or None if no SurveyLink entities could be found.
         """
-        real_link = None
-        tries = 0
+        return klass.pop_pooled(program_label, survey_ordinal)
 
-        while not real_link and tries < 50:
-            # Get a link with eventual consistency (b/c we don't have an id).
-            query = klass.query(SurveyLink.program_label == program_label,
-                                SurveyLink.survey_ordinal == survey_ordinal)
-            possible_link = query.get()
-            tries += 1
+    @classmethod
+    def pool_query(klass, program_label, survey_ordinal):
+        return klass.query(SurveyLink.program_label == program_label,
+                           SurveyLink.survey_ordinal == survey_ordinal)
+
+    @classmethod
+    def backfill_shards(klass, links):
+        """Give links imported before sharding a random shard.
 
-            # The link might not really exist. Check with strong consistency.
-            if possible_link:
-                real_link = possible_link.datastore_pop()  # might return None
+        Args:
+            links: list of SurveyLink entities, any of which may already have
+                a shard.
 
-        return real_link if real_link else None
+        Returns: int number of links given a shard.
+        """
+        keys = [l.key for l in links if l.shard is None]
+        num_sharded = 0
+        n = klass.lease_block_size
+        for i in range(0, len(keys), n):
+            num_sharded += klass.assign_shards(keys[i:i + n])
+        return num_sharded
 
-    @ndb.transactional
-    def datastore_pop(self):
-        """Ensure entity exists, then delete it, atomically.
+    @classmethod
+    @ndb.transactional(xg=True)
+    def assign_shards(klass, keys):
+        """In a transaction, so links leased in the meantime aren't put back.
 
-        Wrapping in a transaction means no race condition between verifying
-        that the entity does, in fact, exist, and deleting it.
+        Returns: int number of links given a shard.
         """
-        entity = self.key.get()
-        if entity:
-            self.key.delete()
-            return self
-        else:
-            return None
+        links = [l for l in ndb.get_multi(keys) if l and l.shard is None]
+        for l in links:
+            l.shard = random.randrange(klass.num_shards)
+        ndb.put_multi(links)
+        return len(links)
 
     def to_client_dict(self):
         return {'url': self.url, 'program_label': self.program_label,
                 'survey_ordinal': self.survey_ordinal}
+
+
+class SurveyLinkImport(ndb.Model):
+    """Progress importing one byte range of a csv of survey links.
+
+    Keyed by file, version (etag), and range, so a retried task finds the
+    progress of the attempt before it, while a newly uploaded file of the
+    same name starts fresh.
+    """
+    program_label = ndb.StringProperty()
+    survey_ordinal = ndb.IntegerProperty()
+    path = ndb.StringProperty()
+    etag = ndb.StringProperty()
+    start = ndb.IntegerProperty()
+    end = ndb.IntegerProperty()
+    # Byte offset of the next row to import, None before the first batch.
+    offset = ndb.IntegerProperty()
+    batch_size = ndb.IntegerProperty()
+    num_imported = ndb.IntegerProperty(default=0)
+    num_skipped = ndb.IntegerProperty(default=0)
+    num_batches = ndb.IntegerProperty(default=0)
+    seconds = ndb.FloatProperty(default=0)
+    complete = ndb.BooleanProperty(default=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    modified = ndb.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def get_or_create(klass, program_label, survey_ordinal, path, start,
+                      end):
+        etag = gcs.stat(path).etag
+        key_name = '{}:{}:{}-{}'.format(path, etag, start,
+                                        '' if end is None else end)
+        return klass.get_or_insert(
+            key_name,
+            program_label=program_label,
+            survey_ordinal=survey_ordinal,
+            path=path,
+            etag=etag,
+            start=start,
+            end=end,
+        )
+
+    def to_client_dict(self):
+        d = self.to_dict(exclude=['created', 'modified'])
+        d['rows_per_second'] = (round(self.num_imported / self.seconds, 1)
+                                if self.seconds else None)
+        return d
@@ -30,7 +30,6 @@ import logging
 
 from gae_models import DatastoreModel
 from .program import Program
-import organization_tasks
 
 
 class Task(DatastoreModel):
@@ -109,27 +108,16 @@ class Task(DatastoreModel):
     def get_task_config(self):
         parent_kind = DatastoreModel.get_kind(DatastoreModel.get_parent_uid(self.uid))
 
+        # Templates are indexed by label, see Program.compiled().
         if parent_kind == 'Organization':
-            tasklist = organization_tasks.tasklist_template
-            for checkpoint in tasklist:
-                for task in checkpoint['tasks']:
-                    if task['label'] == self.label:
-                        return task
-        elif parent_kind == 'Project':
-            program = Program.get_config(self.program_label)
-            for checkpoint in program['project_tasklist_template']:
-                for task in checkpoint['tasks']:
-                    if task['label'] == self.label:
-                        return task
-        elif parent_kind == 'Survey':
-            program = Program.get_config(self.program_label)
-            for survey in program['surveys']:
-                for checkpoint in survey['survey_tasklist_template']:
-                    for task in checkpoint['tasks']:
-                        if task['label'] == self.label:
-                            return task
-
-        return self.default_config.copy()
+            task = Program.get_task_template(None, parent_kind, self.label)
+        elif parent_kind in ('Project', 'Survey'):
+            task = Program.get_task_template(self.program_label, parent_kind,
+                                             self.label)
+        else:
+            task = None
+
+        return task if task else self.default_config.copy()
 
     def to_client_dict(self):
         """Add properties from the template."""
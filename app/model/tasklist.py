@@ -55,15 +55,14 @@ class Tasklist():
             checkpoint_kwargs['project_cohort_id'] = parent.project_cohort_id
             task_kwargs['program_label'] = parent.program_label
 
-        # Dynamically assign ordinals; easier to maintain than hardcoding them.
-        for i, checkpoint_tmpl in enumerate(tasklist_template):
-            checkpoint_tmpl['ordinal'] = i + 1
-
         # Convert templates to checkpoint dictionaries that have ids, merging
         # in all the relationship information that is the same for each.
+        # Dynamically assign ordinals; easier to maintain than hardcoding
+        # them. Templates are read-only, see Program.get_config().
         checkpoints = []
-        for checkpoint_tmpl in tasklist_template:
-            merged_params = dict(checkpoint_tmpl.copy(), **checkpoint_kwargs)
+        for i, checkpoint_tmpl in enumerate(tasklist_template):
+            merged_params = dict(checkpoint_tmpl, ordinal=i + 1,
+                                 **checkpoint_kwargs)
             checkpoints.append(Checkpoint.create(**merged_params))
 
         # Dynamically assign ordinals; easier to maintain than hardcoding them.
@@ -26,6 +26,7 @@ The owns() method in permission.py has special rules regarding this data such
 that all users, even public ones, 'own' public data.
 """
 
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from webapp2_extras.appengine.auth.models import Unique
 import json
@@ -42,6 +43,16 @@ import config
 import util
 
 
+# Uids of users in each role, for notifications, see User.get_role_members().
+# One memcache key for all roles so every user put can clear them all.
+ROLE_MEMBERS_KEY = 'user_role_members'
+# Membership changes clear the cache, this is just a backstop.
+ROLE_MEMBERS_TIMEOUT = 60 * 60
+# Role queries are eventually consistent, so for a while after a membership
+# change they may not reflect it. Don't cache their results in that time.
+ROLE_MEMBERS_SETTLE_SECONDS = 30
+
+
 class BadPassword(Exception):
     """Password doesn't match required pattern."""
     pass
@@ -197,6 +208,53 @@ class User(DatastoreModel):
                 ['user', 'program_admin', 'super_admin']),
         }
 
+    @classmethod
+    def get_super_admins(klass):
+        return klass.get_role_members('super_admin')
+
+    @classmethod
+    def get_program_owners(klass, program_label):
+        return klass.get_role_members('program:' + program_label)
+
+    @classmethod
+    def get_role_members(klass, role):
+        """All users in a role, from a cached list of uids.
+
+        Notifications to supers and program owners used to query for them
+        every time. Fetching known uids is one batch get instead.
+
+        Args:
+            role: str, either 'super_admin' or 'program:<program label>'.
+
+        Returns: list of Users.
+        """
+        client = memcache.Client()
+        cached = client.gets(ROLE_MEMBERS_KEY)
+        if cached and role in cached:
+            users = klass.get_by_id(cached[role]) if cached[role] else []
+            return [u for u in users if u and not u.deleted]
+
+        if role == 'super_admin':
+            users = klass.get(user_type='super_admin', n=float('inf'))
+        elif role.startswith('program:'):
+            users = klass.get(owned_programs=role[len('program:'):],
+                              n=float('inf'))
+        else:
+            raise Exception("Unknown role: {}".format(role))
+        users = list(users)
+
+        uids = [u.uid for u in users]
+        if cached is None:
+            # Fails while the key is locked after a membership change, see
+            # after_put().
+            client.add(ROLE_MEMBERS_KEY, {role: uids},
+                       time=ROLE_MEMBERS_TIMEOUT)
+        else:
+            # Fails if the key was cleared since it was read.
+            cached[role] = uids
+            client.cas(ROLE_MEMBERS_KEY, cached, time=ROLE_MEMBERS_TIMEOUT)
+        return users
+
     @classmethod
     def hash_password(klass, password):
         if re.match(config.password_pattern, password) is None:
@@ -215,6 +273,11 @@ class User(DatastoreModel):
         if self.user_type == 'public':
             raise Exception("Public user cannot be saved.")
 
+    def after_put(self, *args, **kwargs):
+        """Clear cached role members, since this user may have joined or
+        left a role. Blind, rather than reading the cache to check."""
+        memcache.delete(ROLE_MEMBERS_KEY, seconds=ROLE_MEMBERS_SETTLE_SECONDS)
+
     def to_client_dict(self, **kwargs):
         """Overrides DatastoreModel, modifies behavior of hashed_password.
 
@@ -0,0 +1,487 @@
+"""Pooled, reused MySQL connections.
+
+Every SQL-backed method used to open its own `with mysql_connection.connect()`
+block, so a participation or dashboard request opened and closed several
+connections in a row, paying connection setup (TCP, TLS, auth) each time.
+
+Here each instance keeps a pool of open connections, and connect() is a
+drop-in replacement for mysql_connection.connect():
+
+    with mysql_pool.connect() as sql:
+        rows = sql.select_query(query, params)
+
+* A connection is checked out when the outermost block starts, nested
+  blocks reuse it, and it goes back to the pool as soon as the outermost
+  block ends. A request only holds a connection while it's running SQL, and
+  the next block in the same request most likely gets the same one back.
+* middleware(), installed in appengine_config.py, returns anything still
+  checked out when a request is done, e.g. by an abandoned generator.
+* A connection that's been idle for a while is pinged before reuse, and one
+  that fails the ping or is too old is replaced.
+* At most config.mysql_pool_size connections are open at a time. Callers
+  wait for one to be returned, up to config.mysql_pool_wait_seconds, then
+  get PoolExhausted.
+
+Pooled connections keep the driver's default of not autocommitting. The
+outermost connect() block is a transaction: it commits when the block ends,
+or rolls back if the block raises, so multi-statement writes like
+DashboardRow.replace_organizations() are atomic. Either way a connection goes
+back to the pool without an open transaction or its snapshot.
+
+batch() sends several SELECTs, optionally after writes they depend on, to
+MySQL in one round trip over one connection.
+
+Statements sent with the yielded `sql`'s query() and select_query(), in
+batches, and commits are counted and timed by instrumentation.py.
+
+Don't use pooled connections for streaming with a server-side cursor (see
+csv_export.stream_rows()); other queries can't share the connection until
+the stream is done.
+
+Set config.mysql_pool_enabled to False to go back to a fresh connection per
+block. Nested blocks then get their own connections, so writes that must be
+atomic should share one transaction() block.
+"""
+
+import MySQLdb
+import MySQLdb.cursors
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+import config
+import instrumentation
+import mysql_connection
+
+
+# Errors that mean a connection is broken and shouldn't go back in the pool.
+CONNECTION_ERRORS = (MySQLdb.OperationalError, MySQLdb.InterfaceError)
+
+# What MySQL says to a multi-statement query when the connection doesn't
+# allow them, as well as to a genuine syntax error.
+ER_PARSE_ERROR = 1064
+
+STAT_NAMES = ('opened', 'closed', 'checkouts', 'reuses', 'waits', 'wait_ms',
+              'timeouts', 'health_checks', 'reconnects', 'batches',
+              'batched_queries')
+
+_local = threading.local()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PoolExhausted(Exception):
+    """No connection became available in time."""
+    pass
+
+
+class InstrumentedSql(object):
+    """A mysql_connection api object whose statements are counted and timed
+    by instrumentation.py. Anything else passes through."""
+    def __init__(self, sql):
+        self._sql = sql
+
+    def __getattr__(self, name):
+        return getattr(self._sql, name)
+
+    def query(self, query, *args, **kwargs):
+        with instrumentation.timed_sql(query):
+            return self._sql.query(query, *args, **kwargs)
+
+    def select_query(self, query, *args, **kwargs):
+        with instrumentation.timed_sql(query):
+            return self._sql.select_query(query, *args, **kwargs)
+
+    def commit(self):
+        with instrumentation.timed_sql("COMMIT"):
+            self._sql.connection.commit()
+
+
+class PooledConnection(object):
+    """An open mysql_connection api object and its bookkeeping."""
+    def __init__(self):
+        self.context = mysql_connection.connect()
+        self.sql = InstrumentedSql(self.context.__enter__())
+        # The driver's default, in case the connection was set up otherwise.
+        # See connect() for where transactions end.
+        self.sql.connection.autocommit(False)
+        self.created = self.last_used = time.time()
+
+    def rollback(self):
+        """Discard uncommitted writes.
+
+        Returns: bool, False if the connection is broken.
+        """
+        try:
+            self.sql.connection.rollback()
+        except CONNECTION_ERRORS:
+            logging.warning("Error rolling back pooled MySQL connection.",
+                            exc_info=True)
+            return False
+        return True
+
+    def close(self):
+        try:
+            self.context.__exit__(None, None, None)
+        except Exception:
+            logging.warning("Error closing pooled MySQL connection.",
+                            exc_info=True)
+
+
+class Pool(object):
+    """A bounded set of open connections shared by an instance's threads."""
+    def __init__(self, max_size, wait_seconds, health_check_seconds,
+                 max_age_seconds):
+        self.max_size = max_size
+        self.wait_seconds = wait_seconds
+        self.health_check_seconds = health_check_seconds
+        self.max_age_seconds = max_age_seconds
+
+        self._condition = threading.Condition()
+        self._idle = []
+        self._size = 0  # open connections, idle or checked out
+        self._stats = collections.Counter()
+        # Whether our connections run multi-statement queries, see Batch.run().
+        # All are opened the same way, so it's learned once. None if unknown.
+        self.multi_statements = None
+
+    def checkout(self):
+        """Returns: PooledConnection, open and recently known to work."""
+        conn = None
+        deadline = None
+        wait_start = None
+        with self._condition:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1  # reserve a slot, opened below
+                    break
+
+                now = time.time()
+                if deadline is None:
+                    wait_start = now
+                    deadline = now + self.wait_seconds
+                    self._stats['waits'] += 1
+                if now >= deadline:
+                    self._stats['timeouts'] += 1
+                    raise PoolExhausted(
+                        "All {} MySQL connections in use.".format(
+                            self.max_size))
+                self._condition.wait(deadline - now)
+
+            if wait_start is not None:
+                self._stats['wait_ms'] += int(
+                    (time.time() - wait_start) * 1000)
+            self._stats['checkouts'] += 1
+
+        try:
+            return self._open() if conn is None else self._check(conn)
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def checkin(self, conn, broken=False):
+        expired = time.time() - conn.created > self.max_age_seconds
+        if broken or expired:
+            self._close(conn)
+        with self._condition:
+            if broken or expired:
+                self._size -= 1
+            else:
+                conn.last_used = time.time()
+                self._idle.append(conn)
+            self._condition.notify()
+
+    def close_idle(self):
+        """Close all idle connections, e.g. before a deploy or in tests."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._condition:
+            stats = {k: self._stats[k] for k in STAT_NAMES}
+            stats.update(size=self._size, idle=len(self._idle),
+                         in_use=self._size - len(self._idle),
+                         max_size=self.max_size)
+        return stats
+
+    def reset_stats(self):
+        with self._condition:
+            self._stats.clear()
+
+    def count(self, **counts):
+        with self._condition:
+            self._stats.update(counts)
+
+    def _open(self):
+        conn = PooledConnection()
+        self.count(opened=1)
+        return conn
+
+    def _close(self, conn):
+        conn.close()
+        self.count(closed=1)
+
+    def _check(self, conn):
+        """Replace a connection if it's too old or fails a ping."""
+        if time.time() - conn.created > self.max_age_seconds:
+            self._close(conn)
+            return self._open()
+
+        if time.time() - conn.last_used > self.health_check_seconds:
+            self.count(health_checks=1)
+            try:
+                conn.sql.connection.ping()
+            except CONNECTION_ERRORS:
+                self._close(conn)
+                self.count(reconnects=1)
+                return self._open()
+
+        return conn
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = Pool(
+                max_size=config.mysql_pool_size,
+                wait_seconds=config.mysql_pool_wait_seconds,
+                health_check_seconds=config.mysql_pool_health_check_seconds,
+                max_age_seconds=config.mysql_pool_max_age_seconds,
+            )
+        return _pool
+
+
+def _release():
+    """Return this thread's connection to the pool."""
+    conn = getattr(_local, 'conn', None)
+    depth = getattr(_local, 'depth', 0)
+    _local.conn = None
+    _local.depth = 0
+    broken = getattr(_local, 'broken', False)
+    if conn is not None and depth and not broken:
+        # Abandoned mid-block, e.g. by a generator that was never closed.
+        broken = not conn.rollback()
+    if conn is not None:
+        get_pool().checkin(conn, broken=broken)
+    _local.broken = False
+
+
+@contextlib.contextmanager
+def connect():
+    """Like mysql_connection.connect(), but reusing pooled connections.
+
+    The outermost block is a transaction, committed when it ends or rolled
+    back if it raises. Nested blocks join it.
+    """
+    if not config.mysql_pool_enabled:
+        with mysql_connection.connect() as sql:
+            yield InstrumentedSql(sql)
+        return
+
+    if getattr(_local, 'conn', None) is None:
+        _local.conn = get_pool().checkout()
+        _local.depth = 0
+        _local.broken = False
+    else:
+        get_pool().count(reuses=1)
+
+    conn = _local.conn
+    _local.depth += 1
+    outermost = _local.depth == 1
+    finished = False
+    try:
+        yield conn.sql
+        if outermost:
+            conn.sql.commit()
+            finished = True
+    except CONNECTION_ERRORS:
+        _local.broken = True
+        raise
+    finally:
+        _local.depth -= 1
+        if outermost:
+            # Raised, or closed early as a generator.
+            if not finished and not _local.broken:
+                _local.broken = not conn.rollback()
+            _release()
+
+
+def _is_outermost():
+    """Whether the current connect() block is the outermost on its
+    connection, so its transaction holds nothing else."""
+    return not config.mysql_pool_enabled or _local.depth == 1
+
+
+@contextlib.contextmanager
+def transaction():
+    """Like connect(), but the block is one transaction whether or not
+    pooling is enabled. Run every statement with the `sql` it yields rather
+    than in nested blocks."""
+    if config.mysql_pool_enabled:
+        with connect() as sql:
+            yield sql
+        return
+
+    with mysql_connection.connect() as sql:
+        sql = InstrumentedSql(sql)
+        sql.connection.autocommit(False)
+        try:
+            yield sql
+        except Exception:
+            sql.connection.rollback()
+            raise
+        sql.commit()
+
+
+class BatchResult(object):
+    """Rows of one query in a batch, available once the batch block ends."""
+    def __init__(self, query, params, is_select=True):
+        self.query = query
+        self.params = params
+        self.is_select = is_select
+        self.rows = None
+
+    def run_serially(self, sql):
+        if self.is_select:
+            self.rows = sql.select_query(self.query, self.params)
+        else:
+            sql.query(self.query, self.params)
+            self.rows = []
+
+
+class Batch(object):
+    """Collects statements, see batch()."""
+    def __init__(self):
+        self.results = []
+
+    def select(self, query, params=tuple()):
+        """Add a query. Returns: BatchResult, with rows after the block."""
+        result = BatchResult(query.strip().rstrip(';'), tuple(params))
+        self.results.append(result)
+        return result
+
+    def execute(self, query, params=tuple()):
+        """Add a statement that returns no rows, like an INSERT. Statements
+        run in order, so later SELECTs see its effects."""
+        result = BatchResult(query.strip().rstrip(';'), tuple(params),
+                             is_select=False)
+        self.results.append(result)
+        return result
+
+    def run(self):
+        if not self.results:
+            return
+        if len(self.results) == 1:
+            with connect() as sql:
+                self.results[0].run_serially(sql)
+            return
+
+        pool = get_pool()
+        with connect() as sql:
+            if pool.multi_statements is False:
+                for r in self.results:
+                    r.run_serially(sql)
+            else:
+                self.run_together(sql, pool)
+
+        pool.count(batches=1, batched_queries=len(self.results))
+
+    def run_together(self, sql, pool):
+        """One multi-statement round trip, or serially if that turns out not
+        to be allowed."""
+        # Writes that applied before an error are undone. If the batch is
+        # its own transaction, connect()'s ROLLBACK does that. Otherwise a
+        # savepoint, sent as part of the same query, limits it to the batch.
+        has_writes = any(not r.is_select for r in self.results)
+        savepoint = has_writes and not _is_outermost()
+        statements = ["SAVEPOINT `batch`"] if savepoint else []
+        # Each query may end in a comment, so statements go on their own
+        # lines.
+        statements += [r.query for r in self.results]
+        query = '\n;\n'.join(statements)
+        params = tuple(p for r in self.results for p in r.params)
+
+        cursor = sql.connection.cursor(MySQLdb.cursors.DictCursor)
+        executed = False
+        try:
+            with instrumentation.timed_sql(query):
+                cursor.execute(query, params)
+            # At least the first statement ran, so multiple are allowed.
+            executed = True
+            pool.multi_statements = True
+            if savepoint:
+                cursor.nextset()
+            for i, r in enumerate(self.results):
+                # Writes have no result set, i.e. no description.
+                r.rows = (list(cursor.fetchall())
+                          if cursor.description else [])
+                if i < len(self.results) - 1:
+                    cursor.nextset()
+        except MySQLdb.Error as e:
+            if isinstance(e, CONNECTION_ERRORS):
+                raise
+            cursor.close()
+            cursor = None
+            if (not executed and pool.multi_statements is None and
+                    e.args[0] == ER_PARSE_ERROR):
+                # Either multiple statements are disabled for our
+                # connections, so nothing ran, or the first statement has a
+                # syntax error. Run them one at a time, which raises any
+                # genuine error.
+                for r in self.results:
+                    r.run_serially(sql)
+                pool.multi_statements = False
+                logging.warning("MySQL connections don't allow multiple "
+                                "statements, so batches will run serially.")
+                return
+            if savepoint:
+                sql.query("ROLLBACK TO SAVEPOINT `batch`", tuple())
+            raise
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+
+@contextlib.contextmanager
+def batch():
+    """Run SELECTs together over one connection.
+
+        with mysql_pool.batch() as b:
+            first = b.select(query1, params1)
+            second = b.select(query2, params2)
+        first.rows, second.rows
+
+    Queries are sent when the block ends, as one multi-statement query, so
+    don't read rows inside the block. They run in order, so a select may
+    read what an earlier b.execute() wrote, but may not depend on the rows
+    of another select.
+    """
+    b = Batch()
+    yield b
+    b.run()
+
+
+def middleware(application):
+    """Wrap a WSGI application so no request leaves a pooled connection
+    checked out."""
+    def wrapped(environ, start_response):
+        _release()
+        try:
+            return application(environ, start_response)
+        finally:
+            _release()
+
+    return wrapped
@@ -1,7 +1,124 @@
+"""Notifications, and their emails, about things users do.
+
+Most functions here notify one or a few users. Those that notify everyone in
+a role, like all super admins, use fan_out(), which writes the notifications
+in a task, off the request path.
+"""
+
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+import json
 
 from model import (DatastoreModel, Notification, Organization, Program, Project,
                    ProjectCohort, User)
+import config
+
+
+FAN_OUT_URL = '/task/fan_out_notifications'
+
+# Entities per put_multi() when writing notifications and emails.
+PUT_CHUNK_SIZE = 200
+
+# Events per fan out task, keeping task payloads well under the taskqueue's
+# size limit.
+FAN_OUT_BATCH_SIZE = 50
+
+# Max tasks per Queue.add(), allowed by the taskqueue api.
+TASKQUEUE_ADD_LIMIT = 100
+
+
+def fan_out(recipients, digest=False, **params):
+    """Notify many users of the same event, in a task.
+
+    See deliver() for what the task does.
+
+    Args:
+        recipients: list of Users or uids.
+        digest: bool, whether to fold this into recipients' undismissed
+            notifications about the same thing, see
+            Notification.fold_into_digests().
+        params: properties of the notifications, as for Notification.create().
+
+    Returns: the task queued, or None if there was no one to notify or
+        config.notifications_synchronous is set.
+    """
+    tasks = fan_out_many(recipients, [params], digest=digest)
+    return tasks[0] if tasks else None
+
+
+def fan_out_many(recipients, notifications, digest=False):
+    """Notify the same users of many events, in as few tasks as possible.
+
+    Args:
+        recipients: list of Users or uids.
+        digest: bool, see fan_out().
+        notifications: list of dicts of notification properties, one per
+            event, see fan_out().
+
+    Returns: list of tasks queued, empty if there was no one to notify or
+        config.notifications_synchronous is set.
+    """
+    recipient_ids = sorted(set(
+        r if isinstance(r, basestring) else r.uid for r in recipients if r))
+    if not recipient_ids or not notifications:
+        return []
+
+    if config.notifications_synchronous:
+        deliver(recipient_ids, notifications, digest=digest)
+        return []
+
+    tasks = [
+        taskqueue.Task(
+            url=FAN_OUT_URL,
+            params={
+                'recipient_id': recipient_ids,
+                'digest': 'true' if digest else 'false',
+                'notifications': json.dumps(
+                    notifications[i:i + FAN_OUT_BATCH_SIZE]),
+            },
+        )
+        for i in range(0, len(notifications), FAN_OUT_BATCH_SIZE)
+    ]
+    queue = taskqueue.Queue()
+    for i in range(0, len(tasks), TASKQUEUE_ADD_LIMIT):
+        queue.add(tasks[i:i + TASKQUEUE_ADD_LIMIT])
+    return tasks
+
+
+def deliver(recipient_ids, notifications, digest=False):
+    """Write notifications (and emails) to many users, one per recipient and
+    event.
+
+    * Skips recipients who have an undismissed notification about the same
+      task, if there is one, see Notification.filter_redundant().
+    * If digest, folds the event into matching undismissed notifications.
+    * Writes notifications and emails with put_multi(), in chunks.
+
+    Returns: dict of counts for reporting.
+    """
+    recipients = [u for u in User.get_by_id(recipient_ids) if u]
+    notes = [Notification.create(parent=r, **params)
+             for params in notifications for r in recipients]
+
+    if any(params.get('task_id', None) for params in notifications):
+        notes = Notification.filter_redundant(notes)
+
+    digests = []
+    if digest:
+        notes, digests = Notification.fold_into_digests(notes)
+
+    # Emails are written here, in bulk, rather than one at a time by
+    # Notification.after_put().
+    emails = [n.email for n in notes if n.email]
+    for n in notes:
+        n.email = None
+
+    to_put = notes + digests + emails
+    for i in range(0, len(to_put), PUT_CHUNK_SIZE):
+        ndb.put_multi(to_put[i:i + PUT_CHUNK_SIZE])
+
+    return {'notified': len(notes), 'digested': len(digests),
+            'emails': len(emails)}
 
 
 def get_project_program_recipients(project):
@@ -9,7 +126,7 @@ def get_project_program_recipients(project):
     if project.account_manager_id:
         return [User.get_by_id(project.account_manager_id)]
     else:
-        return User.get(owned_programs=project.program_label)
+        return User.get_program_owners(project.program_label)
 
 
 def get_project_organization_recipients(project):
@@ -49,19 +166,15 @@ def requested_to_join_organization(user, organization):
     """Notify existing org admins."""
     # Joining user won't appear here b/c they have assc_organizations.
     owners = User.get(owned_organizations=organization.uid, n=float('inf'))
-    notes = []
-    for owner in owners:
-        note = Notification.create(
-            parent=owner,
-            context_id=organization.uid,
-            subject="New user in your organization",
-            body=u"{} would like to join {}.".format(
-                user.name, organization.name),
-            link='/organizations/{}/users'.format(organization.short_uid),
-            autodismiss=True,
-        )
-        notes.append(note)
-    ndb.put_multi(notes)
+    fan_out(
+        owners,
+        context_id=organization.uid,
+        subject="New user in your organization",
+        body=u"{} would like to join {}.".format(
+            user.name, organization.name),
+        link='/organizations/{}/users'.format(organization.short_uid),
+        autodismiss=True,
+    )
 
 
 def joined_organization(approver, joiner, organization):
@@ -138,12 +251,12 @@ def changed_organization_task(user, organization, task,
         'link': link,
         'autodismiss': True,
     }
-    notes = []
     if user.super_admin:
-        # Notify anyone who owns the organization.
+        # Notify anyone who owns the organization. Redundant notifications
+        # are filtered out by the fan out.
         admins = User.get(
             user_type='user', owned_organizations=organization.uid)
-        notes += [Notification.create(parent=a, **params) for a in admins]
+        fan_out(admins, **params)
     if user.non_admin:
         # Super admins are too busy to care.
         pass
@@ -153,9 +266,6 @@ def changed_organization_task(user, organization, task,
     # else program admin? Program admins are largely not implemented, and likely
     # won't have rights to modify/approve organizations anyway.
 
-    filtered_notes = Notification.filter_redundant(notes)
-    ndb.put_multi(filtered_notes)
-
 
 def created_project(user, project):
     """Notify any program owners, regardless of type."""
@@ -213,10 +323,8 @@ def changed_project_task(user, project, task, project_cohort_id=None):
         parents = get_project_program_recipients(project)
     else:
         parents = get_project_organization_recipients(project)
-    notes = [Notification.create(parent=p, **params) for p in parents]
-
-    filtered_notes = Notification.filter_redundant(notes)
-    ndb.put_multi(filtered_notes)
+    # Redundant notifications are filtered out by the fan out.
+    fan_out(parents, **params)
 
 
 def changed_survey_task(user, survey, task, project_cohort_id=None):
@@ -277,17 +385,28 @@ def completed_task_list(completer, tasklist_parent):
 def joined_cohort(user, project_cohort):
     """Notify program and super admins."""
     # This always happens along with creating a program.
-    pc = project_cohort
-    program_admins = User.get(owned_programs=pc.program_label)
-    super_admins = User.get(user_type='super_admin')
-    organization = Organization.get_by_id(pc.organization_id)
-    program_config = Program.get_config(pc.program_label)
-    cohort_name = program_config['cohorts'][pc.cohort_label]['name']
-
-    notes = []
-    for admin in program_admins + super_admins:
-        note = Notification.create(
-            parent=admin,
+    joined_cohorts([project_cohort])
+
+
+def joined_cohorts(project_cohorts):
+    """Notify program and super admins of many organizations joining cohorts
+    of one program, e.g. when enrolled in bulk."""
+    if not project_cohorts:
+        return
+
+    program_label = project_cohorts[0].program_label
+    program_admins = User.get_program_owners(program_label)
+    super_admins = User.get_super_admins()
+    program_config = Program.get_config(program_label)
+    orgs = Organization.get_by_id(
+        list(set(pc.organization_id for pc in project_cohorts)))
+    orgs_by_id = {o.uid: o for o in orgs if o}
+
+    notifications = []
+    for pc in project_cohorts:
+        organization = orgs_by_id[pc.organization_id]
+        cohort_name = program_config['cohorts'][pc.cohort_label]['name']
+        notifications.append(dict(
             context_id=pc.uid,
             subject=u"{org} joined a cohort".format(org=organization.name),
             body=(
@@ -299,29 +418,26 @@ def joined_cohort(user, project_cohort):
             ),
             link='/organizations/{}'.format(organization.short_uid),
             autodismiss=True,
-        )
-        notes.append(note)
-    ndb.put_multi(notes)
+        ))
 
-def downloaded_identifiers(user, project_cohort_id):
-    supers = User.get(user_type='super_admin')
-    notes = []
+    fan_out_many(program_admins + super_admins, notifications)
 
+def downloaded_identifiers(user, project_cohort_id):
+    """Notify super admins. Repeated downloads make one digest notification
+    rather than one each."""
     project_cohort = ProjectCohort.get_by_id(project_cohort_id)
     organization = Organization.get_by_id(project_cohort.organization_id)
     program = Program.get_config(project_cohort.program_label)
     cohort_name = program['cohorts'][project_cohort.cohort_label]['name']
 
-    for sup in supers:
-        note = Notification.create(
-            parent=sup,
-            context_id=project_cohort_id,
-            subject="IDs Downloaded",
-            body=u"{} ({}) downloaded IDs for {}: {} {}.".format(
-                user.name, user.email, organization.name, program['name'],
-                cohort_name),
-            link='/dashboard/{}'.format(project_cohort.short_uid),
-            autodismiss=True,
-        )
-        notes.append(note)
-    ndb.put_multi(notes)
+    fan_out(
+        User.get_super_admins(),
+        digest=True,
+        context_id=project_cohort_id,
+        subject="IDs Downloaded",
+        body=u"{} ({}) downloaded IDs for {}: {} {}.".format(
+            user.name, user.email, organization.name, program['name'],
+            cohort_name),
+        link='/dashboard/{}'.format(project_cohort.short_uid),
+        autodismiss=True,
+    )
@@ -3,6 +3,14 @@
 import logging
 
 from model import DatastoreModel
+import identity_map
+
+
+# Ownership of these depends on properties of the entity itself.
+FETCHED_KINDS = ('Project', 'ProjectCohort', 'Survey')
+
+# These are owned by whoever owns their parent.
+CHILD_KINDS = ('Task', 'TaskReminder', 'Notification')
 
 
 def owns(user, id_or_entity):
@@ -16,51 +24,132 @@ def owns(user, id_or_entity):
         return True
 
     # Convert to id.
-    uid = (str(id_or_entity) if isinstance(id_or_entity, basestring)
-           else id_or_entity.uid)
+    uid = _to_uid(id_or_entity)
 
     kind = DatastoreModel.get_kind(uid)
 
+    if kind in CHILD_KINDS:
+        # same ownership as parent
+        return owns(user, DatastoreModel.get_parent_uid(uid))
+
+    entity = identity_map.get(uid) if kind in FETCHED_KINDS else None
+
+    return _owns_entity(user, kind, uid, entity)
+
+
+def owns_many(user, ids_or_entities):
+    """Like owns() for many objects at once.
+
+    All the entities needed are fetched in one batch, rather than one get per
+    id, which matters when checking hundreds of project cohorts.
+
+    Unlike owns(), this doesn't raise for ids that ownership doesn't apply to
+    (e.g. participation codes) or for entities that don't exist; they're
+    simply not owned.
+
+    Returns: dict of uid to bool.
+    """
+    uids = [_to_uid(x) for x in ids_or_entities]
+
+    # Supers own everything.
+    if user.super_admin:
+        return {uid: True for uid in uids}
+
+    # Resolve children to the ancestor that determines their ownership.
+    owner_uids = {}
+    for uid in uids:
+        owner_uid = uid
+        while DatastoreModel.get_kind(owner_uid) in CHILD_KINDS:
+            owner_uid = DatastoreModel.get_parent_uid(owner_uid)
+        owner_uids[uid] = owner_uid
+
+    to_fetch = list(set(
+        owner_uid for owner_uid in owner_uids.values()
+        if DatastoreModel.get_kind(owner_uid) in FETCHED_KINDS
+    ))
+    entities = dict(zip(to_fetch, identity_map.get_multi(to_fetch)))
+
+    result = {}
+    for uid, owner_uid in owner_uids.items():
+        kind = DatastoreModel.get_kind(owner_uid)
+        if owns_program(user, uid):
+            result[uid] = True
+        elif kind in FETCHED_KINDS and entities[owner_uid] is None:
+            result[uid] = False
+        else:
+            try:
+                result[uid] = _owns_entity(
+                    user, kind, owner_uid, entities.get(owner_uid, None))
+            except NotImplementedError:
+                result[uid] = False
+
+    return result
+
+
+def owns_program(user, program_label):
+    return user.super_admin or program_label in user.owned_programs
+
+
+def jwt_allows_endpoints(jwt_payload, endpoint_strs):
+    """Which of these endpoints does a decoded jwt allow?
+
+    The batch counterpart to ApiHandler.jwt_allows_endpoint(), which decodes
+    the jwt again for every endpoint it checks.
+
+    Args:
+        jwt_payload: dict, already decoded and validated, or None.
+        endpoint_strs: iterable of str, see ApiHandler.get_endpoint_str().
+
+    Returns: dict of endpoint str to bool.
+    """
+    allowed = set((jwt_payload or {}).get('allowed_endpoints', []))
+    return {e: e in allowed for e in endpoint_strs}
+
+
+def _to_uid(id_or_entity):
+    return (str(id_or_entity) if isinstance(id_or_entity, basestring)
+            else id_or_entity.uid)
+
+
+def _owns_entity(user, kind, uid, entity):
+    """Ownership rules for everything except children of other entities.
+
+    Args:
+        user: User
+        kind: str, kind of uid
+        uid: str
+        entity: the Datastore entity for uid, if kind is in FETCHED_KINDS.
+    """
     # Everyone owns public data.
     owned_orgs = user.owned_organizations + ['Organization_public']
 
     if kind == 'Organization':
         result = uid in owned_orgs
     elif kind == 'Project':
-        project = DatastoreModel.get_by_id(uid)
+        project = entity
         user_owns_program = project.program_label in user.owned_programs
         user_owns_org = project.organization_id in owned_orgs
         user_owns_project = project.uid in user.owned_projects
         result = user_owns_program or user_owns_org or user_owns_project
     elif kind == 'ProjectCohort':
         # Same logic as project
-        pc = DatastoreModel.get_by_id(uid)
+        pc = entity
         user_owns_program = pc.program_label in user.owned_programs
         user_owns_org = pc.organization_id in owned_orgs
         result = user_owns_program or user_owns_org
     elif kind == 'Survey':
         # Same logic as project
-        survey = DatastoreModel.get_by_id(uid)
+        survey = entity
         user_owns_program = survey.program_label in user.owned_programs
         user_owns_org = survey.organization_id in owned_orgs
         result = user_owns_program or user_owns_org
-    elif kind == 'Task' or kind == 'TaskReminder':
-        # same ownership as parent
-        result = owns(user, DatastoreModel.get_parent_uid(uid))
     elif kind == 'User':
         result = uid == user.uid  # no slavery!
     elif kind == 'DataTable':
         result = uid in user.owned_data_tables
     elif kind == 'DataRequest':
         result = uid in user.owned_data_requests
-    elif kind == 'Notification':
-        # same ownership as parent
-        result = owns(user, DatastoreModel.get_parent_uid(uid))
     else:
         raise NotImplementedError("Ownership does not apply to " + uid)
 
     return result
-
-
-def owns_program(user, program_label):
-    return user.super_admin or program_label in user.owned_programs
@@ -0,0 +1,154 @@
+"""Create project cohorts with everything they contain, in bulk.
+
+Joining a cohort creates a ProjectCohort, a Survey for each survey in the
+program, and for each survey a tasklist of Checkpoints (SQL) and Tasks. Put
+one at a time, every survey writes its own tasklist and re-fetches and
+recaches its project cohort, every checkpoint recaches it again, and every
+project cohort queues its own dashboard refresh.
+
+Here enrollment happens in two steps:
+
+    plans = [provisioning.plan(pc) for pc in project_cohorts]
+    provisioning.commit(plans, new_owner=user)
+
+plan() builds the whole tree in memory. commit() writes any number of plans
+with one ndb.put_multi() (project cohorts, surveys, tasks, and task
+reminders), one multi-row checkpoint INSERT, and one round of cache
+invalidation.
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+import datetime
+
+from datastore_helper import chunks
+from model import (Checkpoint, DashboardRow, Program, ProjectCohort, Survey,
+                   TaskReminder, User)
+import util
+
+
+class Plan(object):
+    """A new project cohort and everything in it, not yet written."""
+    def __init__(self, project_cohort, surveys):
+        self.project_cohort = project_cohort
+        self.surveys = surveys
+
+    @property
+    def checkpoints(self):
+        return [c for s in self.surveys for c in s.tasklist.checkpoints]
+
+    @property
+    def tasks(self):
+        return [t for s in self.surveys for t in s.tasklist.tasks]
+
+
+def cohort_error(program_config, cohort_label):
+    """Why a cohort can't be joined, or None if it can."""
+    cohort = program_config['cohorts'].get(cohort_label, None)
+    if cohort is None:
+        return "Cohort not found: {}".format(cohort_label)
+
+    # Can't join after they're closed.
+    close_date = datetime.datetime.strptime(
+        cohort['close_date'], "%Y-%m-%d").date()
+    if datetime.date.today() > close_date:
+        return ("Can't join {}, close date has passed ({})."
+                .format(cohort_label, close_date))
+
+    return None
+
+
+def plan(project_cohort, program_config=None):
+    """Create, in memory, the surveys and tasklists of a new project cohort.
+
+    Args:
+        project_cohort: ProjectCohort, e.g. from create(), may be unsaved.
+        program_config: dict, optional, defaults to the project cohort's.
+
+    Returns: Plan, see commit().
+    """
+    if program_config is None:
+        program_config = Program.get_config(project_cohort.program_label)
+
+    surveys = Survey.create_for_project_cohort(
+        program_config['surveys'], project_cohort)
+    project_cohort.survey_ids = [s.uid for s in surveys]
+
+    return Plan(project_cohort, surveys)
+
+
+def task_reminders(plans, new_owner=None):
+    """Reminders of each new survey's tasklist for the owners of its org,
+    like Tasklist.open() but with owners queried for all orgs at once.
+
+    Args:
+        plans: list of Plan.
+        new_owner: User, optional, included even if queries haven't caught
+            up with their ownership yet.
+    """
+    org_ids = list(set(p.project_cohort.organization_id for p in plans))
+    owners_by_org = {org_id: [] for org_id in org_ids}
+    for chunk in chunks(org_ids):
+        for user in User.get(owned_organizations=chunk, n=float('inf')):
+            for org_id in set(user.owned_organizations) & set(chunk):
+                owners_by_org[org_id].append(user)
+
+    reminders = []
+    for p in plans:
+        owners = owners_by_org[p.project_cohort.organization_id]
+        if new_owner and new_owner.non_admin and new_owner not in owners:
+            owners = owners + [new_owner]
+        # New tasklists have no reminders yet; no need to check.
+        reminders += [TaskReminder.create(s, owner)
+                      for s in p.surveys for owner in owners]
+
+    return reminders
+
+
+def commit(plans, new_owner=None, remind=True):
+    """Write planned project cohorts and their contents.
+
+    Args:
+        plans: list of Plan, from plan().
+        new_owner: User, optional, see task_reminders().
+        remind: bool, whether to create task reminders for org owners.
+
+    Returns: dict of counts of what was written.
+    """
+    if not plans:
+        return {}
+
+    pcs = [p.project_cohort for p in plans]
+    surveys = [s for p in plans for s in p.surveys]
+    checkpoints = [c for p in plans for c in p.checkpoints]
+    tasks = [t for p in plans for t in p.tasks]
+    reminders = task_reminders(plans, new_owner) if remind else []
+
+    # Side effects of put hooks happen once, below.
+    for entity in pcs + surveys:
+        entity.provisioned = True
+    try:
+        # Tasks are children of surveys, but their keys are already known,
+        # so they don't have to wait for the surveys.
+        ndb.put_multi(pcs + surveys + tasks + reminders)
+    finally:
+        for entity in pcs + surveys:
+            entity.provisioned = False
+
+    Checkpoint.insert_multi(checkpoints)
+
+    # Only now that the project cohorts exist can their codes lead to them.
+    ProjectCohort.index_codes(pcs)
+
+    # Any cached properties of these project cohorts predate their surveys
+    # and checkpoints.
+    memcache.delete_multi([util.cached_properties_key(pc.uid) for pc in pcs])
+    DashboardRow.queue_refresh(list(set(pc.organization_id for pc in pcs)))
+
+    return {
+        'project_cohorts': len(pcs),
+        'surveys': len(surveys),
+        'checkpoints': len(checkpoints),
+        'tasks': len(tasks),
+        'task_reminders': len(reminders),
+    }
@@ -1,4 +1,5 @@
-import cloudstorage as gcs
+from google.appengine.ext import blobstore
+from google.appengine.ext.webapp import blobstore_handlers
 import logging
 
 from gae_handlers import (ApiHandler, RestHandler, Route)
@@ -7,6 +8,11 @@ from permission import owns
 import jwt_helper
 
 
+# Datasets larger than this are served by App Engine straight from GCS rather
+# than read into the response, e.g. large csv exports, see csv_export.py.
+DOWNLOAD_INLINE_BYTES = 1024 * 1024
+
+
 def authenticate_rserve(handler):
     """Specialized authentication and log-in for requests from RServe.
 
@@ -42,7 +48,7 @@ def authenticate_rserve(handler):
     return (rserve_user, None)
 
 
-class Datasets(RestHandler):
+class Datasets(RestHandler, blobstore_handlers.BlobstoreDownloadHandler):
     model = Dataset
 
     def post(self):
@@ -89,6 +95,13 @@ class Datasets(RestHandler):
             args = tuple() if error_msg is None else (error_msg,)
             return getattr(self, error_method)(*args)
 
+        if (ds.size or 0) > DOWNLOAD_INLINE_BYTES:
+            # The file never passes through this instance. Although this uses
+            # the blobstore API, the file is in Google Cloud Storage.
+            blob_key = blobstore.create_gs_key('/gs' + ds.gcs_path)
+            return self.send_blob(blob_key, content_type=str(ds.content_type),
+                                  save_as=str(ds.filename))
+
         self.response.headers.update({'Content-Type': str(ds.content_type)})
         self.response.write(ds.read())
 
@@ -0,0 +1,239 @@
+"""Reporting units for RServe's report scripts.
+
+Once a month a cron (/cron/rserve/reports) asks RServe to write reports. For
+each report, RServe needs a "reporting unit" per project cohort: where to
+post the dataset it builds and which task to attach the report to.
+
+Programs say which reports they want in their config:
+
+    'rserve_reports': [
+        {'script': 'cg', 'task_label': 'cg17_survey__report_1'},
+    ],
+
+For each, run() finds the open project cohorts of the program's current
+cohort a page at a time, with a keys-only query. For each page it:
+
+* selects just the survey checkpoints with the report task's label and
+  these project cohorts, filtered in SQL,
+* reads the report task's uid from each checkpoint's task_ids, at the
+  task's position in the checkpoint template, and gets those tasks in one
+  batch to make sure, and
+* posts the page's reporting units to RServe.
+
+Memory and payload size depend on the page size,
+config.rserve_reporting_units_per_request, not on the size of the program.
+"""
+
+from google.appengine.api import urlfetch
+import json
+import logging
+import os
+
+from gae_handlers import rserve_jwt
+from model import Checkpoint, Program, ProjectCohort, SecretValue, Task
+import config
+import util
+
+
+# Credentials RServe needs to run report scripts, sent with every request.
+SECRETS = ('neptune_sql_credentials', 'big_pipe_credentials',
+           'qualtrics_credentials')
+
+
+def neptune_url_base():
+    return '{protocol}://{domain}'.format(
+        protocol='http' if util.is_localhost() else 'https',
+        domain=('localhost:8888' if util.is_localhost()
+                else os.environ['HOSTING_DOMAIN']),
+    )
+
+
+def rserve_url(script):
+    return '{protocol}://{domain}/api/scripts/{script}'.format(
+        protocol='http' if util.is_localhost() else 'https',
+        domain=('localhost:9080' if util.is_localhost()
+                else os.environ['RSERVE_DOMAIN']),
+        script=script,
+    )
+
+
+def report_task_position(program_label, task_label):
+    """Where a report task is in its program's survey tasklists.
+
+    Returns: tuple of (checkpoint label, index of the task among the
+        checkpoint's tasks), or (None, None) if not found.
+    """
+    program_config = Program.get_config(program_label)
+    for survey in program_config.get('surveys', []):
+        for checkpoint in survey.get('survey_tasklist_template', []):
+            labels = [t['label'] for t in checkpoint.get('tasks', [])]
+            if task_label in labels:
+                return checkpoint['label'], labels.index(task_label)
+    return None, None
+
+
+def build_reporting_unit(project_cohort_id, task_id, url_base=None):
+    url_base = url_base or neptune_url_base()
+    # The URLs that RServe will need to post back to.
+    return {
+        'project_cohort_id': project_cohort_id,
+        'post_url': '{base}/api/datasets?parent_id={parent_id}'.format(
+            base=url_base, parent_id=project_cohort_id),
+        'post_task_attachment_url': '{base}/api/tasks/{task_id}/attachment'
+                                    .format(base=url_base, task_id=task_id),
+    }
+
+
+def report_task_ids(program_label, task_label, project_cohort_ids):
+    """Uids of the report task of each project cohort.
+
+    Returns: dict of task uid by project cohort uid, without project cohorts
+        that don't have the task.
+    """
+    checkpoint_label, position = report_task_position(program_label,
+                                                      task_label)
+    if checkpoint_label is None:
+        logging.error("No report task {} in {}."
+                      .format(task_label, program_label))
+        return {}
+
+    checkpoints = Checkpoint.for_project_cohorts(
+        checkpoint_label, project_cohort_ids,
+        fields=('uid', 'project_cohort_id', 'task_ids'),
+    )
+    task_ids_by_pc = {c.project_cohort_id: json.loads(c.task_ids or '[]')
+                      for c in checkpoints}
+
+    # Tasks are created in template order, so the report task should be at
+    # the same position in each checkpoint. Check, in case the template has
+    # changed since.
+    guesses = {pc_id: ids[position] for pc_id, ids in task_ids_by_pc.items()
+               if len(ids) > position}
+    tasks = Task.get_by_id(guesses.values()) if guesses else []
+    found = {t.uid for t in tasks
+             if t and not t.deleted and t.label == task_label}
+    task_id_by_pc = {pc_id: uid for pc_id, uid in guesses.items()
+                     if uid in found}
+
+    # Otherwise look through all the checkpoint's tasks.
+    missing = [pc_id for pc_id in task_ids_by_pc
+               if pc_id not in task_id_by_pc]
+    if missing:
+        all_ids = [uid for pc_id in missing for uid in task_ids_by_pc[pc_id]]
+        tasks_by_id = {t.uid: t for t in Task.get_by_id(all_ids)
+                       if t and not t.deleted and t.label == task_label}
+        for pc_id in missing:
+            for uid in task_ids_by_pc[pc_id]:
+                if uid in tasks_by_id:
+                    task_id_by_pc[pc_id] = uid
+                    break
+
+    return task_id_by_pc
+
+
+def reporting_unit_pages(program_label, cohort_label, task_label,
+                         page_size=None):
+    """Reporting units for every open project cohort in a cohort.
+
+    Yields: lists of reporting unit dicts, up to page_size at a time.
+    """
+    page_size = page_size or config.rserve_reporting_units_per_request
+    query = ProjectCohort.query(
+        ProjectCohort.program_label == program_label,
+        ProjectCohort.cohort_label == cohort_label,
+        ProjectCohort.status == 'open',
+        ProjectCohort.deleted == False,
+    )
+    url_base = neptune_url_base()
+
+    cursor = None
+    more = True
+    while more:
+        keys, cursor, more = query.fetch_page(
+            page_size, keys_only=True, start_cursor=cursor)
+        pc_ids = [k.id() for k in keys]
+        task_id_by_pc = report_task_ids(program_label, task_label, pc_ids)
+
+        missing = len(pc_ids) - len(task_id_by_pc)
+        if missing:
+            logging.warning("{} project cohorts in {} {} have no {} task."
+                            .format(missing, program_label, cohort_label,
+                                    task_label))
+
+        units = [build_reporting_unit(pc_id, task_id_by_pc[pc_id], url_base)
+                 for pc_id in pc_ids if pc_id in task_id_by_pc]
+        if units:
+            yield units
+
+
+def post(script, reporting_units, secrets):
+    """Send one page of reporting units to an RServe script.
+
+    Returns: bool, whether RServe accepted them.
+    """
+    payload = dict(secrets, reporting_units=reporting_units)
+    result = urlfetch.fetch(
+        url=rserve_url(script),
+        payload=json.dumps(payload),
+        method=urlfetch.POST,
+        headers={
+            'Authorization': 'Bearer ' + rserve_jwt(),
+            'Content-Type': 'application/json',
+        }
+    )
+
+    if not result or result.status_code >= 300:
+        logging.error("Non-successful response from RServe: {} {}".format(
+            getattr(result, 'status_code', None),
+            getattr(result, 'content', None)))
+        return False
+
+    logging.info("response status: {}".format(result.status_code))
+    logging.info(result.content)
+    return True
+
+
+def run(program_label=None):
+    """Send reporting units for every configured report to RServe.
+
+    Args:
+        program_label: str, optional, to run just one program's reports.
+
+    Returns: list of dicts summarizing each report.
+    """
+    secrets = {s: SecretValue.get(s, None) for s in SECRETS}
+
+    summaries = []
+    for program_config in Program.get_all_configs():
+        label = program_config['label']
+        if program_label and label != program_label:
+            continue
+        reports = program_config.get('rserve_reports', [])
+        if not reports:
+            continue
+
+        try:
+            cohort = Program.get_current_cohort(label)
+        except Exception:
+            logging.info("No current cohort in {}, skipping reports."
+                         .format(label))
+            continue
+
+        for report in reports:
+            summary = {
+                'program_label': label,
+                'cohort_label': cohort['label'],
+                'script': report['script'],
+                'reporting_units': 0,
+                'requests': 0,
+                'failed_requests': 0,
+            }
+            for units in reporting_unit_pages(label, cohort['label'],
+                                              report['task_label']):
+                summary['reporting_units'] += len(units)
+                summary['requests'] += 1
+                if not post(report['script'], units, secrets):
+                    summary['failed_requests'] += 1
+            summaries.append(summary)
+
+    return summaries
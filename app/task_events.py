@@ -0,0 +1,287 @@
+"""Deferred side effects of task updates.
+
+Checking off a task (PUT /api/tasks/X) used to do everything that follows
+from it before responding: re-derive the checkpoint's status from all its
+tasks, put the checkpoint (clearing caches and refreshing dashboard rows for
+every related project cohort), notify the other kind of user, and update the
+project's last_active. Dozens of RPCs for one click, and clicking through a
+checklist repeated them all for every task.
+
+Now the handler saves the task and emits a TaskChanged event, which goes to a
+pull queue. A worker (/task/process_task_events) leases events in bulk and,
+for everything that happened since it last ran:
+
+* derives each affected checkpoint's status once, getting all their tasks in
+  one batch, and only puts checkpoints whose status changed,
+* sends one notification per task and user, however many times that user
+  changed the task,
+* puts each project once for last_active, and
+* queues dashboard row refreshes once for all the organizations involved.
+
+Workers are debounced: each emit schedules a named worker task for the
+current DEBOUNCE_SECONDS window, so a burst of events is handled by one
+worker shortly after it ends. /cron/flush_task_events is a backstop.
+
+When config.task_events_synchronous is True, events are processed as soon as
+they're emitted, which is what tests want.
+"""
+
+from google.appengine.api import taskqueue
+import collections
+import datetime
+import json
+import logging
+import time
+
+from gae_models import DatastoreModel
+from model import Checkpoint, DashboardRow, Project, Task, User
+from taskqueue_helper import namespace_tag
+import config
+import notifier
+import taskqueue_helper
+
+
+# Pull queue, see queue.yaml.
+QUEUE_NAME = 'task-events'
+
+WORKER_URL = '/task/process_task_events'
+
+# Events within a window of this many seconds share a worker.
+DEBOUNCE_SECONDS = 5
+
+# Max allowed by the taskqueue api.
+LEASE_BATCH_SIZE = 1000
+
+# How long the worker has to process a leased batch before the events become
+# available to other workers. Processing is idempotent, so a repeated batch
+# is harmless.
+LEASE_SECONDS = 60
+
+# Events that have failed this many times are dropped rather than retried.
+MAX_EVENT_RETRIES = 5
+
+
+TaskChanged = collections.namedtuple('TaskChanged', [
+    'task_id',
+    'checkpoint_id',
+    # User who made the change.
+    'user_id',
+    # The client sends this with task updates so notifications can link to
+    # the right dashboard, see notifier.changed_project_task().
+    'project_cohort_id',
+    # str, see config.iso_datetime_format
+    'changed',
+])
+
+
+def task_changed(task, user, project_cohort_id=None):
+    """Emit an event for a task a user just updated."""
+    return emit(TaskChanged(
+        task_id=task.uid,
+        checkpoint_id=task.checkpoint_id,
+        user_id=user.uid,
+        project_cohort_id=project_cohort_id,
+        changed=datetime.datetime.utcnow().strftime(
+            config.iso_datetime_format),
+    ))
+
+
+def emit(event):
+    """Process an event later, in a worker, or now if synchronous."""
+    if config.task_events_synchronous:
+        process([event])
+        return event
+
+    task = taskqueue.Task(payload=json.dumps(event._asdict()), method='PULL',
+                          tag=namespace_tag())
+    taskqueue.Queue(QUEUE_NAME).add(task)
+    schedule_worker()
+    return event
+
+
+def schedule_worker():
+    """Make sure a worker will run after the current debounce window.
+
+    Returns: the task, or None if this window already had one.
+    """
+    window = int(time.time() // DEBOUNCE_SECONDS)
+    name = taskqueue_helper.named_task_name('task-events', window)
+    try:
+        return taskqueue.add(
+            url=WORKER_URL,
+            name=name,
+            countdown=DEBOUNCE_SECONDS,
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        return None
+
+
+def flush(max_batches=10):
+    """Lease, process, and delete events until the queue is empty.
+
+    Returns: dict of counts for reporting.
+    """
+    queue = taskqueue.Queue(QUEUE_NAME)
+    report = {'leased': 0, 'failed': 0, 'checkpoints_changed': 0,
+              'notified': 0, 'projects_active': 0}
+
+    for x in range(max_batches):
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, LEASE_BATCH_SIZE,
+                                         tag=namespace_tag())
+        if not tasks:
+            break
+
+        try:
+            result = process([TaskChanged(**json.loads(t.payload))
+                              for t in tasks])
+            done = tasks
+        except Exception:
+            # One bad event shouldn't hold up the rest. Process them one at a
+            # time and leave only the failures leased, to be retried when
+            # their lease expires.
+            logging.exception("Failed to process a batch of task events.")
+            result, done = process_each(tasks)
+        if done:
+            queue.delete_tasks(done)
+
+        report['leased'] += len(tasks)
+        report['failed'] += len(tasks) - len(done)
+        for k, v in result.items():
+            report[k] += v
+
+    return report
+
+
+def process_each(tasks):
+    """Process leased events one at a time.
+
+    Returns: tuple of (dict of counts for reporting, list of tasks that are
+        done with, either processed or failed too many times).
+    """
+    counts = collections.Counter()
+    done = []
+    for t in tasks:
+        try:
+            counts.update(process([TaskChanged(**json.loads(t.payload))]))
+        except Exception:
+            if t.retry_count < MAX_EVENT_RETRIES:
+                logging.exception(u"Failed to process task event, will "
+                                  u"retry: {}".format(t.payload))
+                continue
+            logging.exception(u"Failed to process task event {} times, "
+                              u"dropping it: {}"
+                              .format(t.retry_count, t.payload))
+        done.append(t)
+    return counts, done
+
+
+def process(events):
+    """Apply the side effects of many task changes at once.
+
+    Returns: dict of counts for reporting.
+    """
+    if not events:
+        return {'checkpoints_changed': 0, 'notified': 0, 'projects_active': 0}
+
+    tasks = Task.get_by_id(list(set(e.task_id for e in events)))
+    tasks_by_id = {t.uid: t for t in tasks if t}
+    users = User.get_by_id(list(set(e.user_id for e in events)))
+    users_by_id = {u.uid: u for u in users if u}
+
+    # Everything put here refreshes the dashboard rows of the same few
+    # organizations; do that once.
+    with DashboardRow.coalesce_refreshes():
+        checkpoints_changed = update_checkpoints(events)
+        notified, active_projects = notify(events, tasks_by_id, users_by_id)
+        for project in active_projects:
+            project.put()
+
+    return {
+        'checkpoints_changed': checkpoints_changed,
+        'notified': notified,
+        'projects_active': len(active_projects),
+    }
+
+
+def update_checkpoints(events):
+    """Bubble task status changes up to checkpoints, putting only those
+    whose status changed.
+
+    Returns: int number of checkpoints changed.
+    """
+    checkpoints = Checkpoint.get_by_ids(
+        set(e.checkpoint_id for e in events if e.checkpoint_id))
+    statuses = Checkpoint.get_statuses_from_tasks(checkpoints)
+
+    changed = [c for c in checkpoints if c.status != statuses[c.uid]]
+    for c in changed:
+        c.status = statuses[c.uid]
+        c.put()
+
+    return len(changed)
+
+
+def notify(events, tasks_by_id, users_by_id):
+    """Notify other parties of changed tasks, once per task and user.
+
+    Returns: tuple of (int number of changes notified, list of projects with
+        last_active updated but not yet put).
+    """
+    # Latest event for each task and user.
+    latest = {}
+    for e in sorted(events, key=lambda e: e.changed):
+        latest[(e.task_id, e.user_id)] = e
+
+    parent_ids = set(tasks_by_id[task_id].key.parent().id()
+                     for task_id, user_id in latest.keys()
+                     if task_id in tasks_by_id)
+    parents = DatastoreModel.get_by_id(list(parent_ids)) if parent_ids else []
+    parents_by_id = {p.uid: p for p in parents if p}
+
+    project_ids = set(p.project_id for p in parents_by_id.values()
+                      if DatastoreModel.get_kind(p) == 'Survey')
+    projects = Project.get_by_id(list(project_ids)) if project_ids else []
+    projects_by_id = {p.uid: p for p in projects if p}
+    projects_by_id.update({p.uid: p for p in parents_by_id.values()
+                           if DatastoreModel.get_kind(p) == 'Project'})
+
+    notified = 0
+    last_active = {}  # by project uid
+    for (task_id, user_id), event in latest.items():
+        task = tasks_by_id.get(task_id, None)
+        user = users_by_id.get(user_id, None)
+        parent = task and parents_by_id.get(task.key.parent().id(), None)
+        if not task or not user or not parent:
+            continue
+        parent_kind = DatastoreModel.get_kind(task.key.parent())
+
+        project = None  # used to update project.last_active
+        if parent_kind == 'Organization':
+            notify_fn = notifier.changed_organization_task
+        elif parent_kind == 'Project':
+            notify_fn = notifier.changed_project_task
+            project = parent
+        elif parent_kind == 'Survey':
+            notify_fn = notifier.changed_survey_task
+            project = projects_by_id.get(parent.project_id, None)
+        else:
+            logging.error('Notification rules for {} tasks not written'
+                          .format(parent_kind))
+            continue
+
+        notify_fn(user, parent, task, event.project_cohort_id)
+        notified += 1
+
+        if project and user.non_admin:
+            changed = datetime.datetime.strptime(
+                event.changed, config.iso_datetime_format)
+            last_active[project.uid] = max(
+                changed, last_active.get(project.uid, changed))
+
+    active_projects = []
+    for project_id, changed in last_active.items():
+        project = projects_by_id[project_id]
+        project.last_active = changed
+        active_projects.append(project)
+
+    return notified, active_projects
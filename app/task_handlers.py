@@ -2,15 +2,19 @@
 
 from google.appengine.api import namespace_manager
 from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 import json
 import logging
 import os
 
 from gae_handlers import ApiHandler, Route
-from graphql_handlers import SuperDashboard
-from model import Email, Organization, Program, Project, SurveyLink, User
+from graphql_handlers import materialize_dashboard_rows
+from model import (DashboardRow, Email, Organization, ParticipationRollup,
+                   PooledCode, Program, Project, SurveyLink, User)
 import auto_prompt
 import config
+import notifier
+import task_events
 import util
 
 
@@ -59,7 +63,8 @@ class TaskWorker(ApiHandler):
 
 class ImportLinks(TaskWorker):
     def get(self, program_label, survey_ordinal, file_name=None):
-        """Launch separate tasks for each csv found to import."""
+        """Launch separate tasks for each byte range of each csv found to
+        import. See SurveyLink.import_range()."""
         paths = SurveyLink.list_gcs_files(program_label, survey_ordinal,
                                           file_name)
         tasks = []
@@ -73,11 +78,17 @@ class ImportLinks(TaskWorker):
                 if not url.endswith('/'):
                     url += '/'
                 url += gcs_path.split('/')[-1]
-            task = taskqueue.add(url=url, queue_name=self.queue_name())
-            tasks.append(task)
+            for start, end in SurveyLink.import_shards(gcs_path):
+                task = taskqueue.add(
+                    url=url,
+                    params={'start': start, 'end': end},
+                    queue_name=self.queue_name(),
+                )
+                tasks.append(task)
 
         self.response.write(json.dumps([{
             'url': task.url,
+            'params': task.extract_params(),
             'was_deleted': task.was_deleted,
             'was_enqueued': task.was_enqueued,
         } for task in tasks]))
@@ -85,27 +96,147 @@ class ImportLinks(TaskWorker):
     def post(self, program_label, survey_ordinal, file_name=None):
         if not file_name:
             return
-        num_imported = SurveyLink.import_links(
-            program_label, int(survey_ordinal), file_name)
-        self.response.write(json.dumps({'num_imported': num_imported}))
+        params = self.get_params({'start': int, 'end': int})
+        if 'start' not in params:
+            # The whole file, as before ranges.
+            num_imported = SurveyLink.import_links(
+                program_label, int(survey_ordinal), file_name)
+            self.response.write(json.dumps({'num_imported': num_imported}))
+            return
+
+        path = SurveyLink.import_path(program_label, survey_ordinal,
+                                      file_name)
+        # Retries of this task resume from the last batch written.
+        self.write(SurveyLink.import_range(
+            program_label, int(survey_ordinal), path, params['start'],
+            params.get('end', None)))
 
 
 class CacheDashboard(TaskWorker):
+    """Formerly rebuilt cached super dashboards, now a no-op.
+
+    Dashboards are served from dashboard rows, see RefreshDashboardRows.
+    Kept for one release so tasks queued before the deploy succeed rather
+    than retrying against a missing route.
+    """
     def post(self):
-        # allowed = ('organization_id', 'program_label', 'cohort_label')
-        # params = {
-        #     k: self.request.get(k) for k in allowed
-        #     if self.request.get(k, None) is not None
-        # }
+        logging.info("Ignoring /task/cache_dashboard, see dashboard rows.")
 
-        # Make sure not to recurse this task.
-        SuperDashboard.__dict__['get'](self, queue_cache_task=False)
 
-    def get_current_user(self):
-        class FakeSuper(object):
-            super_admin = True
+class RefreshDashboardRows(TaskWorker):
+    """Recompute precomputed super dashboard rows for some organizations.
 
-        return FakeSuper()
+    Queued by DashboardRow.queue_refresh(), see model/dashboardrow.py.
+    """
+    def post(self):
+        organization_ids = self.get_params(
+            {'organization_id': list}).get('organization_id', [])
+        num_rows = materialize_dashboard_rows(organization_ids)
+        DashboardRow.record_refresh_stats(executed=1)
+        self.write({
+            'organizations': len(organization_ids),
+            'rows': num_rows,
+        })
+
+
+class BackfillDashboardRows(TaskWorker):
+    """Build precomputed dashboard rows for every organization, e.g. after
+    deploying the dashboard_row table, since rows are otherwise only built as
+    organizations change.
+
+    Works through organizations a page at a time, queuing a task for the
+    next page. GET /task/backfill_dashboard_rows to start.
+    """
+    page_size = 20
+
+    def post(self):
+        params = self.get_params({'cursor': str, 'n': int})
+        n = params.get('n', self.page_size)
+        query = Organization.query().order(Organization.key)
+        if params.get('cursor', None):
+            query = query.filter(
+                Organization.key > ndb.Key('Organization', params['cursor']))
+        org_ids = [k.id() for k in query.fetch(n, keys_only=True)]
+
+        num_rows = materialize_dashboard_rows(org_ids)
+
+        if len(org_ids) == n:
+            taskqueue.add(
+                url=self.request.path,
+                params=dict(self.request.POST, cursor=org_ids[-1], n=n),
+                queue_name=self.queue_name(),
+            )
+        self.write({'organizations': len(org_ids), 'rows': num_rows})
+
+
+class BackfillSurveyLinkShards(TaskWorker):
+    """Give survey links imported before sharding a shard, so leases find
+    them with sharded queries. See model/surveylink.py.
+
+    Works through links a page at a time, queuing a task for the next page.
+    GET /task/backfill_survey_link_shards to start.
+    """
+    page_size = 500
+
+    def post(self):
+        params = self.get_params({'cursor': str, 'n': int})
+        n = params.get('n', self.page_size)
+        query = SurveyLink.query().order(SurveyLink.key)
+        if params.get('cursor', None):
+            query = query.filter(
+                SurveyLink.key > ndb.Key('SurveyLink', params['cursor']))
+        links = query.fetch(n)
+
+        num_sharded = SurveyLink.backfill_shards(links)
+
+        if len(links) == n:
+            taskqueue.add(
+                url=self.request.path,
+                params=dict(self.request.POST, cursor=links[-1].key.id(),
+                            n=n),
+                queue_name=self.queue_name(),
+            )
+        self.write({'links': len(links), 'sharded': num_sharded})
+
+
+class RefillCodePool(TaskWorker):
+    """Reserve participation codes ahead of enrollment. Queued by
+    PooledCode.allocate() when the pool runs low, see model/codepool.py."""
+    def post(self):
+        self.write(PooledCode.refill())
+
+
+class ProcessTaskEvents(TaskWorker):
+    """Apply the side effects of recent task updates. See task_events.py."""
+    def post(self):
+        self.write(task_events.flush())
+
+
+class RecountParticipationRollup(TaskWorker):
+    """Recount participation rollup groups touched by recent progress writes.
+    See model/participationrollup.py."""
+    def post(self):
+        self.write(ParticipationRollup.flush_recounts())
+
+
+class FanOutNotifications(TaskWorker):
+    """Write notifications to many users. Queued by notifier.fan_out()."""
+    def post(self):
+        params = self.get_params({
+            'recipient_id': list,
+            'digest': bool,
+            'notification': 'json',
+            'notifications': 'json',
+        })
+        notifications = params.get('notifications', [])
+        if params.get('notification', None):
+            # Queued before tasks could carry more than one.
+            notifications.append(params['notification'])
+        self.write(notifier.deliver(
+            params.get('recipient_id', []),
+            notifications,
+            digest=params.get('digest', False),
+        ))
 
 
 class EmailProject(TaskWorker):
@@ -135,10 +266,67 @@ class EmailProject(TaskWorker):
         )
         email.put()
 
+
+class BackfillParticipationRollup(TaskWorker):
+    """Recompute ParticipationRollup from raw participant data.
+
+    Works through project cohorts a page at a time, queuing a task for the
+    next page. GET /task/backfill_participation_rollup to start.
+    """
+    page_size = 100
+
+    def post(self):
+        params = self.get_params({'cursor': str, 'n': int})
+        n = params.get('n', self.page_size)
+        pc_ids = ParticipationRollup.project_cohort_ids_after(
+            params.get('cursor', None), n)
+
+        result = self.process(pc_ids)
+
+        if len(pc_ids) == n:
+            taskqueue.add(
+                url=self.request.path,
+                params=dict(self.request.POST, cursor=pc_ids[-1], n=n),
+                queue_name=self.queue_name(),
+            )
+        self.write(result)
+
+    def process(self, pc_ids):
+        ParticipationRollup.rebuild(pc_ids)
+        return {'rebuilt': len(pc_ids)}
+
+
+class CheckParticipationRollup(BackfillParticipationRollup):
+    """Compare ParticipationRollup to raw participant data.
+
+    Pages like BackfillParticipationRollup. Inconsistent project cohorts are
+    logged, and rebuilt if the `repair` param is true.
+    """
+    def process(self, pc_ids):
+        inconsistent = ParticipationRollup.check(pc_ids)
+        repair = self.get_param('repair', bool, False)
+        if repair:
+            ParticipationRollup.rebuild(inconsistent)
+        return {
+            'checked': len(pc_ids),
+            'inconsistent': inconsistent,
+            'repaired': repair,
+        }
+
+
 task_routes = [
+    Route('/task/backfill_dashboard_rows', BackfillDashboardRows),
+    Route('/task/backfill_participation_rollup', BackfillParticipationRollup),
+    Route('/task/backfill_survey_link_shards', BackfillSurveyLinkShards),
     Route('/task/cache_dashboard', CacheDashboard),
+    Route('/task/check_participation_rollup', CheckParticipationRollup),
     Route('/task/import_links/<program_label>/<survey_ordinal>', ImportLinks),
     Route('/task/import_links/<program_label>/<survey_ordinal>/<file_name>',
           ImportLinks),
     Route('/task/email_project/<project_id>/<slug>', EmailProject),
+    Route('/task/fan_out_notifications', FanOutNotifications),
+    Route('/task/process_task_events', ProcessTaskEvents),
+    Route('/task/recount_participation_rollup', RecountParticipationRollup),
+    Route('/task/refill_code_pool', RefillCodePool),
+    Route('/task/refresh_dashboard_rows', RefreshDashboardRows),
 ]
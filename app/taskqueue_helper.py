@@ -0,0 +1,23 @@
+"""Helpers for queueing App Engine tasks."""
+
+from google.appengine.api import namespace_manager
+
+
+def named_task_name(prefix, *parts):
+    """Name for a task that should run at most once per set of parts, e.g.
+    per debounce window.
+
+    Task names are unique across namespaces, which vary by branch, so the
+    current namespace is part of the name.
+    """
+    namespace = namespace_manager.get_namespace().replace('.', '_')
+    return '-'.join(str(p) for p in (prefix, namespace) + parts if p)
+
+
+def namespace_tag():
+    """Tag for pull tasks added in the current namespace.
+
+    Namespaces vary by branch, but they all share each pull queue, so each
+    worker leases only its own namespace's tasks.
+    """
+    return 'namespace:' + namespace_manager.get_namespace()
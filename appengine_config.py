@@ -23,5 +23,15 @@ def gae_mini_profiler_should_profile_development():
 
 def webapp_add_wsgi_middleware(app):
     import gae_mini_profiler.profiler
+    import identity_map
+    import instrumentation
+    import mysql_pool
     profiler_app = gae_mini_profiler.profiler.ProfilerWSGIMiddleware(app)
-    return profiler_app
+    # Scope cached entities to one request and report Datastore RPC counts
+    # in development.
+    identity_app = identity_map.middleware(profiler_app)
+    # Return any pooled MySQL connection a request leaves checked out.
+    pool_app = mysql_pool.middleware(identity_app)
+    # Count and time API and SQL calls of every request, with per-route
+    # aggregates at /api/instrumentation.
+    return instrumentation.middleware(pool_app)
@@ -0,0 +1,108 @@
+"""Shared measurement helpers for benchmarks. See run_benchmarks.py."""
+
+import datetime
+import json
+import os
+import subprocess
+import time
+
+import mysql_connection
+
+
+# Where write_results() saves files, unless BENCHMARK_RESULTS_DIR is set.
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already-sorted list."""
+    if not sorted_values:
+        return None
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def time_calls(fn, n):
+    """Call fn(i) n times, returning throughput and latency in ms."""
+    latencies = []
+    start = time.time()
+    for i in range(n):
+        call_start = time.time()
+        fn(i)
+        latencies.append((time.time() - call_start) * 1000)
+    elapsed = time.time() - start
+    return summarize(latencies, elapsed)
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'n': len(latencies),
+        'seconds': round(elapsed, 3),
+        'per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+def report(name, results):
+    """Print a labeled table of results keyed by variant name."""
+    print('\n== {} =='.format(name))
+    for variant, result in sorted(results.items()):
+        print('{:<30} {}'.format(variant, ', '.join(
+            '{}: {}'.format(k, round(v, 2) if isinstance(v, float) else v)
+            for k, v in sorted(result.items())
+        )))
+
+
+def mysql_status(name):
+    """A MySQL server status counter, e.g. 'Connections', as an int."""
+    with mysql_connection.connect() as sql:
+        rows = sql.select_query("SHOW GLOBAL STATUS LIKE %s", (name,))
+    return int(rows[0]['Value'])
+
+
+def sql_statement_count():
+    """Statements the MySQL server has received so far, from anyone.
+
+    Benchmarks run alone against the test database, so the difference
+    between two calls is what the code in between sent, plus one for the
+    first call itself.
+    """
+    return mysql_status('Questions')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(__file__),
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name, results, settings=None):
+    """Save results as json, for comparing commits with
+    compare_benchmarks.py.
+
+    Returns: str path of the file written.
+    """
+    results_dir = os.environ.get('BENCHMARK_RESULTS_DIR', RESULTS_DIR)
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+
+    commit = git_commit()
+    path = os.path.join(results_dir, '{}-{}.json'.format(
+        name, commit or 'unknown'))
+    with open(path, 'w') as fh:
+        json.dump({
+            'benchmark': name,
+            'commit': commit,
+            'created': datetime.datetime.utcnow().isoformat(),
+            'settings': settings or {},
+            'results': results,
+        }, fh, indent=2, sort_keys=True)
+
+    print('\nResults written to {}'.format(path))
+    return path
@@ -0,0 +1,124 @@
+"""Beacons per second through the cross_site.gif handler, synchronous versus
+write-behind. See beacon_queue.py."""
+
+import os
+import time
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from benchmarks import report, summarize, time_calls
+from model import (Checkpoint, Participant, ParticipantData,
+                   ParticipationRollup, Program, ProjectCohort, Survey)
+from unit_test_helper import ConsistencyTestCase
+import beacon_queue
+import config
+import mysql_connection
+
+
+NUM_PARTICIPANTS = 100
+# Like a participant moving through a survey, each sends several progress
+# values.
+PROGRESS_VALUES = ('1', '10', '33', '50', '66', '100')
+
+
+class BenchBeaconIngestion(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        super(BenchBeaconIngestion, self).set_up()
+
+        # The pull queue is defined in queue.yaml.
+        self.testbed.init_taskqueue_stub(
+            root_path=os.path.join(os.path.dirname(__file__), '..'))
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'checkpoint': Checkpoint.get_table_definition(),
+                'participant': Participant.get_table_definition(),
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+        application = webapp2.WSGIApplication(api_routes, debug=True)
+        self.testapp = webtest.TestApp(application)
+
+    def tear_down(self):
+        config.beacon_write_behind = False
+
+    def seed(self):
+        program_label = 'demo-program'
+        template = Program.get_config(program_label)['surveys'][0][
+            'survey_tasklist_template']
+        pc = ProjectCohort.create(
+            program_label=program_label,
+            organization_id='Organization_foo',
+            project_id='Project_foo',
+            cohort_label='2018',
+        )
+        pc.put()
+        survey = Survey.create(
+            template,
+            program_label=program_label,
+            organization_id='Organization_foo',
+            project_cohort_id=pc.uid,
+            ordinal=1,
+        )
+        survey.put()
+        participants = [
+            Participant.create(name='p{}'.format(x), organization_id='PERTS')
+            for x in range(NUM_PARTICIPANTS)
+        ]
+        Participant.put_multi(participants)
+
+        # Interleave participants as a classroom would.
+        return [
+            (p.uid, survey.uid, value)
+            for value in PROGRESS_VALUES
+            for p in participants
+        ]
+
+    def send(self, beacon):
+        participant_id, survey_id, value = beacon
+        self.testapp.get(
+            '/api/participants/{}/data/cross_site.gif'.format(participant_id),
+            params={'survey_id': survey_id, 'key': 'progress', 'value': value},
+        )
+
+    def test_beacons_per_second(self):
+        beacons = self.seed()
+        results = {}
+
+        config.beacon_write_behind = False
+        results['synchronous'] = time_calls(
+            lambda i: self.send(beacons[i]), len(beacons))
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+        config.beacon_write_behind = True
+        results['write-behind, request'] = time_calls(
+            lambda i: self.send(beacons[i]), len(beacons))
+
+        start = time.time()
+        flush_report = beacon_queue.flush(max_batches=100)
+        flush_seconds = time.time() - start
+        results['write-behind, flush'] = summarize(
+            [flush_seconds * 1000], flush_seconds)
+
+        total_seconds = (results['write-behind, request']['seconds'] +
+                         flush_seconds)
+        results['write-behind, end to end'] = {
+            'n': len(beacons),
+            'seconds': round(total_seconds, 3),
+            'per_second': round(len(beacons) / total_seconds, 1),
+        }
+
+        report('Beacon ingestion', results)
+        self.assertEqual(flush_report['written'], NUM_PARTICIPANTS)
@@ -0,0 +1,119 @@
+"""Cached properties of every project cohort in a large cohort, as when the
+dashboard's cache is cold. Compares building them one project cohort at a
+time with ProjectCohort.batch_cached_properties_from_db()."""
+
+from google.appengine.ext import ndb
+import time
+
+from benchmarks import report, sql_statement_count
+from model import Checkpoint, Organization, Project, ProjectCohort, Survey
+from unit_test_helper import ConsistencyTestCase
+import instrumentation
+import mysql_connection
+
+
+PROGRAM_LABEL = 'demo-program'
+COHORT_LABEL = '2017_spring'
+NUM_PROJECT_COHORTS = 2000
+SURVEYS_PER_PROJECT_COHORT = 2
+SEED_CHUNK_SIZE = 500
+
+
+class BenchCachedProperties(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        super(BenchCachedProperties, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({'checkpoint': Checkpoint.get_table_definition()})
+
+    def seed(self):
+        """Returns: list of project cohorts, each with its own org and
+        project, surveys, and a checkpoint per parent."""
+        entities = []
+        checkpoints = []
+        pcs = []
+        for x in range(NUM_PROJECT_COHORTS):
+            org = Organization.create(name='Bench College {}'.format(x))
+            project = Project.create(organization_id=org.uid,
+                                     program_label=PROGRAM_LABEL)
+            pc = ProjectCohort.create(
+                program_label=PROGRAM_LABEL,
+                organization_id=org.uid,
+                project_id=project.uid,
+                cohort_label=COHORT_LABEL,
+            )
+            surveys = [
+                Survey.create(
+                    [],
+                    program_label=PROGRAM_LABEL,
+                    organization_id=org.uid,
+                    project_cohort_id=pc.uid,
+                    ordinal=ordinal,
+                )
+                for ordinal in range(1, SURVEYS_PER_PROJECT_COHORT + 1)
+            ]
+            pc.survey_ids = [s.uid for s in surveys]
+            entities += [org, project, pc] + surveys
+            pcs.append(pc)
+
+            for parent in [org, project] + surveys:
+                checkpoints.append(Checkpoint.create(
+                    parent_id=parent.uid,
+                    label='bench_checkpoint',
+                    name='Bench Checkpoint',
+                    ordinal=1,
+                    program_label=PROGRAM_LABEL,
+                    cohort_label=COHORT_LABEL,
+                    organization_id=org.uid,
+                    project_id=project.uid,
+                    project_cohort_id=(pc.uid if parent in surveys
+                                       else None),
+                    survey_id=parent.uid if parent in surveys else None,
+                    status='incomplete',
+                ))
+
+        for i in range(0, len(entities), SEED_CHUNK_SIZE):
+            ndb.put_multi(entities[i:i + SEED_CHUNK_SIZE])
+        Checkpoint.insert_multi(checkpoints)
+        return pcs
+
+    def measure(self, fn):
+        ndb.get_context().clear_cache()
+        sql_before = sql_statement_count()
+        start = time.time()
+        with instrumentation.collect() as stats:
+            props_by_id = fn()
+        elapsed = time.time() - start
+        # Minus one for the second status query itself.
+        sql_statements = sql_statement_count() - sql_before - 1
+        return props_by_id, {
+            'seconds': round(elapsed, 3),
+            'datastore_rpcs': stats.counts['datastore'],
+            'sql_statements': sql_statements,
+        }
+
+    def test_cold_dashboard(self):
+        pcs = self.seed()
+
+        results = {}
+        singles, results['one at a time'] = self.measure(
+            lambda: {pc.uid: pc.get_cached_properties_from_db() for pc in pcs})
+        batched, results['batch'] = self.measure(
+            lambda: ProjectCohort.batch_cached_properties_from_db(
+                project_cohorts=pcs))
+
+        report('Cached properties of {} project cohorts'.format(len(pcs)),
+               results)
+
+        for pc in pcs:
+            self.assertEqual(
+                set(c.uid for c in batched[pc.uid]['checkpoints']),
+                set(c.uid for c in singles[pc.uid]['checkpoints']),
+            )
+            self.assertEqual(len(batched[pc.uid]['surveys']),
+                             SURVEYS_PER_PROJECT_COHORT)
+        # Round trips don't grow with the number of project cohorts.
+        self.assertEqual(results['batch']['sql_statements'], 1)
@@ -0,0 +1,89 @@
+"""Concurrent ProjectCohort.create() calls, as when many schools enroll right
+before a cohort opens. Compares generating and reserving codes in the request
+with allocating them from a pool reserved ahead of time. See
+model/codepool.py."""
+
+import threading
+import time
+
+from benchmarks import report, summarize
+from model import PooledCode, ProjectCohort
+from unit_test_helper import ConsistencyTestCase
+import config
+
+
+NUM_CALLERS = 300
+
+
+class BenchCodePool(ConsistencyTestCase):
+
+    # Production queries for pooled codes are eventually consistent.
+    consistency_probability = 0.5
+
+    def set_up(self):
+        super(BenchCodePool, self).set_up()
+        PooledCode.reset_reservoirs()
+
+    def tear_down(self):
+        config.code_pool_enabled = True
+        PooledCode.reset_reservoirs()
+
+    def stampede(self):
+        """Every caller enrolls at once."""
+        latencies = []
+        codes = []
+        errors = []
+        start_gate = threading.Event()
+
+        def call():
+            start_gate.wait()
+            call_start = time.time()
+            try:
+                pc = ProjectCohort.create(program_label='demo-program')
+            except Exception:
+                errors.append(1)
+            else:
+                codes.append(pc.code)
+            latencies.append((time.time() - call_start) * 1000)
+
+        threads = [threading.Thread(target=call) for x in range(NUM_CALLERS)]
+        for t in threads:
+            t.start()
+        start = time.time()
+        start_gate.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        result = summarize(latencies, elapsed)
+        result.update(
+            errors=len(errors),
+            duplicates=len(codes) - len(set(codes)),
+            lease_attempts=PooledCode.lease_stats['attempts'],
+            retries=PooledCode.lease_stats['collisions'],
+            from_reservoir=PooledCode.lease_stats['from_reservoir'],
+            pool_empty=PooledCode.stats['empty'],
+        )
+        return result
+
+    def test_stampede(self):
+        results = {}
+
+        config.code_pool_enabled = False
+        results['generated per request'] = self.stampede()
+
+        config.code_pool_enabled = True
+        PooledCode.reset_reservoirs()
+        refill_start = time.time()
+        refill = PooledCode.refill(target=NUM_CALLERS * 2)
+        refill_seconds = time.time() - refill_start
+        # Refills run well ahead of use, so the pool has had time to become
+        # consistent.
+        PooledCode.query().fetch()
+        results['pooled'] = self.stampede()
+        results['pooled']['refill_seconds'] = round(refill_seconds, 3)
+        results['pooled']['refill_collisions'] = refill['collisions']
+
+        report('ProjectCohort.create() stampede', results)
+        for result in results.values():
+            self.assertEqual(result['duplicates'], 0)
@@ -0,0 +1,143 @@
+"""Peak memory of the completion ids CSV export versus row count, buffered
+(the old select_query plus BytesIO approach) versus streamed. See
+csv_export.py."""
+
+from io import BytesIO
+import threading
+import time
+import unicodecsv
+
+from benchmarks import report
+from model import Participant, ParticipantData, ParticipationRollup
+from unit_test_helper import ConsistencyTestCase
+import csv_export
+import mysql_connection
+
+
+ROW_COUNTS = (1000, 10000, 50000)
+FIELDNAMES = ('token', 'percent_progress', 'module')
+PROJECT_COHORT_ID = 'ProjectCohort_bench'
+
+
+def current_rss_kb():
+    """Resident set size of this process right now. Linux only."""
+    with open('/proc/self/status') as fh:
+        for line in fh:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def peak_rss_growth_kb(fn):
+    """Run fn, sampling RSS in the background, and return the largest
+    growth over the starting RSS along with the elapsed seconds.
+
+    ru_maxrss can't be used because it never goes back down between
+    variants run in the same process.
+    """
+    baseline = current_rss_kb()
+    samples = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            samples.append(current_rss_kb())
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    start = time.time()
+    try:
+        fn()
+    finally:
+        elapsed = time.time() - start
+        done.set()
+        sampler.join()
+    samples.append(current_rss_kb())
+    return max(samples) - baseline, elapsed
+
+
+def buffered_export(query, params):
+    with mysql_connection.connect() as sql:
+        results = sql.select_query(query, params)
+    with BytesIO() as fh:
+        w = unicodecsv.DictWriter(fh, fieldnames=FIELDNAMES, encoding='utf-8')
+        w.writeheader()
+        for row in results:
+            w.writerow(row)
+        fh.seek(0)
+        csv_str = fh.read()
+    return len(csv_str)
+
+
+def streamed_export(query, params):
+    # Like a webapp2 response, keep the chunks, but never the row dicts.
+    body = []
+    for chunk in csv_export.csv_chunks(
+            csv_export.stream_rows(query, params), FIELDNAMES):
+        body.append(chunk)
+    return sum(len(c) for c in body)
+
+
+class BenchCsvExport(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        super(BenchCsvExport, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'participant': Participant.get_table_definition(),
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+    def seed(self, start, stop):
+        participants = [
+            Participant.create(name='token-{:06d}'.format(x),
+                               organization_id='Organization_bench')
+            for x in range(start, stop)
+        ]
+        Participant.put_multi(participants)
+        pds = [
+            ParticipantData.create(
+                key='progress',
+                value=str(x % 101),
+                participant_id=p.uid,
+                program_label='demo-program',
+                cohort_label='2018',
+                project_cohort_id=PROJECT_COHORT_ID,
+                code='bench code',
+                survey_id='Survey_bench',
+                survey_ordinal=1,
+            )
+            for x, p in enumerate(participants)
+        ]
+        # upsert_batch writes in one statement; chunk to stay under
+        # max_allowed_packet.
+        for i in range(0, len(pds), 1000):
+            ParticipantData.upsert_batch(pds[i:i + 1000])
+
+    def test_peak_rss(self):
+        query, params = ParticipantData.completion_ids_query(
+            project_cohort_id=PROJECT_COHORT_ID)
+        results = {}
+        seeded = 0
+
+        for n in ROW_COUNTS:
+            self.seed(seeded, n)
+            seeded = n
+
+            for name, fn in (('buffered', buffered_export),
+                             ('streamed', streamed_export)):
+                size = []
+                growth_kb, elapsed = peak_rss_growth_kb(
+                    lambda: size.append(fn(query, params)))
+                results['{:>6} rows, {}'.format(n, name)] = {
+                    'peak_rss_growth_kb': growth_kb,
+                    'seconds': round(elapsed, 3),
+                    'csv_bytes': size[0],
+                }
+
+        report('Completion ids CSV export', results)
@@ -0,0 +1,113 @@
+"""Participation endpoint latency and MySQL connections per request, with a
+fresh connection per query versus pooled connections. See mysql_pool.py."""
+
+from google.appengine.api import memcache
+import datetime
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from benchmarks import mysql_status, report, time_calls
+from model import (Participant, ParticipantData, ParticipationRollup,
+                   ProjectCohort, User)
+from unit_test_helper import ConsistencyTestCase, jwt_headers
+import config
+import mysql_connection
+import mysql_pool
+
+
+NUM_PROJECT_COHORTS = 20
+PARTICIPANTS_PER_PROJECT_COHORT = 50
+NUM_REQUESTS = 200
+
+
+class BenchMySqlPool(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        super(BenchMySqlPool, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'participant': Participant.get_table_definition(),
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+        application = webapp2.WSGIApplication(api_routes, debug=True)
+        self.testapp = webtest.TestApp(mysql_pool.middleware(application))
+
+    def tear_down(self):
+        config.mysql_pool_enabled = True
+
+    def seed(self):
+        pcs = [
+            ProjectCohort.create(
+                program_label='demo-program',
+                organization_id='Organization_bench',
+                project_id='Project_bench',
+                cohort_label='2017_spring',
+            )
+            for x in range(NUM_PROJECT_COHORTS)
+        ]
+        ProjectCohort.put_multi(pcs)
+
+        pds = [
+            ParticipantData.create(
+                key='progress',
+                value=str((x % 3 + 1) * 33),
+                participant_id='Participant_{}_{}'.format(pc.short_uid, x),
+                program_label='demo-program',
+                cohort_label='2017_spring',
+                project_cohort_id=pc.uid,
+                code=pc.code,
+                survey_id='Survey_bench',
+                survey_ordinal=1,
+            )
+            for pc in pcs
+            for x in range(PARTICIPANTS_PER_PROJECT_COHORT)
+        ]
+        ParticipantData.upsert_batch(pds)
+        return pcs
+
+    def test_connections_per_request(self):
+        pcs = self.seed()
+        sup = User.create(email='super@perts.net', user_type='super_admin')
+        sup.put()
+        headers = jwt_headers(sup)
+
+        # Partial days at both ends, so each request reads the rollup and
+        # raw data for each edge.
+        now = datetime.datetime.utcnow()
+        params = {
+            'start': (now - datetime.timedelta(days=7, hours=3)).strftime(
+                config.iso_datetime_format),
+            'end': (now + datetime.timedelta(hours=3)).strftime(
+                config.iso_datetime_format),
+        }
+
+        def request(i):
+            # Participation is cached; measure the SQL path.
+            memcache.flush_all()
+            self.testapp.get(
+                '/api/project_cohorts/{}/participation'.format(
+                    pcs[i % len(pcs)].uid),
+                params=params,
+                headers=headers,
+            )
+
+        results = {}
+        for name, enabled in (('fresh connections', False), ('pooled', True)):
+            config.mysql_pool_enabled = enabled
+            request(0)  # warm up
+
+            before = mysql_status('Connections')
+            results[name] = time_calls(request, NUM_REQUESTS)
+            # Minus one for the second status query itself.
+            opened = mysql_status('Connections') - before - 1
+            results[name]['connections_per_request'] = (
+                float(opened) / NUM_REQUESTS)
+
+        report('MySQL connections, participation endpoint', results)
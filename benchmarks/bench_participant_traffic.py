@@ -0,0 +1,245 @@
+"""Latency, throughput, and RPC/SQL counts of the participant portal's
+endpoints under a realistic traffic mix.
+
+Seeds organizations, project cohorts, and surveys like the Seed handler
+(api_handlers.Seed), plus participants and participant_data rows, then
+replays a random but repeatable mix of requests:
+
+* POST /api/participants, as the portal does when someone signs in,
+* GET /api/participants/<id>/data, to resume where they left off,
+* cross_site.gif beacons, as they move through the survey, and
+* participation summaries, as dashboards and Copilot poll.
+
+Sizes default to something that runs in a minute or two. Set environment
+variables to seed production-like volumes, e.g.
+
+> BENCH_PROJECT_COHORTS=3000 BENCH_PARTICIPANT_DATA=1000000 \\
+>   python run_benchmarks.py bench_participant_traffic
+
+Results are written as json, see benchmarks.write_results(). Compare two
+commits with compare_benchmarks.py.
+"""
+
+from google.appengine.ext import ndb
+import collections
+import os
+import random
+import time
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from benchmarks import (report, sql_statement_count, summarize,
+                        write_results)
+from model import (Organization, Participant, ParticipantData,
+                   ParticipationRollup, Program, Project, ProjectCohort,
+                   Survey, User)
+from unit_test_helper import ConsistencyTestCase, jwt_headers
+import config
+import instrumentation
+import mysql_connection
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+PROGRAM_LABEL = 'demo-program'
+COHORT_LABEL = '2017_spring'
+
+NUM_PROJECT_COHORTS = env_int('BENCH_PROJECT_COHORTS', 200)
+NUM_PARTICIPANT_DATA = env_int('BENCH_PARTICIPANT_DATA', 20000)
+NUM_REQUESTS = env_int('BENCH_REQUESTS', 1000)
+
+# Relative frequency of each kind of request.
+TRAFFIC_MIX = (
+    ('post_participant', 2),
+    ('get_participant_data', 3),
+    ('beacon', 4),
+    ('participation', 1),
+)
+
+# Project cohorts per batch participation request, like Copilot.
+PARTICIPATION_BATCH_SIZE = 20
+
+SEED_CHUNK_SIZE = 1000
+
+
+class BenchParticipantTraffic(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        super(BenchParticipantTraffic, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'participant': Participant.get_table_definition(),
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+        application = webapp2.WSGIApplication(api_routes, debug=True)
+        self.testapp = webtest.TestApp(application)
+
+        self.random = random.Random(0)
+
+    def seed(self):
+        """Returns: tuple of (list of (pc, survey), list of participants)."""
+        program = Program.get_config(PROGRAM_LABEL)
+        template = program['surveys'][0]['survey_tasklist_template']
+
+        # Put directly rather than one at a time like the Seed handler does;
+        # tasklists aren't part of the participant portal.
+        orgs, projects, pcs, surveys = [], [], [], []
+        for x in range(NUM_PROJECT_COHORTS):
+            org = Organization.create(name='Bench College {}'.format(x))
+            project = Project.create(organization_id=org.uid,
+                                     program_label=PROGRAM_LABEL)
+            pc = ProjectCohort.create(
+                program_label=PROGRAM_LABEL,
+                organization_id=org.uid,
+                project_id=project.uid,
+                cohort_label=COHORT_LABEL,
+            )
+            survey = Survey.create(
+                template,
+                program_label=PROGRAM_LABEL,
+                organization_id=org.uid,
+                project_cohort_id=pc.uid,
+                ordinal=1,
+            )
+            orgs.append(org)
+            projects.append(project)
+            pcs.append(pc)
+            surveys.append(survey)
+        entities = orgs + projects + pcs + surveys
+        for i in range(0, len(entities), SEED_CHUNK_SIZE):
+            ndb.put_multi(entities[i:i + SEED_CHUNK_SIZE])
+
+        # About as many participants as data rows per participant in a
+        # typical survey (progress plus a few others).
+        keys = ('progress', 'saw_baseline', 'condition', 'ep_assent')
+        num_participants = max(1, NUM_PARTICIPANT_DATA // len(keys))
+        participants = []
+        for start in range(0, num_participants, SEED_CHUNK_SIZE):
+            chunk = [
+                Participant.create(
+                    name='bench-{:07d}'.format(x),
+                    organization_id=orgs[x % len(orgs)].uid,
+                )
+                for x in range(start,
+                               min(start + SEED_CHUNK_SIZE, num_participants))
+            ]
+            Participant.put_multi(chunk)
+            participants += chunk
+
+            pds = []
+            for x, p in enumerate(chunk, start):
+                pc, survey = pcs[x % len(pcs)], surveys[x % len(surveys)]
+                for key in keys:
+                    pds.append(ParticipantData.create(
+                        key=key,
+                        value=(str(self.random.choice((1, 33, 66, 100)))
+                               if key == 'progress' else 'true'),
+                        participant_id=p.uid,
+                        program_label=PROGRAM_LABEL,
+                        cohort_label=COHORT_LABEL,
+                        project_cohort_id=pc.uid,
+                        code=pc.code,
+                        survey_id=survey.uid,
+                        survey_ordinal=1,
+                    ))
+            ParticipantData.upsert_batch(pds)
+
+        return zip(pcs, surveys), participants
+
+    def requests(self, pc_surveys, participants):
+        """Generate (endpoint name, function making the request)."""
+        names = [name for name, weight in TRAFFIC_MIX for x in range(weight)]
+        sup = User.create(email='super@perts.net', user_type='super_admin')
+        sup.put()
+        headers = jwt_headers(sup)
+
+        for i in range(NUM_REQUESTS):
+            name = self.random.choice(names)
+            pc, survey = self.random.choice(pc_surveys)
+            participant = self.random.choice(participants)
+
+            if name == 'post_participant':
+                # Half new, half the duplicate posts slow networks make.
+                params = (
+                    {'name': 'new-{:07d}'.format(i),
+                     'organization_id': pc.organization_id}
+                    if i % 2 else
+                    {'name': participant.name,
+                     'organization_id': participant.organization_id}
+                )
+                fn = lambda p=params: self.testapp.post_json(
+                    '/api/participants', p, status=(200, 303))
+            elif name == 'get_participant_data':
+                fn = lambda p=participant: self.testapp.get(
+                    '/api/participants/{}/data'.format(p.uid))
+            elif name == 'beacon':
+                fn = lambda p=participant, s=survey: self.testapp.get(
+                    '/api/participants/{}/data/cross_site.gif'.format(p.uid),
+                    params={'survey_id': s.uid, 'key': 'progress',
+                            'value': str(self.random.randint(1, 100))},
+                )
+            elif name == 'participation':
+                uids = [other.uid for other, s in self.random.sample(
+                    pc_surveys,
+                    min(PARTICIPATION_BATCH_SIZE, len(pc_surveys)))]
+                fn = lambda uids=uids: self.testapp.get(
+                    '/api/project_cohorts/participation',
+                    params={'uid': uids},
+                    headers=headers,
+                )
+
+            yield name, fn
+
+    def test_traffic_mix(self):
+        start = time.time()
+        pc_surveys, participants = self.seed()
+        seed_seconds = time.time() - start
+
+        latencies = collections.defaultdict(list)
+        rpcs = collections.defaultdict(collections.Counter)
+        sql_statements = collections.Counter()
+
+        run_start = time.time()
+        for name, fn in self.requests(pc_surveys, participants):
+            sql_before = sql_statement_count()
+
+            call_start = time.time()
+            with instrumentation.collect() as stats:
+                fn()
+            latencies[name].append((time.time() - call_start) * 1000)
+
+            # Minus one for the second count itself.
+            sql_statements[name] += sql_statement_count() - sql_before - 1
+            rpcs[name].update(stats.counts)
+        run_seconds = time.time() - run_start
+
+        results = {}
+        for name, values in latencies.items():
+            n = len(values)
+            result = summarize(values, sum(values) / 1000)
+            result['sql_per_request'] = round(
+                float(sql_statements[name]) / n, 2)
+            for kind in ('datastore', 'memcache', 'taskqueue'):
+                result['{}_rpcs_per_request'.format(kind)] = round(
+                    float(rpcs[name][kind]) / n, 2)
+            results[name] = result
+        results['all'] = summarize(
+            [v for values in latencies.values() for v in values], run_seconds)
+
+        report('Participant traffic', results)
+        write_results('participant_traffic', results, settings={
+            'project_cohorts': NUM_PROJECT_COHORTS,
+            'participant_data': NUM_PARTICIPANT_DATA,
+            'requests': NUM_REQUESTS,
+            'seed_seconds': round(seed_seconds, 1),
+            'beacon_write_behind': config.beacon_write_behind,
+        })
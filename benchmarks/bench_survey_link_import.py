@@ -0,0 +1,134 @@
+"""Importing a large Qualtrics csv of unique links from cloud storage.
+Compares the original serial import (a blocking put_multi() every 100 rows)
+with async adaptive batches, in one task and in byte-range tasks run in
+parallel. See SurveyLink.import_range()."""
+
+from google.appengine.ext import ndb
+import csv
+import random
+import threading
+import time
+
+import cloudstorage as gcs
+
+from benchmarks import report
+from model import SurveyLink, SurveyLinkImport
+from unit_test_helper import ConsistencyTestCase
+import instrumentation
+import model.surveylink as surveylink
+
+
+PROGRAM_LABEL = 'demo-program'
+NUM_LINKS = 100000
+# About ten ranges for NUM_LINKS rows.
+SHARD_BYTES = 2 * 1024 * 1024
+
+
+def serial_import(path):
+    """How links were imported before byte ranges and async writes."""
+    num_imported = 0
+    link_batch = []
+    with gcs.open(path, 'r') as fh:
+        for row in csv.DictReader(fh):
+            link_batch.append(SurveyLink(
+                id=row['Link'],
+                program_label=PROGRAM_LABEL,
+                survey_ordinal=1,
+                shard=random.randrange(surveylink.NUM_SHARDS),
+            ))
+            if len(link_batch) == 100:
+                ndb.put_multi(link_batch)
+                num_imported += len(link_batch)
+                link_batch = []
+    if link_batch:
+        ndb.put_multi(link_batch)
+        num_imported += len(link_batch)
+    return num_imported
+
+
+class BenchSurveyLinkImport(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        super(BenchSurveyLinkImport, self).set_up()
+
+        # Needed for gcs interaction.
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_blobstore_stub()
+
+    def write_csv(self):
+        path = SurveyLink.import_path(PROGRAM_LABEL, 1, 'bench.csv')
+        rows = ['"Response ID","Last Name","First Name",'
+                '"External Data Reference","Email","Status","End Date",'
+                '"Link","Link Expiration"']
+        rows += [
+            '"","","","","bench{0}@example.com","Email Not Sent Yet","",'
+            '"https://sshs.qualtrics.com/SE?Q_DL=bench_{0:07d}_MLRP",'
+            '"2050-02-16 16:10:00"'.format(x)
+            for x in range(NUM_LINKS)
+        ]
+        with gcs.open(path, 'w') as fh:
+            fh.write('\n'.join(rows))
+        return path
+
+    def measure(self, fn):
+        ndb.delete_multi(SurveyLink.query().fetch(keys_only=True))
+        ndb.delete_multi(SurveyLinkImport.query().fetch(keys_only=True))
+        ndb.get_context().clear_cache()
+
+        start = time.time()
+        with instrumentation.collect() as stats:
+            num_imported = fn()
+        elapsed = time.time() - start
+
+        return {
+            'num_imported': num_imported,
+            'seconds': round(elapsed, 3),
+            'per_second': round(num_imported / elapsed, 1),
+            'datastore_rpcs': stats.counts['datastore'],
+        }
+
+    def test_import(self):
+        path = self.write_csv()
+
+        def parallel():
+            """Like one task per range, all running at once."""
+            counts = []
+            thread_stats = []
+
+            def run(start, end):
+                with instrumentation.collect() as stats:
+                    counts.append(SurveyLink.import_range(
+                        PROGRAM_LABEL, 1, path, start, end)['num_imported'])
+                thread_stats.append(stats)
+
+            threads = [
+                threading.Thread(target=run, args=r)
+                for r in SurveyLink.import_shards(path, SHARD_BYTES)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # Calls are collected per thread. Count the workers' toward
+            # measure()'s.
+            for stats in thread_stats:
+                instrumentation.current().counts.update(stats.counts)
+            return sum(counts)
+
+        results = {
+            'serial, put_multi per 100': self.measure(
+                lambda: serial_import(path)),
+            'one range, async batches': self.measure(
+                lambda: SurveyLink.import_range(
+                    PROGRAM_LABEL, 1, path)['num_imported']),
+            'parallel ranges': self.measure(parallel),
+        }
+
+        report('SurveyLink import, {} rows'.format(NUM_LINKS), results)
+        for result in results.values():
+            self.assertEqual(result['num_imported'], NUM_LINKS)
+
+        gcs.delete(path)
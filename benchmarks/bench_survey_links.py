@@ -0,0 +1,133 @@
+"""Concurrent calls to /api/survey_links/<program>/<ordinal>/get_unique, as
+when a whole class period starts at once. Compares the original allocation
+(one shared query, one link per transaction) with block leases, of links
+imported before sharding and after."""
+
+import threading
+import time
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from benchmarks import report, summarize
+from google.appengine.ext import ndb
+from model import SurveyLink
+from unit_test_helper import ConsistencyTestCase
+
+
+NUM_LINKS = 2000
+NUM_CALLERS = 300
+
+
+@ndb.transactional
+def datastore_pop(key):
+    link = key.get()
+    if link:
+        key.delete()
+    return link
+
+
+def original_get_unique(klass, program_label, survey_ordinal):
+    """How links were allocated before sharding and reservoirs: every caller
+    queries for the first link and tries to pop it."""
+    real_link = None
+    tries = 0
+    while not real_link and tries < 50:
+        query = klass.query(SurveyLink.program_label == program_label,
+                            SurveyLink.survey_ordinal == survey_ordinal)
+        possible_link = query.get()
+        tries += 1
+        if possible_link:
+            real_link = datastore_pop(possible_link.key)
+    return real_link
+
+
+class BenchSurveyLinks(ConsistencyTestCase):
+
+    # Production queries for links are eventually consistent.
+    consistency_probability = 0.5
+
+    def set_up(self):
+        super(BenchSurveyLinks, self).set_up()
+        application = webapp2.WSGIApplication(api_routes, debug=True)
+        self.app = application
+        self.get_unique = SurveyLink.__dict__['get_unique']
+
+    def tear_down(self):
+        SurveyLink.get_unique = self.get_unique
+        SurveyLink.reset_reservoirs()
+
+    def seed(self, sharded):
+        links = [
+            SurveyLink(
+                id='https://example.qualtrics.com/{}'.format(x),
+                program_label='demo-program',
+                survey_ordinal=1,
+                shard=(x % SurveyLink.num_shards) if sharded else None,
+            )
+            for x in range(NUM_LINKS)
+        ]
+        ndb.put_multi(links)
+        # Links are uploaded well ahead of use, so they've had time to
+        # become consistent.
+        ndb.get_multi([l.key for l in links])
+
+    def stampede(self):
+        """Every caller hits the endpoint at once."""
+        latencies = []
+        urls = []
+        errors = []
+        start_gate = threading.Event()
+
+        def call():
+            testapp = webtest.TestApp(self.app)
+            start_gate.wait()
+            call_start = time.time()
+            response = testapp.post(
+                '/api/survey_links/demo-program/1/get_unique',
+                expect_errors=True,
+            )
+            latencies.append((time.time() - call_start) * 1000)
+            if response.status_int == 200:
+                urls.append(response.json['url'])
+            else:
+                errors.append(response.status_int)
+
+        threads = [threading.Thread(target=call) for x in range(NUM_CALLERS)]
+        for t in threads:
+            t.start()
+        start = time.time()
+        start_gate.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        result = summarize(latencies, elapsed)
+        result.update(
+            not_found=len(errors),
+            duplicates=len(urls) - len(set(urls)),
+            lease_attempts=SurveyLink.lease_stats['attempts'],
+            retries=SurveyLink.lease_stats['collisions'],
+            from_reservoir=SurveyLink.lease_stats['from_reservoir'],
+        )
+        return result
+
+    def run_case(self, sharded):
+        ndb.delete_multi(SurveyLink.query().fetch(keys_only=True))
+        SurveyLink.reset_reservoirs()
+        self.seed(sharded=sharded)
+        return self.stampede()
+
+    def test_stampede(self):
+        results = {}
+
+        SurveyLink.get_unique = classmethod(original_get_unique)
+        results['original, first link'] = self.run_case(sharded=False)
+
+        SurveyLink.get_unique = self.get_unique
+        results['unsharded, block lease'] = self.run_case(sharded=False)
+        results['sharded, block lease'] = self.run_case(sharded=True)
+
+        report('SurveyLink get_unique stampede', results)
+        for result in results.values():
+            self.assertEqual(result['duplicates'], 0)
@@ -0,0 +1,82 @@
+"""Task.to_client_dict() over many tasks, as when rendering a large
+dashboard. Compares indexed template lookup (see Program.compiled()) with
+searching the program config for every task."""
+
+from benchmarks import report, time_calls
+from model import DatastoreModel, Organization, Program, Project, Survey, Task
+from unit_test_helper import ConsistencyTestCase
+import organization_tasks
+
+
+NUM_TASKS = 10000
+
+
+def linear_task_config(task):
+    """How task configs were found before they were indexed."""
+    parent_kind = DatastoreModel.get_kind(
+        DatastoreModel.get_parent_uid(task.uid))
+    if parent_kind == 'Organization':
+        tasklist = organization_tasks.tasklist_template
+    elif parent_kind == 'Project':
+        tasklist = Program.get_config(task.program_label)[
+            'project_tasklist_template']
+    else:
+        tasklist = [
+            c for s in Program.get_config(task.program_label)['surveys']
+            for c in s['survey_tasklist_template']
+        ]
+    for checkpoint in tasklist:
+        for t in checkpoint['tasks']:
+            if t['label'] == task.label:
+                return t
+    return task.default_config.copy()
+
+
+class BenchTaskClientDict(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def tasks(self):
+        """Tasks from every part of a realistic program, in memory."""
+        program_label = 'cg17'
+        config = Program.get_config(program_label)
+        org = Organization.create(name='Foo College')
+        project = Project.create(program_label=program_label,
+                                 organization_id=org.uid)
+        survey = Survey.create([], program_label=program_label,
+                               organization_id=org.uid, ordinal=1)
+
+        parents_templates = [(org, organization_tasks.tasklist_template),
+                             (project, config['project_tasklist_template'])]
+        parents_templates += [(survey, s['survey_tasklist_template'])
+                              for s in config['surveys']]
+        templates = [
+            (parent, t)
+            for parent, tasklist in parents_templates
+            for checkpoint in tasklist
+            for t in checkpoint['tasks']
+        ]
+
+        tasks = []
+        for x in range(NUM_TASKS):
+            parent, template = templates[x % len(templates)]
+            tasks.append(Task.create(template['label'], 1, 'Checkpoint_foo',
+                                     parent=parent,
+                                     program_label=program_label))
+        return tasks
+
+    def test_to_client_dict(self):
+        tasks = self.tasks()
+        results = {}
+
+        results['linear search'] = time_calls(
+            lambda i: linear_task_config(tasks[i]), len(tasks))
+        results['indexed'] = time_calls(
+            lambda i: tasks[i].get_task_config(), len(tasks))
+        results['to_client_dict'] = time_calls(
+            lambda i: tasks[i].to_client_dict(), len(tasks))
+
+        report('Task config lookup', results)
+
+        for t in tasks[:100]:
+            self.assertIs(t.get_task_config(), linear_task_config(t))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Compare two benchmark results files, e.g. from before and after a change.
+
+> python compare_benchmarks.py old.json new.json [threshold]
+
+Results files are written by benchmarks.write_results(). Every numeric
+measurement present in both is listed with its relative change. Latencies
+(*_ms) and per-request counts (*_per_request) that grew by more than the
+threshold (default 0.2, i.e. 20%) are flagged as regressions, and the script
+exits non-zero if there are any, so it can gate a build.
+
+Unlike run_benchmarks.py this needs nothing but python.
+"""
+
+import json
+import sys
+
+
+DEFAULT_THRESHOLD = 0.2
+
+# Measurements where bigger is worse.
+REGRESSION_SUFFIXES = ('_ms', '_per_request')
+
+
+def load(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD):
+    """Returns: tuple of (list of printable lines, int number of
+    regressions)."""
+    lines = ['{} ({}) vs. {} ({})'.format(
+        old['benchmark'], old.get('commit'),
+        new['benchmark'], new.get('commit'))]
+    regressions = 0
+
+    for variant in sorted(set(old['results']) & set(new['results'])):
+        lines.append('\n' + variant)
+        old_result = old['results'][variant]
+        new_result = new['results'][variant]
+        for measure in sorted(set(old_result) & set(new_result)):
+            before, after = old_result[measure], new_result[measure]
+            if not all(isinstance(v, (int, float)) for v in (before, after)):
+                continue
+
+            change = (float(after) - before) / before if before else None
+            regressed = (
+                change is not None and change > threshold and
+                measure.endswith(REGRESSION_SUFFIXES)
+            )
+            regressions += regressed
+            lines.append('  {:<36} {:>12} {:>12} {:>9}{}'.format(
+                measure, before, after,
+                '' if change is None else '{:+.0%}'.format(change),
+                '  REGRESSION' if regressed else '',
+            ))
+
+    return lines, regressions
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print(__doc__)
+        sys.exit(2)
+
+    threshold = float(sys.argv[3]) if len(sys.argv) == 4 else DEFAULT_THRESHOLD
+    lines, regressions = compare(load(sys.argv[1]), load(sys.argv[2]),
+                                 threshold)
+    print('\n'.join(lines))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,9 @@
+/* TAKE DOWN checkpoint composite indexes */
+
+ALTER TABLE `checkpoint`
+  DROP INDEX `parent_kind-organization`,
+  DROP INDEX `parent_kind-project`,
+  DROP INDEX `parent_kind-project_cohort`,
+  DROP INDEX `parent_kind-program`,
+  DROP INDEX `parent-ordinal`,
+  DROP INDEX `project_cohort`;
@@ -0,0 +1,11 @@
+/* Composite indexes for the ways we actually read checkpoints, so that task
+lists and dashboards stop scanning the whole table. See
+Checkpoint.for_tasklists() and Checkpoint.for_organizations_in_program(). */
+
+ALTER TABLE `checkpoint`
+  ADD INDEX `parent_kind-organization` (`parent_kind`, `organization_id`, `ordinal`),
+  ADD INDEX `parent_kind-project` (`parent_kind`, `project_id`, `ordinal`),
+  ADD INDEX `parent_kind-project_cohort` (`parent_kind`, `project_cohort_id`, `ordinal`),
+  ADD INDEX `parent_kind-program` (`parent_kind`, `program_label`),
+  ADD INDEX `parent-ordinal` (`parent_id`, `ordinal`),
+  ADD INDEX `project_cohort` (`project_cohort_id`);
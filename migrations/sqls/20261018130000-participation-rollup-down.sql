@@ -0,0 +1,3 @@
+/* TAKE DOWN participation rollup */
+
+DROP TABLE `participation_rollup`;
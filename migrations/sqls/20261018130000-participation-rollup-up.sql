@@ -0,0 +1,18 @@
+/* Participation counts by day, see model/participationrollup.py. Fill it
+with GET /task/backfill_participation_rollup after migrating. */
+
+CREATE TABLE `participation_rollup` (
+  `project_cohort_id` varchar(50) NOT NULL,
+  `survey_id` varchar(50) NOT NULL,
+  `value` varchar(50) NOT NULL,
+  `day` date NOT NULL,
+  `survey_ordinal` tinyint(3) unsigned DEFAULT NULL,
+  `program_label` varchar(50) DEFAULT NULL,
+  `cohort_label` varchar(50) DEFAULT NULL,
+  `code` varchar(50) DEFAULT NULL,
+  `n` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`project_cohort_id`, `survey_id`, `value`, `day`),
+  KEY `survey-day` (`survey_id`, `day`),
+  KEY `program-cohort-day` (`program_label`, `cohort_label`, `day`),
+  KEY `code-day` (`code`, `day`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
@@ -0,0 +1,3 @@
+/* TAKE DOWN dashboard rows */
+
+DROP TABLE `dashboard_row`;
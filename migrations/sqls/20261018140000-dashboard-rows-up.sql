@@ -0,0 +1,15 @@
+/* Precomputed super dashboard rows, see model/dashboardrow.py. They're
+filled in by /cron/cache_dashboards after migrating. */
+
+CREATE TABLE `dashboard_row` (
+  `project_cohort_id` varchar(50) NOT NULL,
+  `organization_id` varchar(50) NOT NULL,
+  `program_label` varchar(50) NOT NULL,
+  `cohort_label` varchar(50) NOT NULL,
+  `document` mediumtext NOT NULL,
+  `summary` text NOT NULL,
+  `materialized` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`project_cohort_id`),
+  KEY `program-cohort` (`program_label`, `cohort_label`),
+  KEY `organization` (`organization_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
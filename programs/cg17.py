@@ -56,6 +56,12 @@ config = {
         }
     },
     'default_cohort': "2017_spring",
+    # RServe scripts run for every open project cohort in the current cohort
+    # by /cron/rserve/reports. Each posts its report as an attachment to the
+    # task with this label. See rserve_reports.py.
+    'rserve_reports': [
+        {'script': 'cg', 'task_label': 'cg17_survey__report_1'},
+    ],
     'project_tasklist_template': [
         # project checkpoint
         {
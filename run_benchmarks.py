@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Run python performance benchmarks from the command line.
+
+Benchmarks live in the benchmarks folder, are named bench_*.py, and are
+written as unittest cases so they get the same App Engine testbed stubs and
+MySQL test database as our unit tests. They print their measurements rather
+than asserting on them.
+
+Add a module name as the first argument to run only that file, e.g.
+> python run_benchmarks.py bench_beacon_ingestion
+
+Some also save their results as json, see benchmarks.write_results(), so runs
+on different commits can be compared with compare_benchmarks.py.
+
+Setup here mirrors run_tests.py.
+"""
+
+import unittest
+import ruamel.yaml
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'gae_server'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+import branch_environment
+
+# Tell python where it can find the app engine sdk.
+# https://cloud.google.com/appengine/docs/python/tools/localunittesting?hl=en#Python_Setting_up_a_testing_framework
+# Path for Codeship.
+sys.path.insert(0, '/home/rof/appengine/python_appengine')
+# Paths for local testing.
+sys.path.insert(0, '/usr/local/google_appengine')
+sys.path.insert(0, '/usr/local/google-cloud-sdk/platform/google_appengine')
+sys.path.insert(0, '/usr/local/Caskroom/google-cloud-sdk/latest/google-cloud-sdk/platform/google_appengine/')
+user_path = os.path.expanduser('~/google-cloud-sdk/platform/google_appengine')
+sys.path.insert(0, user_path)
+
+# 2018-10-11 We found that the fix_sys_path() function started changing the
+# script's working directory, so any downstream use of the filesystem was
+# broken. Hack around this by restoring the cwd. Note that we can't just stop
+# using this function because it allows tests to load SDK-provided python libs,
+# like webapp2.
+original_cwd = os.getcwd()
+import dev_appserver
+dev_appserver.fix_sys_path()
+os.chdir(original_cwd)
+
+# We modify the import paths in this project, so similarly modify them during
+# testing.
+import appengine_config
+
+# PERTS code expects this to be set so we can detect deployed vs.
+# not deployed (SDK i.e. dev_appserver). See environment functions like
+# is_localhost() in util.py.
+# Also important for unit testing cloudstorage api, which checks this value to
+# decide if it will talk to a stub service or the real GCS.
+os.environ['SERVER_SOFTWARE'] = 'Development/X.Y'
+
+bench_arg = sys.argv[1] if len(sys.argv) == 2 else None
+
+# Read through app.yaml and set an environment variables that are present.
+with open('app.yaml', 'r') as file_handle:
+    # Read as a dictionary.
+    app_yaml = ruamel.yaml.load(file_handle.read(), ruamel.yaml.Loader)
+
+for key, value in app_yaml['env_variables'].items():
+    os.environ[key] = value
+
+branch = branch_environment.get_branch()
+conf = branch_environment.load_branch_conf(branch)
+os.environ['APPLICATION_ID'] = conf['app.yaml']['PROJECT_ID']
+
+if bench_arg:
+    suite = unittest.loader.TestLoader().loadTestsFromName(
+        'benchmarks.' + bench_arg)
+else:
+    suite = unittest.loader.TestLoader().discover(
+        'benchmarks', pattern='bench_*.py')
+
+test_result = unittest.TextTestRunner(verbosity=2).run(suite)
+
+sys.exit(0 if test_result.wasSuccessful() else 1)
@@ -245,19 +245,21 @@ import ValidationError from 'utils/ValidationError';
       // forgiving regex to separate the code and the session.
       // N.B. this runs after stripCode() so we don't have to worry about
       // whitespace or case.
-      let codeWord1, codeWord2, session;
+      // Codes have two or more words; pooled codes get longer as the
+      // shorter ones run out (see app/model/codepool.py).
+      let code, session;
       // Should handle things like "trout viper1" or "trout viper 1foo"
-      const withSession = /^([a-z]+) ([a-z]+) ?(\d+).*$/;
-      const withoutSession = /^([a-z]+) ([a-z]+)$/;
+      const withSession = /^([a-z]+(?: [a-z]+)+) ?(\d+).*$/;
+      const withoutSession = /^([a-z]+(?: [a-z]+)+)$/;
       if (withSession.test(codeInput)) {
-        [, codeWord1, codeWord2, session] = withSession.exec(codeInput);
+        [, code, session] = withSession.exec(codeInput);
         vm.session = parseInt(session, 10);
       } else if (withoutSession.test(codeInput)) {
-        [, codeWord1, codeWord2] = withoutSession.exec(codeInput);
+        [, code] = withoutSession.exec(codeInput);
       } else {
         return codeErrorCallback();
       }
-      vm.code = `${codeWord1} ${codeWord2}`;
+      vm.code = code;
       return vm.code;
     };
 
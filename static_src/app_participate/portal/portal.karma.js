@@ -82,6 +82,12 @@ describe('nepPortal', function() {
       // similar but without session number
       ' trout   viper ': ['trout viper', undefined],
       'TrOuT vIpEr': ['trout viper', undefined],
+
+      // longer codes, from a grown code pool
+      'trout viper salmon 1': ['trout viper salmon', 1],
+      'trout viper salmon1': ['trout viper salmon', 1],
+      'trout viper salmon eel 12': ['trout viper salmon eel', 12],
+      'Trout  Viper Salmon': ['trout viper salmon', undefined],
     };
     for (let input in tests) {
       if (tests.hasOwnProperty(input)) {
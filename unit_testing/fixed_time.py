@@ -0,0 +1,10 @@
+"""Shared by tests of time-windowed behavior."""
+
+
+class FixedTime(object):
+    """Stands in for the time module so debounce windows are predictable."""
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def time(self):
+        return self.seconds
@@ -0,0 +1,17 @@
+"""Shared by tests that bound how many Datastore RPCs a request makes."""
+
+from google.appengine.ext import ndb
+
+import instrumentation
+
+
+def count_datastore_rpcs(fn, *args, **kwargs):
+    """Call fn with a cold ndb context cache.
+
+    Returns: tuple of fn's return value and the number of Datastore RPCs it
+        made, as counted by instrumentation.collect().
+    """
+    ndb.get_context().clear_cache()
+    with instrumentation.collect() as stats:
+        result = fn(*args, **kwargs)
+    return result, stats.counts['datastore']
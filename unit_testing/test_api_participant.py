@@ -8,6 +8,7 @@ from model import (
     AuthToken,
     Participant,
     ParticipantData,
+    ParticipationRollup,
     Program,
     ProjectCohort,
     Survey,
@@ -15,7 +16,9 @@ from model import (
 )
 from unit_test_helper import ConsistencyTestCase, login_headers
 import config
+import instrumentation
 import mysql_connection
+import mysql_pool
 
 
 class TestApiParticipant(ConsistencyTestCase):
@@ -32,6 +35,8 @@ class TestApiParticipant(ConsistencyTestCase):
             sql.reset({
                 'participant': Participant.get_table_definition(),
                 'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
             })
 
         application = webapp2.WSGIApplication(
@@ -81,3 +86,51 @@ class TestApiParticipant(ConsistencyTestCase):
             '/api/participants/{}'.format(p.uid),
             response.headers['Location'],
         )
+
+    def test_post_duplicate_upsert(self):
+        first = self.testapp.post_json(
+            '/api/participants',
+            {'name': 'Rene', 'organization_id': 'Org_Eruditorum'},
+        )
+        # Same participant, no redirect.
+        second = self.testapp.post_json(
+            '/api/participants?upsert=true',
+            {'name': 'Rene', 'organization_id': 'Org_Eruditorum'},
+        )
+        self.assertEqual(json.loads(first.body)['uid'],
+                         json.loads(second.body)['uid'])
+
+    def test_upsert_statements(self):
+        # The insert and select go in one query, then the block commits.
+        with instrumentation.collect() as stats:
+            Participant.upsert('Simone', 'Org_Eruditorum')
+        self.assertEqual(stats.counts['sql'], 2)
+
+        # Within a transaction, the batch's savepoint is part of that query,
+        # and the outer block commits.
+        with mysql_pool.connect():
+            with instrumentation.collect() as stats:
+                Participant.upsert('Ada', 'Org_Eruditorum')
+        self.assertEqual(stats.counts['sql'], 1)
+
+    def test_upsert(self):
+        # Exists in the db but not in memcache.
+        p = self.create_participant()
+        existing, created = Participant.upsert(p.name, p.organization_id)
+        self.assertEqual(existing.uid, p.uid)
+        self.assertFalse(created)
+
+        new, created = Participant.upsert('Simone', p.organization_id)
+        self.assertTrue(created)
+        self.assertEqual(Participant.get_by_id(new.uid).name, 'Simone')
+
+        # Cached now, by name and by id.
+        again, created = Participant.upsert('Simone', p.organization_id)
+        self.assertEqual(again.uid, new.uid)
+        self.assertFalse(created)
+        self.assertEqual(Participant.get_by_id_cached(new.uid).uid, new.uid)
+
+        # Someone else's id.
+        taken, created = Participant.upsert('Ada', p.organization_id,
+                                            id=p.uid)
+        self.assertIsNone(taken)
@@ -9,6 +9,7 @@ from model import (
     AuthToken,
     Participant,
     ParticipantData,
+    ParticipationRollup,
     Program,
     ProjectCohort,
     Survey,
@@ -39,8 +40,12 @@ class TestApiParticipantData(ConsistencyTestCase):
             sql.reset({
                 'participant': Participant.get_table_definition(),
                 'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
             })
 
+        config.participation_rollup_synchronous = True
+
         application = webapp2.WSGIApplication(
             api_routes,
             config={
@@ -61,6 +66,7 @@ class TestApiParticipantData(ConsistencyTestCase):
 
     def tear_down(self):
         Program.reset_mocks()
+        config.participation_rollup_synchronous = False
 
     def test_whitelist(self):
         """Certain pd values should readable, other's shouldn't."""
@@ -489,3 +495,79 @@ class TestApiParticipantData(ConsistencyTestCase):
         pd = ParticipantData.get_by_participant(
             participant.uid, survey.project_cohort_id)[0]
         self.assertEqual(pd.value, '100')
+
+    def test_batch_write(self):
+        pc, survey, participant = self.create_pd_context()
+        other = Participant.create(name='Ada', organization_id='PERTS')
+        other.put()
+
+        response = self.testapp.post_json(
+            '/api/participant_data',
+            {
+                'participant_id': participant.uid,
+                'items': [
+                    {'key': 'progress', 'value': 1, 'survey_id': survey.uid},
+                    {'key': 'condition', 'value': 'treatment',
+                     'survey_id': survey.uid, 'testing': 'false'},
+                    {'key': 'progress', 'value': '33',
+                     'survey_id': survey.uid},
+                    {'key': 'progress', 'value': '100',
+                     'survey_id': survey.uid,
+                     'participant_id': other.uid,
+                     'survey_descriptor': 'cycle-1',
+                     'testing': True},
+                ],
+            },
+        )
+        results = json.loads(response.body)['results']
+        self.assertEqual([r['status'] for r in results], [200] * 4)
+
+        pds = ParticipantData.get_by_participant(participant.uid, pc.uid)
+        self.assertEqual(
+            {pd.key: pd.value for pd in pds},
+            {'progress': '33', 'condition': 'treatment'},
+        )
+        self.assertEqual(pds[0].code, pc.code)
+
+        self.assertFalse(any(pd.testing for pd in pds))
+
+        other_pd = ParticipantData.get_by_participant(other.uid, pc.uid)[0]
+        self.assertEqual(other_pd.survey_id, survey.uid + ':cycle-1')
+        self.assertTrue(other_pd.testing)
+
+    def test_batch_write_invalid_items(self):
+        pc, survey, participant = self.create_pd_context()
+        self.testapp.post_json(
+            '/api/participants/{}/data/progress'.format(participant.uid),
+            {'value': '50', 'survey_id': survey.uid},
+        )
+
+        response = self.testapp.post_json(
+            '/api/participant_data',
+            {
+                'participant_id': participant.uid,
+                'items': [
+                    {'key': 'progress', 'value': '101',
+                     'survey_id': survey.uid},
+                    {'key': 'consent', 'survey_id': survey.uid},
+                    {'key': 'consent', 'value': 'yes',
+                     'survey_id': 'Survey_dne'},
+                    {'key': 'progress', 'value': '10',
+                     'survey_id': survey.uid},
+                    {'key': 'consent', 'value': 'yes',
+                     'survey_id': survey.uid},
+                ],
+            },
+        )
+        results = json.loads(response.body)['results']
+        self.assertEqual([r['status'] for r in results],
+                         [400, 400, 404, 400, 200])
+        self.assertEqual(results[3]['error'],
+                         'Progress value may not decrease.')
+
+        pds = ParticipantData.get_by_participant(participant.uid, pc.uid)
+        self.assertEqual({pd.key: pd.value for pd in pds},
+                         {'progress': '50', 'consent': 'yes'})
+
+        self.testapp.post_json('/api/participant_data', {'items': []},
+                               status=400)
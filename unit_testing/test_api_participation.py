@@ -11,6 +11,7 @@ from gae_handlers import BaseHandler
 from model import (
     Participant,
     ParticipantData,
+    ParticipationRollup,
     Program,
     ProjectCohort,
     User,
@@ -64,10 +65,15 @@ class TestApiParticipation(ConsistencyTestCase):
             sql.reset({
                 'participant': Participant.get_table_definition(),
                 'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
             })
 
+        config.participation_rollup_synchronous = True
+
     def tear_down(self):
         Program.reset_mocks()
+        config.participation_rollup_synchronous = False
 
     def test_survey_participation(self):
         org_id = 'Org_foo'
@@ -150,16 +156,15 @@ class TestApiParticipation(ConsistencyTestCase):
         # Running various queries works as expected.
         self.batch_participation(user, pcs)
 
-        # Simulate a new pd being written to the first pc by clearing that
-        # memcache key. The server should fall back to sql and still give the
-        # same results.
-        id_key = ParticipantData.participation_by_pc_cache_key(pcs[0].uid)
-        code_key = ParticipantData.participation_by_pc_cache_key(pcs[0].code)
-        self.assertIsNotNone(memcache.get(id_key))
-        self.assertIsNotNone(memcache.get(code_key))
-        memcache.delete(id_key)
-        memcache.delete(code_key)
+        # Simulate a new pd being written to the first pc by invalidating its
+        # cached results. The server should fall back to sql and still give
+        # the same results.
+        ParticipantData.reset_participation_cache_stats()
+        ParticipantData.invalidate_participation([pcs[0].uid, pcs[0].code])
         self.batch_participation(user, pcs)
+        stats = ParticipantData.participation_cache_stats()
+        self.assertGreater(stats['stale'], 0)
+        self.assertGreater(stats['hit'], 0)
 
         # Now with everything cached, clearing the db and running the same
         # queries again should have the same result.
@@ -210,3 +215,30 @@ class TestApiParticipation(ConsistencyTestCase):
             }
 
             self.assertEqual(json.loads(result.body), expected)
+
+    def test_cache_stats_requires_super_admin(self):
+        user = User.create(email='user@school.edu')
+        user.put()
+        admin = User.create(email='admin@perts.net', user_type='super_admin')
+        admin.put()
+
+        self.testapp.get(
+            '/api/participation/cache_stats',
+            headers=jwt_headers(user),
+            status=403,
+        )
+
+        result = self.testapp.get(
+            '/api/participation/cache_stats',
+            headers=jwt_headers(admin),
+        )
+        self.assertEqual(
+            set(json.loads(result.body).keys()),
+            {'hit', 'miss', 'stale', 'hit_rate'},
+        )
+
+        self.testapp.delete(
+            '/api/participation/cache_stats',
+            headers=jwt_headers(admin),
+            status=204,
+        )
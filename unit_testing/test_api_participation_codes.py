@@ -92,6 +92,16 @@ class TestApiParticipationCodes(ConsistencyTestCase):
             status=404,
         )
 
+    def test_get_longer_code(self):
+        """Codes from a grown pool have more than two words."""
+        pc = ProjectCohort.create(program_label='demo-program',
+                                  code='trout viper salmon')
+        pc.put()
+
+        response = self.testapp.get('/api/codes/trout-viper-salmon')
+
+        self.assertEqual(json.loads(response.body)['uid'], pc.uid)
+
     def test_create_code_requires_auth(self):
         response = self.testapp.post_json('/api/codes', {}, status=401)
 
@@ -269,6 +279,9 @@ class TestApiParticipationCodes(ConsistencyTestCase):
         unique_key = ndb.Key('Unique', ProjectCohort.uniqueness_key(code))
         self.assertIsNone(unique_key.get())
 
+        # And the code no longer resolves.
+        self.testapp.get(path, status=404)
+
     def test_patch_delete_codes(self):
         codes = ('trout viper', 'solid snake')
         pcs = []
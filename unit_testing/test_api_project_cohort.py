@@ -42,7 +42,6 @@ class TestApiProjectCohort(ConsistencyTestCase):
         # Existing things to relate to.
         program_label = 'demo-program'
         cohort_label = 'demo-cohort'
-        program = Program.get_config(program_label)
         org_id = 'Org_Foo'
         user = User.create(email="test@example.com",
                            owned_organizations=[org_id])
@@ -59,7 +58,6 @@ class TestApiProjectCohort(ConsistencyTestCase):
             'open_date': str(cohort_date - one_day),  # yesterday
             'close_date': str(cohort_date + one_day),  # tomorrow
         }
-        program['cohorts'][cohort_label] = cohort_config
         Program.mock_program_config(
             program_label,
             {'cohorts': {cohort_label: cohort_config}},
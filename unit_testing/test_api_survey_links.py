@@ -33,6 +33,9 @@ class TestApiSurveyLinks(ConsistencyTestCase):
         )
         self.testapp = webtest.TestApp(application)
 
+        # Leased links are kept in memory between calls.
+        SurveyLink.reset_reservoirs()
+
     def test_get_unique(self):
         """Unauthed participants can get unique survey links."""
         program_label = 'demo-program'
@@ -34,6 +34,12 @@ class TestApiTask(ConsistencyTestCase):
         )
         self.testapp = webtest.TestApp(application)
 
+        # Check side effects of task updates right away. See task_events.py.
+        config.task_events_synchronous = True
+
+    def tear_down(self):
+        config.task_events_synchronous = False
+
     def test_update_checkpoint_incomplete(self):
         user = User.create(email='super@perts.net', user_type='super_admin')
         user.put()
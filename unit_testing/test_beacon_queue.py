@@ -0,0 +1,218 @@
+"""Test write-behind ingestion of participant data beacons."""
+
+from google.appengine.api import namespace_manager
+from google.appengine.ext import testbed
+
+from unit_test_helper import ConsistencyTestCase
+from model import (Checkpoint, Participant, ParticipantData,
+                   ParticipationRollup, Program, ProjectCohort, Survey)
+import beacon_queue
+import config
+import mysql_connection
+
+
+class TestBeaconQueue(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestBeaconQueue, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'checkpoint': Checkpoint.get_table_definition(),
+                'participant': Participant.get_table_definition(),
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+        config.participation_rollup_synchronous = True
+
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.real_write_beacons = beacon_queue.write_beacons
+
+    def tear_down(self):
+        namespace_manager.set_namespace('')
+        config.participation_rollup_synchronous = False
+        beacon_queue.write_beacons = self.real_write_beacons
+
+    def create_pd_context(self):
+        program_label = 'demo-program'
+        program_config = Program.get_config(program_label)
+        template = program_config['surveys'][0]['survey_tasklist_template']
+
+        project_cohort = ProjectCohort.create(
+            program_label=program_label,
+            organization_id='Organization_foo',
+            project_id='Project_foo',
+            cohort_label='2018',
+        )
+        project_cohort.put()
+
+        survey = Survey.create(
+            template,
+            program_label=program_label,
+            organization_id='Organization_foo',
+            project_cohort_id=project_cohort.uid,
+            ordinal=1,
+        )
+        survey.put()
+
+        participant = Participant.create(name='Pascal', organization_id='PERTS')
+        participant.put()
+
+        return (project_cohort, survey, participant)
+
+    def beacon(self, participant_id, survey_id, key, value,
+               received='2020-01-01T00:00:00Z'):
+        return {
+            'participant_id': participant_id,
+            'survey_id': survey_id,
+            'key': key,
+            'value': value,
+            'testing': False,
+            'received': received,
+        }
+
+    def test_upsert_batch_never_downgrades_progress(self):
+        pc, survey, participant = self.create_pd_context()
+
+        def pd(key, value):
+            return ParticipantData.create(
+                key=key,
+                value=value,
+                participant_id=participant.uid,
+                program_label=pc.program_label,
+                cohort_label=pc.cohort_label,
+                project_cohort_id=pc.uid,
+                code=pc.code,
+                survey_id=survey.uid,
+                survey_ordinal=survey.ordinal,
+            )
+
+        ParticipantData.upsert_batch([pd('progress', '66'),
+                                      pd('link', 'http://first')])
+        ParticipantData.upsert_batch([pd('progress', '33'),
+                                      pd('link', 'http://second')])
+
+        by_key = {p.key: p.value for p in
+                  ParticipantData.get_by_participant(participant.uid)}
+        self.assertEqual(by_key['progress'], '66')
+        self.assertEqual(by_key['link'], 'http://second')
+
+        ParticipantData.upsert_batch([pd('progress', '100')])
+        by_key = {p.key: p.value for p in
+                  ParticipantData.get_by_participant(participant.uid)}
+        self.assertEqual(by_key['progress'], '100')
+
+        # Participation counts followed along.
+        self.assertEqual(ParticipationRollup.check([pc.uid]), [])
+
+    def test_coalesce(self):
+        beacons = [
+            self.beacon('Participant_a', 'Survey_1', 'progress', '33'),
+            self.beacon('Participant_a', 'Survey_1', 'progress', '100'),
+            self.beacon('Participant_a', 'Survey_1', 'progress', '66'),
+            self.beacon('Participant_a', 'Survey_1', 'link', 'new',
+                        received='2020-01-01T00:00:01Z'),
+            self.beacon('Participant_a', 'Survey_1', 'link', 'old'),
+            self.beacon('Participant_b', 'Survey_1', 'progress', '1'),
+        ]
+        coalesced = beacon_queue.coalesce(beacons)
+        by_index = {(b['participant_id'], b['key']): b['value']
+                    for b in coalesced}
+
+        self.assertEqual(len(coalesced), 3)
+        self.assertEqual(by_index[('Participant_a', 'progress')], '100')
+        self.assertEqual(by_index[('Participant_a', 'link')], 'new')
+        self.assertEqual(by_index[('Participant_b', 'progress')], '1')
+
+    def test_write_beacons(self):
+        pc, survey, participant = self.create_pd_context()
+
+        beacons = [
+            self.beacon(participant.uid, survey.uid, 'progress', '1'),
+            self.beacon(participant.uid, survey.uid, 'progress', '33'),
+            # Invalid participant and survey are dropped.
+            self.beacon('Participant_dne', survey.uid, 'progress', '1'),
+            self.beacon(participant.uid, 'Survey_dne', 'progress', '1'),
+        ]
+        cached_ids = [survey.uid, pc.uid, pc.code]
+        generations = ParticipantData.participation_generations(cached_ids)
+        written, invalid = beacon_queue.write_beacons(beacons)
+
+        self.assertEqual(written, 1)
+        self.assertEqual(invalid, 2)
+
+        pds = ParticipantData.get_by_participant(participant.uid, pc.uid)
+        self.assertEqual(len(pds), 1)
+        self.assertEqual(pds[0].value, '33')
+        self.assertEqual(pds[0].code, pc.code)
+        self.assertEqual(pds[0].survey_ordinal, survey.ordinal)
+
+        # Participation cached before the write is stale, whenever it was
+        # cached.
+        new_generations = ParticipantData.participation_generations(cached_ids)
+        for id in cached_ids:
+            self.assertGreater(new_generations[id], generations[id])
+
+    def test_write_beacons_with_descriptor(self):
+        pc, survey, participant = self.create_pd_context()
+
+        beacon = self.beacon(participant.uid, survey.uid, 'progress', '1')
+        beacon['survey_descriptor'] = 'cycle-1'
+        beacon_queue.write_beacons([beacon])
+
+        pds = ParticipantData.get_by_participant(participant.uid, pc.uid)
+        self.assertEqual(
+            pds[0].survey_id,
+            ParticipantData.combine_survey_descriptor(survey.uid, 'cycle-1'),
+        )
+
+    def test_flush_leases_own_namespace(self):
+        """Branches share the queue but not each other's beacons."""
+        pc, survey, participant = self.create_pd_context()
+        params = {'key': 'progress', 'value': '1', 'survey_id': survey.uid,
+                  'testing': False}
+
+        namespace_manager.set_namespace('other-branch')
+        beacon_queue.enqueue(participant.uid, params)
+        namespace_manager.set_namespace('')
+        beacon_queue.enqueue(participant.uid, params)
+
+        self.assertEqual(beacon_queue.flush()['leased'], 1)
+        namespace_manager.set_namespace('other-branch')
+        self.assertEqual(beacon_queue.flush()['leased'], 1)
+
+    def test_flush_isolates_failures(self):
+        """A beacon that can't be written doesn't hold up the rest."""
+        pc, survey, participant = self.create_pd_context()
+        bad = Participant.create(name='Bad', organization_id='PERTS')
+        bad.put()
+        params = {'key': 'progress', 'value': '1', 'survey_id': survey.uid,
+                  'testing': False}
+        beacon_queue.enqueue(participant.uid, params)
+        beacon_queue.enqueue(bad.uid, params)
+
+        def write_beacons(beacons):
+            if any(b['participant_id'] == bad.uid for b in beacons):
+                raise Exception("Bad beacon.")
+            return self.real_write_beacons(beacons)
+        beacon_queue.write_beacons = write_beacons
+
+        report = beacon_queue.flush()
+
+        self.assertEqual(report['leased'], 2)
+        self.assertEqual(report['written'], 1)
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(
+            len(ParticipantData.get_by_participant(participant.uid)), 1)
+
+        # Only the failing beacon is left, leased until it's retried.
+        remaining = self.taskqueue_stub.get_filtered_tasks(
+            queue_names=beacon_queue.QUEUE_NAME)
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(beacon_queue.flush()['leased'], 0)
@@ -1,15 +1,14 @@
 """Test Checkpoint methods."""
 
-from google.appengine.api import memcache
+from google.appengine.ext import testbed
 import json
 import logging
 import unittest
 
 from unit_test_helper import ConsistencyTestCase
 from model import (DatastoreModel, Checkpoint, Organization, Program, Project,
-                   ProjectCohort)
+                   ProjectCohort, Survey)
 import organization_tasks
-import util
 
 
 class TestCheckpoints(ConsistencyTestCase):
@@ -117,25 +116,136 @@ class TestCheckpoints(ConsistencyTestCase):
             'waiting',
         )
 
-    def test_put_clears_dashboard_queries(self):
+    def test_put_queues_dashboard_refresh(self):
         org, project, pc, checkpoint = self.create_with_project_cohort()
 
-        org_key = util.cached_query_key(
-            'SuperDashboard',
-            organization_id=pc.organization_id,
+        checkpoint.status = 'complete'
+        checkpoint.put()
+
+        tasks = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).get_filtered_tasks(
+                url='/task/refresh_dashboard_rows')
+        self.assertTrue(any(pc.organization_id in t.payload for t in tasks))
+
+    def test_for_tasklists(self):
+        org, project, pc, checkpoint = self.create_with_project_cohort()
+
+        # Another project cohort in the same org, with its own survey
+        # checkpoint.
+        other_project = Project.create(
+            program_label=self.program_label,
+            organization_id=org.uid,
+        )
+        other_project.put()
+        other_pc = ProjectCohort.create(
+            program_label=self.program_label,
+            organization_id=org.uid,
+            project_id=other_project.uid,
         )
-        program_cohort_key = util.cached_query_key(
-            'SuperDashboard',
-            program_label=pc.program_label,
-            cohort_label=pc.cohort_label,
+        other_pc.put()
+        other_checkpoint = Checkpoint.create(
+            parent_id='Survey_bar', ordinal=1, label='demo_survey__foo',
+            name="Survey Foo", program_label=self.program_label,
+            organization_id=org.uid, project_id=other_project.uid,
+            project_cohort_id=other_pc.uid,
         )
+        other_checkpoint.put()
+
+        by_pc = Checkpoint.for_tasklists([pc, other_pc])
+
+        # Same results as asking one at a time.
+        for p in (pc, other_pc):
+            self.assertEqual(
+                [c.uid for c in by_pc[p.uid]],
+                [c.uid for c in Checkpoint.for_tasklist(p)],
+            )
+
+        # Org checkpoints are shared, survey checkpoints are not.
+        uids = [c.uid for c in by_pc[pc.uid]]
+        other_uids = [c.uid for c in by_pc[other_pc.uid]]
+        self.assertIn(checkpoint.uid, uids)
+        self.assertNotIn(other_checkpoint.uid, uids)
+        self.assertIn(other_checkpoint.uid, other_uids)
+        for c in org.tasklist.checkpoints:
+            self.assertIn(c.uid, uids)
+            self.assertIn(c.uid, other_uids)
+
+        # Sorted by kind of parent, then ordinal.
+        kinds = [c.parent_kind for c in by_pc[pc.uid]]
+        self.assertEqual(kinds, sorted(
+            kinds, key=['Organization', 'Project', 'Survey'].index))
+
+        # Fields can be limited, as for cached properties.
+        limited = Checkpoint.for_tasklists([pc], fields=['uid', 'status'])
+        self.assertEqual(len(limited[pc.uid]), len(uids))
+
+    def test_batch_cached_properties_include_checkpoints(self):
+        org, project, pc, checkpoint = self.create_with_project_cohort()
 
-        memcache.set(org_key, {'foo': 1})
-        memcache.set(program_cohort_key, {'foo': 1})
+        props = ProjectCohort.batch_cached_properties_from_db(
+            project_cohorts=[pc])[pc.uid]
 
-        # This should clear memcache.
-        checkpoint.status = 'complete'
-        checkpoint.put()
+        self.assertEqual(
+            set(c.uid for c in props['checkpoints']),
+            set(c.uid for c in Checkpoint.for_tasklist(pc)),
+        )
 
-        self.assertIsNone(memcache.get(org_key))
-        self.assertIsNone(memcache.get(program_cohort_key))
+    def test_batch_cached_properties_match_single(self):
+        org, project, pc, checkpoint = self.create_with_project_cohort()
+        other_pc = ProjectCohort.create(
+            program_label=self.program_label,
+            organization_id=org.uid,
+            project_id=project.uid,
+        )
+        other_pc.put()
+
+        by_pc = Checkpoint.for_tasklists([pc, other_pc])
+        all_checkpoints = {c.uid: c for cs in by_pc.values() for c in cs}
+        batches = (
+            ProjectCohort.batch_cached_properties_from_db(
+                project_cohorts=[pc, other_pc]),
+            # Checkpoints passed in are sorted out by project cohort.
+            ProjectCohort.batch_cached_properties_from_db(
+                project_cohorts=[pc, other_pc],
+                checkpoints=all_checkpoints.values()),
+        )
+
+        for props_by_id in batches:
+            for p in (pc, other_pc):
+                single = p.get_cached_properties_from_db()
+                props = props_by_id[p.uid]
+                self.assertEqual(
+                    set(c.uid for c in props['checkpoints']),
+                    set(c.uid for c in single['checkpoints']),
+                )
+                self.assertEqual(props['organization'].uid, org.uid)
+                self.assertEqual(props['project'].uid, project.uid)
+                self.assertEqual([s.uid for s in props['surveys']],
+                                 [s.uid for s in single['surveys']])
+        # Only the first project cohort has the survey checkpoint.
+        self.assertNotIn(checkpoint.uid, [
+            c.uid for c in batches[0][other_pc.uid]['checkpoints']])
+
+    def test_batch_cached_properties_unlisted_surveys(self):
+        """Surveys are found even if the project cohort doesn't list them."""
+        org, project, pc, checkpoint = self.create_with_project_cohort()
+        survey = Survey.create(
+            [],
+            program_label=self.program_label,
+            organization_id=org.uid,
+            project_cohort_id=pc.uid,
+            ordinal=1,
+        )
+        survey.put()
+        # Apply the write so queries see it.
+        Survey.get_by_id(survey.uid)
+        self.assertEqual(pc.survey_ids, [])
+
+        props = ProjectCohort.batch_cached_properties_from_db(
+            project_cohorts=[pc])[pc.uid]
+        self.assertEqual([s.uid for s in props['surveys']], [survey.uid])
+
+        # An empty list passed in means there are none.
+        props = ProjectCohort.batch_cached_properties_from_db(
+            project_cohorts=[pc], surveys=[])[pc.uid]
+        self.assertEqual(props['surveys'], [])
@@ -0,0 +1,110 @@
+"""Test the pool of reserved participation codes."""
+
+from google.appengine.ext import ndb
+
+from model import PooledCode, ProjectCohort
+from unit_test_helper import ConsistencyTestCase
+import config
+import model.codepool as codepool
+
+
+class TestCodePool(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestCodePool, self).set_up()
+        PooledCode.reset_reservoirs()
+        self.original_generate = codepool.code_phrase.generate
+
+    def tear_down(self):
+        codepool.code_phrase.generate = self.original_generate
+        PooledCode.reset_reservoirs()
+
+    def test_refill_reserves(self):
+        report = PooledCode.refill(target=50)
+
+        self.assertEqual(report['reserved'], 50)
+        pooled = PooledCode.query().fetch()
+        self.assertEqual(len(pooled), 50)
+        # Each code is already reserved, so nothing else can take it.
+        for p in pooled:
+            self.assertIsNotNone(PooledCode.unique_key(p.code).get())
+            self.assertEqual(p.key.parent(), PooledCode.unique_key(p.code))
+            self.assertIn(p.shard, range(PooledCode.num_shards))
+
+        # Already full.
+        self.assertEqual(PooledCode.refill(target=50)['reserved'], 0)
+
+    def test_allocate(self):
+        PooledCode.refill(target=30)
+
+        codes = [PooledCode.allocate() for x in range(30)]
+
+        self.assertEqual(len(set(codes)), 30)
+        self.assertNotIn(None, codes)
+        # One lease per block, the rest from the reservoir.
+        self.assertEqual(PooledCode.lease_stats['from_reservoir'],
+                         30 - PooledCode.lease_stats['attempts'])
+        self.assertEqual(PooledCode.depth(), 0)
+        self.assertIsNone(PooledCode.allocate())
+
+    def test_create_uses_pool(self):
+        PooledCode.refill(target=5)
+        pooled_codes = set(p.code for p in PooledCode.query())
+
+        pc = ProjectCohort.create(program_label='demo-program')
+
+        self.assertIn(pc.code, pooled_codes)
+
+    def test_create_without_pool(self):
+        pc = ProjectCohort.create(program_label='demo-program')
+
+        # Reserved the old way, and a refill is on its way.
+        self.assertIsNotNone(PooledCode.unique_key(pc.code).get())
+        self.assertEqual(PooledCode.stats['empty'], 1)
+        self.assertEqual(PooledCode.stats['refills_queued'], 1)
+
+    def test_skips_used_codes(self):
+        ProjectCohort.create(program_label='demo-program', code='trout viper')
+        codepool.code_phrase.generate = lambda n=2: 'trout viper'
+
+        report = PooledCode.refill(target=1)
+
+        self.assertNotIn('trout viper', [p.code for p in PooledCode.query()])
+        self.assertGreater(report['collisions'], 0)
+
+    def test_grows_when_crowded(self):
+        # Every two-word code is taken.
+        def generate(n=2):
+            if n == 2:
+                return 'trout viper'
+            return self.original_generate(n=n)
+
+        ProjectCohort.create(program_label='demo-program', code='trout viper')
+        codepool.code_phrase.generate = generate
+
+        report = PooledCode.refill(target=10)
+
+        self.assertEqual(report['num_words'], config.code_pool_min_words + 1)
+        self.assertEqual(report['reserved'], 10)
+        for p in PooledCode.query():
+            self.assertEqual(len(p.code.split(' ')), 3)
+
+        # Participants can still find their project cohort by a longer code.
+        pc = ProjectCohort.create(program_label='demo-program')
+        pc.put()
+        self.assertEqual(len(pc.code.split(' ')), 3)
+        self.assertEqual(ProjectCohort.get_by_code(pc.code).uid, pc.uid)
+
+    def test_lease_race(self):
+        PooledCode.refill(target=10)
+        keys = PooledCode.query().fetch(keys_only=True)
+
+        first = PooledCode.datastore_pop_multi(keys)
+        second = PooledCode.datastore_pop_multi(keys)
+
+        self.assertEqual(len(first), 10)
+        self.assertEqual(second, [])
+        self.assertEqual(ndb.get_multi(keys), [None] * 10)
@@ -0,0 +1,185 @@
+"""Test streaming CSV exports."""
+
+import datetime
+import urlparse
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from gae_handlers import BaseHandler
+from model import (Dataset, Participant, ParticipantData,
+                   ParticipationRollup, ProjectCohort, User)
+from unit_test_helper import ConsistencyTestCase, jwt_headers
+import config
+import csv_export
+import jwt_helper
+import mysql_connection
+
+
+class TestCsvExport(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestCsvExport, self).set_up()
+
+        # Needed for gcs interaction.
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_blobstore_stub()
+        self.gcs_threshold = config.csv_export_gcs_threshold
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'participant': Participant.get_table_definition(),
+                'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
+            })
+
+        application = webapp2.WSGIApplication(api_routes, debug=True)
+        self.testapp = webtest.TestApp(application)
+
+    def tear_down(self):
+        config.csv_export_gcs_threshold = self.gcs_threshold
+
+    def create_pds(self, n):
+        pc = ProjectCohort.create(
+            program_label='demo-program',
+            organization_id='Organization_foo',
+            project_id='Project_foo',
+            cohort_label='2018',
+        )
+        pc.put()
+        pds = [
+            ParticipantData.create(
+                key='progress',
+                value=str(x % 100),
+                participant_id='Participant_{:04d}'.format(x),
+                program_label=pc.program_label,
+                cohort_label=pc.cohort_label,
+                project_cohort_id=pc.uid,
+                code=pc.code,
+                survey_id='Survey_foo',
+                survey_ordinal=1,
+            )
+            for x in range(n)
+        ]
+        ParticipantData.put_multi(pds)
+        return pc, pds
+
+    def query_window(self):
+        start = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        end = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        return start, end
+
+    def get_anonymous_csv(self, pc, status=200, headers=None):
+        if headers is None:
+            admin = User.create(email='admin@perts.net',
+                                user_type='super_admin')
+            admin.put()
+            headers = jwt_headers(admin)
+        start, end = self.query_window()
+        return self.testapp.get(
+            '/api/project_cohorts/{}/completion'.format(pc.uid),
+            params={
+                'format': 'csv',
+                'start': start.strftime(config.iso_datetime_format),
+                'end': end.strftime(config.iso_datetime_format),
+            },
+            headers=headers,
+            status=status,
+        )
+
+    def follow_to_dataset(self, response):
+        """Returns: tuple of the Dataset redirected to and its download."""
+        location = urlparse.urlparse(response.headers['Location'])
+        dataset = Dataset.get_by_id(location.path.split('/')[-1])
+        # No other credentials; the redirect carries its own.
+        download = self.testapp.get(
+            '{}?{}'.format(location.path, location.query))
+        return dataset, download
+
+    def test_csv_chunks(self):
+        rows = [{'a': x, 'b': u'é', 'ignored': True} for x in range(5)]
+        chunks = list(csv_export.csv_chunks(rows, ('a', 'b'),
+                                            rows_per_chunk=2))
+
+        # Header and first two rows, two rows, last row.
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0].splitlines()[0], 'a,b')
+        self.assertEqual(
+            ''.join(chunks).splitlines()[1:],
+            ['{},\xc3\xa9'.format(x) for x in range(5)],
+        )
+
+    def test_csv_chunks_empty(self):
+        chunks = list(csv_export.csv_chunks([], ('a', 'b')))
+        self.assertEqual(chunks, ['a,b\r\n'])
+
+    def test_stream_rows_matches_select(self):
+        pc, pds = self.create_pds(25)
+        start, end = self.query_window()
+        query, params = ParticipantData.completion_ids_anonymous_query(
+            pc.uid, start, end)
+
+        streamed = list(csv_export.stream_rows(query, params, fetch_size=7))
+
+        self.assertEqual(
+            streamed,
+            list(ParticipantData.completion_ids_anonymous(pc.uid, start, end)),
+        )
+        self.assertEqual(len(streamed), 25)
+
+    def test_anonymous_csv(self):
+        pc, pds = self.create_pds(3)
+
+        response = self.get_anonymous_csv(pc)
+
+        self.assertEqual(response.headers['Content-Type'], 'application/csv')
+        lines = response.body.splitlines()
+        self.assertEqual(lines[0], 'participant_id,survey_ordinal,value')
+        self.assertEqual(len(lines), 4)
+
+    def test_large_csv_to_dataset(self):
+        """Exports that pass the threshold while streaming go to GCS."""
+        config.csv_export_gcs_threshold = 2
+        pc, pds = self.create_pds(5)
+
+        response = self.get_anonymous_csv(pc, status=302)
+
+        dataset, download = self.follow_to_dataset(response)
+        self.assertEqual(dataset.parent_id, pc.uid)
+        lines = dataset.read().splitlines()
+        self.assertEqual(lines[0], 'participant_id,survey_ordinal,value')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(download.body, dataset.read())
+
+    def test_large_csv_jwt_endpoint(self):
+        """Callers allowed by a jwt endpoint, rather than by owning the
+        project cohort, can download the Dataset too."""
+        config.csv_export_gcs_threshold = 2
+        pc, pds = self.create_pds(5)
+        user = User.create(email='triton@perts.net', user_type='user')
+        user.put()
+        path = '/api/project_cohorts/{}/completion'.format(pc.uid)
+        endpoint = BaseHandler.__dict__['get_endpoint_str'](
+            None, method='GET', path=path)
+        payload = {'user_id': user.uid, 'email': user.email,
+                   'allowed_endpoints': [endpoint]}
+
+        response = self.get_anonymous_csv(
+            pc, status=302,
+            headers={'Authorization': 'Bearer ' + jwt_helper.encode(payload)})
+
+        dataset, download = self.follow_to_dataset(response)
+        self.assertEqual(len(download.body.splitlines()), 6)
+
+        # The token allows only this download.
+        other = Dataset.create('other.csv', u'a,b', 'text/csv')
+        other.put()
+        token = urlparse.parse_qs(
+            urlparse.urlparse(response.headers['Location']).query)['token'][0]
+        self.testapp.get('/api/datasets/{}?token={}'.format(other.uid, token),
+                         status=403)
@@ -0,0 +1,127 @@
+"""Test precomputed super dashboard rows."""
+
+from google.appengine.ext import testbed
+import json
+
+from fixed_time import FixedTime
+from model import DashboardRow
+from unit_test_helper import ConsistencyTestCase
+import model.dashboardrow
+import mysql_connection
+
+
+class TestDashboardRow(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestDashboardRow, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({'dashboard_row': DashboardRow.get_table_definition()})
+
+        self.real_time = model.dashboardrow.time
+        model.dashboardrow.time = FixedTime(1000)
+
+    def tear_down(self):
+        model.dashboardrow.time = self.real_time
+
+    def document(self, pc_id, org_id='Organization_foo'):
+        return {
+            'uid': pc_id,
+            'short_uid': pc_id.split('_')[1],
+            'organization_id': org_id,
+            'program_label': 'demo-program',
+            'cohort_label': '2018',
+            'status': 'open',
+            'data_export_survey': 'not in summary',
+            'checkpoints': [{'uid': 'Checkpoint_1', 'status': 'incomplete',
+                             'parent_kind': 'Survey', 'survey_id': None,
+                             'name': 'not in summary'}],
+            'organization': {'status': 'approved', 'name': 'Foo'},
+            'project': None,
+            'surveys': [],
+        }
+
+    def select_documents(self, **kwargs):
+        query, params = DashboardRow.documents_query('document', **kwargs)
+        with mysql_connection.connect() as sql:
+            return [json.loads(r['json'])['uid']
+                    for r in sql.select_query(query, params)]
+
+    def test_summarize(self):
+        summary = DashboardRow.summarize(self.document('ProjectCohort_a'))
+        self.assertNotIn('data_export_survey', summary)
+        self.assertEqual(summary['organization'], {'status': 'approved'})
+        self.assertNotIn('name', summary['checkpoints'][0])
+        self.assertIsNone(summary['project'])
+
+    def test_summary_fields(self):
+        """Summaries have what the program cohort dashboard query asks for."""
+        fields = model.dashboardrow.SUMMARY_FIELDS
+        self.assertIsNone(fields['uid'])
+        self.assertEqual(fields['organization'], ('status',))
+        self.assertIn('survey_id', fields['checkpoints'])
+        self.assertNotIn('program_cohort', fields)
+
+    def test_replace_organizations(self):
+        DashboardRow.replace_organizations(
+            ['Organization_foo', 'Organization_bar'],
+            [self.document('ProjectCohort_a'),
+             self.document('ProjectCohort_b'),
+             self.document('ProjectCohort_c', 'Organization_bar')],
+        )
+        self.assertEqual(
+            self.select_documents(),
+            ['ProjectCohort_a', 'ProjectCohort_b', 'ProjectCohort_c'],
+        )
+
+        # Project cohort b is gone, bar is untouched.
+        DashboardRow.replace_organizations(
+            ['Organization_foo'], [self.document('ProjectCohort_a')])
+        self.assertEqual(
+            self.select_documents(),
+            ['ProjectCohort_a', 'ProjectCohort_c'],
+        )
+        self.assertEqual(
+            self.select_documents(organization_id='Organization_bar'),
+            ['ProjectCohort_c'],
+        )
+
+    def test_queue_refresh_dedupes(self):
+        DashboardRow.reset_refresh_stats()
+        org_ids = ['Organization_{}'.format(x) for x in range(150)]
+
+        # One task per organization, across multiple batches.
+        tasks = DashboardRow.queue_refresh(org_ids + org_ids[:5] + [None])
+        self.assertEqual(len(tasks), len(org_ids))
+
+        # Requests within the same window are dropped...
+        model.dashboardrow.time = FixedTime(1010)
+        self.assertEqual(DashboardRow.queue_refresh(org_ids[:10]), [])
+
+        # ...but not those in the next.
+        model.dashboardrow.time = FixedTime(
+            1000 + model.dashboardrow.REFRESH_DEBOUNCE_SECONDS)
+        self.assertEqual(len(DashboardRow.queue_refresh(org_ids[:1])), 1)
+
+        self.assertEqual(DashboardRow.refresh_stats(), {
+            'requested': 161,
+            'queued': 151,
+            'executed': 0,
+            'dropped': 10,
+        })
+
+    def test_coalesce_refreshes(self):
+        with DashboardRow.coalesce_refreshes():
+            self.assertEqual(
+                DashboardRow.queue_refresh(['Organization_foo']), [])
+            with DashboardRow.coalesce_refreshes():
+                DashboardRow.queue_refresh(['Organization_bar'])
+            DashboardRow.queue_refresh(['Organization_foo'])
+
+        tasks = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).get_filtered_tasks(
+                url='/task/refresh_dashboard_rows')
+        self.assertEqual(len(tasks), 2)
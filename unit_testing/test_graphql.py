@@ -52,7 +52,6 @@ class TestGraphQL(ConsistencyTestCase):
     def create_project_cohort(self, cohort_date=datetime.datetime.today()):
         program_label = 'demo-program'
         cohort_label = 'demo-cohort'
-        program = Program.get_config(program_label)
         org_id = 'Org_Foo'
         liaison_id = 'User_liaison'
         project = Project.create(organization_id=org_id,
@@ -66,7 +65,6 @@ class TestGraphQL(ConsistencyTestCase):
             'open_date': str(cohort_date - one_day),  # yesterday
             'close_date': str(cohort_date + one_day),  # tomorrow
         }
-        program['cohorts'][cohort_label] = cohort_config
         Program.mock_program_config(
             program_label,
             {'cohorts': {cohort_label: cohort_config}},
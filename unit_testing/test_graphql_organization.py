@@ -6,6 +6,7 @@ import webtest
 
 from api_handlers import api_routes
 from model import User, Organization
+from rpc_counter import count_datastore_rpcs
 from unit_test_helper import ConsistencyTestCase, login_headers
 import config
 
@@ -32,6 +33,17 @@ class TestGraphQLOrganization(ConsistencyTestCase):
         )
         self.testapp = webtest.TestApp(application)
 
+    def count_rpcs(self, query, user):
+        """Run a query, returning the response data and the number of
+        Datastore RPCs made."""
+        response, num_rpcs = count_datastore_rpcs(
+            self.testapp.post_json,
+            '/api/graphql',
+            {'query': query},
+            headers=login_headers(user.uid),
+        )
+        return json.loads(response.body), num_rpcs
+
     def test_get_single_org(self):
         user = User.create(email="super@example.com", user_type='super_admin')
         user.put()
@@ -126,3 +138,74 @@ class TestGraphQLOrganization(ConsistencyTestCase):
         )
 
         self.assertEqual(json.loads(response.body), expected)
+
+    def test_liaisons_batched(self):
+        """Liaisons of all organizations are fetched together."""
+        user = User.create(email="super@example.com", user_type='super_admin')
+        user.put()
+
+        def create_org(x):
+            liaison = User.create(email='liaison{}@example.com'.format(x))
+            liaison.put()
+            org = Organization.create(name="Org {}".format(x),
+                                      liaison_id=liaison.uid)
+            org.put()
+
+        query = '''
+        query GetLiaisons {
+            organizations {
+                liaison {
+                    email
+                }
+            }
+        }
+        '''
+
+        create_org(1)
+        data, one_org_rpcs = self.count_rpcs(query, user)
+        self.assertEqual(len(data['organizations']), 1)
+
+        create_org(2)
+        create_org(3)
+        data, three_org_rpcs = self.count_rpcs(query, user)
+        self.assertEqual(
+            sorted(o['liaison']['email'] for o in data['organizations']),
+            ['liaison{}@example.com'.format(x) for x in (1, 2, 3)],
+        )
+
+        self.assertEqual(one_org_rpcs, three_org_rpcs)
+
+    def test_users_of_many_orgs(self):
+        """Owners aren't dropped when the batch needs several queries."""
+        user = User.create(email="super@example.com", user_type='super_admin')
+        user.put()
+
+        num_orgs = 35
+        for x in range(num_orgs):
+            org = Organization.create(name="Org {}".format(x))
+            org.put()
+            owner = User.create(email='owner{:02d}@example.com'.format(x),
+                                owned_organizations=[org.uid])
+            owner.put()
+
+        query = '''
+        query GetOwners {
+            organizations {
+                users {
+                    email
+                }
+            }
+        }
+        '''
+        response = self.testapp.post_json(
+            '/api/graphql',
+            {'query': query},
+            headers=login_headers(user.uid),
+        )
+        data = json.loads(response.body)
+
+        self.assertEqual(
+            sorted(u['email'] for o in data['organizations']
+                   for u in o['users']),
+            ['owner{:02d}@example.com'.format(x) for x in range(num_orgs)],
+        )
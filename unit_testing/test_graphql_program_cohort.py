@@ -99,9 +99,8 @@ class TestGraphQLProgramCohort(ConsistencyTestCase):
         )
 
         conf = Program.get_config('demo-program')
-        cohort = conf['cohorts']['2018']
-        cohort['program_label'] = conf['label']
-        cohort['program_name'] = conf['name']
+        cohort = dict(conf['cohorts']['2018'], program_label=conf['label'],
+                      program_name=conf['name'])
         cohort = OrderedDict((k, cohort[k]) for k in sorted(cohort.keys()))
 
         self.assertEqual(
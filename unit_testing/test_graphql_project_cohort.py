@@ -1,6 +1,7 @@
 """Test reading project cohorts with GraphQL."""
 
 from collections import OrderedDict
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 import datetime
 import json
@@ -11,6 +12,7 @@ import webtest
 
 from api_handlers import api_routes
 from gae_models import DatastoreModel
+from rpc_counter import count_datastore_rpcs
 from unit_test_helper import ConsistencyTestCase, login_headers
 from model import (Checkpoint, Organization, Program, Project, ProjectCohort,
                    Survey, Task, User)
@@ -239,6 +241,105 @@ class TestGraphQLProjectCohort(ConsistencyTestCase):
 
         self.assertEqual(response.body, json.dumps(expected))
 
+    def count_rpcs(self, url, user_id):
+        """Get a url, returning the response data and the number of Datastore
+        RPCs made."""
+        response, num_rpcs = count_datastore_rpcs(
+            self.testapp.get, url, headers=login_headers(user_id))
+        return json.loads(response.body), num_rpcs
+
+    def test_dashboard_rpcs_batched(self):
+        """Related data for all project cohorts is fetched together, so the
+        number of RPCs doesn't depend on the number of project cohorts."""
+        program = Program.get_config(self.program_label)
+        liaison, org, project, pc, surveys = self.create_project_cohort()
+        pc.survey_ids = [s.uid for s in surveys]
+        pc.put()
+        url = '/api/organizations/{}/dashboard'.format(org.uid)
+
+        def add_project_cohort():
+            project = Project.create(organization_id=org.uid,
+                                     program_label=self.program_label)
+            project.put()
+            pc = ProjectCohort.create(
+                project_id=project.uid,
+                organization_id=org.uid,
+                program_label=self.program_label,
+                cohort_label=self.cohort_label,
+                liaison_id=liaison.uid,
+            )
+            surveys = Survey.create_for_project_cohort(program['surveys'], pc)
+            ndb.put_multi(surveys)
+            pc.survey_ids = [s.uid for s in surveys]
+            pc.put()
+            return pc
+
+        # Mock consistency for the project cohort query.
+        ndb.get_multi([pc.key], use_cache=False)
+        data, one_pc_rpcs = self.count_rpcs(url, liaison.uid)
+        self.assertEqual(len(data['project_cohorts']), 1)
+
+        new_pcs = [add_project_cohort() for x in range(2)]
+        ndb.get_multi([p.key for p in new_pcs], use_cache=False)
+        data, three_pc_rpcs = self.count_rpcs(url, liaison.uid)
+        self.assertEqual(len(data['project_cohorts']), 3)
+        for pc_dict in data['project_cohorts']:
+            self.assertEqual(len(pc_dict['surveys']), len(surveys))
+            self.assertEqual(pc_dict['organization']['uid'], org.uid)
+
+        self.assertEqual(one_pc_rpcs, three_pc_rpcs)
+
+    def test_cohort_dashboard_cached(self):
+        """The cohort dashboard's related data comes from cached properties,
+        fetched once, and not at all once memcache is warm."""
+        liaison, org, project, pc, surveys = self.create_project_cohort()
+        pc.survey_ids = [s.uid for s in surveys]
+        pc.put()
+        user = User.create(email='super@perts.net', user_type='super_admin')
+        user.put()
+        # Mock consistency for the project cohort query.
+        ndb.get_multi([pc.key], use_cache=False)
+
+        checkpoint_queries = []
+        for_tasklists = Checkpoint.__dict__['for_tasklists']
+
+        def count_for_tasklists(*args, **kwargs):
+            checkpoint_queries.append(1)
+            return for_tasklists.__get__(None, Checkpoint)(*args, **kwargs)
+        Checkpoint.for_tasklists = staticmethod(count_for_tasklists)
+
+        def run_query():
+            del checkpoint_queries[:]
+            response, num_rpcs = count_datastore_rpcs(
+                self.testapp.post_json,
+                '/api/graphql',
+                {
+                    'query': graphql_queries.program_cohort_dashboard,
+                    'variables': {'program_label': self.program_label,
+                                  'cohort_label': self.cohort_label},
+                },
+                headers=login_headers(user.uid),
+            )
+            return json.loads(response.body), num_rpcs, len(checkpoint_queries)
+
+        try:
+            memcache.flush_all()
+            cold, cold_rpcs, cold_sql = run_query()
+            warm, warm_rpcs, warm_sql = run_query()
+        finally:
+            Checkpoint.for_tasklists = for_tasklists
+
+        self.assertEqual(warm, cold)
+        pc_data = warm['project_cohorts'][0]
+        self.assertEqual(len(pc_data['surveys']), len(surveys))
+        self.assertEqual(pc_data['project']['uid'], project.uid)
+        self.assertEqual(pc_data['organization']['status'], org.status)
+
+        # Cold: checkpoints queried once, by the cached properties, not
+        # again by the resolvers. Warm: not at all, and fewer RPCs.
+        self.assertEqual((cold_sql, warm_sql), (1, 0))
+        self.assertLess(warm_rpcs, cold_rpcs)
+
     def test_dashboard_by_owner_empty(self):
         user = User.create(email='org@perts.net', user_type='user')
         user.put()
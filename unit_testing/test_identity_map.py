@@ -0,0 +1,99 @@
+"""Test the request-scoped entity identity map."""
+
+import json
+import webapp2
+import webtest
+
+from model import Organization, ProjectCohort
+from unit_test_helper import ConsistencyTestCase
+import identity_map
+import instrumentation
+
+
+class IdentityMapHandler(webapp2.RequestHandler):
+    """Gets entities the way a handler would, reporting RPCs made."""
+
+    def get(self):
+        uids = self.request.get_all('uid')
+        counts = []
+
+        identity_map.prefetch(uids)
+        counts.append(identity_map.rpc_count())
+
+        first = [identity_map.get(uid) for uid in uids]
+        second = identity_map.get_multi(uids)
+        counts.append(identity_map.rpc_count())
+
+        self.response.write(json.dumps({
+            'rpc_counts': counts,
+            'found': [e.uid if e else None for e in first],
+            'cohort_labels': [e.cohort_label if e else None for e in first],
+            'same_instances': all(a is b for a, b in zip(first, second)),
+        }))
+
+
+class TestIdentityMap(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestIdentityMap, self).set_up()
+
+        application = webapp2.WSGIApplication(
+            [('/identity_map', IdentityMapHandler)], debug=True)
+        # Installed together as in appengine_config.py; rpc_count() reads
+        # instrumentation's counts.
+        self.testapp = webtest.TestApp(instrumentation.middleware(
+            identity_map.middleware(application)))
+
+    def create_pcs(self, n):
+        org = Organization.create(name='Foo Academy')
+        org.put()
+        pcs = [
+            ProjectCohort.create(
+                program_label='demo-program',
+                organization_id=org.uid,
+                project_id='Project_{}'.format(x),
+                cohort_label='2018',
+            )
+            for x in range(n)
+        ]
+        ProjectCohort.put_multi(pcs)
+        return pcs
+
+    def test_outside_request_passes_through(self):
+        pc = self.create_pcs(1)[0]
+        self.assertIsNone(identity_map.rpc_count())
+        self.assertEqual(identity_map.get(pc.uid).uid, pc.uid)
+        self.assertEqual(identity_map.get_multi([]), [])
+
+    def test_dedupes_within_request(self):
+        pcs = self.create_pcs(5)
+        uids = [pc.uid for pc in pcs] + ['ProjectCohort_dne']
+
+        response = self.testapp.get('/identity_map', params={'uid': uids})
+        body = json.loads(response.body)
+
+        # Gets after the prefetch don't hit the Datastore.
+        after_prefetch, after_gets = body['rpc_counts']
+        self.assertGreater(after_prefetch, 0)
+        self.assertEqual(after_prefetch, after_gets)
+
+        self.assertEqual(body['found'], [pc.uid for pc in pcs] + [None])
+        self.assertTrue(body['same_instances'])
+
+    def test_fresh_map_per_request(self):
+        pc = self.create_pcs(1)[0]
+
+        first = json.loads(self.testapp.get(
+            '/identity_map', params={'uid': [pc.uid]}).body)
+        self.assertEqual(first['cohort_labels'], ['2018'])
+
+        pc.cohort_label = '2019'
+        pc.put()
+
+        # Nothing carries over from the previous request.
+        second = json.loads(self.testapp.get(
+            '/identity_map', params={'uid': [pc.uid]}).body)
+        self.assertEqual(second['cohort_labels'], ['2019'])
@@ -0,0 +1,129 @@
+"""Test per-request counts and timings of API and SQL calls."""
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+import json
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from model import Organization, User
+from unit_test_helper import ConsistencyTestCase, jwt_headers
+import instrumentation
+import mysql_pool
+
+
+class BusyHandler(webapp2.RequestHandler):
+    """Makes one of every kind of call."""
+
+    def get(self, org_id):
+        Organization.get_by_id(org_id)
+        memcache.get('instrumentation_test')
+        taskqueue.add(url='/task/noop')
+        with mysql_pool.connect() as sql:
+            sql.select_query("SELECT %s AS `n`", (1,))
+        self.response.write(json.dumps(
+            dict(instrumentation.current().counts)))
+
+
+class TestInstrumentation(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestInstrumentation, self).set_up()
+
+        application = webapp2.WSGIApplication(
+            [webapp2.Route('/busy/<org_id>', BusyHandler)] + api_routes,
+            debug=True,
+        )
+        self.testapp = webtest.TestApp(
+            instrumentation.middleware(application))
+        instrumentation.reset_route_stats()
+
+    def test_outside_request(self):
+        self.assertIsNone(instrumentation.current())
+        Organization.create(name='Foo Academy').put()
+        self.assertIsNone(instrumentation.current())
+
+    def test_counts_and_header(self):
+        org = Organization.create(name='Foo Academy')
+        org.put()
+
+        response = self.testapp.get('/busy/{}'.format(org.uid))
+        counts = json.loads(response.body)
+
+        self.assertEqual(counts['datastore'], 1)
+        self.assertEqual(counts['memcache'], 1)
+        self.assertEqual(counts['taskqueue'], 1)
+        # The select and connect()'s commit.
+        self.assertEqual(counts['sql'], 2)
+
+        timing = response.headers['Server-Timing']
+        for kind in ('datastore', 'memcache', 'taskqueue', 'sql', 'total'):
+            self.assertIn(kind + ';dur=', timing)
+
+    def test_route_aggregates(self):
+        org = Organization.create(name='Foo Academy')
+        org.put()
+        for x in range(3):
+            self.testapp.get('/busy/{}'.format(org.uid))
+        self.testapp.get('/busy/Organization_dne')
+
+        routes = instrumentation.route_stats()['routes']
+        busy = routes['GET /busy/<org_id>']
+        self.assertEqual(busy['requests'], 4)
+        self.assertEqual(sum(b['n'] for b in busy['histogram']), 4)
+        self.assertEqual(busy['per_request']['sql']['calls'], 2)
+
+    def test_collect(self):
+        org = Organization.create(name='Foo Academy')
+        org.put()
+
+        with instrumentation.collect() as outer:
+            memcache.get('instrumentation_test')
+            with instrumentation.collect() as inner:
+                self.assertIs(instrumentation.current(), inner)
+                self.testapp.get('/busy/{}'.format(org.uid))
+            self.assertIs(instrumentation.current(), outer)
+
+        # Calls count toward every enclosing block, including the request's.
+        self.assertEqual(inner.counts['memcache'], 1)
+        self.assertEqual(inner.counts['sql'], 2)
+        self.assertEqual(outer.counts['memcache'], 2)
+        self.assertEqual(outer.counts['sql'], 2)
+        self.assertIsNone(instrumentation.current())
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            instrumentation.normalize_sql("""
+                SELECT * FROM `participant`
+                WHERE `uid` IN (%s, %s, %s) AND `name` = 'it\\'s' LIMIT 10
+            """),
+            "SELECT * FROM `participant` WHERE `uid` IN (?...) "
+            "AND `name` = ? LIMIT ?",
+        )
+        self.assertEqual(
+            instrumentation.normalize_sql(
+                "INSERT INTO `t` (`a`, `b`) VALUES (%s, %s),\n(%s, %s)"),
+            "INSERT INTO `t` (`a`, `b`) VALUES (?...), ...",
+        )
+
+    def test_endpoint_requires_super_admin(self):
+        user = User.create(email='user@perts.net', user_type='user')
+        sup = User.create(email='super@perts.net', user_type='super_admin')
+        user.put()
+        sup.put()
+
+        self.testapp.get('/api/instrumentation', headers=jwt_headers(user),
+                         status=403)
+        response = self.testapp.get('/api/instrumentation',
+                                    headers=jwt_headers(sup))
+        self.assertIn('routes', json.loads(response.body))
+
+        self.testapp.delete('/api/instrumentation', headers=jwt_headers(sup),
+                            status=204)
+        # Only the delete itself is left.
+        self.assertEqual(instrumentation.route_stats()['routes'].keys(),
+                         ['DELETE /api/instrumentation'])
@@ -0,0 +1,240 @@
+"""Test pooled MySQL connections."""
+
+import MySQLdb
+import json
+import webapp2
+import webtest
+
+from model import ParticipantData
+from unit_test_helper import ConsistencyTestCase
+import instrumentation
+import mysql_connection
+import mysql_pool
+
+
+# Arguments to MySQLdb's connection.set_server_option().
+MYSQL_OPTION_MULTI_STATEMENTS_ON = 0
+MYSQL_OPTION_MULTI_STATEMENTS_OFF = 1
+
+
+class PoolHandler(webapp2.RequestHandler):
+    """Runs a few separate queries, like a handler calling several models."""
+
+    def get(self):
+        connections = set()
+        for x in range(3):
+            with mysql_pool.connect() as sql:
+                sql.select_query("SELECT %s AS `n`", (x,))
+                connections.add(id(sql))
+        self.response.write(json.dumps({'connections': len(connections)}))
+
+
+class TestMySqlPool(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestMySqlPool, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({
+                'participant_data': ParticipantData.get_table_definition(),
+            })
+
+        self.pool = mysql_pool.get_pool()
+        self.pool.reset_stats()
+
+    def test_reuse_between_blocks(self):
+        with mysql_pool.connect() as sql:
+            first = sql
+        with mysql_pool.connect() as sql:
+            second = sql
+
+        self.assertIs(first, second)
+        self.assertEqual(self.pool.stats()['checkouts'], 2)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_nested_blocks_share_connection(self):
+        with mysql_pool.connect() as outer:
+            with mysql_pool.connect() as inner:
+                self.assertIs(outer, inner)
+        stats = self.pool.stats()
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['reuses'], 1)
+
+    def test_request_reuses_connection(self):
+        application = webapp2.WSGIApplication([('/pool', PoolHandler)])
+        testapp = webtest.TestApp(mysql_pool.middleware(application))
+
+        body = json.loads(testapp.get('/pool').body)
+
+        # Returned after each block, and checked out again.
+        self.assertEqual(body['connections'], 1)
+        self.assertEqual(self.pool.stats()['checkouts'], 3)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def insert_pd(self, sql, uid):
+        sql.query(
+            "INSERT INTO `participant_data` "
+            "(`uid`, `short_uid`, `key`, `value`, `participant_id`, "
+            "`program_label`, `project_cohort_id`, `code`, `survey_id`) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            (uid, uid.split('_')[1], 'progress', '1', 'Participant_foo',
+             'demo-program', 'ProjectCohort_foo', 'trout viper',
+             'Survey_foo'),
+        )
+
+    def pd_uids(self):
+        with mysql_connection.connect() as sql:
+            rows = sql.select_query("SELECT `uid` FROM `participant_data`")
+        return sorted(r['uid'] for r in rows)
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(ValueError):
+            with mysql_pool.connect() as sql:
+                self.insert_pd(sql, 'ParticipantData_foo')
+                with mysql_pool.connect() as inner:
+                    self.insert_pd(inner, 'ParticipantData_bar')
+                raise ValueError()
+
+        self.assertEqual(self.pd_uids(), [])
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_commit_outermost_block(self):
+        with mysql_pool.connect() as sql:
+            self.insert_pd(sql, 'ParticipantData_foo')
+            # An error handled inside the block doesn't roll it back.
+            try:
+                with mysql_pool.connect() as inner:
+                    self.insert_pd(inner, 'ParticipantData_bar')
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(self.pd_uids(),
+                         ['ParticipantData_bar', 'ParticipantData_foo'])
+
+    def test_health_check(self):
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+
+        # Idle too long, so pinged before reuse.
+        conn.last_used -= self.pool.health_check_seconds + 1
+        self.assertIs(self.pool.checkout(), conn)
+        self.pool.checkin(conn)
+        self.assertEqual(self.pool.stats()['health_checks'], 1)
+        self.assertEqual(self.pool.stats()['reconnects'], 0)
+
+        # Too old, so replaced.
+        conn.created -= self.pool.max_age_seconds + 1
+        replacement = self.pool.checkout()
+        self.pool.checkin(replacement)
+        self.assertIsNot(replacement, conn)
+
+    def test_exhausted(self):
+        pool = mysql_pool.Pool(max_size=1, wait_seconds=0.01,
+                               health_check_seconds=30, max_age_seconds=60)
+        conn = pool.checkout()
+        with self.assertRaises(mysql_pool.PoolExhausted):
+            pool.checkout()
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(), conn)
+        pool.checkin(conn)
+        pool.close_idle()
+
+    def test_batch(self):
+        with mysql_pool.batch() as batch:
+            first = batch.select("SELECT %s AS `n`", (1,))
+            # Queries may end in comments.
+            second = batch.select("""
+                SELECT %s AS `n`, %s AS `m`
+                # comment
+            """, (2, 3))
+            empty = batch.select(
+                "SELECT * FROM `participant_data` WHERE `uid` = %s",
+                ('ParticipantData_dne',))
+
+        self.assertEqual(first.rows, [{'n': 1}])
+        self.assertEqual(second.rows, [{'n': 2, 'm': 3}])
+        self.assertEqual(empty.rows, [])
+        self.assertEqual(self.pool.stats()['batched_queries'], 3)
+
+    def test_batch_write_then_select(self):
+        with mysql_pool.batch() as batch:
+            batch.execute(
+                "INSERT INTO `participant_data` "
+                "(`uid`, `short_uid`, `key`, `value`, `participant_id`, "
+                "`program_label`, `project_cohort_id`, `code`, `survey_id`) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                ('ParticipantData_foo', 'foo', 'progress', '1',
+                 'Participant_foo', 'demo-program', 'ProjectCohort_foo',
+                 'trout viper', 'Survey_foo'),
+            )
+            written = batch.select(
+                "SELECT `uid` FROM `participant_data` WHERE `uid` = %s",
+                ('ParticipantData_foo',))
+
+        self.assertEqual(written.rows, [{'uid': 'ParticipantData_foo'}])
+
+    def test_batch_error_not_written_twice(self):
+        """A failing statement raises rather than being retried serially,
+        and writes before it are rolled back with the block."""
+        with self.assertRaises(MySQLdb.ProgrammingError):
+            with mysql_pool.batch() as batch:
+                batch.execute(
+                    "INSERT INTO `participant_data` "
+                    "(`uid`, `short_uid`, `key`, `value`, `participant_id`, "
+                    "`program_label`, `project_cohort_id`, `code`, "
+                    "`survey_id`) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    ('ParticipantData_foo', 'foo', 'progress', '1',
+                     'Participant_foo', 'demo-program', 'ProjectCohort_foo',
+                     'trout viper', 'Survey_foo'),
+                )
+                batch.select("SELECT * FROM `table_dne`")
+
+        self.assertEqual(self.pd_uids(), [])
+
+    def test_nested_batch_error_keeps_outer_writes(self):
+        """Writes before a failing statement in a batch are undone, but not
+        the enclosing block's."""
+        with mysql_pool.connect() as sql:
+            self.insert_pd(sql, 'ParticipantData_foo')
+            with self.assertRaises(MySQLdb.ProgrammingError):
+                with mysql_pool.batch() as batch:
+                    batch.execute(
+                        "DELETE FROM `participant_data` WHERE `uid` = %s",
+                        ('ParticipantData_foo',),
+                    )
+                    batch.select("SELECT * FROM `table_dne`")
+
+        self.assertEqual(self.pd_uids(), ['ParticipantData_foo'])
+
+    def test_batch_without_multi_statements(self):
+        conn = self.pool.checkout()
+        conn.sql.connection.set_server_option(
+            MYSQL_OPTION_MULTI_STATEMENTS_OFF)
+        self.pool.checkin(conn)
+        self.pool.multi_statements = None
+
+        try:
+            # The first batch tries both statements together, then runs them
+            # one at a time. It's learned from that, so the second doesn't
+            # try. Each also commits.
+            for x, num_statements in enumerate((4, 3)):
+                with instrumentation.collect() as stats:
+                    with mysql_pool.batch() as batch:
+                        first = batch.select("SELECT %s AS `n`", (x,))
+                        second = batch.select("SELECT %s AS `m`", (x,))
+                self.assertEqual(first.rows, [{'n': x}])
+                self.assertEqual(second.rows, [{'m': x}])
+                self.assertEqual(stats.counts['sql'], num_statements)
+                self.assertIs(self.pool.multi_statements, False)
+        finally:
+            conn.sql.connection.set_server_option(
+                MYSQL_OPTION_MULTI_STATEMENTS_ON)
+            self.pool.multi_statements = None
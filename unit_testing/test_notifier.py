@@ -1,8 +1,12 @@
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
 import logging
 import unittest
 
-from model import Organization, Project, User
+from model import Organization, Project, ProjectCohort, User
 from unit_test_helper import ConsistencyTestCase
+import config
+import model.user as user_model
 import notifier
 
 
@@ -13,6 +17,15 @@ class TestNotifier(ConsistencyTestCase):
     # user, it's not a big deal.
     consistency_probability = 1
 
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestNotifier, self).set_up()
+
+        config.notifications_synchronous = True
+
+    def tear_down(self):
+        config.notifications_synchronous = False
+
     def test_requested_to_join_organization(self):
         """Applying to join an org notifies org owners."""
         org = Organization.create(name="Foo Org")
@@ -265,6 +278,104 @@ class TestNotifier(ConsistencyTestCase):
         notifier.changed_organization_task(sup, org, task)
         self.assertEqual(len(admin1.notifications()), 2)
 
+    def test_role_members_cached(self):
+        """Super admins are cached until a user is saved."""
+        sup1 = User.create(email='sup1@perts.net', user_type='super_admin')
+        sup1.put()
+        # Let the change settle, see ROLE_MEMBERS_SETTLE_SECONDS.
+        memcache.flush_all()
+        self.assertEqual([u.uid for u in User.get_super_admins()], [sup1.uid])
+        self.assertIn('super_admin',
+                      memcache.get(user_model.ROLE_MEMBERS_KEY))
+
+        # New supers clear the cache.
+        sup2 = User.create(email='sup2@perts.net', user_type='super_admin')
+        sup2.put()
+        self.assertEqual(set(u.uid for u in User.get_super_admins()),
+                         {sup1.uid, sup2.uid})
+        # Possibly stale query results aren't cached right after a change.
+        self.assertIsNone(memcache.get(user_model.ROLE_MEMBERS_KEY))
+
+        # So do former supers.
+        memcache.flush_all()
+        User.get_super_admins()
+        sup1.user_type = 'user'
+        sup1.put()
+        self.assertEqual([u.uid for u in User.get_super_admins()], [sup2.uid])
+
+    def create_download(self):
+        sup = User.create(email='sup@perts.net', user_type='super_admin')
+        sup.put()
+        org = Organization.create(name='Foo Org')
+        org.put()
+        pc = ProjectCohort.create(
+            program_label='demo-program',
+            organization_id=org.uid,
+            project_id='Project_foo',
+            cohort_label='2017_spring',
+        )
+        pc.put()
+        admin = User.create(email='admin@perts.net', user_type='user',
+                            name='Addi Admin')
+        return sup, admin, pc
+
+    def test_downloaded_identifiers_digest(self):
+        """Repeated downloads count up in one notification."""
+        sup, admin, pc = self.create_download()
+
+        for x in range(3):
+            notifier.downloaded_identifiers(admin, pc.uid)
+
+        notes = sup.notifications()
+        self.assertEqual(len(notes), 1)
+        self.assertEqual(notes[0].digest_count, 3)
+
+        # Once dismissed, the next download starts a new one.
+        notes[0].dismissed = True
+        notes[0].put()
+        notifier.downloaded_identifiers(admin, pc.uid)
+        self.assertEqual(len(sup.notifications()), 2)
+
+    def test_fan_out_in_task(self):
+        """Outside of tests, notifications are written in a task."""
+        sup, admin, pc = self.create_download()
+        config.notifications_synchronous = False
+
+        notifier.downloaded_identifiers(admin, pc.uid)
+
+        self.assertEqual(len(sup.notifications()), 0)
+        tasks = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).get_filtered_tasks(
+                url=notifier.FAN_OUT_URL)
+        self.assertEqual(len(tasks), 1)
+
+    def test_joined_cohorts_one_task(self):
+        """Bulk enrollment notifies of every cohort joined in one task."""
+        sup, admin, pc = self.create_download()
+        other_org = Organization.create(name='Bar Org')
+        other_org.put()
+        other_pc = ProjectCohort.create(
+            program_label=pc.program_label,
+            organization_id=other_org.uid,
+            project_id='Project_bar',
+            cohort_label=pc.cohort_label,
+        )
+        other_pc.put()
+
+        config.notifications_synchronous = False
+        notifier.joined_cohorts([pc, other_pc])
+        tasks = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).get_filtered_tasks(
+                url=notifier.FAN_OUT_URL)
+        self.assertEqual(len(tasks), 1)
+
+        config.notifications_synchronous = True
+        notifier.joined_cohorts([pc, other_pc])
+        self.assertEqual(
+            sorted(n.context_id for n in sup.notifications()),
+            sorted([pc.uid, other_pc.uid]),
+        )
+
     @unittest.skip("No tasklist notifications pending future cohort designs.")
     def test_complete_organization_tasklist(self):
         """Super and org admins get notifications about complete tasklist."""
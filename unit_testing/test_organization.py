@@ -1,9 +1,13 @@
 from google.appengine.api import memcache
+from google.appengine.ext import testbed
+from fixed_time import FixedTime
 from model import (DatastoreModel, Checkpoint, Organization, Project,
                    ProjectCohort, Task, User)
 from unit_test_helper import ConsistencyTestCase
+import model.dashboardrow
 import mysql_connection
 import logging
+import time
 import util
 
 
@@ -18,6 +22,11 @@ class TestOrganization(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({'checkpoint': Checkpoint.get_table_definition()})
 
+        self.real_time = model.dashboardrow.time
+
+    def tear_down(self):
+        model.dashboardrow.time = self.real_time
+
     def test_create(self):
         o = Organization.create()
 
@@ -122,28 +131,24 @@ class TestOrganization(ConsistencyTestCase):
         self.assertIsNone(memcache.get(p_key))
         self.assertIsNone(memcache.get(pc_key))
 
-    def test_put_clears_dashboard_queries(self):
+    def test_put_queues_dashboard_refresh(self):
         org, project, pc = self.create_org_with_pc()
 
-        org_key = util.cached_query_key(
-            'SuperDashboard',
-            organization_id=org.uid,
-        )
-        program_cohort_key = util.cached_query_key(
-            'SuperDashboard',
-            program_label=pc.program_label,
-            cohort_label=pc.cohort_label,
-        )
-        memcache.set(org_key, {'foo': 1})
-        memcache.set(program_cohort_key, {'foo': 1})
-        self.assertEqual(memcache.get(program_cohort_key), {'foo': 1})
+        # Start from an empty queue in a new debounce window, so the put below
+        # has to queue a refresh of its own.
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        taskqueue_stub.FlushQueue('default')
+        model.dashboardrow.time = FixedTime(
+            time.time() + model.dashboardrow.REFRESH_DEBOUNCE_SECONDS)
 
         # Re-fetch the org so it doesn't have an associated tasklist, which
-        # saves checkpoints. This should clear memcache without relying on those
-        # checkpoints.
+        # saves checkpoints. This should queue a refresh without relying on
+        # those checkpoints.
         org = org.key.get()
         org.name = "Bar University"
         org.put()
 
-        self.assertIsNone(memcache.get(org_key))
-        self.assertIsNone(memcache.get(program_cohort_key))
+        tasks = taskqueue_stub.get_filtered_tasks(
+            url='/task/refresh_dashboard_rows')
+        self.assertEqual(len(tasks), 1)
+        self.assertIn(org.uid, tasks[0].payload)
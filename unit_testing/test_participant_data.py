@@ -6,7 +6,8 @@ import unittest
 
 from google.appengine.api import memcache
 from unit_test_helper import ConsistencyTestCase
-from model import Participant, ParticipantData, SqlModel
+from model import Participant, ParticipantData, ParticipationRollup, SqlModel
+import config
 import mysql_connection
 
 
@@ -22,8 +23,15 @@ class TestParticipantData(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({
                 'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
             })
 
+        config.participation_rollup_synchronous = True
+
+    def tear_down(self):
+        config.participation_rollup_synchronous = False
+
     def test_create_portal_pd(self, testing=False):
         """Set all the pd potentially required by the portal."""
         # Using the same project and project cohort ids from the mock function.
@@ -216,38 +224,33 @@ class TestParticipantData(ConsistencyTestCase):
             project_cohort_id='ProjectCohort_12345678')
         self.assertEqual(results, [])
 
-    def test_put_clears_cache(self):
+    def test_put_invalidates_cache(self):
         pc_id = 'ProjectCohort_foo'
         survey_id = 'Survey_foo'
         code = 'foo bar'
 
-        start1 = datetime.datetime.today()
-        end1   = start1 + datetime.timedelta(days=1)
-        start2 = start1 + datetime.timedelta(days=2)
-        end2   = start1 + datetime.timedelta(days=3)
+        start = datetime.datetime.today()
+        end = start + datetime.timedelta(days=1)
+        date_key = ParticipantData.date_key(start, end)
 
-        cache_data = {
-            ParticipantData.participation_cache_key(pc_id): {
-                ParticipantData.date_key(start1, end1): ['result1'],
-                ParticipantData.date_key(start2, end2): ['result2'],
-            },
-            ParticipantData.participation_cache_key(survey_id): {
-                ParticipantData.date_key(start1, end1): ['result1'],
-                ParticipantData.date_key(start2, end2): ['result2'],
-            },
-            ParticipantData.participation_by_pc_cache_key(pc_id): {
-                ParticipantData.date_key(start1, end1): ['result1'],
-                ParticipantData.date_key(start2, end2): ['result2'],
-            },
-            ParticipantData.participation_by_pc_cache_key(code): {
-                ParticipantData.date_key(start1, end1): ['result1'],
-                ParticipantData.date_key(start2, end2): ['result2'],
-            },
-        }
-        memcache.set_multi(cache_data)
+        # Pretend results are already cached for the current generations.
+        generations = ParticipantData.participation_generations(
+            [pc_id, survey_id, code])
+        memcache.set_multi({
+            ParticipantData.participation_cache_key(
+                pc_id, generations[pc_id], date_key): ['cached'],
+            ParticipantData.participation_cache_key(
+                survey_id, generations[survey_id], date_key): ['cached'],
+            ParticipantData.participation_by_pc_cache_key(
+                code, generations[code], date_key): ['cached'],
+        })
+        self.assertEqual(
+            ParticipantData.participation(
+                project_cohort_id=pc_id, start=start, end=end),
+            ['cached'],
+        )
 
-        # Write a pd that relates to the pc and survey, falling in the first
-        # date range. That date range should clear, the other should remain.
+        # Write a pd that relates to the pc and survey.
         pd = ParticipantData.create(
             key='progress',
             value=1,
@@ -262,14 +265,47 @@ class TestParticipantData(ConsistencyTestCase):
         )
         ParticipantData.put_for_index(pd, 'participant-survey-key')
 
-        for cache_key in cache_data.keys():
-            self.assertEqual(len(memcache.get(cache_key)), 1)
+        # Each related entity has moved on by one generation.
+        new_generations = ParticipantData.participation_generations(
+            [pc_id, survey_id, code])
+        for id, generation in generations.items():
+            self.assertEqual(new_generations[id], generation + 1)
 
-    def test_cache_truncation(self):
-        big_cache_value = {
-          '2019-01-01T00:00:00{}'.format(x): 'foo'
-          for x in range(1001)
-        }
-        truncated = ParticipantData.truncate_cached(big_cache_value)
-        self.assertEqual(len(truncated), 100)
+        # So cached results aren't used.
+        ParticipantData.reset_participation_cache_stats()
+        expected = [{'value': '1', 'survey_ordinal': 1, 'n': 1}]
+        self.assertEqual(
+            ParticipantData.participation(
+                project_cohort_id=pc_id, start=start, end=end),
+            expected,
+        )
+        self.assertEqual(
+            ParticipantData.participation(
+                survey_id=survey_id, start=start, end=end),
+            expected,
+        )
+        by_pc = ParticipantData.participation_by_project_cohort(
+            [code], using_codes=True, start=start, end=end)
+        self.assertEqual(len(by_pc), 1)
+        self.assertEqual(by_pc[0]['n'], 1)
+
+        stats = ParticipantData.participation_cache_stats()
+        self.assertEqual(stats['stale'], 3)
+        self.assertEqual(stats['hit'], 0)
+
+    def test_cache_stats(self):
+        self.test_create_portal_pd()
+        ParticipantData.reset_participation_cache_stats()
+
+        start = datetime.datetime.today()
+        end = start + datetime.timedelta(days=1)
+        for x in range(3):
+            ParticipantData.participation(
+                survey_id='Survey_1', start=start, end=end)
+
+        stats = ParticipantData.participation_cache_stats()
+        self.assertEqual(stats['miss'], 1)
+        self.assertEqual(stats['hit'], 2)
+        self.assertEqual(stats['stale'], 0)
+        self.assertAlmostEqual(stats['hit_rate'], 2.0 / 3)
 
@@ -5,7 +5,10 @@ import logging
 import unittest
 
 from unit_test_helper import ConsistencyTestCase
-from model import (Participant, ParticipantData, ProjectCohort, Survey)
+from model import (Participant, ParticipantData, ParticipationRollup,
+                   ProjectCohort, Survey)
+import config
+import instrumentation
 import mysql_connection
 
 
@@ -67,8 +70,15 @@ class TestParticipation(ConsistencyTestCase):
             sql.reset({
                 'participant': Participant.get_table_definition(),
                 'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
             })
 
+        config.participation_rollup_synchronous = True
+
+    def tear_down(self):
+        config.participation_rollup_synchronous = False
+
     def mock_participants(self):
         unfinished_id = Participant.convert_uid(self.unfinished_id)
         finished_id = Participant.convert_uid(self.finished_id)
@@ -258,3 +268,219 @@ class TestParticipation(ConsistencyTestCase):
         ]
 
         self.assertEqual(result, expected)
+
+    def assert_rollup_matches_raw(self, **scope):
+        now = datetime.datetime.now()
+        today = datetime.datetime.combine(now.date(), datetime.time())
+        hour = datetime.timedelta(hours=1)
+        day = datetime.timedelta(days=1)
+        date_ranges = [
+            (None, None),
+            (today, today + day),
+            (today - day, today + 2 * day),
+            (now - hour, now + hour),
+            (today - day - hour, today + day + hour),
+            (now + hour, None),
+        ]
+        for start, end in date_ranges:
+            self.assertEqual(
+                ParticipantData.participation_from_rollup(
+                    start=start, end=end, **scope),
+                ParticipantData.participation_from_sql(
+                    start=start, end=end, **scope),
+            )
+
+    def test_rollup_matches_raw(self):
+        pc_id1 = 'ProjectCohort_one'
+        pc_id2 = 'ProjectCohort_two'
+        pds = (self.mock_one_finished_one_unfinished(1, pc_id=pc_id1) +
+               self.mock_one_finished_one_unfinished(2, pc_id=pc_id1) +
+               self.mock_one_finished_one_unfinished(1, pc_id=pc_id2))
+
+        self.assert_rollup_matches_raw(survey_id=pds[0].survey_id)
+        self.assert_rollup_matches_raw(project_cohort_id=pc_id1)
+        self.assert_rollup_matches_raw(program_label=self.program_label,
+                                       cohort_label=self.cohort_label)
+
+        self.assertEqual(
+            ParticipantData.participation_by_project_cohort_from_rollup(
+                [pc_id1, pc_id2]),
+            ParticipantData.participation_by_project_cohort_from_sql(
+                [pc_id1, pc_id2]),
+        )
+        self.assertEqual(ParticipationRollup.check([pc_id1, pc_id2]), [])
+
+        # Deleting moves rows out of their buckets too.
+        ParticipantData.delete_multi(pds[:3])
+        self.assert_rollup_matches_raw(project_cohort_id=pc_id1)
+
+    def test_rollup_racing_writes(self):
+        """Writes that read the same row beforehand don't double count."""
+        pc_id = 'ProjectCohort_foo'
+        pd = self.mock_one_finished_one_unfinished(1, pc_id=pc_id)[0]
+
+        def upgrade(value):
+            return ParticipantData.create(
+                key='progress', value=value, participant_id=pd.participant_id,
+                program_label=pd.program_label, cohort_label=pd.cohort_label,
+                project_cohort_id=pd.project_cohort_id, code=pd.code,
+                survey_id=pd.survey_id, survey_ordinal=pd.survey_ordinal,
+            )
+
+        # Both writers read the row before either writes, then each records
+        # its write against what it read.
+        racers = [upgrade(33), upgrade(66)]
+        existing = ParticipantData.get_existing_progress(racers[:1])
+        for racer in racers:
+            ParticipantData.upsert_batch([racer])
+        for racer in racers:
+            ParticipationRollup.record(existing, [racer], only_increases=True)
+
+        self.assertEqual(ParticipationRollup.check([pc_id]), [])
+        self.assert_rollup_matches_raw(project_cohort_id=pc_id)
+
+    def test_upsert_batch_reads_with_write(self):
+        """The rows the rollup needs are read in the write's round trip."""
+        config.participation_rollup_synchronous = False
+        pc_id = 'ProjectCohort_foo'
+        pd = self.mock_one_finished_one_unfinished(1, pc_id=pc_id)[0]
+        upgrade = ParticipantData.create(
+            key='progress', value=66, participant_id=pd.participant_id,
+            program_label=pd.program_label, cohort_label=pd.cohort_label,
+            project_cohort_id=pd.project_cohort_id, code=pd.code,
+            survey_id=pd.survey_id, survey_ordinal=pd.survey_ordinal,
+        )
+
+        with instrumentation.collect() as stats:
+            ParticipantData.upsert_batch([upgrade])
+        # The read and upsert, then the commit.
+        self.assertEqual(stats.counts['sql'], 2)
+
+        ParticipationRollup.flush_recounts()
+        self.assertEqual(ParticipationRollup.check([pc_id]), [])
+        self.assert_rollup_matches_raw(project_cohort_id=pc_id)
+
+    def test_rollup_queued_recount(self):
+        """Writes queue their groups, and the worker recounts them once."""
+        config.participation_rollup_synchronous = False
+        pc_id = 'ProjectCohort_foo'
+        self.mock_one_finished_one_unfinished(1, pc_id=pc_id)
+        self.mock_one_finished_one_unfinished(2, pc_id=pc_id)
+
+        # Nothing is counted until the worker runs.
+        self.assertEqual(ParticipationRollup.check([pc_id]), [pc_id])
+        generation = ParticipantData.participation_generations([pc_id])[pc_id]
+
+        report = ParticipationRollup.flush_recounts()
+        self.assertGreater(report['leased'], 0)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(ParticipationRollup.check([pc_id]), [])
+
+        # Participation cached in the meantime is stale.
+        self.assertGreater(
+            ParticipantData.participation_generations([pc_id])[pc_id],
+            generation,
+        )
+        self.assert_rollup_matches_raw(project_cohort_id=pc_id)
+
+        self.assertEqual(ParticipationRollup.flush_recounts()['leased'], 0)
+
+    def test_rollup_ignores_testing(self):
+        survey = Survey.create([], ordinal=1, program_label=self.program_label)
+        survey.put()
+        pd = ParticipantData.create(
+            key='progress', value=1, participant_id='Participant_tester',
+            program_label=self.program_label,
+            project_cohort_id='ProjectCohort_foo', code='trout viper',
+            survey_id=survey.uid,
+            survey_ordinal=survey.ordinal, testing=True,
+        )
+        ParticipantData.put_for_index(pd, 'participant-survey-key')
+
+        self.assertEqual(
+            ParticipantData.participation_from_rollup(survey_id=survey.uid),
+            [],
+        )
+
+    def test_rollup_check_and_rebuild(self):
+        pc_id = 'ProjectCohort_foo'
+        self.mock_one_finished_one_unfinished(1, pc_id=pc_id)
+
+        # Simulate drift, e.g. from a request that died after writing pd.
+        with mysql_connection.connect() as sql:
+            sql.query("UPDATE `participation_rollup` SET `n` = `n` + 1", ())
+
+        self.assertEqual(ParticipationRollup.check([pc_id]), [pc_id])
+
+        ParticipationRollup.rebuild([pc_id])
+        self.assertEqual(ParticipationRollup.check([pc_id]), [])
+        self.assert_rollup_matches_raw(project_cohort_id=pc_id)
+
+        # Also in one transaction without pooled connections.
+        config.mysql_pool_enabled = False
+        try:
+            with mysql_connection.connect() as sql:
+                sql.query("UPDATE `participation_rollup` SET `n` = `n` + 1",
+                          ())
+            ParticipationRollup.rebuild([pc_id])
+        finally:
+            config.mysql_pool_enabled = True
+        self.assertEqual(ParticipationRollup.check([pc_id]), [])
+
+    def test_upsert_without_increase_keeps_modified(self):
+        """Rows whose progress doesn't go up stay in their day bucket, even
+        if other columns change."""
+        pc_id = 'ProjectCohort_foo'
+        pd = self.mock_one_finished_one_unfinished(1, pc_id=pc_id)[0]
+
+        with mysql_connection.connect() as sql:
+            sql.query(
+                """
+                    UPDATE `participant_data`
+                    SET `modified` = `modified` - INTERVAL 1 DAY
+                    WHERE `uid` = %s
+                """,
+                (pd.uid,),
+            )
+        ParticipationRollup.rebuild([pc_id])
+        before = ParticipantData.get_by_id(pd.uid).modified
+
+        same = ParticipantData.create(
+            key='progress', value=pd.value, participant_id=pd.participant_id,
+            program_label=pd.program_label, cohort_label=pd.cohort_label,
+            project_cohort_id=pd.project_cohort_id, code='other code',
+            survey_id=pd.survey_id, survey_ordinal=pd.survey_ordinal,
+        )
+        ParticipantData.upsert_batch([same])
+
+        self.assertEqual(ParticipantData.get_by_id(pd.uid).modified, before)
+        self.assertEqual(ParticipationRollup.check([pc_id]), [])
+
+    def test_full_days(self):
+        day = datetime.timedelta(days=1)
+        midnight = datetime.datetime(2020, 1, 1)
+        noon = datetime.datetime(2020, 1, 1, 12)
+
+        # Whole days only.
+        self.assertEqual(
+            ParticipationRollup.full_days(midnight, midnight + 2 * day),
+            ((midnight.date(), midnight.date() + 2 * day), []),
+        )
+        # Dates are the same as midnight.
+        self.assertEqual(
+            ParticipationRollup.full_days(midnight.date(), None),
+            ((midnight.date(), None), []),
+        )
+        # Partial days on each end.
+        self.assertEqual(
+            ParticipationRollup.full_days(noon, noon + 2 * day),
+            (
+                (midnight.date() + day, midnight.date() + 2 * day),
+                [(noon, midnight + day), (midnight + 2 * day, noon + 2 * day)],
+            ),
+        )
+        # Less than a whole day.
+        self.assertEqual(
+            ParticipationRollup.full_days(noon, noon + day),
+            (None, [(noon, noon + day)]),
+        )
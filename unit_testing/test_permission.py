@@ -0,0 +1,83 @@
+"""Test ownership rules in permission.py."""
+
+from model import Organization, ProjectCohort, Survey, User
+from permission import jwt_allows_endpoints, owns, owns_many
+from unit_test_helper import ConsistencyTestCase
+
+
+class TestPermission(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def create_entities(self):
+        owned_org = Organization.create(name='Owned Academy')
+        other_org = Organization.create(name='Other Academy')
+        Organization.put_multi([owned_org, other_org])
+
+        pcs = [
+            ProjectCohort.create(
+                program_label='demo-program',
+                organization_id=org.uid,
+                project_id='Project_foo',
+                cohort_label='2018',
+            )
+            for org in (owned_org, other_org)
+        ]
+        ProjectCohort.put_multi(pcs)
+
+        surveys = [
+            Survey.create(
+                [],
+                program_label='demo-program',
+                organization_id=pc.organization_id,
+                project_cohort_id=pc.uid,
+                ordinal=1,
+            )
+            for pc in pcs
+        ]
+        Survey.put_multi(surveys)
+
+        user = User.create(email='user@school.edu',
+                           owned_organizations=[owned_org.uid])
+        user.put()
+
+        return user, [owned_org, other_org] + pcs + surveys
+
+    def test_owns_many_matches_owns(self):
+        user, entities = self.create_entities()
+        uids = [e.uid for e in entities]
+
+        result = owns_many(user, uids)
+
+        self.assertEqual(result, {uid: owns(user, uid) for uid in uids})
+        # Owned org, its pc, and its survey.
+        self.assertEqual(sum(result.values()), 3)
+
+    def test_owns_many_unowned_kinds(self):
+        user, entities = self.create_entities()
+
+        result = owns_many(
+            user, ['cool cat', 'ProjectCohort_dne', entities[0]])
+
+        self.assertEqual(result, {
+            'cool cat': False,
+            'ProjectCohort_dne': False,
+            entities[0].uid: True,
+        })
+
+    def test_owns_many_super_admin(self):
+        admin = User.create(email='admin@perts.net', user_type='super_admin')
+        result = owns_many(admin, ['cool cat', 'ProjectCohort_dne'])
+        self.assertTrue(all(result.values()))
+
+    def test_jwt_allows_endpoints(self):
+        payload = {'allowed_endpoints': ['GET //neptune/api/foo']}
+        self.assertEqual(
+            jwt_allows_endpoints(
+                payload, ['GET //neptune/api/foo', 'GET //neptune/api/bar']),
+            {'GET //neptune/api/foo': True, 'GET //neptune/api/bar': False},
+        )
+        self.assertEqual(
+            jwt_allows_endpoints(None, ['GET //neptune/api/foo']),
+            {'GET //neptune/api/foo': False},
+        )
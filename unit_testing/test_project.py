@@ -1,11 +1,15 @@
 """Test Project entities."""
 
 from google.appengine.api import memcache
+from google.appengine.ext import testbed
+import time
 import unittest
 
+from fixed_time import FixedTime
 from unit_test_helper import ConsistencyTestCase
 from model import (Checkpoint, Organization, Program, Project, ProjectCohort,
                    Task)
+import model.dashboardrow
 import mysql_connection
 import util
 
@@ -22,6 +26,11 @@ class TestProject(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({'checkpoint': Checkpoint.get_table_definition()})
 
+        self.real_time = model.dashboardrow.time
+
+    def tear_down(self):
+        model.dashboardrow.time = self.real_time
+
     def test_program_access(self):
         """Should be able to look up program config through project."""
         organization = Organization.create(name='Foo College')
@@ -100,27 +109,36 @@ class TestProject(ConsistencyTestCase):
 
         self.assertIsNone(memcache.get(key))
 
-    def test_put_clears_dashboard_queries(self):
+    def test_put_queues_dashboard_refresh(self):
         project, pc = self.create_with_pc()
 
-        org_key = util.cached_query_key(
-            'SuperDashboard',
-            organization_id=project.organization_id,
-        )
-        program_cohort_key = util.cached_query_key(
-            'SuperDashboard',
-            program_label=pc.program_label,
-            cohort_label=pc.cohort_label,
-        )
-        memcache.set(org_key, {'foo': 1})
-        memcache.set(program_cohort_key, {'foo': 1})
+        # Start from an empty queue in a new debounce window, so the put below
+        # has to queue a refresh of its own.
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        taskqueue_stub.FlushQueue('default')
+        model.dashboardrow.time = FixedTime(
+            time.time() + model.dashboardrow.REFRESH_DEBOUNCE_SECONDS)
 
-        # Re-fetch the org so it doesn't have an associated tasklist, which
-        # saves checkpoints. This should clear memcache without relying on those
-        # checkpoints.
+        # Re-fetch the project so it doesn't have an associated tasklist,
+        # which saves checkpoints. This should queue a refresh without relying
+        # on those checkpoints.
         project = project.key.get()
         project.priority = True
         project.put()
 
-        self.assertIsNone(memcache.get(org_key))
-        self.assertIsNone(memcache.get(program_cohort_key))
+        tasks = taskqueue_stub.get_filtered_tasks(
+            url='/task/refresh_dashboard_rows')
+        self.assertEqual(len(tasks), 1)
+        self.assertIn(project.organization_id, tasks[0].payload)
+
+    def test_put_without_cohorts_queues_no_dashboard_refresh(self):
+        project = Project.create(
+            program_label='demo-program',
+            organization_id='Organization_Foo',
+        )
+        project.put()
+
+        tasks = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).get_filtered_tasks(
+                url='/task/refresh_dashboard_rows')
+        self.assertEqual(tasks, [])
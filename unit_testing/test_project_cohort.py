@@ -1,11 +1,12 @@
 """Test Project Cohort entities."""
 
 from google.appengine.api import memcache
+from google.appengine.ext import testbed
 import unittest
 
 from unit_test_helper import ConsistencyTestCase
 from model import Program, ProjectCohort
-import util
+import model.projectcohort
 
 
 class TestProjectCohort(ConsistencyTestCase):
@@ -52,7 +53,7 @@ class TestProjectCohort(ConsistencyTestCase):
         )
         self.assertEqual(pc.portal_type, program['default_portal_type'])
 
-    def test_put_clears_dashboard_queries(self):
+    def test_put_queues_dashboard_refresh(self):
         pc = ProjectCohort.create(
             program_label='demo-program',
             organization_id='Organization_Foo',
@@ -60,21 +61,38 @@ class TestProjectCohort(ConsistencyTestCase):
             cohort_label='2018',
         )
 
-        org_key = util.cached_query_key(
-            'SuperDashboard',
-            organization_id=pc.organization_id,
-        )
-        program_cohort_key = util.cached_query_key(
-            'SuperDashboard',
-            program_label=pc.program_label,
-            cohort_label=pc.cohort_label,
-        )
+        # Its row in the super dashboard should be rebuilt.
+        pc.put()
+
+        tasks = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).get_filtered_tasks(
+                url='/task/refresh_dashboard_rows')
+        self.assertTrue(any(pc.organization_id in t.payload for t in tasks))
+
+    def test_get_by_code_without_query(self):
+        pc = ProjectCohort.create(program_label=self.program_label)
+        pc.put()
+
+        # Queries aren't consistent in this test case, but the code was
+        # indexed when it was written.
+        self.assertEqual(ProjectCohort.get(code=pc.code), [])
+        self.assertEqual(ProjectCohort.get_by_code(pc.code), pc)
 
-        memcache.set(org_key, {'foo': 1})
-        memcache.set(program_cohort_key, {'foo': 1})
+        # Other instances find it in memcache.
+        model.projectcohort._code_index.clear()
+        self.assertEqual(ProjectCohort.get_by_code(pc.code), pc)
 
-        # This should clear memcache.
+    def test_get_by_code_stale_index(self):
+        pc = ProjectCohort.create(program_label=self.program_label)
         pc.put()
+        pc.key.get()  # simulate consistency
+
+        # E.g. indexed by another instance before a delete.
+        ProjectCohort.index_code(pc.code, 'ProjectCohort_deleted')
+        self.assertEqual(ProjectCohort.get_by_code(pc.code), pc)
+        self.assertEqual(
+            memcache.get(model.projectcohort.CODE_INDEX_PREFIX + pc.code),
+            pc.uid,
+        )
 
-        self.assertIsNone(memcache.get(org_key))
-        self.assertIsNone(memcache.get(program_cohort_key))
+        self.assertIsNone(ProjectCohort.get_by_code('dne dne'))
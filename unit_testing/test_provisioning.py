@@ -0,0 +1,158 @@
+"""Test creating project cohorts and their contents in bulk."""
+
+import datetime
+import json
+import webapp2
+import webtest
+
+from api_handlers import api_routes
+from model import (Checkpoint, DashboardRow, Organization, Program, Project,
+                   ProjectCohort, Survey, Task, TaskReminder, User)
+from unit_test_helper import ConsistencyTestCase, jwt_headers
+import config
+import mysql_connection
+import provisioning
+
+
+class TestProvisioning(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    program_label = 'demo-program'
+    cohort_label = 'demo-cohort'
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestProvisioning, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({'checkpoint': Checkpoint.get_table_definition()})
+
+        application = webapp2.WSGIApplication(api_routes, debug=True)
+        self.testapp = webtest.TestApp(application)
+
+        # An open cohort.
+        today = datetime.date.today()
+        one_day = datetime.timedelta(days=1)
+        Program.mock_program_config(
+            self.program_label,
+            {'cohorts': {self.cohort_label: {
+                'label': self.cohort_label,
+                'name': 'Demo Cohort',
+                'open_date': str(today - one_day),
+                'close_date': str(today + one_day),
+            }}},
+        )
+        self.program = Program.get_config(self.program_label)
+
+        config.notifications_synchronous = True
+
+    def tear_down(self):
+        Program.reset_mocks()
+        config.notifications_synchronous = False
+
+    def create_org(self, name):
+        org = Organization.create(name=name)
+        org.put()
+        owner = User.create(email='{}@example.com'.format(name),
+                            owned_organizations=[org.uid])
+        owner.put()
+        project = Project.create(organization_id=org.uid,
+                                 program_label=self.program_label)
+        project.put()
+        return owner, project
+
+    def test_commit(self):
+        owner, project = self.create_org('foo')
+        pc = ProjectCohort.create(
+            organization_id=project.organization_id,
+            project_id=project.uid,
+            program_label=self.program_label,
+            cohort_label=self.cohort_label,
+        )
+
+        plan = provisioning.plan(pc)
+        DashboardRow.reset_refresh_stats()
+        # Codes aren't indexed until their project cohorts are written.
+        self.assertEqual(ProjectCohort.uids_for_codes([pc.code]), {})
+        counts = provisioning.commit([plan])
+        self.assertEqual(ProjectCohort.uids_for_codes([pc.code]),
+                         {pc.code: pc.uid})
+
+        num_surveys = len(self.program['surveys'])
+        self.assertEqual(counts['project_cohorts'], 1)
+        self.assertEqual(counts['surveys'], num_surveys)
+        self.assertEqual(counts['task_reminders'], num_surveys)
+
+        fetched = ProjectCohort.get_by_id(pc.uid)
+        self.assertEqual(len(fetched.survey_ids), num_surveys)
+        self.assertEqual(len(Survey.get(project_cohort_id=pc.uid)),
+                         num_surveys)
+        self.assertEqual(
+            len(Checkpoint.get(project_cohort_id=pc.uid, n=float('inf'))),
+            counts['checkpoints'],
+        )
+        self.assertEqual(len(Task.get(ancestor=Survey.get_by_id(
+            pc.survey_ids[0]))), len(plan.surveys[0].tasklist.tasks))
+        self.assertEqual(len(TaskReminder.get(ancestor=owner)), num_surveys)
+
+        # Hooks were deferred, and the dashboard row refresh requested once
+        # rather than by every survey and checkpoint.
+        self.assertFalse(pc.provisioned)
+        self.assertEqual(DashboardRow.refresh_stats()['requested'], 1)
+
+    def test_batch_enroll(self):
+        sup = User.create(email='super@perts.net', user_type='super_admin')
+        sup.put()
+        owner, project = self.create_org('foo')
+        other_owner, other_project = self.create_org('bar')
+        existing = ProjectCohort.create(
+            organization_id=other_project.organization_id,
+            project_id=other_project.uid,
+            program_label=self.program_label,
+            cohort_label=self.cohort_label,
+        )
+        existing.put()
+
+        body = {
+            'program_label': self.program_label,
+            'cohort_label': self.cohort_label,
+            'items': [
+                {'organization_id': project.organization_id,
+                 'expected_participants': 100},
+                {'organization_id': other_project.organization_id},
+                {'organization_id': 'Organization_dne'},
+            ],
+        }
+
+        self.testapp.post_json('/api/project_cohorts/batch', body,
+                               headers=jwt_headers(owner), status=403)
+        response = self.testapp.post_json('/api/project_cohorts/batch', body,
+                                          headers=jwt_headers(sup))
+        results = json.loads(response.body)['results']
+
+        self.assertEqual([r['status'] for r in results], [200, 400, 404])
+        pc = ProjectCohort.get_by_id(results[0]['project_cohort_id'])
+        self.assertEqual(pc.code, results[0]['code'])
+        self.assertEqual(pc.project_id, project.uid)
+        self.assertEqual(pc.expected_participants, 100)
+        self.assertEqual(len(pc.survey_ids), len(self.program['surveys']))
+
+        # Super admins hear about the new project cohort, as they do when an
+        # org joins on its own.
+        self.assertEqual(len(sup.notifications()), 1)
+
+    def test_batch_enroll_unknown_program(self):
+        sup = User.create(email='super@perts.net', user_type='super_admin')
+        sup.put()
+        owner, project = self.create_org('foo')
+
+        body = {
+            'program_label': 'program-dne',
+            'cohort_label': self.cohort_label,
+            'items': [{'organization_id': project.organization_id}],
+        }
+        self.testapp.post_json('/api/project_cohorts/batch', body,
+                               headers=jwt_headers(sup), status=400)
+        self.assertEqual(
+            ProjectCohort.get(organization_id=project.organization_id), [])
@@ -0,0 +1,100 @@
+"""Test building reporting units for RServe report scripts."""
+
+import datetime
+
+from model import Checkpoint, Program, ProjectCohort, Task
+from unit_test_helper import ConsistencyTestCase
+import mysql_connection
+import provisioning
+import rserve_reports
+
+
+class TestRServeReports(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    program_label = 'demo-program'
+    cohort_label = 'demo-cohort'
+    report_label = 'demo_survey__report_1'
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestRServeReports, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({'checkpoint': Checkpoint.get_table_definition()})
+
+        self.mock_program(['demo_survey__monitor_1', self.report_label])
+
+    def tear_down(self):
+        Program.reset_mocks()
+
+    def mock_program(self, task_labels):
+        today = datetime.date.today()
+        one_day = datetime.timedelta(days=1)
+        Program.mock_program_config(self.program_label, {
+            'cohorts': {self.cohort_label: {
+                'label': self.cohort_label,
+                'name': 'Demo Cohort',
+                'open_date': str(today - one_day),
+                'close_date': str(today + one_day),
+            }},
+            'surveys': [{
+                'name': "Student Module",
+                'survey_tasklist_template': [{
+                    'name': "Monitor",
+                    'label': 'demo_survey__monitor_1',
+                    'tasks': [{'label': l} for l in task_labels],
+                }],
+            }],
+            'rserve_reports': [
+                {'script': 'demo', 'task_label': self.report_label},
+            ],
+        })
+
+    def create_project_cohorts(self, n, **kwargs):
+        pcs = [
+            ProjectCohort.create(
+                organization_id='Organization_{}'.format(x),
+                project_id='Project_{}'.format(x),
+                program_label=self.program_label,
+                cohort_label=self.cohort_label,
+                **kwargs
+            )
+            for x in range(n)
+        ]
+        provisioning.commit([provisioning.plan(pc) for pc in pcs],
+                            remind=False)
+        return pcs
+
+    def test_pages(self):
+        pcs = self.create_project_cohorts(3)
+        self.create_project_cohorts(1, status='closed')
+
+        pages = list(rserve_reports.reporting_unit_pages(
+            self.program_label, self.cohort_label, self.report_label,
+            page_size=2))
+
+        self.assertEqual([len(p) for p in pages], [2, 1])
+        units = {u['project_cohort_id']: u for p in pages for u in p}
+        self.assertEqual(set(units), set(pc.uid for pc in pcs))
+        for pc_id, unit in units.items():
+            self.assertIn(pc_id, unit['post_url'])
+            task_id = unit['post_task_attachment_url'].split('/')[-2]
+            task = Task.get_by_id(task_id)
+            self.assertEqual(task.label, self.report_label)
+            self.assertEqual(
+                ProjectCohort.get_by_id(pc_id).survey_ids[0],
+                task.key.parent().id(),
+            )
+
+    def test_template_changed(self):
+        """Tasks created from an older template are still found."""
+        pc = self.create_project_cohorts(1)[0]
+        self.mock_program([self.report_label, 'demo_survey__monitor_1'])
+
+        task_ids = rserve_reports.report_task_ids(
+            self.program_label, self.report_label, [pc.uid])
+
+        self.assertEqual(Task.get_by_id(task_ids[pc.uid]).label,
+                         self.report_label)
@@ -5,7 +5,8 @@ import logging
 import unittest
 
 from unit_test_helper import ConsistencyTestCase
-from model import Checkpoint, Program, Project, ParticipantData
+from model import (Checkpoint, Program, Project, ParticipantData,
+                   ParticipationRollup)
 import mysql_connection
 
 
@@ -34,6 +35,8 @@ class TestSqlModel(ConsistencyTestCase):
             sql.reset({
                 'checkpoint': Checkpoint.get_table_definition(),
                 'participant_data': ParticipantData.get_table_definition(),
+                'participation_rollup':
+                    ParticipationRollup.get_table_definition(),
             })
 
     def tearDown(self):
@@ -1,11 +1,13 @@
 """Test Survey entities."""
 
-from google.appengine.api import memcache
+from google.appengine.ext import testbed
+from fixed_time import FixedTime
 from unit_test_helper import ConsistencyTestCase
 from model import Checkpoint, Program, ProjectCohort, Survey, Task
 import logging
+import model.dashboardrow
 import mysql_connection
-import util
+import time
 
 
 class TestSurvey(ConsistencyTestCase):
@@ -20,6 +22,11 @@ class TestSurvey(ConsistencyTestCase):
         with mysql_connection.connect() as sql:
             sql.reset({'checkpoint': Checkpoint.get_table_definition()})
 
+        self.real_time = model.dashboardrow.time
+
+    def tear_down(self):
+        model.dashboardrow.time = self.real_time
+
     def test_program_access(self):
         """Should be able to look up program config through project."""
         tasklist_template = []
@@ -62,7 +69,7 @@ class TestSurvey(ConsistencyTestCase):
         num_tasks = sum([len(checkpoint['tasks']) for checkpoint in template])
         self.assertEqual(len(tasks), num_tasks)
 
-    def test_put_clears_dashboard_queries(self):
+    def test_put_queues_dashboard_refresh(self):
         org_id = 'Organization_Foo'
         program_label = 'demo-program'
         pc = ProjectCohort.create(
@@ -83,25 +90,21 @@ class TestSurvey(ConsistencyTestCase):
         )
         survey.put()
 
-        org_key = util.cached_query_key(
-            'SuperDashboard',
-            organization_id=pc.organization_id,
-        )
-        program_cohort_key = util.cached_query_key(
-            'SuperDashboard',
-            program_label=pc.program_label,
-            cohort_label=pc.cohort_label,
-        )
-
-        memcache.set(org_key, {'foo': 1})
-        memcache.set(program_cohort_key, {'foo': 1})
+        # Start from an empty queue in a new debounce window, so the put below
+        # has to queue a refresh of its own.
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        taskqueue_stub.FlushQueue('default')
+        model.dashboardrow.time = FixedTime(
+            time.time() + model.dashboardrow.REFRESH_DEBOUNCE_SECONDS)
 
-        # Re-fetch the org so it doesn't have an associated tasklist, which
-        # saves checkpoints. This should clear memcache without relying on those
-        # checkpoints.
+        # Re-fetch the survey so it doesn't have an associated tasklist, which
+        # saves checkpoints. This should queue a refresh without relying on
+        # those checkpoints.
         survey = survey.key.get()
         survey.status = 'ready'
         survey.put()
 
-        self.assertIsNone(memcache.get(org_key))
-        self.assertIsNone(memcache.get(program_cohort_key))
+        tasks = taskqueue_stub.get_filtered_tasks(
+            url='/task/refresh_dashboard_rows')
+        self.assertEqual(len(tasks), 1)
+        self.assertIn(org_id, tasks[0].payload)
@@ -1,12 +1,13 @@
 """Test SurveyLink entities and their interaction with cloud storage."""
 
+from google.appengine.ext import ndb
 import cloudstorage as gcs
 import logging
 import random
 import string
 
 from unit_test_helper import ConsistencyTestCase
-from model import SurveyLink
+from model import SurveyLink, SurveyLinkImport
 
 
 def generate_csv_content(num_links):
@@ -58,6 +59,9 @@ class TestSurveyLinksInconsistent(ConsistencyTestCase):
         self.testbed.init_urlfetch_stub()
         self.testbed.init_blobstore_stub()
 
+        # Leased links are kept in memory between calls.
+        SurveyLink.reset_reservoirs()
+
     def test_create_links(self):
         """Can import a csv from cloud storage."""
         program_label = 'demo-program'
@@ -134,6 +138,9 @@ class TestSurveyLinksConsistent(ConsistencyTestCase):
         self.testbed.init_urlfetch_stub()
         self.testbed.init_blobstore_stub()
 
+        # Leased links are kept in memory between calls.
+        SurveyLink.reset_reservoirs()
+
     def test_duplicate_links_overwrite(self):
         """Importing links should be idempotent."""
         program_label = 'demo-program'
@@ -151,3 +158,150 @@ class TestSurveyLinksConsistent(ConsistencyTestCase):
         self.assertEqual(len(keys), 101)
 
         gcs.delete(path)
+
+    def test_import_assigns_shards(self):
+        """Imported links are spread across random shards."""
+        program_label = 'demo-program'
+        content, urls = generate_csv_content(101)
+        path = SurveyLink.import_path(program_label, 1, 'links.csv')
+        with gcs.open(path, 'w') as fh:
+            fh.write(content)
+        SurveyLink.import_links(program_label, 1, 'links.csv')
+
+        shards = set(l.shard for l in SurveyLink.query())
+        self.assertNotIn(None, shards)
+        self.assertGreater(len(shards), 1)
+
+        gcs.delete(path)
+
+    def test_import_ranges(self):
+        """Byte ranges together import every row exactly once."""
+        program_label = 'demo-program'
+        content, urls = generate_csv_content(300)
+        path = SurveyLink.import_path(program_label, 1, 'links.csv')
+        with gcs.open(path, 'w') as fh:
+            fh.write(content)
+
+        ranges = SurveyLink.import_shards(path, shard_bytes=1000)
+        self.assertGreater(len(ranges), 1)
+        counts = [
+            SurveyLink.import_range(program_label, 1, path, start, end)[
+                'num_imported']
+            for start, end in ranges
+        ]
+
+        self.assertEqual(sum(counts), len(urls))
+        self.assertEqual(sorted(l.url for l in SurveyLink.query()),
+                         sorted(urls))
+
+        report = SurveyLink.import_report(program_label, 1)
+        self.assertEqual(len(report), 1)
+        self.assertEqual(report[0]['shards'], len(ranges))
+        self.assertEqual(report[0]['shards_complete'], len(ranges))
+        self.assertEqual(report[0]['num_imported'], len(urls))
+
+        gcs.delete(path)
+
+    def test_import_resumes(self):
+        """A retried import starts from the last batch written."""
+        program_label = 'demo-program'
+        content, urls = generate_csv_content(150)
+        path = SurveyLink.import_path(program_label, 1, 'links.csv')
+        with gcs.open(path, 'w') as fh:
+            fh.write(content)
+        SurveyLink.import_range(program_label, 1, path)
+
+        # As if the task had died after writing the first 100 links.
+        lines = content.split('\n')
+        progress = SurveyLinkImport.query().get()
+        progress.complete = False
+        progress.offset = sum(len(l) + 1 for l in lines[:101])
+        progress.num_imported = 100
+        progress.put()
+        ndb.delete_multi(SurveyLink.query().fetch(keys_only=True))
+
+        result = SurveyLink.import_range(program_label, 1, path)
+
+        self.assertEqual(result['num_imported'], 150)
+        self.assertTrue(result['complete'])
+        self.assertEqual(sorted(l.url for l in SurveyLink.query()),
+                         sorted(urls[100:]))
+
+        # Already done, so a further retry imports nothing.
+        ndb.delete_multi(SurveyLink.query().fetch(keys_only=True))
+        SurveyLink.import_range(program_label, 1, path)
+        self.assertEqual(SurveyLink.query().count(), 0)
+
+        gcs.delete(path)
+
+    def test_reservoir(self):
+        """One lease serves several callers from memory."""
+        kwargs = {'program_label': 'demo-program', 'survey_ordinal': 1}
+        links = [SurveyLink(id='link{}'.format(x), shard=0, **kwargs)
+                 for x in range(3)]
+        ndb.put_multi(links)
+
+        fetched = [SurveyLink.get_unique('demo-program', 1) for x in range(3)]
+
+        self.assertEqual(set(l.url for l in fetched),
+                         set(l.url for l in links))
+        self.assertEqual(SurveyLink.lease_stats['attempts'], 1)
+        self.assertEqual(SurveyLink.lease_stats['from_reservoir'], 2)
+
+        # All were removed from the datastore when leased.
+        self.assertEqual(SurveyLink.query().count(), 0)
+        self.assertIsNone(SurveyLink.get_unique('demo-program', 1))
+
+    def test_no_duplicates(self):
+        """Many calls across shards never issue the same link twice."""
+        num_links = 50
+        links = [
+            SurveyLink(id='link{}'.format(x), program_label='demo-program',
+                       survey_ordinal=1, shard=x % 7)
+            for x in range(num_links)
+        ]
+        ndb.put_multi(links)
+
+        urls = [SurveyLink.get_unique('demo-program', 1).url
+                for x in range(num_links)]
+
+        self.assertEqual(len(set(urls)), num_links)
+        self.assertIsNone(SurveyLink.get_unique('demo-program', 1))
+
+    def test_unsharded_links(self):
+        """Links imported before sharding can still be leased."""
+        num_links = 30
+        links = [
+            SurveyLink(id='link{}'.format(x), program_label='demo-program',
+                       survey_ordinal=1)
+            for x in range(num_links)
+        ]
+        ndb.put_multi(links)
+
+        urls = [SurveyLink.get_unique('demo-program', 1).url
+                for x in range(num_links)]
+
+        self.assertEqual(len(set(urls)), num_links)
+        self.assertIsNone(SurveyLink.get_unique('demo-program', 1))
+
+    def test_backfill_shards(self):
+        links = [
+            SurveyLink(id='link{}'.format(x), program_label='demo-program',
+                       survey_ordinal=1, shard=0 if x < 5 else None)
+            for x in range(25)
+        ]
+        ndb.put_multi(links)
+        # Leased after being read for the backfill.
+        links[-1].key.delete()
+
+        num_sharded = SurveyLink.backfill_shards(links)
+
+        self.assertEqual(num_sharded, 19)
+        stored = SurveyLink.query().fetch()
+        self.assertEqual(len(stored), 24)
+        self.assertNotIn(None, [l.shard for l in stored])
+        # Already sharded links are left alone.
+        self.assertEqual(
+            [l.shard for l in ndb.get_multi([l.key for l in links[:5]])],
+            [0] * 5,
+        )
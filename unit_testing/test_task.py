@@ -1,5 +1,6 @@
 from model import Checkpoint, Organization, Program, Project, Survey, Task
 from unit_test_helper import ConsistencyTestCase
+import copy
 import logging
 import mysql_connection
 
@@ -165,3 +166,83 @@ class TestTask(ConsistencyTestCase):
 
         self.assertFalse(project.tasklist.tasks[0].disabled)
         self.assertTrue(project.tasklist.tasks[1].disabled)
+
+    def test_template_registry(self):
+        """Templates are indexed by label, including mocked programs."""
+        program_label = 'demo-program'
+        config = Program.get_config(program_label)
+        checkpoint_template = config['surveys'][0][
+            'survey_tasklist_template'][0]
+        task_template = checkpoint_template['tasks'][0]
+
+        self.assertIs(
+            Program.get_task_template(program_label, 'Survey',
+                                      task_template['label']),
+            task_template,
+        )
+        self.assertIs(
+            Program.get_checkpoint_template(program_label, 'Survey',
+                                            checkpoint_template['label']),
+            checkpoint_template,
+        )
+        self.assertIsNone(
+            Program.get_task_template(program_label, 'Survey', 'dne'))
+        self.assertIsNone(Program.get_task_template(
+            program_label, 'Project', task_template['label']))
+
+        org_task = organization_tasks.tasklist_template[0]['tasks'][0]
+        self.assertIs(
+            Program.get_task_template(None, 'Organization', org_task['label']),
+            org_task,
+        )
+
+        # The registry is shared by the whole process, so it can't change,
+        # all the way down. Copies can.
+        with self.assertRaises(TypeError):
+            Program.compiled()['configs'][program_label] = {}
+        with self.assertRaises(TypeError):
+            config['cohorts']['2017_spring']['name'] = "Changed"
+        with self.assertRaises(TypeError):
+            config['surveys'].append({})
+        copied = copy.deepcopy(config)
+        copied['surveys'][0]['name'] = "Changed"
+        self.assertNotEqual(config['surveys'][0]['name'], "Changed")
+
+        # Mocks take precedence, and go away when reset.
+        mock_task = {'label': task_template['label'], 'body': "<p>Mock</p>"}
+        Program.mock_program_config(program_label, {
+            'surveys': [{'survey_tasklist_template': [{'tasks': [mock_task]}]}]
+        })
+        self.assertIs(
+            Program.get_task_template(program_label, 'Survey',
+                                      task_template['label']),
+            mock_task,
+        )
+        Program.reset_mocks()
+        self.assertIs(
+            Program.get_task_template(program_label, 'Survey',
+                                      task_template['label']),
+            task_template,
+        )
+
+    def test_template_parent_kinds(self):
+        """Project and survey templates may share labels."""
+        program_label = 'shared-labels'
+        project_task = {'label': 'shared__task', 'body': "<p>Project</p>"}
+        survey_task = {'label': 'shared__task', 'body': "<p>Survey</p>"}
+        Program.mock_program_config(program_label, {
+            'project_tasklist_template': [{'tasks': [project_task]}],
+            'surveys': [
+                {'survey_tasklist_template': [{'tasks': [survey_task]}]},
+            ],
+        })
+
+        self.assertIs(
+            Program.get_task_template(program_label, 'Project',
+                                      'shared__task'),
+            project_task,
+        )
+        self.assertIs(
+            Program.get_task_template(program_label, 'Survey', 'shared__task'),
+            survey_task,
+        )
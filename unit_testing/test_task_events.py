@@ -0,0 +1,154 @@
+"""Test deferred side effects of task updates."""
+
+from google.appengine.api import namespace_manager
+from google.appengine.ext import testbed
+
+from fixed_time import FixedTime
+from model import Checkpoint, Notification, Organization, User
+from unit_test_helper import ConsistencyTestCase
+import config
+import mysql_connection
+import task_events
+
+
+class TestTaskEvents(ConsistencyTestCase):
+
+    consistency_probability = 1
+
+    def set_up(self):
+        # Let ConsistencyTestCase set up the datastore testing stub.
+        super(TestTaskEvents, self).set_up()
+
+        with mysql_connection.connect() as sql:
+            sql.reset({'checkpoint': Checkpoint.get_table_definition()})
+
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.real_time = task_events.time
+        self.real_notify = task_events.notify
+        config.notifications_synchronous = True
+
+    def tear_down(self):
+        task_events.time = self.real_time
+        task_events.notify = self.real_notify
+        config.notifications_synchronous = False
+        namespace_manager.set_namespace('')
+
+    def create_org(self):
+        sup = User.create(email='super@perts.net', user_type='super_admin')
+        sup.put()
+        org = Organization.create(name='Foo Org')
+        org.put()
+        admin = User.create(email='admin@school.edu',
+                            owned_organizations=[org.uid])
+        admin.put()
+
+        checkpoint = org.tasklist.checkpoints[0]
+        tasks = [t for t in org.tasklist.tasks
+                 if t.checkpoint_id == checkpoint.uid]
+        return sup, admin, org, checkpoint, tasks
+
+    def test_emit_queues_one_worker_per_window(self):
+        sup, admin, org, checkpoint, tasks = self.create_org()
+
+        task_events.time = FixedTime(1000)
+        for t in tasks:
+            task_events.task_changed(t, sup)
+        task_events.time = FixedTime(1000 + task_events.DEBOUNCE_SECONDS)
+        task_events.task_changed(tasks[0], sup)
+
+        events = self.taskqueue_stub.get_filtered_tasks(
+            queue_names=task_events.QUEUE_NAME)
+        workers = self.taskqueue_stub.get_filtered_tasks(
+            url=task_events.WORKER_URL)
+        self.assertEqual(len(events), len(tasks) + 1)
+        self.assertEqual(len(workers), 2)
+
+        # Nothing happens until the worker runs.
+        self.assertEqual(Checkpoint.get_by_id(checkpoint.uid).status,
+                         'incomplete')
+
+    def test_flush_coalesces(self):
+        sup, admin, org, checkpoint, tasks = self.create_org()
+
+        for t in tasks:
+            t.status = 'complete'
+            t.put()
+            task_events.task_changed(t, sup)
+        # Changing the same task again shouldn't notify again.
+        task_events.task_changed(tasks[0], sup)
+
+        report = task_events.flush()
+
+        self.assertEqual(report['leased'], len(tasks) + 1)
+        self.assertEqual(report['checkpoints_changed'], 1)
+        self.assertEqual(report['notified'], len(tasks))
+        self.assertEqual(Checkpoint.get_by_id(checkpoint.uid).status,
+                         'complete')
+
+        # The org admin hears about it.
+        notes = Notification.get(ancestor=admin)
+        self.assertGreater(len(notes), 0)
+
+        # Nothing left to do.
+        self.assertEqual(task_events.flush()['leased'], 0)
+
+    def test_flush_isolates_failures(self):
+        """An event that raises doesn't hold up the rest of its batch."""
+        sup, admin, org, checkpoint, tasks = self.create_org()
+        for t in tasks:
+            t.status = 'complete'
+            t.put()
+            task_events.task_changed(t, sup)
+
+        bad_task_id = tasks[0].uid
+
+        def notify(events, *args):
+            if any(e.task_id == bad_task_id for e in events):
+                raise Exception("Bad event.")
+            return self.real_notify(events, *args)
+        task_events.notify = notify
+
+        report = task_events.flush()
+
+        self.assertEqual(report['leased'], len(tasks))
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(report['notified'], len(tasks) - 1)
+
+        # Only the failing event is left, leased until it's retried.
+        remaining = self.taskqueue_stub.get_filtered_tasks(
+            queue_names=task_events.QUEUE_NAME)
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(task_events.flush()['leased'], 0)
+
+    def test_namespaces_separate(self):
+        """Branches share the queue but not each other's events."""
+        sup, admin, org, checkpoint, tasks = self.create_org()
+
+        task_events.time = FixedTime(1000)
+        task_events.task_changed(tasks[0], sup)
+        namespace_manager.set_namespace('other-branch')
+        task_events.task_changed(tasks[0], sup)
+
+        # Each namespace has its own worker in the same window.
+        workers = self.taskqueue_stub.get_filtered_tasks(
+            url=task_events.WORKER_URL)
+        self.assertEqual(len(workers), 2)
+
+        self.assertEqual(task_events.flush()['leased'], 1)
+        namespace_manager.set_namespace('')
+        self.assertEqual(task_events.flush()['leased'], 1)
+
+    def test_unchanged_checkpoint_not_put(self):
+        sup, admin, org, checkpoint, tasks = self.create_org()
+
+        # Task saved without changing anything that affects the checkpoint.
+        report = task_events.process([task_events.TaskChanged(
+            task_id=tasks[0].uid,
+            checkpoint_id=checkpoint.uid,
+            user_id=sup.uid,
+            project_cohort_id=None,
+            changed='2020-01-01T00:00:00Z',
+        )])
+
+        self.assertEqual(report['checkpoints_changed'], 0)